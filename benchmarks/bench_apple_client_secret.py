@@ -0,0 +1,24 @@
+# Sign in with Apple client secret per token request: the cached ES256 assertion
+# (AppleClientSecret.get) vs parsing the key and signing a new one every time.
+#
+#   python -m benchmarks.bench_apple_client_secret [iterations]
+import sys
+
+from benchmarks.stand_ins import LocalAppleServer
+from benchmarks.timing import measure, report
+from src.apple_token_client import AppleClientSecret
+
+
+def main(iterations: int) -> None:
+    settings = LocalAppleServer().settings()[:4]
+    cached = AppleClientSecret(*settings)
+    results = [
+        measure("client_secret_cached", cached.get, iterations),
+        measure("client_secret_signed_per_request", lambda: AppleClientSecret(*settings).get(), iterations // 100),
+    ]
+    results[0]["speedup"] = round(results[1]["us_per_op"] / results[0]["us_per_op"], 1)
+    report(results)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
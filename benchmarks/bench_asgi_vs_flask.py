@@ -0,0 +1,116 @@
+# Sign-in throughput of the Flask app (N blocking workers) vs the ASGI app (one
+# event loop) with the same upstream latencies. Google is the local stand-in;
+# secrets come from a fixed map and DynamoDB is the SQLite user store with a
+# fixed per-call latency.
+#
+#   python -m benchmarks.bench_asgi_vs_flask [requests] [flask_workers] [asgi_concurrency]
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from benchmarks.stand_ins import LatencyUserStore, LocalGoogleServer
+from benchmarks.timing import percentiles, report
+
+GOOGLE_LATENCY_SECONDS = 0.05
+DYNAMODB_LATENCY_SECONDS = 0.01
+
+
+def run_flask(app, requests: int, workers: int):
+    def sign_in(index: int) -> float:
+        client = app.test_client()
+        start = time.perf_counter()
+        response = client.post(
+            "/api/v1/signinWithGoogle",
+            data=json.dumps({"authorization_code": f"4/0Ab{index}:user{index}@example.com"}),
+            content_type="application/json",
+        )
+        assert response.status_code == 200, response.data
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        samples = list(executor.map(sign_in, range(requests)))
+    return time.perf_counter() - start, samples
+
+
+def run_asgi(app, requests: int, concurrency: int):
+    from src import async_service
+    from test.asgi_client import AsgiTestClient
+
+    client = AsgiTestClient(app)
+
+    async def scenario():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def sign_in(index: int) -> float:
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.request(
+                    "POST",
+                    "/api/v1/signinWithGoogle",
+                    json.dumps({"authorization_code": f"4/0Ab{index}:user{index}@example.com"}),
+                    {"Content-Type": "application/json"},
+                )
+                assert response.status_code == 200, response.data
+                return time.perf_counter() - start
+
+        start = time.perf_counter()
+        samples = await asyncio.gather(*(sign_in(index) for index in range(requests)))
+        elapsed = time.perf_counter() - start
+        await async_service.close()
+        return elapsed, samples
+
+    return asyncio.run(scenario())
+
+
+def summarize(name: str, requests: int, concurrency: int, elapsed: float, samples):
+    result = {
+        "name": name,
+        "requests": requests,
+        "concurrency": concurrency,
+        "requests_per_second": round(requests / elapsed, 1),
+    }
+    result.update(percentiles(samples))
+    return result
+
+
+def main(requests: int, flask_workers: int, asgi_concurrency: int) -> None:
+    server = LocalGoogleServer(latency=GOOGLE_LATENCY_SECONDS).start()
+    os.environ["GOOGLE_TOKEN_URI"] = server.token_uri
+    os.environ["GOOGLE_JWKS_URI"] = server.jwks_uri
+    os.environ["GOOGLE_TOKEN_POOL_SIZE"] = str(max(flask_workers, asgi_concurrency))
+
+    from src.app import app as flask_app
+    from src.asgi_app import app as asgi_app
+    from src.user_store import SQLiteUserStore
+
+    secrets = {
+        "client_id": server.issuer.audience,
+        "client_secret": "bench-secret",
+        "redirect_uri": "https://localhost/callback",
+        "encryption_secret_key": "bench-encryption-key",
+    }
+    store = LatencyUserStore(SQLiteUserStore(), DYNAMODB_LATENCY_SECONDS)
+    with patch("src.service.get_authentication_secrets", return_value=secrets), \
+            patch("src.service.get_user_store", return_value=store), \
+            patch("src.local_utils.get_user_store", return_value=store):
+        flask_elapsed, flask_samples = run_flask(flask_app, requests, flask_workers)
+        asgi_elapsed, asgi_samples = run_asgi(asgi_app, requests, asgi_concurrency)
+    server.stop()
+
+    report([
+        summarize("flask_sync_workers", requests, flask_workers, flask_elapsed, flask_samples),
+        summarize("asgi_event_loop", requests, asgi_concurrency, asgi_elapsed, asgi_samples),
+    ])
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 400,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 4,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 200,
+    )
@@ -0,0 +1,58 @@
+# Tail latency of an idempotent read (Secrets Manager GetSecretValue against the local stand-in)
+# when 2% of requests stall for 200 ms: a plain call vs a hedged one (Dependency.call(hedge=True)),
+# which sends a second request once the first has taken longer than the recent p95.
+#
+#   python -m benchmarks.bench_hedged_reads [requests]
+import random
+import sys
+import time
+
+import boto3
+from botocore.config import Config
+
+from benchmarks.stand_ins import LocalAwsServer
+from benchmarks.timing import percentiles, report
+from src.resilience import Dependency, is_aws_failure
+
+STALL_SECONDS = 0.2
+STALL_RATE = 0.02
+
+
+def run(name: str, server: LocalAwsServer, dependency: Dependency, hedge: bool, requests: int):
+    client = boto3.client(
+        "secretsmanager",
+        endpoint_url=server.endpoint_url,
+        region_name="us-east-1",
+        aws_access_key_id="local",
+        aws_secret_access_key="local",
+        config=Config(retries={"total_max_attempts": 1}, max_pool_connections=4),
+    )
+    stalls = random.Random(42)
+    samples = []
+    for _ in range(requests):
+        if stalls.random() < STALL_RATE:
+            server.faults.inject(STALL_SECONDS)
+        start = time.perf_counter()
+        dependency.call(lambda: client.get_secret_value(SecretId="authentication"), hedge=hedge)
+        samples.append(time.perf_counter() - start)
+        server.faults.clear()
+    return {"name": name, "requests": requests, **percentiles(samples)}
+
+
+def main(requests: int) -> None:
+    server = LocalAwsServer(secrets={"authentication": {"client_id": "local"}}).start()
+    try:
+        results = []
+        for name, hedge in (("secrets_read_plain", False), ("secrets_read_hedged", True)):
+            dependency = Dependency(f"bench_{name}", is_aws_failure, enabled=True)
+            before = server.requests.get("GetSecretValue", 0)
+            result = run(name, server, dependency, hedge, requests)
+            result["hedged_requests"] = server.requests.get("GetSecretValue", 0) - before - requests
+            results.append(result)
+        report(results)
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,42 @@
+# Compares today's three unverified id_token decodes with one verified decode
+# against a warm JWKS cache.
+#
+#   python -m benchmarks.bench_id_token [iterations]
+import sys
+
+import jwt
+from utils.jwt_utils import extract_email, extract_name, extract_profile
+
+from benchmarks.stand_ins import LocalJwksIssuer
+from benchmarks.timing import measure, report
+from src.constants import GOOGLE_ISSUERS
+from src.id_token import IdTokenClaims, JwksCache, verify_id_token
+
+
+def main(iterations: int) -> None:
+    issuer = LocalJwksIssuer()
+    jwks_cache = JwksCache("local", fetcher=issuer.fetch)
+    id_token = issuer.mint_id_token("bench@example.com")
+
+    def three_decodes():
+        extract_email(id_token)
+        extract_name(id_token)
+        extract_profile(id_token)
+
+    def verify_once():
+        claims = verify_id_token(id_token, jwks_cache, issuer.audience, GOOGLE_ISSUERS)
+        return claims.email, claims.name, claims.profile
+
+    def decode_once_unverified():
+        return IdTokenClaims.from_payload(jwt.decode(id_token, options={"verify_signature": False}))
+
+    report([
+        measure("three_unverified_decodes", three_decodes, iterations),
+        measure("one_unverified_decode", decode_once_unverified, iterations),
+        measure("one_verified_decode_cached_jwks", verify_once, iterations),
+        {"name": "jwks_fetches", "count": issuer.fetches},
+    ])
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,113 @@
+# Logging cost on the request thread for one sign-in's worth of service log lines:
+# the previous eager f-strings written synchronously by a basicConfig-style handler,
+# against %-style lines through the queue-based pipeline, with and without sampling.
+# Runs against /dev/null and against a sink whose writes block for 100us, as stderr does
+# when the pipe to the log collector is backed up.
+#
+#   python -m benchmarks.bench_logging [iterations]
+import logging
+import os
+import sys
+import time
+
+from benchmarks.timing import measure, report
+from src.logging_config import configure_logging, shutdown_logging
+
+EMAIL = "bench@example.com"
+SECRETS = {"client_id": "id", "client_secret": "secret", "redirect_uri": "https://localhost", "encryption_secret_key": "k"}
+USER = {
+    "email": EMAIL,
+    "profile": {"name": "Bench User", "given_name": "Bench", "family_name": "User", "picture": "https://example.com/p.png"},
+    "access_token": "gAAAAAB" + "a" * 180,
+    "refresh_token": "gAAAAAB" + "r" * 140,
+    "name": "Bench User",
+    "created_at": "2024-01-01T00:00:00",
+    "oidc_provider": "google-oauth2",
+}
+
+
+class SlowSink:
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    def write(self, text: str) -> None:
+        time.sleep(self.delay)
+
+    def flush(self) -> None:
+        pass
+
+
+def eager_signin_lines(logger: logging.Logger) -> None:
+    logger.info(f"Fetched redirect_uri from AWS: {SECRETS['redirect_uri']}")
+    logger.info(f"Attempting to fetch token with code: {'4/0AbCdEfGhIjK'[:10]}...")
+    logger.info("Token fetched successfully")
+    logger.info(f"Verified ID token for: {EMAIL}")
+    logger.info(f"Checking if user exists: {EMAIL}")
+    logger.info(f"User {EMAIL} not found in the user store")
+    logger.info(f"Attempting to create user: {EMAIL}")
+    logger.info(f"Extracted user details: name={USER['name']}, profile={USER['profile']}")
+    logger.info(f"Retrieved authentication secrets. Keys: {SECRETS.keys()}")
+    logger.info(f"Saving user data to the user store: {USER}")
+    logger.info(f"User {EMAIL} created successfully")
+    logger.info(f"Authenticating user: {EMAIL}")
+    logger.info("Cookie created successfully")
+
+
+def lazy_signin_lines(logger: logging.Logger) -> None:
+    logger.info("Fetched redirect_uri from AWS: %s", SECRETS["redirect_uri"])
+    logger.info("Attempting to fetch token with code: %s...", "4/0AbCdEfGhIjK"[:10])
+    logger.info("Token fetched successfully")
+    logger.info("Verified ID token for: %s", EMAIL)
+    logger.info("Checking if user exists: %s", EMAIL)
+    logger.info("User %s not found in the user store", EMAIL)
+    logger.info("Attempting to create user: %s", EMAIL)
+    logger.info("Extracted user details for %s: profile fields=%s", EMAIL, sorted(USER["profile"]))
+    logger.info("Retrieved authentication secrets. Keys: %s", SECRETS.keys())
+    logger.info("Saving user data to the user store: %s", USER)
+    logger.info("User %s created successfully", EMAIL)
+    logger.info("Authenticating user: %s", EMAIL)
+    logger.info("Cookie created successfully")
+
+
+def run(sink_name, sink, iterations: int):
+    root = logging.getLogger()
+    logger = logging.getLogger("bench.service")
+    results = []
+
+    handler = logging.StreamHandler(sink)
+    handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    results.append(measure(f"{sink_name}_eager_fstrings_sync_handler", lambda: eager_signin_lines(logger), iterations))
+    root.removeHandler(handler)
+
+    for name, log_format, rates in (
+        ("lazy_queue_text", "text", {}),
+        ("lazy_queue_json", "json", {}),
+        ("lazy_queue_text_sampled_10pct", "text", {"bench.service": 0.1}),
+    ):
+        queue_handler = configure_logging(log_format=log_format, stream=sink, sample_rates=rates, queue_size=10 ** 7)
+        result = measure(f"{sink_name}_{name}", lambda: lazy_signin_lines(logger), iterations)
+        start = time.perf_counter()
+        shutdown_logging()
+        result["listener_drain_seconds"] = round(time.perf_counter() - start, 3)
+        result["dropped"] = queue_handler.dropped
+        results.append(result)
+        for extra in root.handlers[:]:
+            root.removeHandler(extra)
+
+    baseline = results[0]["us_per_op"]
+    for result in results[1:]:
+        result["us_saved_per_signin"] = round(baseline - result["us_per_op"], 3)
+    return results
+
+
+def main(iterations: int) -> None:
+    results = run("devnull", open(os.devnull, "w"), iterations)
+    # Fewer iterations: the synchronous baseline sleeps for every line
+    results += run("slow_sink", SlowSink(0.0001), max(iterations // 10, 100))
+    report(results)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,113 @@
+# Overhead of request profiling (src/profiling.py). Requests to /health on the Flask and ASGI apps
+# with profiling off (the default), on but sampling 1 in 1000, and on sampling every request: the
+# per-request cost of the hooks, next to a request that does almost nothing. Then a CPU-bound
+# request (PBKDF2, a few ms) unprofiled and profiled at two sampler intervals: the cost of the
+# sampler thread while it takes stacks, and the samples it collected. The settings take turns and
+# each figure is the best of RUNS runs, since the differences are smaller than the drift of one.
+#
+#   python -m benchmarks.bench_profiling [requests]
+import asyncio
+import functools
+import hashlib
+import sys
+import time
+from unittest.mock import patch
+
+from benchmarks.timing import measure, report
+from src.profiling import RequestProfiler
+
+ADMIN_TOKEN = "bench-admin-token"
+RUNS = 3
+
+
+def _best_of_turns(runs):
+    # runs: (name, zero-argument function returning a result); best result of each name
+    best = {}
+    for _ in range(RUNS):
+        for name, run in runs:
+            result = run()
+            if name not in best or result["us_per_op"] < best[name]["us_per_op"]:
+                best[name] = result
+    return [best[name] for name, _ in runs]
+
+
+def _profilers():
+    return [
+        ("off", RequestProfiler(enabled=False)),
+        ("on_1_in_1000", RequestProfiler(enabled=True, sample_every=1000, admin_token=ADMIN_TOKEN)),
+        ("on_every_request", RequestProfiler(enabled=True, sample_every=1, admin_token=ADMIN_TOKEN)),
+    ]
+
+
+def bench_flask(requests: int):
+    from src import app as flask_app_module
+
+    client = flask_app_module.app.test_client()
+
+    def run(name, profiler):
+        with patch.object(flask_app_module, "request_profiler", profiler):
+            return measure(f"flask_health_profiling_{name}", lambda: client.get("/health"), requests)
+
+    return _best_of_turns([(name, functools.partial(run, name, profiler)) for name, profiler in _profilers()])
+
+
+def bench_asgi(requests: int):
+    from src import asgi_app as asgi_app_module
+    from test.asgi_client import AsgiTestClient
+
+    client = AsgiTestClient(asgi_app_module.app)
+
+    async def requests_to_health(count: int) -> float:
+        start = time.perf_counter()
+        for _ in range(count):
+            await client.request("GET", "/health")
+        return time.perf_counter() - start
+
+    def run(name, profiler):
+        with patch.object(asgi_app_module, "request_profiler", profiler):
+            asyncio.run(requests_to_health(100))
+            elapsed = asyncio.run(requests_to_health(requests))
+        return {
+            "name": f"asgi_health_profiling_{name}",
+            "iterations": requests,
+            "total_seconds": round(elapsed, 6),
+            "us_per_op": round(elapsed / requests * 1e6, 3),
+            "ops_per_second": round(requests / elapsed, 1),
+        }
+
+    return _best_of_turns([(name, functools.partial(run, name, profiler)) for name, profiler in _profilers()])
+
+
+def cpu_bound_request() -> bytes:
+    return hashlib.pbkdf2_hmac("sha256", b"password", b"salt", 5000)
+
+
+def bench_sampler(requests: int):
+    profilers = [RequestProfiler(enabled=True, sample_every=1, interval=interval) for interval in (0.005, 0.001)]
+
+    def run_profiled(profiler):
+        def profiled_request():
+            profiled = profiler.begin("GET /cpu", {})
+            try:
+                cpu_bound_request()
+            finally:
+                profiler.end(profiled)
+
+        return measure(f"cpu_request_profiled_every_{profiler.interval * 1000:g}ms", profiled_request, requests, warmup=10)
+
+    results = _best_of_turns(
+        [("unprofiled", functools.partial(measure, "cpu_request_unprofiled", cpu_bound_request, requests, warmup=10))]
+        + [(str(profiler.interval), functools.partial(run_profiled, profiler)) for profiler in profilers]
+    )
+    for result, profiler in zip(results[1:], profilers):
+        summary = profiler.report()["GET /cpu"]
+        result["samples_per_request"] = round(summary["samples"] / summary["requests"], 2)
+    return results
+
+
+def main(requests: int) -> None:
+    report(bench_flask(requests) + bench_asgi(requests) + bench_sampler(max(1, requests // 20)))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,83 @@
+# Session validations per second with a million revoked sessions held by the worker: the
+# in-memory revocation check alone, the full authenticate_session (JWT verification plus the
+# check), and a SQLite lookup per validation for comparison. Also reports the load time and
+# the memory of the filter and sorted fingerprints against a plain set of jti strings.
+#
+#   python -m benchmarks.bench_revocation [revoked] [iterations]
+import sys
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from benchmarks.timing import measure, report
+from src import session_revocation
+from src.local_utils import create_jwt
+from src.session_revocation import RevocationList, RevocationSet, SQLiteRevocationStore, authenticate_session
+
+ENCRYPTION_SECRET_KEY = "bench-encryption-secret-key-of-32-bytes"
+
+
+def main(revoked_count: int, iterations: int) -> None:
+    jtis = [uuid.uuid4().hex for _ in range(revoked_count)]
+    expires_at = time.time() + 86400
+
+    started = time.perf_counter()
+    revoked = RevocationSet(capacity=revoked_count)
+    revoked.add_many((jti, expires_at) for jti in jtis)
+    load_seconds = time.perf_counter() - started
+
+    tracemalloc.start()
+    plain = set(jtis)
+    set_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    store = SQLiteRevocationStore()
+    now = time.time()
+    for jti in jtis:
+        store.revoke(jti, "user@example.com", now, now + 86400)
+    revocations = RevocationList(store_factory=lambda: store, interval=3600, revoked=revoked)
+    revocations.sync()
+
+    def session(jti):
+        issued = datetime.now()
+        payload = {"email": "user@example.com", "iat": issued, "exp": issued + timedelta(days=30), "jti": jti}
+        return create_jwt(payload, ENCRYPTION_SECRET_KEY)
+
+    valid_jti, revoked_jti = uuid.uuid4().hex, jtis[len(jtis) // 2]
+    valid_session = session(valid_jti)
+    connection = store._connection
+
+    def sqlite_lookup():
+        connection.execute("SELECT 1 FROM session_revocations WHERE jti = ?", (valid_jti,)).fetchone()
+
+    connection.execute("CREATE INDEX IF NOT EXISTS session_revocations_jti ON session_revocations (jti)")
+    with patch.object(session_revocation, "revocation_list", revocations):
+        results = [
+            measure("check_valid_session", lambda: valid_jti in revoked, iterations),
+            measure("check_revoked_session", lambda: revoked_jti in revoked, iterations),
+            measure("check_plain_set", lambda: valid_jti in plain, iterations),
+            measure("sqlite_indexed_lookup", sqlite_lookup, iterations),
+            measure(
+                "authenticate_session_valid",
+                lambda: authenticate_session(valid_session, ENCRYPTION_SECRET_KEY),
+                iterations // 10,
+            ),
+        ]
+    revocations.stop()
+    results.append({
+        "name": "memory",
+        "revoked": len(revoked),
+        "load_seconds": round(load_seconds, 3),
+        "filter_fingerprints_and_expiries_bytes": revoked.memory_bytes(),
+        "python_set_of_jti_bytes": set_bytes,
+    })
+    report(results)
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1000000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 200000,
+    )
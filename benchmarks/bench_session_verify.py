@@ -0,0 +1,60 @@
+# Session verifications per second: verify_session() for a session in the LRU (digest and
+# dict lookup, plus the in-memory revocation check) against a full JWT verification, over a
+# working set of distinct sessions.
+#
+#   python -m benchmarks.bench_session_verify [iterations] [sessions]
+import itertools
+import sys
+import uuid
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from benchmarks.timing import measure, report
+from src import session_revocation
+from src.local_utils import create_jwt, verify_session_token
+from src.session_revocation import RevocationList, RevocationSet, SQLiteRevocationStore
+from src.session_verification import VerifiedSessionCache, verify_session
+
+ENCRYPTION_SECRET_KEY = "bench-encryption-secret-key-of-32-bytes"
+
+
+def main(iterations: int, sessions: int) -> None:
+    issued = datetime.now()
+    tokens = [
+        create_jwt(
+            {"email": f"user{index}@example.com", "iat": issued, "exp": issued + timedelta(days=30), "jti": uuid.uuid4().hex},
+            ENCRYPTION_SECRET_KEY,
+        )
+        for index in range(sessions)
+    ]
+    store = SQLiteRevocationStore()
+    revocations = RevocationList(store_factory=lambda: store, interval=3600, revoked=RevocationSet())
+    revocations.sync()
+    cached = itertools.cycle(tokens)
+    uncached = itertools.cycle(tokens)
+
+    with patch.object(session_revocation, "revocation_list", revocations), patch(
+        "src.session_verification.verified_sessions", VerifiedSessionCache(max_entries=sessions)
+    ):
+        results = [
+            measure("verify_session_cached", lambda: verify_session(next(cached), ENCRYPTION_SECRET_KEY), iterations),
+        ]
+    with patch.object(session_revocation, "revocation_list", revocations), patch(
+        "src.session_verification.verified_sessions", VerifiedSessionCache(max_entries=0)
+    ):
+        results.append(
+            measure("verify_session_uncached", lambda: verify_session(next(uncached), ENCRYPTION_SECRET_KEY), iterations // 10)
+        )
+    results.append(
+        measure("verify_session_token_only", lambda: verify_session_token(tokens[0], ENCRYPTION_SECRET_KEY), iterations // 10)
+    )
+    revocations.stop()
+    results[0]["speedup"] = round(results[1]["us_per_op"] / results[0]["us_per_op"], 1)
+    report(results)
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 200000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 10000,
+    )
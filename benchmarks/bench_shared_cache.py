@@ -0,0 +1,102 @@
+# Shared-memory cache (src/shared_cache.py) vs a dict per worker, the way the user existence
+# cache is used: forked workers look keys up and fill misses themselves. Reports get/set cost in
+# one process, then throughput, hit rate and memory across workers. The shared table is sized for
+# the key space; per-worker memory is the RSS each worker gained while filling its dict.
+#
+#   python -m benchmarks.bench_shared_cache [workers] [keys] [lookups per worker]
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+from benchmarks.timing import measure, report
+from src.shared_cache import SharedCache
+
+
+def _rss_kb() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() // 1024
+
+
+def _worker(cache, keys: int, lookups: int, seed: int):
+    rng = random.Random(seed)
+    hits = 0
+    rss_before = _rss_kb()
+    start = time.perf_counter()
+    for _ in range(lookups):
+        key = f"user-{rng.randrange(keys)}@example.com"
+        if cache.get(key) is not None:
+            hits += 1
+        else:
+            cache[key] = True
+    elapsed = time.perf_counter() - start
+    return {"seconds": elapsed, "hits": hits, "rss_growth_kb": _rss_kb() - rss_before}
+
+
+def _run_workers(make_cache, workers: int, keys: int, lookups: int):
+    cache = make_cache()
+    children = []
+    for worker in range(workers):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            if hasattr(cache, "reset_after_fork"):
+                cache.reset_after_fork()
+            result = _worker(cache, keys, lookups, seed=worker)
+            os.write(write_fd, json.dumps(result).encode())
+            os._exit(0)
+        os.close(write_fd)
+        children.append((pid, read_fd))
+    results = []
+    for pid, read_fd in children:
+        with os.fdopen(read_fd) as f:
+            results.append(json.loads(f.read()))
+        os.waitpid(pid, 0)
+    return results
+
+
+def _summary(name: str, results, lookups: int):
+    slowest = max(result["seconds"] for result in results)
+    total = lookups * len(results)
+    return {
+        "name": name,
+        "workers": len(results),
+        "lookups": total,
+        "ops_per_second": round(total / slowest, 1),
+        "hit_rate": round(sum(result["hits"] for result in results) / total, 4),
+        "memory_kb": sum(result["rss_growth_kb"] for result in results),
+    }
+
+
+def main(workers: int, keys: int, lookups: int) -> None:
+    with tempfile.TemporaryDirectory(dir="/dev/shm" if os.path.isdir("/dev/shm") else None) as directory:
+        single = SharedCache(os.path.join(directory, "single.cache"), slots=1024, slot_bytes=128)
+        single["user@example.com"] = True
+        local = {"user@example.com": True}
+        results = [
+            measure("dict_get", lambda: local.get("user@example.com"), 200000),
+            measure("shared_get", lambda: single.get("user@example.com"), 200000),
+            measure("shared_set", lambda: single.set("user@example.com", True), 200000),
+        ]
+        single.close()
+
+        slots = keys * 2
+        path = os.path.join(directory, "workers.cache")
+        per_worker = _run_workers(dict, workers, keys, lookups)
+        shared = _run_workers(lambda: SharedCache(path, slots=slots, slot_bytes=128), workers, keys, lookups)
+        results.append(_summary("per_worker_dicts", per_worker, lookups))
+        # Shared pages are counted once, for the whole table, instead of in every worker's RSS
+        table = SharedCache(path, slots=slots, slot_bytes=128)
+        results.append(dict(_summary("shared_cache", shared, lookups), memory_kb=table.size // 1024))
+        table.close()
+        report(results)
+
+
+if __name__ == "__main__":
+    arguments = [int(argument) for argument in sys.argv[1:]]
+    defaults = [4, 50000, 100000]
+    main(*(arguments + defaults[len(arguments):]))
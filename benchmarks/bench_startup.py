@@ -0,0 +1,128 @@
+# Import-time report for the app entry points, like `python -X importtime`, summarised per
+# top-level package, plus the cost of warm_up() and of the first DynamoDB client with and
+# without it. Each sample runs in a fresh interpreter.
+#
+#   python -m benchmarks.bench_startup [--runs 5] [--output startup.json] [--compare previous.json]
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from benchmarks.load_test import REPOSITORY_ROOT, git_revision
+
+ENTRY_POINTS = ("src.app", "src.asgi_app")
+
+FIRST_CLIENT_SCRIPT = """
+import time
+import {entry_point}
+{warm_up}
+start = time.perf_counter()
+from src.dynamodb_client import get_dynamodb_client
+get_dynamodb_client()
+print(time.perf_counter() - start)
+"""
+WARM_UP_SCRIPT = "import {entry_point}\nfrom src.warmup import warm_up\nprint(warm_up())"
+
+
+def python(code: str, *flags: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *flags, "-c", code], cwd=REPOSITORY_ROOT, env=dict(os.environ),
+        capture_output=True, text=True, check=True,
+    )
+
+
+def parse_importtime(stderr: str) -> List[Dict[str, Any]]:
+    # "import time: self [us] | cumulative | imported package"
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append({"module": name.strip(), "self_us": int(self_us), "cumulative_us": int(cumulative_us)})
+    return modules
+
+
+def import_report(entry_point: str, runs: int, top: int) -> Dict[str, Any]:
+    totals, by_package = [], defaultdict(list)
+    for _ in range(runs):
+        modules = parse_importtime(python(f"import {entry_point}", "-X", "importtime").stderr)
+        totals.append(next(m["cumulative_us"] for m in modules if m["module"] == entry_point))
+        per_package: Dict[str, int] = defaultdict(int)
+        for module in modules:
+            per_package[module["module"].split(".")[0]] += module["self_us"]
+        for package, self_us in per_package.items():
+            by_package[package].append(self_us)
+    packages = sorted(((statistics.median(v), k) for k, v in by_package.items()), reverse=True)[:top]
+    return {
+        "entry_point": entry_point,
+        "import_ms": round(statistics.median(totals) / 1000, 1),
+        "import_ms_min": round(min(totals) / 1000, 1),
+        "top_packages_ms": {package: round(self_us / 1000, 1) for self_us, package in packages},
+    }
+
+
+def first_client_report(entry_point: str, runs: int) -> Dict[str, Any]:
+    def median_seconds(code: str) -> float:
+        return statistics.median(float(python(code).stdout.split()[-1]) for _ in range(runs))
+
+    return {
+        "entry_point": entry_point,
+        "warm_up_ms": round(median_seconds(WARM_UP_SCRIPT.format(entry_point=entry_point)) * 1000, 1),
+        "first_dynamodb_client_cold_ms": round(
+            median_seconds(FIRST_CLIENT_SCRIPT.format(entry_point=entry_point, warm_up="")) * 1000, 1
+        ),
+        "first_dynamodb_client_after_warm_up_ms": round(
+            median_seconds(FIRST_CLIENT_SCRIPT.format(
+                entry_point=entry_point, warm_up="from src.warmup import warm_up\nwarm_up()"
+            )) * 1000, 1
+        ),
+    }
+
+
+def compare(current: Dict[str, Any], previous: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    before = {result["entry_point"]: result for result in previous["imports"]}
+    regressions = []
+    for result in current["imports"]:
+        old = before.get(result["entry_point"])
+        # The fastest run is far less noisy than the median on a shared machine
+        if old and result["import_ms_min"] > old["import_ms_min"] * (1 + tolerance):
+            regressions.append({
+                "entry_point": result["entry_point"],
+                "import_ms_min": [old["import_ms_min"], result["import_ms_min"]],
+            })
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="packages to list by import time")
+    parser.add_argument("--output")
+    parser.add_argument("--compare", help="previous results JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    arguments = parser.parse_args(argv)
+
+    report = {
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "imports": [import_report(entry_point, arguments.runs, arguments.top) for entry_point in ENTRY_POINTS],
+        "warm_up": [first_client_report(entry_point, arguments.runs) for entry_point in ENTRY_POINTS[:1]],
+    }
+    if arguments.compare:
+        with open(arguments.compare) as previous:
+            report["regressions"] = compare(report, json.load(previous), arguments.tolerance)
+    output = json.dumps(report, indent=2)
+    if arguments.output:
+        with open(arguments.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+# Token exchange against a local HTTPS stand-in for oauth2.googleapis.com:
+# a new google_auth_oauthlib Flow per request (today's path) vs the pooled
+# GoogleTokenClient.
+#
+#   python -m benchmarks.bench_token_exchange [requests] [concurrency]
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from google_auth_oauthlib.flow import Flow
+
+from benchmarks.stand_ins import LocalGoogleServer
+from benchmarks.timing import percentiles, report
+from src.constants import GOOGLE_AUTH_URI, GOOGLE_OPENID_SCOPE
+from src.google_token_client import GoogleTokenClient
+
+REDIRECT_URI = "https://localhost/callback"
+
+
+def run(name: str, server: LocalGoogleServer, exchange: Callable[[str], None], requests: int, concurrency: int):
+    connections_before = server.connections
+
+    def timed(index: int) -> float:
+        start = time.perf_counter()
+        exchange(f"4/0Ab{index}:bench@example.com")
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(timed, range(requests)))
+    elapsed = time.perf_counter() - start
+    result = {
+        "name": name,
+        "requests": requests,
+        "concurrency": concurrency,
+        "requests_per_second": round(requests / elapsed, 1),
+        "connections_opened": server.connections - connections_before,
+    }
+    result.update(percentiles(samples))
+    return result
+
+
+def main(requests: int, concurrency: int) -> None:
+    server = LocalGoogleServer(tls=True).start()
+    client_id = server.issuer.audience
+
+    def flow_per_request(code: str) -> None:
+        flow = Flow.from_client_config(
+            client_config={
+                "web": {
+                    "client_id": client_id,
+                    "client_secret": "bench-secret",
+                    "redirect_uris": [REDIRECT_URI],
+                    "auth_uri": GOOGLE_AUTH_URI,
+                    "token_uri": server.token_uri,
+                }
+            },
+            scopes=[GOOGLE_OPENID_SCOPE],
+            redirect_uri=REDIRECT_URI,
+        )
+        flow.fetch_token(code=code, verify=server.ca_bundle)
+
+    client = GoogleTokenClient(
+        client_id, "bench-secret", REDIRECT_URI,
+        token_uri=server.token_uri, pool_size=concurrency, ca_bundle=server.ca_bundle,
+    )
+    try:
+        report([
+            run("flow_per_request", server, flow_per_request, requests, concurrency),
+            run("pooled_token_client", server, client.exchange_code, requests, concurrency),
+        ])
+    finally:
+        client.close()
+        server.stop()
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 500,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 8,
+    )
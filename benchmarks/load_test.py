@@ -0,0 +1,276 @@
+# End-to-end load test: runs the service under gunicorn with different worker
+# classes and counts, against local stand-ins for Google (token + JWKS) and
+# AWS (DynamoDB + Secrets Manager), and reports throughput, latency
+# percentiles and RSS per worker as JSON.
+#
+#   python -m benchmarks.load_test --worker-classes sync,gthread --workers 1,2 \
+#       --concurrency 1,8,32 --output results.json [--compare previous.json]
+import argparse
+import http.client
+import importlib.util
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from benchmarks.stand_ins import LocalAwsServer, LocalGoogleServer
+from benchmarks.timing import percentiles
+from src.constants import API_PREFIX, API_VERSION, AUTHENTICATION_SECRET_NAME
+
+SIGNIN_PATH = f"/{API_PREFIX}/{API_VERSION}/signinWithGoogle"
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPOSITORY_ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+class GunicornProcess:
+    def __init__(self, app: str, worker_class: str, workers: int, threads: int, environment: Dict[str, str]):
+        self.port = free_port()
+        command = [
+            sys.executable, "-m", "gunicorn", app,
+            "--bind", f"127.0.0.1:{self.port}",
+            "--workers", str(workers),
+            "--worker-class", worker_class,
+            "--log-level", "warning",
+        ]
+        if worker_class == "gthread":
+            command += ["--threads", str(threads)]
+        self.process = subprocess.Popen(
+            command, cwd=REPOSITORY_ROOT, env=dict(os.environ, **environment),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+
+    def wait_until_ready(self, timeout: float = 60.0) -> float:
+        start = time.perf_counter()
+        while time.perf_counter() - start < timeout:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"gunicorn exited with {self.process.returncode}")
+            try:
+                connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=1)
+                connection.request("GET", "/health")
+                if connection.getresponse().status == 200:
+                    return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.1)
+        raise TimeoutError("gunicorn did not become ready")
+
+    def worker_rss_kb(self) -> List[int]:
+        rss = []
+        for pid in os.listdir("/proc"):
+            if not pid.isdigit():
+                continue
+            try:
+                with open(f"/proc/{pid}/status") as status:
+                    fields = dict(line.split(":", 1) for line in status if ":" in line)
+            except OSError:
+                continue
+            if int(fields.get("PPid", "0").strip()) == self.process.pid:
+                rss.append(int(fields.get("VmRSS", "0 kB").split()[0]))
+        return sorted(rss)
+
+    def stop(self) -> None:
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+def drive(port: int, endpoint: str, concurrency: int, requests: int, users: int) -> Dict[str, Any]:
+    local = threading.local()
+    counter = iter(range(requests))
+    counter_lock = threading.Lock()
+
+    def connection() -> http.client.HTTPConnection:
+        if not hasattr(local, "connection"):
+            local.connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        return local.connection
+
+    def one_request(index: int) -> Optional[float]:
+        if endpoint == "health":
+            method, path, body, headers = "GET", "/health", None, {}
+        else:
+            code = f"4/0Ab{index}-{time.time_ns()}:user{index % users}@example.com"
+            method, path, headers = "POST", SIGNIN_PATH, {"Content-Type": "application/json"}
+            body = json.dumps({"authorization_code": code})
+        start = time.perf_counter()
+        try:
+            conn = connection()
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            ok = response.status == 200
+        except (OSError, http.client.HTTPException):
+            local.__dict__.pop("connection", None)
+            ok = False
+        elapsed = time.perf_counter() - start
+        return elapsed if ok else None
+
+    def client_loop() -> List[Optional[float]]:
+        samples = []
+        while True:
+            with counter_lock:
+                index = next(counter, None)
+            if index is None:
+                return samples
+            samples.append(one_request(index))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = [sample for samples in executor.map(lambda _: client_loop(), range(concurrency)) for sample in samples]
+    elapsed = time.perf_counter() - start
+    latencies = [sample for sample in results if sample is not None]
+    summary = {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": len(results) - len(latencies),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+    }
+    summary.update(percentiles(latencies))
+    return summary
+
+
+def run(arguments: argparse.Namespace) -> Dict[str, Any]:
+    google = LocalGoogleServer(latency=arguments.google_latency).start()
+    secrets = {
+        AUTHENTICATION_SECRET_NAME: {
+            "client_id": google.issuer.audience,
+            "client_secret": "load-test-secret",
+            "redirect_uri": "https://localhost/callback",
+            "encryption_secret_key": "load-test-encryption-key",
+        }
+    }
+    aws = LocalAwsServer(secrets=secrets, latency=arguments.aws_latency).start()
+    environment = dict(
+        aws.environment(),
+        GOOGLE_TOKEN_URI=google.token_uri,
+        GOOGLE_JWKS_URI=google.jwks_uri,
+        CONDITIONAL_SIGNIN_WRITE=str(arguments.conditional_write).lower(),
+    )
+    results = []
+    try:
+        for worker_class in arguments.worker_classes:
+            if worker_class == "gevent" and importlib.util.find_spec("gevent") is None:
+                results.append({"worker_class": worker_class, "skipped": "gevent is not installed"})
+                continue
+            for workers in arguments.workers:
+                server = GunicornProcess(arguments.app, worker_class, workers, arguments.threads, environment)
+                try:
+                    startup_seconds = server.wait_until_ready()
+                    # Warm per-worker caches (secrets, JWKS, HTTP pools) before measuring
+                    drive(server.port, "signin", workers * 2, workers * 4, arguments.users)
+                    for endpoint in arguments.endpoints:
+                        for concurrency in arguments.concurrency:
+                            result = {
+                                "worker_class": worker_class,
+                                "workers": workers,
+                                "threads": arguments.threads if worker_class == "gthread" else 1,
+                                "startup_seconds": round(startup_seconds, 3),
+                            }
+                            result.update(drive(server.port, endpoint, concurrency, arguments.requests, arguments.users))
+                            result["rss_kb_per_worker"] = server.worker_rss_kb()
+                            results.append(result)
+                            print(json.dumps(result), file=sys.stderr)
+                finally:
+                    server.stop()
+    finally:
+        google.stop()
+        aws.stop()
+
+    return {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "settings": {
+            "app": arguments.app,
+            "google_latency": arguments.google_latency,
+            "aws_latency": arguments.aws_latency,
+            "requests": arguments.requests,
+            "users": arguments.users,
+            "conditional_write": arguments.conditional_write,
+        },
+        "results": results,
+    }
+
+
+def result_key(result: Dict[str, Any]) -> tuple:
+    return (result["worker_class"], result.get("workers"), result.get("endpoint"), result.get("concurrency"))
+
+
+def compare(current: Dict[str, Any], previous: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    # Flags runs whose throughput dropped or p99 grew by more than `tolerance`
+    previous_results = {result_key(result): result for result in previous["results"] if "skipped" not in result}
+    regressions = []
+    for result in current["results"]:
+        before = previous_results.get(result_key(result))
+        if "skipped" in result or before is None:
+            continue
+        throughput_change = result["requests_per_second"] / max(before["requests_per_second"], 1e-9) - 1
+        p99_change = result["p99_ms"] / max(before["p99_ms"], 1e-9) - 1
+        if throughput_change < -tolerance or p99_change > tolerance:
+            regressions.append({
+                "run": dict(zip(("worker_class", "workers", "endpoint", "concurrency"), result_key(result))),
+                "requests_per_second": [before["requests_per_second"], result["requests_per_second"]],
+                "p99_ms": [before["p99_ms"], result["p99_ms"]],
+            })
+    return regressions
+
+
+def parse_arguments(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    def int_list(value: str) -> List[int]:
+        return [int(item) for item in value.split(",")]
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--app", default="src.app:app")
+    parser.add_argument("--worker-classes", type=lambda v: v.split(","), default=["sync", "gthread", "gevent"])
+    parser.add_argument("--workers", type=int_list, default=[1, 2, 4])
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--concurrency", type=int_list, default=[1, 4, 16, 64])
+    parser.add_argument("--endpoints", type=lambda v: v.split(","), default=["health", "signin"])
+    parser.add_argument("--requests", type=int, default=500, help="requests per endpoint and concurrency level")
+    parser.add_argument("--users", type=int, default=100, help="distinct users; the rest are returning sign-ins")
+    parser.add_argument("--google-latency", type=float, default=0.05)
+    parser.add_argument("--aws-latency", type=float, default=0.005)
+    parser.add_argument("--conditional-write", action="store_true")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    parser.add_argument("--compare", help="previous results JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    arguments = parse_arguments(argv)
+    report = run(arguments)
+    if arguments.compare:
+        with open(arguments.compare) as previous:
+            report["regressions"] = compare(report, json.load(previous), arguments.tolerance)
+    output = json.dumps(report, indent=2)
+    if arguments.output:
+        with open(arguments.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
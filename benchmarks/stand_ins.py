@@ -0,0 +1,610 @@
+import base64
+import datetime
+import ipaddress
+import json
+import os
+import ssl
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Deque, Dict, Optional, Tuple, Union
+from urllib.parse import parse_qs, unquote
+
+import jwt
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from cryptography.x509.oid import NameOID
+
+
+class LocalJwksIssuer:
+    def __init__(
+        self,
+        kid: str = "local-key-1",
+        issuer: str = "https://accounts.google.com",
+        audience: str = "local-client-id",
+        max_age: int = 3600,
+    ):
+        self.issuer = issuer
+        self.audience = audience
+        self.max_age = max_age
+        self.keys: Dict[str, Any] = {}
+        self.current_kid = kid
+        self.fetches = 0
+        self.add_key(kid)
+
+    def add_key(self, kid: str) -> None:
+        self.keys[kid] = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.current_kid = kid
+
+    def jwks(self) -> Dict[str, Any]:
+        keys = []
+        for kid, private_key in self.keys.items():
+            jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+            jwk.update({"kid": kid, "alg": "RS256", "use": "sig"})
+            keys.append(jwk)
+        return {"keys": keys}
+
+    def headers(self) -> Dict[str, str]:
+        return {"Cache-Control": f"public, max-age={self.max_age}, must-revalidate, no-transform"}
+
+    def fetch(self, jwks_uri: str) -> Tuple[Dict[str, Any], Dict[str, str]]:
+        # Drop-in replacement for the HTTP fetcher used by src.id_token.JwksCache
+        self.fetches += 1
+        return self.jwks(), self.headers()
+
+    def mint_id_token(self, email: str, kid: str = None, **claims: Any) -> str:
+        kid = kid or self.current_kid
+        now = int(time.time())
+        payload = {
+            "iss": self.issuer,
+            "aud": self.audience,
+            "sub": str(abs(hash(email))),
+            "email": email,
+            "email_verified": True,
+            "name": "Local User",
+            "picture": "https://example.com/photo.png",
+            "iat": now,
+            "exp": now + 3600,
+        }
+        payload.update(claims)
+        return jwt.encode(payload, self.keys[kid], algorithm="RS256", headers={"kid": kid})
+
+
+def create_self_signed_certificate(directory: str) -> Tuple[str, str]:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=5))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(
+            x509.SubjectAlternativeName([
+                x509.DNSName("localhost"),
+                x509.IPAddress(ipaddress.ip_address("127.0.0.1")),
+            ]),
+            critical=False,
+        )
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path = os.path.join(directory, "cert.pem")
+    key_path = os.path.join(directory, "key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(certificate.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.TraditionalOpenSSL,
+            serialization.NoEncryption(),
+        ))
+    return cert_path, key_path
+
+
+DROP = "drop"
+THROTTLE = "throttle"
+
+
+class Faults:
+    # Scripted failures for the next requests a stand-in receives, one per request: an HTTP
+    # status (503), THROTTLE, DROP (the connection is closed without an answer) or a delay in
+    # seconds (float) before the normal answer. Requests after the script get normal answers.
+    def __init__(self):
+        self._script: Deque[Union[int, float, str]] = deque()
+        self._lock = threading.Lock()
+
+    def inject(self, *faults: Union[int, float, str]) -> None:
+        with self._lock:
+            self._script.extend(faults)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._script.clear()
+
+    def next(self) -> Optional[Union[int, float, str]]:
+        with self._lock:
+            return self._script.popleft() if self._script else None
+
+
+class LocalGoogleServer:
+    # Stand-in for oauth2.googleapis.com: token endpoint (authorization_code and
+    # refresh_token grants) plus the JWKS certs endpoint.
+    def __init__(
+        self,
+        issuer: Optional[LocalJwksIssuer] = None,
+        latency: float = 0.0,
+        tls: bool = False,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.issuer = issuer or LocalJwksIssuer()
+        self.latency = latency
+        self.tls = tls
+        self.host = host
+        self.port = port
+        self.connections = 0
+        self.token_requests = 0
+        self.faults = Faults()
+        self.ca_bundle: Optional[str] = None
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._tempdir: Optional[tempfile.TemporaryDirectory] = None
+
+    @property
+    def base_url(self) -> str:
+        scheme = "https" if self.tls else "http"
+        host = "localhost" if self.tls else self.host
+        return f"{scheme}://{host}:{self._server.server_address[1]}"
+
+    @property
+    def token_uri(self) -> str:
+        return f"{self.base_url}/token"
+
+    @property
+    def jwks_uri(self) -> str:
+        return f"{self.base_url}/oauth2/v3/certs"
+
+    def token_response(self, form: Dict[str, str]) -> Tuple[int, Dict[str, Any]]:
+        if form.get("client_id") != self.issuer.audience:
+            return 401, {"error": "invalid_client"}
+        grant_type = form.get("grant_type")
+        if grant_type == "authorization_code" and form.get("code"):
+            # Codes look like "<anything>:<email>" so load tests can spread users
+            email = form["code"].rsplit(":", 1)[-1] if ":" in form["code"] else "local-user@example.com"
+            return 200, {
+                "access_token": f"ya29.{uuid.uuid4().hex}",
+                "refresh_token": f"1//{uuid.uuid4().hex}",
+                "id_token": self.issuer.mint_id_token(email),
+                "expires_in": 3599,
+                "token_type": "Bearer",
+            }
+        if grant_type == "refresh_token" and form.get("refresh_token"):
+            return 200, {"access_token": f"ya29.{uuid.uuid4().hex}", "expires_in": 3599, "token_type": "Bearer"}
+        return 400, {"error": "invalid_grant"}
+
+    def start(self) -> "LocalGoogleServer":
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with stand_in._lock:
+                    stand_in.connections += 1
+
+            def do_GET(self):
+                self._send(200, stand_in.issuer.jwks(), stand_in.issuer.headers())
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+                authorization = self.headers.get("Authorization", "")
+                if authorization.startswith("Basic "):
+                    client_id, _, client_secret = base64.b64decode(authorization[6:]).decode().partition(":")
+                    form.update(client_id=unquote(client_id), client_secret=unquote(client_secret))
+                with stand_in._lock:
+                    stand_in.token_requests += 1
+                if stand_in.latency:
+                    time.sleep(stand_in.latency)
+                fault = stand_in.faults.next()
+                if fault == DROP:
+                    self.close_connection = True
+                    return
+                if fault == THROTTLE or isinstance(fault, int):
+                    self._send(429 if fault == THROTTLE else fault, {"error": "temporarily_unavailable"})
+                    return
+                if isinstance(fault, float):
+                    time.sleep(fault)
+                status, body = stand_in.token_response(form)
+                self._send(status, body)
+
+            def _send(self, status, body, headers=None):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        if self.tls:
+            self._tempdir = tempfile.TemporaryDirectory()
+            cert_path, key_path = create_self_signed_certificate(self._tempdir.name)
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(cert_path, key_path)
+            self._server.socket = context.wrap_socket(
+                self._server.socket, server_side=True, do_handshake_on_connect=False
+            )
+            self.ca_bundle = cert_path
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        if self._tempdir is not None:
+            self._tempdir.cleanup()
+
+
+class LocalAppleServer(LocalGoogleServer):
+    # Stand-in for appleid.apple.com: the token endpoint only accepts a client secret that is
+    # an ES256 assertion signed with the team's key, and ID tokens come from the Apple issuer.
+    def __init__(self, issuer: Optional[LocalJwksIssuer] = None, team_id: str = "LOCALTEAM1", key_id: str = "LOCALKEY01", **kwargs: Any):
+        super().__init__(
+            issuer or LocalJwksIssuer(kid="local-apple-key", issuer="https://appleid.apple.com", audience="local.services.id"),
+            **kwargs,
+        )
+        self.team_id = team_id
+        self.key_id = key_id
+        self.signing_key = ec.generate_private_key(ec.SECP256R1())
+        self.private_key = self.signing_key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        ).decode("ascii")
+        self.client_secrets: Dict[str, int] = {}
+
+    @property
+    def jwks_uri(self) -> str:
+        return f"{self.base_url}/auth/keys"
+
+    def settings(self, redirect_uri: str = "https://example.com/callback") -> Tuple[str, str, str, str, str]:
+        # In the order of the apple_* keys in the authentication secret
+        return self.issuer.audience, self.team_id, self.key_id, self.private_key, redirect_uri
+
+    def token_response(self, form: Dict[str, str]) -> Tuple[int, Dict[str, Any]]:
+        client_secret = form.get("client_secret", "")
+        try:
+            if jwt.get_unverified_header(client_secret).get("kid") != self.key_id:
+                return 400, {"error": "invalid_client"}
+            claims = jwt.decode(
+                client_secret,
+                self.signing_key.public_key(),
+                algorithms=["ES256"],
+                audience="https://appleid.apple.com",
+                issuer=self.team_id,
+            )
+        except jwt.PyJWTError:
+            return 400, {"error": "invalid_client"}
+        if claims.get("sub") != form.get("client_id"):
+            return 400, {"error": "invalid_client"}
+        with self._lock:
+            self.client_secrets[client_secret] = self.client_secrets.get(client_secret, 0) + 1
+        return super().token_response(form)
+
+
+class LatencyUserStore:
+    # Wraps a user store and adds a fixed delay per call, approximating DynamoDB round trips
+    def __init__(self, store, latency: float):
+        self.store = store
+        self.latency = latency
+
+    def __getattr__(self, name: str):
+        method = getattr(self.store, name)
+
+        def call(*args, **kwargs):
+            time.sleep(self.latency)
+            return method(*args, **kwargs)
+
+        return call
+
+
+class ConditionalCheckFailed(Exception):
+    pass
+
+
+class LocalAwsServer:
+    # Speaks enough of the DynamoDB (DynamoDB_20120810.*) and Secrets Manager
+    # (secretsmanager.GetSecretValue) JSON protocols for this service. Point boto3
+    # at it with AWS_ENDPOINT_URL_DYNAMODB / AWS_ENDPOINT_URL_SECRETS_MANAGER.
+    def __init__(
+        self,
+        secrets: Optional[Dict[str, Dict[str, Any]]] = None,
+        latency: float = 0.0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        key_schema: Optional[Dict[str, Tuple[str, ...]]] = None,
+    ):
+        self.secrets = secrets or {}
+        # Tables not listed are keyed by email
+        self.key_schema = {"session_revocations": ("pk", "sk"), **(key_schema or {})}
+        self.latency = latency
+        self.host = host
+        self.port = port
+        self.tables: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.requests: Dict[str, int] = {}
+        # Write requests BatchWriteItem hands back as UnprocessedItems before accepting more
+        self.unprocessed_writes = 0
+        self.scan_page_size = 100
+        self.faults = Faults()
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def endpoint_url(self) -> str:
+        return f"http://{self.host}:{self._server.server_address[1]}"
+
+    def environment(self) -> Dict[str, str]:
+        return {
+            "AWS_ENDPOINT_URL_DYNAMODB": self.endpoint_url,
+            "AWS_ENDPOINT_URL_SECRETS_MANAGER": self.endpoint_url,
+            "AWS_ACCESS_KEY_ID": "local",
+            "AWS_SECRET_ACCESS_KEY": "local",
+            "AWS_DEFAULT_REGION": "us-east-1",
+        }
+
+    def handle(self, target: str, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        service, _, operation = target.partition(".")
+        with self._lock:
+            self.requests[operation] = self.requests.get(operation, 0) + 1
+            if service == "secretsmanager" and operation == "GetSecretValue":
+                secret = self.secrets.get(body["SecretId"])
+                if secret is None:
+                    return 400, {"__type": "ResourceNotFoundException", "message": "Secret not found"}
+                return 200, {"Name": body["SecretId"], "SecretString": json.dumps(secret), "VersionId": "local"}
+            handler = getattr(self, f"_{operation}", None)
+            if service != "DynamoDB_20120810" or handler is None:
+                return 400, {"__type": "UnknownOperationException", "message": target}
+            try:
+                return 200, handler(body)
+            except ConditionalCheckFailed:
+                return 400, {
+                    "__type": "com.amazonaws.dynamodb.v20120810#ConditionalCheckFailedException",
+                    "message": "The conditional request failed",
+                }
+
+    def _table(self, name: str) -> Dict[str, Dict[str, Any]]:
+        return self.tables.setdefault(name, {})
+
+    @staticmethod
+    def _key(key: Dict[str, Any]) -> str:
+        return json.dumps(key, sort_keys=True)
+
+    def _item_key(self, table_name: str, item: Dict[str, Any]) -> str:
+        return self._key({name: item[name] for name in self.key_schema.get(table_name, ("email",))})
+
+    @staticmethod
+    def _name(token: str, names: Dict[str, str]) -> str:
+        return names.get(token, token)
+
+    def _project(self, item: Dict[str, Any], body: Dict[str, Any]) -> Dict[str, Any]:
+        if "ProjectionExpression" not in body:
+            return item
+        names = body.get("ExpressionAttributeNames", {})
+        wanted = {self._name(token.strip(), names) for token in body["ProjectionExpression"].split(",")}
+        return {name: value for name, value in item.items() if name in wanted}
+
+    def _check_condition(self, item: Optional[Dict[str, Any]], body: Dict[str, Any]) -> None:
+        condition = body.get("ConditionExpression")
+        if not condition:
+            return
+        names = body.get("ExpressionAttributeNames", {})
+        values = body.get("ExpressionAttributeValues", {})
+        for clause in condition.split(" OR "):
+            clause = clause.strip()
+            if clause.startswith("attribute_not_exists("):
+                if item is None or self._name(clause[21:-1].strip(), names) not in item:
+                    return
+            elif clause.startswith("attribute_exists("):
+                if item is not None and self._name(clause[17:-1].strip(), names) in item:
+                    return
+            elif " < " in clause:
+                left, right = (part.strip() for part in clause.split(" < "))
+                current = (item or {}).get(self._name(left, names))
+                if current is not None and list(current.values())[0] < list(values[right].values())[0]:
+                    return
+            else:
+                raise ValueError(f"Unsupported condition: {clause}")
+        raise ConditionalCheckFailed()
+
+    def _GetItem(self, body):
+        item = self._table(body["TableName"]).get(self._key(body["Key"]))
+        return {"Item": self._project(item, body)} if item is not None else {}
+
+    def _PutItem(self, body):
+        table = self._table(body["TableName"])
+        key = self._item_key(body["TableName"], body["Item"])
+        self._check_condition(table.get(key), body)
+        table[key] = body["Item"]
+        return {}
+
+    def _UpdateItem(self, body):
+        table = self._table(body["TableName"])
+        key = self._key(body["Key"])
+        old = table.get(key)
+        self._check_condition(old, body)
+        item = dict(old) if old is not None else dict(body["Key"])
+        names = body.get("ExpressionAttributeNames", {})
+        values = body.get("ExpressionAttributeValues", {})
+        expression = body["UpdateExpression"].strip()
+        assert expression.startswith("SET "), expression
+        updated = []
+        for assignment in _split_assignments(expression[4:]):
+            target, _, source = (part.strip() for part in assignment.partition("="))
+            name = self._name(target, names)
+            if source.startswith("if_not_exists("):
+                path, value = (part.strip() for part in source[14:-1].split(","))
+                if self._name(path, names) in item:
+                    # DynamoDB still reports the attribute as updated (to its own value)
+                    updated.append(name)
+                    continue
+                source = value
+            item[name] = values[source]
+            updated.append(name)
+        table[key] = item
+        if body.get("ReturnValues") == "UPDATED_OLD" and old is not None:
+            return {"Attributes": {name: old[name] for name in updated if name in old}}
+        if body.get("ReturnValues") == "ALL_NEW":
+            return {"Attributes": item}
+        return {}
+
+    def _BatchGetItem(self, body):
+        responses: Dict[str, Any] = {}
+        for table_name, request in body["RequestItems"].items():
+            table = self._table(table_name)
+            found = [table[self._key(key)] for key in request["Keys"] if self._key(key) in table]
+            responses[table_name] = [self._project(item, request) for item in found]
+        return {"Responses": responses, "UnprocessedKeys": {}}
+
+    def _Scan(self, body):
+        # Segments split the keys by a stable hash; pages follow key order like a real table partition
+        table = self._table(body["TableName"])
+        total_segments = body.get("TotalSegments", 1)
+        keys = sorted(
+            key for key in table
+            if total_segments == 1 or zlib.crc32(key.encode()) % total_segments == body["Segment"]
+        )
+        if "ExclusiveStartKey" in body:
+            start = self._item_key(body["TableName"], body["ExclusiveStartKey"])
+            keys = [key for key in keys if key > start]
+        limit = min(body.get("Limit", self.scan_page_size), self.scan_page_size)
+        page = keys[:limit]
+        response: Dict[str, Any] = {"Items": [self._project(table[key], body) for key in page], "Count": len(page)}
+        if len(keys) > limit:
+            last = table[page[-1]]
+            response["LastEvaluatedKey"] = {
+                name: last[name] for name in self.key_schema.get(body["TableName"], ("email",))
+            }
+        return response
+
+    def _Query(self, body):
+        # "<pk> = :v" optionally followed by "AND <sk> > :v"; items come back in sort key order
+        table = self._table(body["TableName"])
+        names = body.get("ExpressionAttributeNames", {})
+        values = body.get("ExpressionAttributeValues", {})
+        conditions = []
+        for clause in body["KeyConditionExpression"].split(" AND "):
+            left, operator, right = clause.split()
+            conditions.append((self._name(left, names), operator, values[right]["S"]))
+        schema = self.key_schema.get(body["TableName"], ("email",))
+        items = [
+            item for item in table.values()
+            if all(item[name]["S"] == value if operator == "=" else item[name]["S"] > value
+                   for name, operator, value in conditions)
+        ]
+        items.sort(key=lambda item: tuple(item[name]["S"] for name in schema))
+        if "ExclusiveStartKey" in body:
+            start = tuple(body["ExclusiveStartKey"][name]["S"] for name in schema)
+            items = [item for item in items if tuple(item[name]["S"] for name in schema) > start]
+        limit = min(body.get("Limit", self.scan_page_size), self.scan_page_size)
+        page = items[:limit]
+        response: Dict[str, Any] = {"Items": [self._project(item, body) for item in page], "Count": len(page)}
+        if len(items) > limit:
+            response["LastEvaluatedKey"] = {name: page[-1][name] for name in schema}
+        return response
+
+    def _BatchWriteItem(self, body):
+        unprocessed: Dict[str, Any] = {}
+        for table_name, requests in body["RequestItems"].items():
+            if len(requests) > 25:
+                raise ValueError("Too many items requested for the BatchWriteItem call")
+            table = self._table(table_name)
+            bounced = min(self.unprocessed_writes, len(requests))
+            if bounced:
+                self.unprocessed_writes -= bounced
+                unprocessed[table_name] = requests[-bounced:]
+                requests = requests[:-bounced]
+            for request in requests:
+                if "PutRequest" in request:
+                    item = request["PutRequest"]["Item"]
+                    table[self._item_key(table_name, item)] = item
+                elif "DeleteRequest" in request:
+                    table.pop(self._key(request["DeleteRequest"]["Key"]), None)
+        return {"UnprocessedItems": unprocessed}
+
+    def start(self) -> "LocalAwsServer":
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if stand_in.latency:
+                    time.sleep(stand_in.latency)
+                fault = stand_in.faults.next()
+                if fault == DROP:
+                    self.close_connection = True
+                    return
+                if isinstance(fault, float):
+                    time.sleep(fault)
+                if fault == THROTTLE:
+                    status, response = 400, {
+                        "__type": "com.amazonaws.dynamodb.v20120810#ProvisionedThroughputExceededException",
+                        "message": "The level of configured provisioned throughput for the table was exceeded",
+                    }
+                elif isinstance(fault, int):
+                    status, response = fault, {"__type": "InternalServerError", "message": "Injected fault"}
+                else:
+                    status, response = stand_in.handle(self.headers.get("X-Amz-Target", ""), body)
+                payload = json.dumps(response).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/x-amz-json-1.0")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+def _split_assignments(expression: str):
+    depth, current = 0, []
+    for char in expression:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        if char == "," and depth == 0:
+            yield "".join(current)
+            current = []
+        else:
+            current.append(char)
+    if current:
+        yield "".join(current)
@@ -0,0 +1,36 @@
+import json
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+
+def measure(name: str, fn: Callable[[], Any], iterations: int, warmup: int = 100) -> Dict[str, Any]:
+    for _ in range(warmup):
+        fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    elapsed = time.perf_counter() - start
+    return {
+        "name": name,
+        "iterations": iterations,
+        "total_seconds": round(elapsed, 6),
+        "us_per_op": round(elapsed / iterations * 1e6, 3),
+        "ops_per_second": round(iterations / elapsed, 1),
+    }
+
+
+def report(results: List[Dict[str, Any]]) -> None:
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    if not ordered:
+        return {"p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0}
+
+    def pick(fraction: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] * 1000, 3)
+
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
@@ -24,6 +24,7 @@ export class AuthServiceStack extends Stack {
     new AuthServiceIamPolicies(this, 'AuthServiceIamPolicies', {
       ec2Instance: ec2Instance.instance,
       dynamoDbTable: dynamoDb.table,
+      revocationTable: dynamoDb.revocationTable,
       s3Bucket: wheelBucket,
     });
 
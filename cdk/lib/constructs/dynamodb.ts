@@ -4,6 +4,7 @@ import { Table, AttributeType, BillingMode, ITable } from 'aws-cdk-lib/aws-dynam
 
 export class AuthServiceDynamoDb extends Construct {
   public readonly table: ITable;
+  public readonly revocationTable: ITable;
 
   constructor(scope: Construct, id: string) {
     super(scope, id);
@@ -21,5 +22,16 @@ export class AuthServiceDynamoDb extends Construct {
         removalPolicy: RemovalPolicy.RETAIN,
       });
     }
+
+    // Session revocations (src/session_revocation.py): one partition per UTC day, and the
+    // expires_at TTL drops each entry once the revoked session would have expired anyway
+    this.revocationTable = new Table(this, 'SessionRevocationsTable', {
+      tableName: 'session_revocations',
+      partitionKey: { name: 'pk', type: AttributeType.STRING },
+      sortKey: { name: 'sk', type: AttributeType.STRING },
+      timeToLiveAttribute: 'expires_at',
+      billingMode: BillingMode.PAY_PER_REQUEST,
+      removalPolicy: RemovalPolicy.RETAIN,
+    });
   }
 }
\ No newline at end of file
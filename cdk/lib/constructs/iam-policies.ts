@@ -8,6 +8,7 @@ import { createPolicyStatement } from '@genflowly/cdk-commons';
 export interface AuthServiceIamPoliciesProps {
   ec2Instance: Instance;
   dynamoDbTable: ITable;
+  revocationTable: ITable;
   s3Bucket: IBucket;
 }
 
@@ -50,7 +51,7 @@ export class AuthServiceIamPolicies extends Construct {
         'dynamodb:Query',
         'dynamodb:Scan'
       ],
-      resources: [props.dynamoDbTable.tableArn]
+      resources: [props.dynamoDbTable.tableArn, props.revocationTable.tableArn]
     });
 
     props.ec2Instance.role.addToPrincipalPolicy(dynamoDbPolicy);
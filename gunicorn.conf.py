@@ -0,0 +1,16 @@
+# Loaded automatically by gunicorn when it is started from the repository root.
+#
+# With GUNICORN_PRELOAD=true the app is imported and warmed up once in the master, and
+# workers fork with it already in memory. Each worker recreates its own HTTP pools, boto3
+# clients, executors and background threads after the fork. Code changes then need a full
+# restart rather than a HUP, so it is off by default.
+import os
+
+preload_app = os.environ.get("GUNICORN_PRELOAD", "false").lower() == "true"
+
+
+def on_starting(server):
+    if server.cfg.preload_app:
+        from src.warmup import warm_up
+
+        warm_up()
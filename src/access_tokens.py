@@ -0,0 +1,231 @@
+# Google access tokens for signed-in users, served by /api/v1/accessToken.
+#
+# Downstream services get the user's current access token from here instead of each refreshing
+# it with Google. Decrypted tokens are cached per worker until ACCESS_TOKEN_EXPIRY_MARGIN_SECONDS
+# before they expire. On a miss the token stored with the user is used if it is still fresh
+# (another worker may have refreshed it), otherwise it is refreshed with the stored refresh token.
+# Only one lookup or refresh per user runs at a time, and the requests waiting for it give up at
+# their deadline; the refreshed token is written back to the user store on a background thread.
+# Sign-in stores the expiry of the token it received, so that token is served without a refresh.
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, Optional, Tuple
+
+from prometheus_client import REGISTRY, Counter
+
+from src import service
+from src.constants import (
+    ACCESS_TOKEN_CACHE_SIZE,
+    ACCESS_TOKEN_DEADLINE_SECONDS,
+    ACCESS_TOKEN_EXPIRY_MARGIN_SECONDS,
+    ACCESS_TOKEN_PERSIST_WORKERS,
+)
+from src.apple_token_client import get_apple_token_client
+from src.google_token_client import GoogleTokenClient, TokenExchangeError, get_google_token_client
+from src.identity_providers import APPLE, provider_for_user
+from src.local_utils import InvalidSessionError
+from src.resilience import request_deadline, time_remaining
+from src.session_verification import verify_session
+from src.user_store import UserStore, get_user_store
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXPIRES_IN_SECONDS = service.DEFAULT_EXPIRES_IN_SECONDS
+TOKEN_ATTRIBUTES = ("access_token", "access_token_expires_at", "refresh_token", "oidc_provider")
+
+access_token_requests = Counter(
+    "access_token_requests_total",
+    "Access token lookups by source (cache, joined, store, refresh, error)",
+    ["source"],
+    registry=REGISTRY,
+)
+
+
+class AccessTokenError(Exception):
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+
+class AccessTokenCache:
+    # LRU of (access token, expiry as epoch seconds) per email
+    def __init__(self, max_entries: int = ACCESS_TOKEN_CACHE_SIZE, margin: float = ACCESS_TOKEN_EXPIRY_MARGIN_SECONDS):
+        self.max_entries = max_entries
+        self.margin = margin
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+    def get(self, email: str) -> Optional[Tuple[str, float]]:
+        with self._lock:
+            entry = self._entries.get(email)
+            if entry is None:
+                return None
+            if not self.is_fresh(entry[1]):
+                del self._entries[email]
+                return None
+            self._entries.move_to_end(email)
+            return entry
+
+    def put(self, email: str, access_token: str, expires_at: float) -> None:
+        with self._lock:
+            self._entries[email] = (access_token, expires_at)
+            self._entries.move_to_end(email)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, email: str) -> None:
+        with self._lock:
+            self._entries.pop(email, None)
+
+    def is_fresh(self, expires_at: float) -> bool:
+        return expires_at - self.margin > time.time()
+
+
+def _token_client(oidc_provider: Optional[str]) -> GoogleTokenClient:
+    # Refresh tokens are only accepted by the provider that issued them
+    if provider_for_user(oidc_provider) is APPLE:
+        return get_apple_token_client(*service._fetch_sign_with_apple_secrets_from_aws())
+    client_id, client_secret, redirect_uri = service._fetch_sign_with_google_secrets_from_aws()
+    return get_google_token_client(client_id, client_secret, redirect_uri)
+
+
+class AccessTokenBroker:
+    def __init__(
+        self,
+        cache: Optional[AccessTokenCache] = None,
+        store_factory: Callable[[], UserStore] = get_user_store,
+        persist_workers: int = ACCESS_TOKEN_PERSIST_WORKERS,
+    ):
+        self.cache = cache or AccessTokenCache()
+        self._store_factory = store_factory
+        self._persist_workers = persist_workers
+        self._persist_executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._flights: Dict[str, Future] = {}
+
+    def get(self, email: str) -> Tuple[str, float]:
+        # (access token, expiry as epoch seconds)
+        entry = self.cache.get(email)
+        if entry is not None:
+            access_token_requests.labels(source="cache").inc()
+            return entry
+        with self._lock:
+            flight = self._flights.get(email)
+            leader = flight is None
+            if leader:
+                flight = self._flights[email] = Future()
+        if not leader:
+            access_token_requests.labels(source="joined").inc()
+            try:
+                return flight.result(timeout=time_remaining())
+            except FutureTimeoutError:
+                access_token_requests.labels(source="error").inc()
+                logger.error("Gave up waiting for the access token refresh of %s", email)
+                raise AccessTokenError("Access token refresh timed out", 504)
+        try:
+            entry = self._load(email)
+        except BaseException as e:
+            access_token_requests.labels(source="error").inc()
+            flight.set_exception(e)
+            raise
+        else:
+            flight.set_result(entry)
+        finally:
+            with self._lock:
+                self._flights.pop(email, None)
+        return entry
+
+    def flush(self) -> None:
+        # Waits for queued write-backs; used at shutdown and in tests
+        with self._lock:
+            executor, self._persist_executor = self._persist_executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def _load(self, email: str) -> Tuple[str, float]:
+        item = self._store_factory().get(email, attributes=TOKEN_ATTRIBUTES)
+        if item is None:
+            raise AccessTokenError("Unknown user", 404)
+        encryption_secret_key = service._get_encryption_secret_key()
+
+        expires_at = float(item.get("access_token_expires_at") or 0)
+        if item.get("access_token") and self.cache.is_fresh(expires_at):
+            access_token = service.decrypt_token(item["access_token"], encryption_secret_key)
+            access_token_requests.labels(source="store").inc()
+            self.cache.put(email, access_token, expires_at)
+            return access_token, expires_at
+
+        if not item.get("refresh_token"):
+            raise AccessTokenError("No refresh token stored for user, sign in again", 401)
+        refresh_token = service.decrypt_token(item["refresh_token"], encryption_secret_key)
+        token_client = _token_client(item.get("oidc_provider"))
+        try:
+            tokens = token_client.refresh(refresh_token)
+        except TokenExchangeError as e:
+            logger.error("Access token refresh failed for %s: %s", email, e)
+            if e.status_code in (400, 401):
+                # invalid_grant: the user revoked access or the refresh token expired
+                raise AccessTokenError("Refresh token was rejected, sign in again", 401)
+            raise AccessTokenError("Access token refresh failed", 502)
+        except Exception as e:
+            logger.error("Access token refresh failed for %s: %s", email, e)
+            raise AccessTokenError("Access token refresh failed", 502)
+
+        access_token_requests.labels(source="refresh").inc()
+        access_token = tokens["access_token"]
+        expires_at = time.time() + int(tokens.get("expires_in", DEFAULT_EXPIRES_IN_SECONDS))
+        self.cache.put(email, access_token, expires_at)
+        self._persist(email, access_token, tokens.get("refresh_token"), expires_at, encryption_secret_key)
+        return access_token, expires_at
+
+    def _persist(self, email, access_token, refresh_token, expires_at, encryption_secret_key) -> None:
+        with self._lock:
+            if self._persist_executor is None:
+                self._persist_executor = ThreadPoolExecutor(
+                    max_workers=self._persist_workers, thread_name_prefix="access-token-persist"
+                )
+            self._persist_executor.submit(
+                self._write, email, access_token, refresh_token, expires_at, encryption_secret_key
+            )
+
+    def _write(self, email, access_token, refresh_token, expires_at, encryption_secret_key) -> None:
+        try:
+            attributes = {
+                "access_token": service.encrypt_token(access_token, encryption_secret_key),
+                "access_token_expires_at": int(expires_at),
+            }
+            if refresh_token:
+                # Google rarely rotates refresh tokens, but when it does the old one stops working
+                attributes["refresh_token"] = service.encrypt_token(refresh_token, encryption_secret_key)
+            self._store_factory().update_attributes(email, attributes)
+        except Exception as e:
+            logger.error("Could not store refreshed access token for %s: %s", email, e)
+
+    def reset_after_fork(self) -> None:
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._persist_executor = None
+
+
+def access_token_for_session(session_token: Optional[str]) -> Tuple[str, int]:
+    # (access token, seconds until it expires) for the user of a session JWT
+    if not session_token:
+        raise AccessTokenError("Session token is required", 401)
+    try:
+        claims = verify_session(session_token)
+    except InvalidSessionError as e:
+        logger.info("Rejected access token request: %s", e)
+        raise AccessTokenError("Invalid session", 401)
+    with request_deadline(ACCESS_TOKEN_DEADLINE_SECONDS):
+        access_token, expires_at = access_token_broker.get(claims["email"])
+    return access_token, max(0, int(expires_at - time.time()))
+
+
+access_token_broker = AccessTokenBroker()
+os.register_at_fork(after_in_child=access_token_broker.reset_after_fork)
+atexit.register(access_token_broker.flush)
@@ -0,0 +1,281 @@
+# Admission control for the sign-in endpoint.
+#
+# At most `limit` sign-ins run at once per worker. Further requests wait in a FIFO queue of at
+# most `max_queue` entries for up to `queue_timeout` seconds; beyond that they are shed with
+# 503 and Retry-After instead of piling up until the load balancer times out. With
+# ADMISSION_ADAPTIVE the limit follows latency (AIMD): it grows by one per limit's worth of
+# fast completions and is cut when completions exceed ADMISSION_LATENCY_TARGET_SECONDS. A
+# per-client-IP token bucket can additionally cap how fast one client may sign in.
+# Works for threads (Flask) and for asyncio tasks (ASGI) on the same controller.
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Mapping, Optional, Tuple
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+
+from src.constants import (
+    ADMISSION_CONCURRENCY_LIMIT,
+    ADMISSION_MAX_QUEUE,
+    ADMISSION_QUEUE_TIMEOUT_SECONDS,
+    ADMISSION_ADAPTIVE,
+    ADMISSION_MIN_LIMIT,
+    ADMISSION_MAX_LIMIT,
+    ADMISSION_LATENCY_TARGET_SECONDS,
+    ADMISSION_RATE_PER_CLIENT,
+    ADMISSION_BURST_PER_CLIENT,
+    ADMISSION_TRUST_FORWARDED_FOR,
+    SIGNIN_STAGE_BUCKETS,
+)
+
+BACKOFF_FACTOR = 0.9
+MAX_TRACKED_CLIENTS = 100000
+
+admission_requests = Counter(
+    "admission_requests_total",
+    "Sign-in admission decisions (admitted, queued, shed, rate_limited)",
+    ["result"],
+    registry=REGISTRY,
+)
+admission_shed = Counter(
+    "admission_shed_total", "Sign-ins rejected with 503 by reason (queue_full, queue_timeout)", ["reason"], registry=REGISTRY
+)
+admission_queue_wait = Histogram(
+    "admission_queue_wait_seconds", "Time admitted sign-ins waited for a slot", buckets=SIGNIN_STAGE_BUCKETS, registry=REGISTRY
+)
+admission_limit = Gauge("admission_concurrency_limit", "Current sign-in concurrency limit", registry=REGISTRY)
+ADMISSION_METRICS = (admission_requests, admission_shed, admission_queue_wait, admission_limit)
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def status(self) -> int:
+        return 429 if self.reason == "rate_limited" else 503
+
+
+class TokenBucketLimiter:
+    # One bucket per client, least recently seen clients are forgotten first
+    def __init__(self, rate: float, burst: float, max_clients: int = MAX_TRACKED_CLIENTS, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def acquire(self, client: str) -> float:
+        # 0 when a token was taken, otherwise the seconds until one is available
+        now = self._clock()
+        with self._lock:
+            tokens, updated = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[client] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class _Waiter:
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop
+        self.enqueued = time.monotonic()
+        if loop is None:
+            self.event = threading.Event()
+        else:
+            self.future = loop.create_future()
+        self.granted = False
+
+    def grant(self) -> None:
+        # Called with the controller lock held
+        self.granted = True
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self) -> None:
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class Ticket:
+    # Holds one concurrency slot; releasing it reports the latency to the limit algorithm
+    def __init__(self, controller: "AdmissionController", started: float):
+        self._controller = controller
+        self._started = started
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._controller._release(time.monotonic() - self._started)
+
+    def __enter__(self) -> "Ticket":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        limit: int = ADMISSION_CONCURRENCY_LIMIT,
+        max_queue: int = ADMISSION_MAX_QUEUE,
+        queue_timeout: float = ADMISSION_QUEUE_TIMEOUT_SECONDS,
+        adaptive: bool = ADMISSION_ADAPTIVE,
+        min_limit: int = ADMISSION_MIN_LIMIT,
+        max_limit: int = ADMISSION_MAX_LIMIT,
+        latency_target: float = ADMISSION_LATENCY_TARGET_SECONDS,
+        rate_limiter: Optional[TokenBucketLimiter] = None,
+    ):
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.adaptive = adaptive
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, limit)
+        self.latency_target = latency_target
+        self.rate_limiter = rate_limiter
+        self._limit = float(limit)
+        self._in_flight = 0
+        self._waiters: Deque[_Waiter] = deque()
+        self._lock = threading.Lock()
+        self._last_decrease = 0.0
+        self._latency = latency_target
+        admission_limit.set(limit)
+
+    @property
+    def limit(self) -> int:
+        return max(1, int(self._limit))
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def admit(self, client: Optional[str] = None) -> Ticket:
+        waiter = self._enter(client)
+        if waiter is not None:
+            if not waiter.event.wait(self.queue_timeout):
+                self._abandon(waiter)
+        return self._admitted(waiter)
+
+    async def admit_async(self, client: Optional[str] = None) -> Ticket:
+        waiter = self._enter(client, asyncio.get_running_loop())
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._abandon(waiter)
+            except asyncio.CancelledError:
+                self._abandon(waiter, cancelled=True)
+                raise
+        return self._admitted(waiter)
+
+    def _enter(self, client: Optional[str], loop=None) -> Optional[_Waiter]:
+        if self.rate_limiter is not None and client is not None:
+            wait = self.rate_limiter.acquire(client)
+            if wait > 0:
+                admission_requests.labels(result="rate_limited").inc()
+                raise AdmissionRejected("rate_limited", max(1, math.ceil(wait)))
+        with self._lock:
+            if self._in_flight < self.limit and not self._waiters:
+                self._in_flight += 1
+                return None
+            if len(self._waiters) >= self.max_queue:
+                retry_after = self._retry_after()
+            else:
+                waiter = _Waiter(loop)
+                self._waiters.append(waiter)
+                admission_requests.labels(result="queued").inc()
+                return waiter
+        self._shed("queue_full", retry_after)
+
+    def _abandon(self, waiter: _Waiter, cancelled: bool = False) -> None:
+        with self._lock:
+            if waiter.granted:
+                # The slot was handed over just as the wait ran out
+                if cancelled:
+                    self._release_slot()
+                return
+            self._waiters.remove(waiter)
+            retry_after = self._retry_after()
+        if not cancelled:
+            self._shed("queue_timeout", retry_after)
+
+    def _admitted(self, waiter: Optional[_Waiter]) -> Ticket:
+        now = time.monotonic()
+        admission_requests.labels(result="admitted").inc()
+        if waiter is not None:
+            admission_queue_wait.observe(now - waiter.enqueued)
+        return Ticket(self, now)
+
+    def _shed(self, reason: str, retry_after: int) -> None:
+        admission_requests.labels(result="shed").inc()
+        admission_shed.labels(reason=reason).inc()
+        raise AdmissionRejected(reason, retry_after)
+
+    def _retry_after(self) -> int:
+        # Roughly how long the current queue takes to drain at the observed latency
+        return max(1, math.ceil(self._latency * (len(self._waiters) + 1) / self.limit))
+
+    def _release(self, latency: float) -> None:
+        with self._lock:
+            self._latency += 0.1 * (latency - self._latency)
+            if self.adaptive:
+                self._adapt(latency)
+            self._release_slot()
+
+    def _release_slot(self) -> None:
+        # Called with the lock held: hand the slot straight to the oldest waiter if the
+        # (possibly lowered) limit allows it
+        self._in_flight -= 1
+        while self._waiters and self._in_flight < self.limit:
+            self._in_flight += 1
+            self._waiters.popleft().grant()
+
+    def _adapt(self, latency: float) -> None:
+        now = time.monotonic()
+        if latency > self.latency_target:
+            # At most one cut per target interval, so one slow burst is not counted many times
+            if now - self._last_decrease >= self.latency_target:
+                self._limit = max(self.min_limit, self._limit * BACKOFF_FACTOR)
+                self._last_decrease = now
+        elif self._in_flight >= self.limit / 2:
+            # Only grow while the limit is actually being used
+            self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+        admission_limit.set(self.limit)
+
+    def reset_after_fork(self) -> None:
+        # Slots and waiters belong to the parent's requests
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._waiters = deque()
+
+
+def client_address(headers: Mapping[str, str], remote_addr: Optional[str]) -> Optional[str]:
+    # Behind nginx the peer is the proxy; its X-Forwarded-For entry is the last one
+    if ADMISSION_TRUST_FORWARDED_FOR:
+        forwarded = headers.get("X-Forwarded-For") or headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.rsplit(",", 1)[-1].strip()
+    return remote_addr
+
+
+signin_admission = AdmissionController(
+    rate_limiter=TokenBucketLimiter(ADMISSION_RATE_PER_CLIENT, ADMISSION_BURST_PER_CLIENT)
+    if ADMISSION_RATE_PER_CLIENT > 0 else None
+)
+os.register_at_fork(after_in_child=signin_admission.reset_after_fork)
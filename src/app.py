@@ -1,17 +1,38 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from prometheus_flask_exporter import PrometheusMetrics
-from typing import Any, Dict
+from typing import Any, Callable, Dict, Tuple
 import logging
 from flask_cors import CORS
 
-from src.constants import API_PREFIX, API_VERSION
+from src.access_tokens import AccessTokenError, access_token_for_session
+from src.admission import AdmissionRejected, client_address, signin_admission
+from src.constants import API_PREFIX, API_VERSION, CONDITIONAL_SIGNIN_WRITE, SIGNIN_DEADLINE_SECONDS
+from src.identity_providers import APPLE, GOOGLE, IDENTITY_PROVIDERS, IdentityProvider
+from src.id_token import IdTokenClaims
+from src.local_utils import (
+    InvalidSessionError,
+    expired_session_cookie_header,
+    session_cookie_header,
+    session_token_from_headers,
+)
+from src.logging_config import configure_logging
+from src.profiling import request_profiler
+from src.resilience import DependencyUnavailable, request_deadline
+from src.session_renewal import renew_session, renewal_response
+from src.session_revocation import UnrevocableSessionError, logout
+from src.session_verification import verify_session
 from src.service import (
+    authorize_with_apple,
     authorize_with_google,
+    verify_apple_id_token,
+    verify_google_id_token,
+    signin_user,
     is_user_exists,
     create_user,
     authenticate_user,
 )
-from src.local_utils import extract_email_from_token
+from src.signin_dedup import SigninResponse, signin_deduplicator
+from src.stage_metrics import trace_id, trace_id_from_headers
 
 app = Flask(__name__)
 CORS(app)
@@ -28,13 +49,38 @@ metrics.register_default(
 )
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 
-@app.route(f"/{API_PREFIX}/{API_VERSION}/signinWithGoogle", methods=["POST"])
+@app.before_request
+def begin_profile() -> None:
+    if request_profiler.enabled and request.url_rule is not None and request.endpoint != "admin_profile":
+        g.profile = request_profiler.begin(f"{request.method} {request.url_rule.rule}", request.headers)
+
+
+@app.teardown_request
+def end_profile(exception) -> None:
+    profiled = g.pop("profile", None)
+    if profiled is not None:
+        request_profiler.end(profiled)
+
+
+@app.route(f"/{API_PREFIX}/{API_VERSION}/signinWithGoogle", methods=["POST"], defaults={"provider": GOOGLE.name})
+@app.route(f"/{API_PREFIX}/{API_VERSION}/signinWithApple", methods=["POST"], defaults={"provider": APPLE.name})
 @metrics.gauge('in_progress', 'Long running requests in progress')
-def signin_with_google() -> Any:
+def signin_with_provider(provider: str) -> Any:
+    trace_id.set(trace_id_from_headers(request.headers))
+    try:
+        ticket = signin_admission.admit(client_address(request.headers, request.remote_addr))
+    except AdmissionRejected as e:
+        logger.warning("Sign-in rejected: %s", e.reason)
+        return jsonify({"error": "Too many sign-in requests, retry later"}), e.status, {"Retry-After": str(e.retry_after)}
+    with ticket, request_deadline(SIGNIN_DEADLINE_SECONDS):
+        return _signin_with_provider(IDENTITY_PROVIDERS[provider])
+
+
+def _signin_with_provider(provider: IdentityProvider) -> Any:
     try:
         data: Dict[str, Any] = request.get_json()
         if data is None:
@@ -42,24 +88,62 @@ def signin_with_google() -> Any:
         if "authorization_code" not in data:
             raise KeyError("Authorization code is required in parameters")
     except ValueError as e:
-        logger.error(f"ValueError: {e}")
+        logger.error("ValueError: %s", e)
         return jsonify({"error": str(e)}), 400
     except KeyError as e:
-        logger.error(f"KeyError: {e}")
+        logger.error("KeyError: %s", e)
         return jsonify({"error": str(e)}), 400
     except Exception as e:
-        logger.error(f"Unexpected error 3: {e}")
+        logger.error("Unexpected error 3: %s", e)
         return jsonify({"error": "An unexpected error occurred"}), 500
     # Step 1 - Get Authorization code from request
     authorization_code: str = data["authorization_code"]
-    # Step 2 - Request authorization with Google
-    logger.info(f"Received redirect_uri: {data.get('redirect_uri')}")  # Add this line
+    # Step 2 - Request authorization with the provider
+    logger.info("Received redirect_uri: %s", data.get('redirect_uri'))  # Add this line
+
+    # Duplicate POSTs of the same code share one sign-in and its response
+    response = signin_deduplicator.run(authorization_code, lambda: _capture(_signin(authorization_code, provider)))
+    return Response(response.body, response.status, response.headers)
+
+
+def _capture(result: Any) -> SigninResponse:
+    response = app.make_response(result)
+    return SigninResponse(response.status_code, list(response.headers.items()), response.get_data())
 
+
+def _provider_steps(provider: IdentityProvider) -> Tuple[Callable[[str], Any], Callable[[str], IdTokenClaims]]:
+    # Resolved per call, so each provider's steps are this module's (patchable) imports
+    if provider is APPLE:
+        return authorize_with_apple, verify_apple_id_token
+    return authorize_with_google, verify_google_id_token
+
+
+def _signin(authorization_code: str, provider: IdentityProvider = GOOGLE) -> Any:
+    authorize, verify_id_token = _provider_steps(provider)
     try:
-        access_token, refresh_token, id_token = authorize_with_google(authorization_code)
+        access_token, refresh_token, id_token, expires_at = authorize(authorization_code)
+    except DependencyUnavailable as e:
+        logger.warning("Sign-in failed fast: %s", e)
+        return jsonify({"error": f"{provider.display_name} sign-in is temporarily unavailable, retry later"}), 503
     except Exception:
-        return jsonify({"error": "Exception occurred during authorization with Google"}), 500
-    user_email = extract_email_from_token(id_token)
+        return jsonify({"error": f"Exception occurred during authorization with {provider.display_name}"}), 500
+    # Decoded and signature-checked once, then passed down the pipeline
+    try:
+        claims = verify_id_token(id_token)
+    except Exception as e:
+        logger.error("ID token verification failed: %s", e)
+        return jsonify({"error": "Invalid ID token"}), 401
+    user_email = claims.email
+
+    if CONDITIONAL_SIGNIN_WRITE:
+        # Steps 3-5 in one conditional DynamoDB write
+        try:
+            response, user_created = signin_user(claims, access_token, refresh_token, expires_at)
+        except Exception as e:
+            logger.error("Conditional sign-in write failed: %s", e)
+            return jsonify({"error": "Exception occurred during customer authentication"}), 500
+        return response
+
     # Step 3 - Check if customer exists
     try:
         user_exists: bool = is_user_exists(user_email)
@@ -68,7 +152,7 @@ def signin_with_google() -> Any:
 
     # Step 4 - Create customer if not exists
     if not user_exists:
-        user_create_success = create_user(user_email, id_token, access_token, refresh_token)
+        user_create_success = create_user(user_email, claims, access_token, refresh_token, expires_at)
         if not user_create_success:
             return jsonify({"error": "Exception occurred during customer signup"}), 500
 
@@ -81,6 +165,81 @@ def signin_with_google() -> Any:
     return response
 
 
+@app.route(f"/{API_PREFIX}/{API_VERSION}/accessToken", methods=["GET"])
+def access_token() -> Any:
+    try:
+        token, expires_in = access_token_for_session(session_token_from_headers(request.headers))
+    except AccessTokenError as e:
+        return jsonify({"error": str(e)}), e.status
+    except Exception as e:
+        logger.error("Unexpected error in access_token: %s", e)
+        return jsonify({"error": "An unexpected error occurred"}), 500
+    return jsonify({"access_token": token, "expires_in": expires_in}), 200, {"Cache-Control": "no-store"}
+
+
+@app.route(f"/{API_PREFIX}/{API_VERSION}/session/verify", methods=["GET"])
+def session_verify() -> Any:
+    try:
+        claims = verify_session(session_token_from_headers(request.headers))
+    except InvalidSessionError as e:
+        logger.info("Rejected session: %s", e)
+        return jsonify({"error": "Invalid session"}), 401
+    except Exception as e:
+        logger.error("Unexpected error in session_verify: %s", e)
+        return jsonify({"error": "An unexpected error occurred"}), 500
+    return jsonify({"claims": claims}), 200, {"Cache-Control": "no-store"}
+
+
+@app.route(f"/{API_PREFIX}/{API_VERSION}/session/renew", methods=["POST"])
+def session_renew() -> Any:
+    try:
+        token, exp = renew_session(session_token_from_headers(request.headers))
+    except InvalidSessionError as e:
+        logger.info("Rejected session renewal: %s", e)
+        return jsonify({"error": "Invalid session"}), 401
+    except Exception as e:
+        logger.error("Unexpected error in session_renew: %s", e)
+        return jsonify({"error": "An unexpected error occurred"}), 500
+    headers = {"Cache-Control": "no-store"}
+    if token is not None:
+        headers["Set-Cookie"] = session_cookie_header(token)
+    return jsonify(renewal_response(token, exp)), 200, headers
+
+
+@app.route(f"/{API_PREFIX}/{API_VERSION}/logout", methods=["POST"])
+def logout_session() -> Any:
+    try:
+        logout(session_token_from_headers(request.headers))
+    except InvalidSessionError as e:
+        logger.info("Rejected logout: %s", e)
+        return jsonify({"error": "Invalid session"}), 401
+    except UnrevocableSessionError as e:
+        logger.warning("Logout of a session without jti: %s", e)
+        error = {"error": "Session cannot be revoked, it stays valid until expires_at", "expires_at": int(e.expires_at)}
+        return jsonify(error), 409
+    except Exception as e:
+        logger.error("Unexpected error in logout: %s", e)
+        return jsonify({"error": "An unexpected error occurred"}), 500
+    return jsonify({"status": "logged out"}), 200, {"Set-Cookie": expired_session_cookie_header()}
+
+
+@app.route(f"/{API_PREFIX}/{API_VERSION}/admin/profile", methods=["GET", "DELETE"])
+def admin_profile() -> Any:
+    status = request_profiler.admin_error(request.headers)
+    if status is not None:
+        return jsonify({"error": "Not Found" if status == 404 else "Invalid admin token"}), status
+    if request.method == "DELETE":
+        request_profiler.reset()
+        return jsonify({"status": "reset"}), 200
+    try:
+        report = request_profiler.report(request.args.get("format", "summary"), request.args.get("route"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if isinstance(report, str):
+        return Response(report, 200, {"Cache-Control": "no-store"}, content_type="text/plain; charset=utf-8")
+    return jsonify(report), 200, {"Cache-Control": "no-store"}
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({"status": "healthy"}), 200
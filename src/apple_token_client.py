@@ -0,0 +1,144 @@
+# Sign in with Apple token endpoint client.
+#
+# Apple has no static client secret: the client authenticates with an ES256 JWT signed with the
+# team's private key (iss=team_id, sub=client_id, aud=https://appleid.apple.com) that may stay
+# valid for six months. AppleClientSecret signs it once and hands out the same assertion until
+# APPLE_CLIENT_SECRET_REFRESH_SECONDS before it expires, so sign-ins never pay for an ECDSA
+# signature. The Flask and ASGI token clients share one assertion per worker.
+import logging
+import os
+import threading
+import time
+from typing import Callable, Optional, Tuple
+
+from src.constants import (
+    APPLE_CLIENT_SECRET_LIFETIME_SECONDS,
+    APPLE_CLIENT_SECRET_REFRESH_SECONDS,
+    APPLE_TOKEN_POOL_SIZE,
+    APPLE_TOKEN_TIMEOUT_SECONDS,
+    APPLE_TOKEN_URI,
+)
+from src.google_token_client import GoogleTokenClient
+from src.resilience import APPLE_TOKEN
+
+logger = logging.getLogger(__name__)
+
+APPLE_AUDIENCE = "https://appleid.apple.com"
+
+
+class AppleClientSecret:
+    def __init__(
+        self,
+        client_id: str,
+        team_id: str,
+        key_id: str,
+        private_key: str,
+        lifetime: float = APPLE_CLIENT_SECRET_LIFETIME_SECONDS,
+        refresh_before: float = APPLE_CLIENT_SECRET_REFRESH_SECONDS,
+        clock: Callable[[], float] = time.time,
+    ):
+        from jwt.algorithms import ECAlgorithm
+
+        if refresh_before >= lifetime:
+            raise ValueError("Apple client secret refresh margin must be shorter than its lifetime")
+        self.client_id = client_id
+        self.team_id = team_id
+        self.key_id = key_id
+        self.lifetime = lifetime
+        self.refresh_before = refresh_before
+        self._clock = clock
+        # Parsed once; signing with a prepared key skips the PEM decode
+        self._signing_key = ECAlgorithm(ECAlgorithm.SHA256).prepare_key(private_key)
+        self._lock = threading.Lock()
+        self._current: Optional[Tuple[str, float]] = None
+        self.signed = 0
+
+    def get(self) -> str:
+        now = self._clock()
+        current = self._current
+        if current is not None and now < current[1]:
+            return current[0]
+        with self._lock:
+            current = self._current
+            if current is None or now >= current[1]:
+                current = self._current = self._sign(now)
+            return current[0]
+
+    def _sign(self, now: float) -> Tuple[str, float]:
+        import jwt
+
+        issued_at = int(now)
+        expires_at = issued_at + int(self.lifetime)
+        assertion = jwt.encode(
+            {"iss": self.team_id, "iat": issued_at, "exp": expires_at, "aud": APPLE_AUDIENCE, "sub": self.client_id},
+            self._signing_key,
+            algorithm="ES256",
+            headers={"kid": self.key_id},
+        )
+        self.signed += 1
+        logger.info("Signed Apple client secret with key %s, valid until %s", self.key_id, expires_at)
+        return assertion, expires_at - self.refresh_before
+
+
+class AppleTokenClient(GoogleTokenClient):
+    def __init__(
+        self,
+        client_secret: AppleClientSecret,
+        redirect_uri: str,
+        token_uri: str = APPLE_TOKEN_URI,
+        pool_size: int = APPLE_TOKEN_POOL_SIZE,
+        timeout: float = APPLE_TOKEN_TIMEOUT_SECONDS,
+        ca_bundle: Optional[str] = None,
+    ):
+        super().__init__(client_secret.client_id, "", redirect_uri, token_uri, pool_size, timeout, ca_bundle, APPLE_TOKEN)
+        self.assertion = client_secret
+
+    def _client_secret(self) -> str:
+        return self.assertion.get()
+
+
+_lock = threading.Lock()
+_client_secret: Optional[AppleClientSecret] = None
+_client_secret_config: Optional[Tuple[str, str, str, str]] = None
+_client: Optional[AppleTokenClient] = None
+_client_config: Optional[Tuple[AppleClientSecret, str]] = None
+
+
+def get_apple_client_secret(client_id: str, team_id: str, key_id: str, private_key: str) -> AppleClientSecret:
+    # Re-signed early only when the Apple settings in the secrets change (e.g. a new key)
+    global _client_secret, _client_secret_config
+    config = (client_id, team_id, key_id, private_key)
+    with _lock:
+        if _client_secret is None or _client_secret_config != config:
+            _client_secret = AppleClientSecret(client_id, team_id, key_id, private_key)
+            _client_secret_config = config
+        return _client_secret
+
+
+def get_apple_token_client(
+    client_id: str, team_id: str, key_id: str, private_key: str, redirect_uri: str
+) -> AppleTokenClient:
+    global _client, _client_config
+    client_secret = get_apple_client_secret(client_id, team_id, key_id, private_key)
+    config = (client_secret, redirect_uri)
+    with _lock:
+        if _client is None or _client_config != config:
+            if _client is not None:
+                logger.info("Apple OAuth client settings changed, rebuilding token client")
+                _client.close()
+            _client = AppleTokenClient(client_secret, redirect_uri)
+            _client_config = config
+        return _client
+
+
+def _reset_after_fork() -> None:
+    # The child signs its own assertion and opens its own connections
+    global _lock, _client_secret, _client_secret_config, _client, _client_config
+    _lock = threading.Lock()
+    _client_secret = None
+    _client_secret_config = None
+    _client = None
+    _client_config = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
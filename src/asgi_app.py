@@ -0,0 +1,402 @@
+# asyncio/ASGI entry point with the same routes and JSON error contract as src/app.py.
+# Run with: gunicorn -k uvicorn.workers.UvicornWorker src.asgi_app:app
+import json
+import logging
+import sys
+import urllib.parse
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Info, make_asgi_app
+from prometheus_client import PlatformCollector, ProcessCollector
+
+from src import async_service
+from src.access_tokens import AccessTokenError, access_token_broker, access_token_for_session, access_token_requests
+from src.admission import ADMISSION_METRICS, AdmissionRejected, client_address, signin_admission
+from src.constants import API_PREFIX, API_VERSION, CONDITIONAL_SIGNIN_WRITE, SIGNIN_DEADLINE_SECONDS
+from src.existence_cache import user_exists_cache_requests
+from src.id_token import IdTokenClaims
+from src.identity_providers import APPLE, GOOGLE, IdentityProvider
+from src.local_utils import (
+    InvalidSessionError,
+    expired_session_cookie_header,
+    session_cookie_header,
+    session_token_from_headers,
+)
+from src.logging_config import configure_logging
+from src.async_service import (
+    authorize_with_apple,
+    authorize_with_google,
+    verify_apple_id_token,
+    verify_google_id_token,
+    signin_user,
+    is_user_exists,
+    create_user,
+    authenticate_user,
+)
+from src.profiling import request_profiler
+from src.resilience import RESILIENCE_METRICS, DependencyUnavailable, request_deadline
+from src.session_renewal import renew_session, renewal_response, session_renewals
+from src.session_revocation import SESSION_REVOCATION_METRICS, UnrevocableSessionError, logout
+from src.session_verification import session_verifications, verify_session
+from src.session_writer import SESSION_WRITE_METRICS, session_write_queue
+from src.signin_dedup import SigninResponse, signin_dedup_requests, signin_deduplicator
+from src.stage_metrics import signin_stage_duration, trace_id, trace_id_from_headers
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# Separate registry so the Flask and ASGI apps can be imported in the same process
+registry = CollectorRegistry()
+ProcessCollector(registry=registry)
+PlatformCollector(registry=registry)
+Info("authorization_service", "Metrics for Sign in with Google and Apple", registry=registry).info(
+    {"version": "1.0.0"}
+)
+by_path_counter = Counter("by_path_counter", "Request count by request paths", ["path"], registry=registry)
+in_progress = Gauge("in_progress", "Long running requests in progress", registry=registry)
+registry.register(signin_stage_duration)
+for collector in SESSION_WRITE_METRICS:
+    registry.register(collector)
+registry.register(signin_dedup_requests)
+registry.register(access_token_requests)
+for collector in ADMISSION_METRICS:
+    registry.register(collector)
+for collector in SESSION_REVOCATION_METRICS:
+    registry.register(collector)
+registry.register(session_verifications)
+registry.register(user_exists_cache_requests)
+registry.register(session_renewals)
+for collector in RESILIENCE_METRICS:
+    registry.register(collector)
+metrics_app = make_asgi_app(registry=registry)
+
+SIGNIN_WITH_GOOGLE_PATH = f"/{API_PREFIX}/{API_VERSION}/signinWithGoogle"
+SIGNIN_WITH_APPLE_PATH = f"/{API_PREFIX}/{API_VERSION}/signinWithApple"
+ACCESS_TOKEN_PATH = f"/{API_PREFIX}/{API_VERSION}/accessToken"
+LOGOUT_PATH = f"/{API_PREFIX}/{API_VERSION}/logout"
+SESSION_VERIFY_PATH = f"/{API_PREFIX}/{API_VERSION}/session/verify"
+SESSION_RENEW_PATH = f"/{API_PREFIX}/{API_VERSION}/session/renew"
+ADMIN_PROFILE_PATH = f"/{API_PREFIX}/{API_VERSION}/admin/profile"
+CORS_HEADERS = [("Access-Control-Allow-Origin", "*")]
+
+
+class Request:
+    def __init__(self, scope: Dict[str, Any], body: bytes):
+        self.method: str = scope["method"]
+        self.remote_addr: Optional[str] = (scope.get("client") or (None,))[0]
+        self.path: str = scope["path"]
+        self.headers: Dict[str, str] = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope["headers"]}
+        self.args: Dict[str, str] = dict(urllib.parse.parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+        self.body = body
+
+    def get_json(self) -> Any:
+        # Mirrors Flask: a non-JSON content type or malformed body is an error
+        if not self.headers.get("content-type", "").startswith("application/json"):
+            raise TypeError("Content-Type must be application/json")
+        return json.loads(self.body or b"null")
+
+
+async def signin_with_google(request: Request) -> Any:
+    return await signin_with_provider(request, GOOGLE)
+
+
+async def signin_with_apple(request: Request) -> Any:
+    return await signin_with_provider(request, APPLE)
+
+
+async def signin_with_provider(request: Request, provider: IdentityProvider) -> Any:
+    trace_id.set(trace_id_from_headers(request.headers))
+    in_progress.inc()
+    try:
+        try:
+            ticket = await signin_admission.admit_async(client_address(request.headers, request.remote_addr))
+        except AdmissionRejected as e:
+            logger.warning("Sign-in rejected: %s", e.reason)
+            return {"error": "Too many sign-in requests, retry later"}, e.status, [("Retry-After", str(e.retry_after))]
+        with ticket, request_deadline(SIGNIN_DEADLINE_SECONDS):
+            return await _signin_with_provider(request, provider)
+    finally:
+        in_progress.dec()
+
+
+async def _signin_with_provider(request: Request, provider: IdentityProvider) -> Any:
+    try:
+        data: Dict[str, Any] = request.get_json()
+        if data is None:
+            raise ValueError("POST parameters empty")
+        if "authorization_code" not in data:
+            raise KeyError("Authorization code is required in parameters")
+    except ValueError as e:
+        if isinstance(e, json.JSONDecodeError):
+            logger.error("Unexpected error 3: %s", e)
+            return {"error": "An unexpected error occurred"}, 500
+        logger.error("ValueError: %s", e)
+        return {"error": str(e)}, 400
+    except KeyError as e:
+        logger.error("KeyError: %s", e)
+        return {"error": str(e)}, 400
+    except Exception as e:
+        logger.error("Unexpected error 3: %s", e)
+        return {"error": "An unexpected error occurred"}, 500
+    authorization_code: str = data["authorization_code"]
+
+    # Duplicate POSTs of the same code share one sign-in and its response
+    response = await signin_deduplicator.run_async(
+        authorization_code, lambda: _capture(_signin(authorization_code, provider)), async_service.run_blocking
+    )
+    return response.body, response.status, response.headers
+
+
+async def _capture(result: Awaitable[Any]) -> SigninResponse:
+    status, headers, payload = render(await result)
+    headers = [(name, value) for name, value in headers if name != "Content-Length" and (name, value) not in CORS_HEADERS]
+    return SigninResponse(status, headers, payload)
+
+
+def _provider_steps(provider: IdentityProvider) -> Tuple[Callable[[str], Awaitable[Any]], Callable[[str], Awaitable[IdTokenClaims]]]:
+    # Resolved per call, so each provider's steps are this module's (patchable) imports
+    if provider is APPLE:
+        return authorize_with_apple, verify_apple_id_token
+    return authorize_with_google, verify_google_id_token
+
+
+async def _signin(authorization_code: str, provider: IdentityProvider = GOOGLE) -> Any:
+    authorize, verify_id_token = _provider_steps(provider)
+    try:
+        access_token, refresh_token, id_token, expires_at = await authorize(authorization_code)
+    except DependencyUnavailable as e:
+        logger.warning("Sign-in failed fast: %s", e)
+        return {"error": f"{provider.display_name} sign-in is temporarily unavailable, retry later"}, 503
+    except Exception:
+        return {"error": f"Exception occurred during authorization with {provider.display_name}"}, 500
+    try:
+        claims = await verify_id_token(id_token)
+    except Exception as e:
+        logger.error("ID token verification failed: %s", e)
+        return {"error": "Invalid ID token"}, 401
+    user_email = claims.email
+
+    if CONDITIONAL_SIGNIN_WRITE:
+        try:
+            response, user_created = await signin_user(claims, access_token, refresh_token, expires_at)
+        except Exception as e:
+            logger.error("Conditional sign-in write failed: %s", e)
+            return {"error": "Exception occurred during customer authentication"}, 500
+        return response
+
+    try:
+        user_exists: bool = await is_user_exists(user_email)
+    except Exception:
+        return {"error": "Exception occurred during customer verification"}, 500
+
+    if not user_exists:
+        user_create_success = await create_user(user_email, claims, access_token, refresh_token, expires_at)
+        if not user_create_success:
+            return {"error": "Exception occurred during customer signup"}, 500
+
+    try:
+        response = await authenticate_user(user_email)
+    except Exception:
+        return {"error": "Exception occurred during customer authentication"}, 500
+    return response
+
+
+async def access_token(request: Request) -> Any:
+    try:
+        token, expires_in = await async_service.run_blocking(
+            access_token_for_session, session_token_from_headers(request.headers)
+        )
+    except AccessTokenError as e:
+        return {"error": str(e)}, e.status
+    except Exception as e:
+        logger.error("Unexpected error in access_token: %s", e)
+        return {"error": "An unexpected error occurred"}, 500
+    return {"access_token": token, "expires_in": expires_in}, 200, [("Cache-Control", "no-store")]
+
+
+async def session_verify(request: Request) -> Any:
+    try:
+        claims = await async_service.run_blocking(verify_session, session_token_from_headers(request.headers))
+    except InvalidSessionError as e:
+        logger.info("Rejected session: %s", e)
+        return {"error": "Invalid session"}, 401
+    except Exception as e:
+        logger.error("Unexpected error in session_verify: %s", e)
+        return {"error": "An unexpected error occurred"}, 500
+    return {"claims": claims}, 200, [("Cache-Control", "no-store")]
+
+
+async def session_renew(request: Request) -> Any:
+    try:
+        token, exp = await async_service.run_blocking(renew_session, session_token_from_headers(request.headers))
+    except InvalidSessionError as e:
+        logger.info("Rejected session renewal: %s", e)
+        return {"error": "Invalid session"}, 401
+    except Exception as e:
+        logger.error("Unexpected error in session_renew: %s", e)
+        return {"error": "An unexpected error occurred"}, 500
+    headers = [("Cache-Control", "no-store")]
+    if token is not None:
+        headers.append(("Set-Cookie", session_cookie_header(token)))
+    return renewal_response(token, exp), 200, headers
+
+
+async def logout_session(request: Request) -> Any:
+    try:
+        await async_service.run_blocking(logout, session_token_from_headers(request.headers))
+    except InvalidSessionError as e:
+        logger.info("Rejected logout: %s", e)
+        return {"error": "Invalid session"}, 401
+    except UnrevocableSessionError as e:
+        logger.warning("Logout of a session without jti: %s", e)
+        error = {"error": "Session cannot be revoked, it stays valid until expires_at", "expires_at": int(e.expires_at)}
+        return error, 409
+    except Exception as e:
+        logger.error("Unexpected error in logout: %s", e)
+        return {"error": "An unexpected error occurred"}, 500
+    return {"status": "logged out"}, 200, [("Set-Cookie", expired_session_cookie_header())]
+
+
+async def admin_profile(request: Request) -> Any:
+    status = request_profiler.admin_error(request.headers)
+    if status is not None:
+        return {"error": "Not Found" if status == 404 else "Invalid admin token"}, status
+    try:
+        report = request_profiler.report(request.args.get("format", "summary"), request.args.get("route"))
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    headers = [("Cache-Control", "no-store")]
+    if isinstance(report, str):
+        headers.append(("Content-Type", "text/plain; charset=utf-8"))
+    return report, 200, headers
+
+
+async def admin_profile_reset(request: Request) -> Any:
+    status = request_profiler.admin_error(request.headers)
+    if status is not None:
+        return {"error": "Not Found" if status == 404 else "Invalid admin token"}, status
+    request_profiler.reset()
+    return {"status": "reset"}, 200
+
+
+async def health_check(request: Request) -> Any:
+    return {"status": "healthy"}, 200
+
+
+async def google_auth_login_redirect(request: Request) -> Any:
+    return "Login successful. You can close this window."
+
+
+async def google_auth_signup_redirect(request: Request) -> Any:
+    return "Signup successful. You can close this window."
+
+
+async def google_auth_backend_redirect(request: Request) -> Any:
+    return "Authentication successful. You can close this window."
+
+
+routes: Dict[Tuple[str, str], Callable[[Request], Awaitable[Any]]] = {
+    ("POST", SIGNIN_WITH_GOOGLE_PATH): signin_with_google,
+    ("POST", SIGNIN_WITH_APPLE_PATH): signin_with_apple,
+    ("GET", SIGNIN_WITH_GOOGLE_PATH): google_auth_backend_redirect,
+    ("GET", ACCESS_TOKEN_PATH): access_token,
+    ("GET", SESSION_VERIFY_PATH): session_verify,
+    ("POST", SESSION_RENEW_PATH): session_renew,
+    ("POST", LOGOUT_PATH): logout_session,
+    ("GET", ADMIN_PROFILE_PATH): admin_profile,
+    ("DELETE", ADMIN_PROFILE_PATH): admin_profile_reset,
+    ("GET", "/health"): health_check,
+    ("GET", "/login"): google_auth_login_redirect,
+    ("GET", "/signup"): google_auth_signup_redirect,
+}
+
+
+def render(result: Any) -> Tuple[int, List[Tuple[str, str]], bytes]:
+    # Accepts the same shapes as Flask views: body, (body, status) or (body, status, headers)
+    status, headers = 200, []
+    if isinstance(result, tuple):
+        body = result[0]
+        status = result[1] if len(result) > 1 else 200
+        headers = list(result[2]) if len(result) > 2 else []
+    else:
+        body = result
+    has_content_type = any(name.lower() == "content-type" for name, _ in headers)
+    if isinstance(body, (dict, list)):
+        payload = json.dumps(body).encode()
+        content_type = "application/json"
+    else:
+        payload = body if isinstance(body, bytes) else str(body).encode()
+        content_type = "text/html; charset=utf-8"
+    if not has_content_type:
+        headers.append(("Content-Type", content_type))
+    headers.append(("Content-Length", str(len(payload))))
+    return status, headers + CORS_HEADERS, payload
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def _lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await async_service.close()
+            await async_service.run_blocking(session_write_queue.close)
+            await async_service.run_blocking(access_token_broker.flush)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+def _dispatch(request: Request) -> Optional[Callable[[Request], Awaitable[Any]]]:
+    return routes.get((request.method, request.path))
+
+
+async def app(scope, receive, send) -> None:
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    if scope["path"] == "/metrics":
+        await metrics_app(scope, receive, send)
+        return
+
+    request = Request(scope, await _read_body(receive))
+    by_path_counter.labels(path=request.path).inc()
+    if request.method == "OPTIONS":
+        result = ("", 200, [
+            ("Access-Control-Allow-Methods", "GET, POST, OPTIONS"),
+            ("Access-Control-Allow-Headers", request.headers.get("access-control-request-headers", "*")),
+        ])
+    else:
+        handler = _dispatch(request)
+        if handler is not None:
+            profiled = None
+            if request_profiler.enabled and request.path != ADMIN_PROFILE_PATH:
+                # This coroutine's frame marks the event loop's samples that belong to the request
+                profiled = request_profiler.begin(f"{request.method} {request.path}", request.headers, sys._getframe())
+            try:
+                result = await handler(request)
+            finally:
+                if profiled is not None:
+                    request_profiler.end(profiled)
+        elif any(path == request.path for _, path in routes):
+            result = {"error": "Method Not Allowed"}, 405
+        else:
+            result = {"error": "Not Found"}, 404
+
+    status, headers, payload = render(result)
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers],
+    })
+    await send({"type": "http.response.body", "body": payload})
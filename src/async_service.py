@@ -0,0 +1,246 @@
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from src import service
+from src.apple_token_client import AppleClientSecret, get_apple_client_secret
+from src.constants import (
+    APPLE_TOKEN_URI,
+    APPLE_TOKEN_POOL_SIZE,
+    APPLE_TOKEN_TIMEOUT_SECONDS,
+    GOOGLE_TOKEN_URI,
+    GOOGLE_TOKEN_POOL_SIZE,
+    GOOGLE_TOKEN_TIMEOUT_SECONDS,
+    ASYNC_BLOCKING_WORKERS,
+)
+from src.google_token_client import TokenExchangeError
+from src.id_token import IdTokenClaims
+from src.identity_providers import APPLE, GOOGLE
+from src.local_utils import session_cookie_header
+from src.profiling import current_profile
+from src.resilience import APPLE_TOKEN, GOOGLE_TOKEN, Dependency, call_timeout, is_connect_failure
+from src.stage_metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+# boto3 and the Secrets Manager client have no asyncio API, so their calls run on a
+# bounded pool of threads while the event loop keeps serving other sign-ins
+_blocking_executor = ThreadPoolExecutor(max_workers=ASYNC_BLOCKING_WORKERS, thread_name_prefix="asgi-blocking")
+
+COOKIE_RESPONSE_BODY = "Cookie is set using SimpleCookie!"
+
+
+async def run_blocking(fn, *args) -> Any:
+    # Copy the context so the request's trace ID reaches stage metrics recorded on the thread
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    profiled = current_profile.get()
+    if profiled is not None:
+        # The executor thread is sampled while it works for a profiled request
+        return await loop.run_in_executor(_blocking_executor, functools.partial(context.run, profiled.on_thread, fn, *args))
+    return await loop.run_in_executor(_blocking_executor, functools.partial(context.run, fn, *args))
+
+
+class AsyncGoogleTokenClient:
+    def __init__(
+        self,
+        client_id: str,
+        client_secret: str,
+        redirect_uri: str,
+        token_uri: str = GOOGLE_TOKEN_URI,
+        pool_size: int = GOOGLE_TOKEN_POOL_SIZE,
+        timeout: float = GOOGLE_TOKEN_TIMEOUT_SECONDS,
+        dependency: Dependency = GOOGLE_TOKEN,
+    ):
+        import aiohttp
+
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.redirect_uri = redirect_uri
+        self.token_uri = token_uri
+        self.timeout = timeout
+        self.dependency = dependency
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=pool_size),
+            timeout=aiohttp.ClientTimeout(total=timeout),
+        )
+
+    async def exchange_code(self, authorization_code: str) -> Dict[str, Any]:
+        # Codes are single-use: a request that may have reached the endpoint is not sent again
+        return await self._post(
+            {"grant_type": "authorization_code", "code": authorization_code, "redirect_uri": self.redirect_uri},
+            retry_if=is_connect_failure,
+        )
+
+    async def refresh(self, refresh_token: str) -> Dict[str, Any]:
+        return await self._post({"grant_type": "refresh_token", "refresh_token": refresh_token})
+
+    async def close(self) -> None:
+        await self.session.close()
+
+    def _client_secret(self) -> str:
+        return self.client_secret
+
+    async def _post(
+        self, data: Dict[str, str], retry_if: Optional[Callable[[BaseException], bool]] = None
+    ) -> Dict[str, Any]:
+        data = dict(data, client_id=self.client_id, client_secret=self._client_secret())
+        return await self.dependency.call_async(lambda: self._send(data), retry_if=retry_if)
+
+    async def _send(self, data: Dict[str, str]) -> Dict[str, Any]:
+        import aiohttp
+
+        timeout = aiohttp.ClientTimeout(total=call_timeout(self.timeout, self.dependency.name))
+        async with self.session.post(
+            self.token_uri, data=data, headers={"Accept": "application/json"}, timeout=timeout
+        ) as response:
+            if response.status != 200:
+                text = await response.text()
+                raise TokenExchangeError(f"Token endpoint returned {response.status}: {text[:200]}", response.status)
+            return await response.json(content_type=None)
+
+
+class AsyncAppleTokenClient(AsyncGoogleTokenClient):
+    def __init__(
+        self,
+        client_secret: AppleClientSecret,
+        redirect_uri: str,
+        token_uri: str = APPLE_TOKEN_URI,
+        pool_size: int = APPLE_TOKEN_POOL_SIZE,
+        timeout: float = APPLE_TOKEN_TIMEOUT_SECONDS,
+    ):
+        super().__init__(client_secret.client_id, "", redirect_uri, token_uri, pool_size, timeout, APPLE_TOKEN)
+        self.assertion = client_secret
+
+    def _client_secret(self) -> str:
+        return self.assertion.get()
+
+
+_token_client: Optional[AsyncGoogleTokenClient] = None
+_token_client_config: Optional[Tuple[Any, ...]] = None
+
+
+async def get_async_google_token_client(client_id: str, client_secret: str, redirect_uri: str) -> AsyncGoogleTokenClient:
+    # Only touched from the event loop thread; the loop is part of the key because
+    # aiohttp sessions cannot be shared between loops
+    global _token_client, _token_client_config
+    config = (client_id, client_secret, redirect_uri, asyncio.get_running_loop())
+    if _token_client is None or _token_client_config != config:
+        if _token_client is not None and _token_client_config[3] is config[3]:
+            await _token_client.close()
+        _token_client = AsyncGoogleTokenClient(client_id, client_secret, redirect_uri, token_uri=GOOGLE_TOKEN_URI)
+        _token_client_config = config
+    return _token_client
+
+
+async def authorize_with_google(authorization_code) -> Tuple[str, Optional[str], str, int]:
+    client_id, client_secret, redirect_uri = await run_blocking(service._fetch_sign_with_google_secrets_from_aws)
+    try:
+        token_client = await get_async_google_token_client(client_id, client_secret, redirect_uri)
+        with observe_stage(GOOGLE.token_exchange_stage):
+            tokens = await token_client.exchange_code(authorization_code)
+        logger.info("Token fetched successfully")
+        return tokens["access_token"], tokens.get("refresh_token"), tokens["id_token"], service.access_token_expires_at(tokens)
+    except Exception as e:
+        logger.error("Error fetching tokens from Google: %s", e)
+        raise
+
+
+async def verify_google_id_token(id_token) -> IdTokenClaims:
+    return await run_blocking(service.verify_google_id_token, id_token)
+
+
+_apple_token_client: Optional[AsyncAppleTokenClient] = None
+_apple_token_client_config: Optional[Tuple[Any, ...]] = None
+
+
+async def get_async_apple_token_client(
+    client_id: str, team_id: str, key_id: str, private_key: str, redirect_uri: str
+) -> AsyncAppleTokenClient:
+    # Its own connection pool, and the client secret assertion shared with the Flask client
+    global _apple_token_client, _apple_token_client_config
+    client_secret = get_apple_client_secret(client_id, team_id, key_id, private_key)
+    config = (client_secret, redirect_uri, asyncio.get_running_loop())
+    if _apple_token_client is None or _apple_token_client_config != config:
+        if _apple_token_client is not None and _apple_token_client_config[2] is config[2]:
+            await _apple_token_client.close()
+        _apple_token_client = AsyncAppleTokenClient(client_secret, redirect_uri, token_uri=APPLE_TOKEN_URI)
+        _apple_token_client_config = config
+    return _apple_token_client
+
+
+async def authorize_with_apple(authorization_code) -> Tuple[str, Optional[str], str, int]:
+    settings = await run_blocking(service._fetch_sign_with_apple_secrets_from_aws)
+    try:
+        token_client = await get_async_apple_token_client(*settings)
+        with observe_stage(APPLE.token_exchange_stage):
+            tokens = await token_client.exchange_code(authorization_code)
+        logger.info("Token fetched successfully")
+        return tokens["access_token"], tokens.get("refresh_token"), tokens["id_token"], service.access_token_expires_at(tokens)
+    except Exception as e:
+        logger.error("Error fetching tokens from Apple: %s", e)
+        raise
+
+
+async def verify_apple_id_token(id_token) -> IdTokenClaims:
+    return await run_blocking(service.verify_apple_id_token, id_token)
+
+
+async def is_user_exists(user_email) -> bool:
+    return await run_blocking(service.is_user_exists, user_email)
+
+
+async def create_user(user_email, claims: IdTokenClaims, access_token, refresh_token, expires_at=None) -> bool:
+    return await run_blocking(service.create_user, user_email, claims, access_token, refresh_token, expires_at)
+
+
+async def signin_user(claims: IdTokenClaims, access_token, refresh_token, expires_at=None):
+    token, user_created = await run_blocking(service.write_signin, claims, access_token, refresh_token, expires_at)
+    return (COOKIE_RESPONSE_BODY, 200, [("Set-Cookie", session_cookie_header(token))]), user_created
+
+
+async def authenticate_user(user_email):
+    logger.info("Authenticating user: %s", user_email)
+    try:
+        token = await run_blocking(service.start_session, user_email)
+    except KeyError as ke:
+        logger.error("KeyError in authenticate_user: %s", ke)
+        return {"error": str(ke)}, 400
+    except json.JSONDecodeError as e:
+        logger.error("JSONDecodeError in authenticate_user: %s", e)
+        return {"error": "Invalid secret format"}, 500
+    except Exception as e:
+        logger.error("Unexpected error in authenticate_user: %s", e)
+        return {"error": "An unexpected error occurred"}, 500
+    logger.info("Cookie created successfully")
+    return COOKIE_RESPONSE_BODY, 200, [("Set-Cookie", session_cookie_header(token))]
+
+
+async def close() -> None:
+    global _token_client, _token_client_config, _apple_token_client, _apple_token_client_config
+    if _token_client is not None:
+        await _token_client.close()
+    if _apple_token_client is not None:
+        await _apple_token_client.close()
+    _token_client = None
+    _token_client_config = None
+    _apple_token_client = None
+    _apple_token_client_config = None
+
+
+def _reset_after_fork() -> None:
+    # Executor threads and the aiohttp session (bound to the parent's loop) do not survive fork
+    global _blocking_executor, _token_client, _token_client_config, _apple_token_client, _apple_token_client_config
+    _blocking_executor = ThreadPoolExecutor(max_workers=ASYNC_BLOCKING_WORKERS, thread_name_prefix="asgi-blocking")
+    _token_client = None
+    _token_client_config = None
+    _apple_token_client = None
+    _apple_token_client_config = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,237 @@
+# Bulk export and import of the user table as NDJSON (one user per line).
+#
+#   python -m src.bulk_users export --segments 8 --workers 8 [--attributes email,name] [--output users.ndjson]
+#   python -m src.bulk_users import --input users.ndjson [--workers 4] [--max-writes-per-second 500]
+#
+# Export runs a parallel segmented scan and streams items to stdout or a file as they arrive, so the
+# table is never held in memory. Import writes batches of 25 items (whole items, replacing existing
+# users), retries unprocessed items and can be throttled to a write rate. The store follows
+# USER_STORE_BACKEND, so both commands also work against SQLite or the local DynamoDB stand-in.
+# Numbers are exported as JSON numbers, sets as lists and binary values as base64 strings.
+import argparse
+import base64
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from typing import Any, Dict, IO, Iterable, Iterator, List, Optional, Sequence
+
+from src.constants import AUTHENTICATION_DDB_TABLE, USER_STORE_BACKEND
+from src.logging_config import configure_logging
+from src.user_store import BATCH_WRITE_LIMIT, SCAN_PAGE_SIZE, DynamoDBUserStore, UserStore, create_user_store
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = 10000
+_DONE = object()
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=str)
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(bytes(value)).decode("ascii")
+    if hasattr(value, "value"):
+        # boto3 Binary
+        return base64.b64encode(value.value).decode("ascii")
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def dumps(item: Dict[str, Any]) -> str:
+    return json.dumps(item, default=_json_default, separators=(",", ":"), sort_keys=True)
+
+
+def loads(line: str) -> Dict[str, Any]:
+    # DynamoDB takes no floats, only Decimal
+    return json.loads(line, parse_float=Decimal)
+
+
+class Throttle:
+    # Paces callers to `rate` units per second in total; 0 disables it
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self, units: int) -> None:
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + units / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+
+def export_users(
+    store: UserStore,
+    output: IO[str],
+    segments: int = 4,
+    workers: int = 4,
+    attributes: Optional[Sequence[str]] = None,
+    page_size: int = SCAN_PAGE_SIZE,
+) -> int:
+    # Segment scans put serialized lines on a bounded queue; this thread writes them out
+    lines: "queue.Queue[Any]" = queue.Queue(maxsize=QUEUE_SIZE)
+    errors: List[BaseException] = []
+    # Set when writing fails, so scans blocked on the full queue give up instead of hanging the exit
+    stop = threading.Event()
+
+    def put(line: Any) -> bool:
+        while not stop.is_set():
+            try:
+                lines.put(line, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def scan_segment(segment: int) -> None:
+        try:
+            for item in store.scan(segment, segments, attributes, page_size):
+                if not put(dumps(item)):
+                    return
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            put(_DONE)
+
+    count = 0
+    with ThreadPoolExecutor(max_workers=min(workers, segments), thread_name_prefix="export") as executor:
+        for segment in range(segments):
+            executor.submit(scan_segment, segment)
+        remaining = segments
+        try:
+            while remaining:
+                line = lines.get()
+                if line is _DONE:
+                    remaining -= 1
+                    continue
+                output.write(line + "\n")
+                count += 1
+        except BaseException:
+            # e.g. BrokenPipeError from `export | head`
+            stop.set()
+            raise
+    output.flush()
+    if errors:
+        raise errors[0]
+    return count
+
+
+def _batches(items: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    batch: List[Dict[str, Any]] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_users(
+    store: UserStore,
+    lines: Iterable[str],
+    workers: int = 4,
+    batch_size: int = BATCH_WRITE_LIMIT,
+    max_writes_per_second: float = 0,
+    failed_output: Optional[IO[str]] = None,
+) -> Dict[str, int]:
+    # At most 2 batches per worker are read ahead of the writers
+    throttle = Throttle(max_writes_per_second)
+    pending = threading.BoundedSemaphore(workers * 2)
+    lock = threading.Lock()
+    totals = {"written": 0, "failed": 0}
+
+    def write(batch: List[Dict[str, Any]]) -> None:
+        try:
+            throttle.wait(len(batch))
+            try:
+                failed = store.batch_put(batch)
+            except Exception as e:
+                logger.error("Batch write failed: %s", e)
+                failed = batch
+            with lock:
+                totals["written"] += len(batch) - len(failed)
+                totals["failed"] += len(failed)
+                if failed_output is not None:
+                    for item in failed:
+                        failed_output.write(dumps(item) + "\n")
+        finally:
+            pending.release()
+
+    items = (loads(line) for line in lines if line.strip())
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="import") as executor:
+        for batch in _batches(items, batch_size):
+            pending.acquire()
+            executor.submit(write, batch)
+    return totals
+
+
+def _store(table: str) -> UserStore:
+    if USER_STORE_BACKEND == "dynamodb":
+        return DynamoDBUserStore(table)
+    return create_user_store()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Export or import the user table as NDJSON")
+    parser.add_argument("--table", default=AUTHENTICATION_DDB_TABLE)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export")
+    export_parser.add_argument("--segments", type=int, default=4, help="parallel scan segments")
+    export_parser.add_argument("--workers", type=int, default=4)
+    export_parser.add_argument("--attributes", help="comma-separated attributes to export (default: all)")
+    export_parser.add_argument("--page-size", type=int, default=SCAN_PAGE_SIZE)
+    export_parser.add_argument("--output", default="-", help="file to write, - for stdout")
+
+    import_parser = commands.add_parser("import")
+    import_parser.add_argument("--input", default="-", help="file to read, - for stdin")
+    import_parser.add_argument("--workers", type=int, default=4)
+    import_parser.add_argument("--batch-size", type=int, default=BATCH_WRITE_LIMIT)
+    import_parser.add_argument("--max-writes-per-second", type=float, default=0, help="0 for unthrottled")
+    import_parser.add_argument("--failed-output", help="file for items that could not be written")
+
+    args = parser.parse_args(argv)
+    configure_logging()
+    store = _store(args.table)
+    started = time.perf_counter()
+
+    if args.command == "export":
+        attributes = [name.strip() for name in args.attributes.split(",")] if args.attributes else None
+        output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+        try:
+            count = export_users(store, output, args.segments, args.workers, attributes, args.page_size)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        summary: Dict[str, Any] = {"exported": count}
+    else:
+        source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+        failed_output = open(args.failed_output, "w", encoding="utf-8") if args.failed_output else None
+        try:
+            summary = import_users(
+                store, source, args.workers, min(args.batch_size, BATCH_WRITE_LIMIT),
+                args.max_writes_per_second, failed_output,
+            )
+        finally:
+            if source is not sys.stdin:
+                source.close()
+            if failed_output is not None:
+                failed_output.close()
+    summary["seconds"] = round(time.perf_counter() - started, 3)
+    print(json.dumps(summary), file=sys.stderr)
+    return 1 if summary.get("failed") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,5 @@
+import os
+
 API_PREFIX = 'api'
 API_VERSION = 'v1'
 
@@ -8,7 +10,176 @@ AUTHENTICATION_SECRET_NAME = "authentication_secrets"
 COOKIE_DAYS_TO_EXPIRE = 30
 
 GOOGLE_AUTH_URI = "https://accounts.google.com/o/oauth2/auth"
-GOOGLE_TOKEN_URI = "https://oauth2.googleapis.com/token"
+GOOGLE_TOKEN_URI = os.environ.get("GOOGLE_TOKEN_URI", "https://oauth2.googleapis.com/token")
 GOOGLE_PROFILE_INFO_SCOPE = "https://www.googleapis.com/auth/userinfo.profile"
 GOOGLE_EMAIL_SCOPE = "https://www.googleapis.com/auth/userinfo.email"
 GOOGLE_OPENID_SCOPE = "openid"
+
+# Secrets Manager cache (per worker)
+SECRETS_CACHE_TTL_SECONDS = float(os.environ.get("SECRETS_CACHE_TTL_SECONDS", "300"))
+SECRETS_CACHE_RETRY_SECONDS = float(os.environ.get("SECRETS_CACHE_RETRY_SECONDS", "10"))
+
+# Google ID token verification
+GOOGLE_JWKS_URI = os.environ.get("GOOGLE_JWKS_URI", "https://www.googleapis.com/oauth2/v3/certs")
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+JWKS_DEFAULT_MAX_AGE_SECONDS = 3600
+JWKS_MIN_REFETCH_SECONDS = 30
+ID_TOKEN_LEEWAY_SECONDS = 60
+
+# Sign in with one conditional UpdateItem instead of read + put + update
+CONDITIONAL_SIGNIN_WRITE = os.environ.get("CONDITIONAL_SIGNIN_WRITE", "false").lower() == "true"
+
+# Google token exchange HTTP client (per worker)
+GOOGLE_TOKEN_POOL_SIZE = int(os.environ.get("GOOGLE_TOKEN_POOL_SIZE", "10"))
+GOOGLE_TOKEN_TIMEOUT_SECONDS = float(os.environ.get("GOOGLE_TOKEN_TIMEOUT_SECONDS", "10"))
+
+# Sign in with Apple: token endpoint client (per worker), ID token verification and the
+# ES256 client secret, re-signed APPLE_CLIENT_SECRET_REFRESH_SECONDS before it expires
+APPLE_TOKEN_URI = os.environ.get("APPLE_TOKEN_URI", "https://appleid.apple.com/auth/token")
+APPLE_JWKS_URI = os.environ.get("APPLE_JWKS_URI", "https://appleid.apple.com/auth/keys")
+APPLE_ISSUERS = ("https://appleid.apple.com",)
+APPLE_TOKEN_POOL_SIZE = int(os.environ.get("APPLE_TOKEN_POOL_SIZE", "10"))
+APPLE_TOKEN_TIMEOUT_SECONDS = float(os.environ.get("APPLE_TOKEN_TIMEOUT_SECONDS", "10"))
+APPLE_CLIENT_SECRET_LIFETIME_SECONDS = int(os.environ.get("APPLE_CLIENT_SECRET_LIFETIME_SECONDS", str(180 * 86400)))
+APPLE_CLIENT_SECRET_REFRESH_SECONDS = int(os.environ.get("APPLE_CLIENT_SECRET_REFRESH_SECONDS", "86400"))
+
+# ASGI app: threads used for blocking calls (boto3, secrets refresh, JWKS fetch)
+ASYNC_BLOCKING_WORKERS = int(os.environ.get("ASYNC_BLOCKING_WORKERS", "32"))
+
+# User store backend: "dynamodb" (default) or "sqlite" for offline load tests
+USER_STORE_BACKEND = os.environ.get("USER_STORE_BACKEND", "dynamodb")
+USER_STORE_SQLITE_PATH = os.environ.get("USER_STORE_SQLITE_PATH", ":memory:")
+DYNAMODB_MAX_POOL_CONNECTIONS = int(os.environ.get("DYNAMODB_MAX_POOL_CONNECTIONS", "25"))
+DYNAMODB_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("DYNAMODB_CONNECT_TIMEOUT_SECONDS", "1"))
+DYNAMODB_READ_TIMEOUT_SECONDS = float(os.environ.get("DYNAMODB_READ_TIMEOUT_SECONDS", "3"))
+DYNAMODB_MAX_ATTEMPTS = int(os.environ.get("DYNAMODB_MAX_ATTEMPTS", "3"))
+
+# Per-stage sign-in latency histograms; exemplars need an OpenMetrics scrape
+SIGNIN_STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIGNIN_STAGE_EXEMPLARS = os.environ.get("SIGNIN_STAGE_EXEMPLARS", "false").lower() == "true"
+
+# Stored OAuth tokens: "fernet" keeps utils.hashing_utils.encrypt_message, "envelope" uses src/token_crypto.py
+TOKEN_ENCRYPTION_FORMAT = os.environ.get("TOKEN_ENCRYPTION_FORMAT", "fernet")
+TOKEN_DATA_KEY_MAX_USES = int(os.environ.get("TOKEN_DATA_KEY_MAX_USES", "10000"))
+TOKEN_DATA_KEY_MAX_AGE_SECONDS = float(os.environ.get("TOKEN_DATA_KEY_MAX_AGE_SECONDS", "300"))
+
+# Write-behind for session writes: the cookie is returned before session_start_time/jwt are stored
+SESSION_WRITE_BEHIND = os.environ.get("SESSION_WRITE_BEHIND", "false").lower() == "true"
+SESSION_WRITE_QUEUE_SIZE = int(os.environ.get("SESSION_WRITE_QUEUE_SIZE", "1000"))
+SESSION_WRITE_BATCH_SIZE = int(os.environ.get("SESSION_WRITE_BATCH_SIZE", "25"))
+SESSION_WRITE_FLUSH_INTERVAL_SECONDS = float(os.environ.get("SESSION_WRITE_FLUSH_INTERVAL_SECONDS", "0.05"))
+SESSION_WRITE_CONCURRENCY = int(os.environ.get("SESSION_WRITE_CONCURRENCY", "8"))
+SESSION_WRITE_DRAIN_TIMEOUT_SECONDS = float(os.environ.get("SESSION_WRITE_DRAIN_TIMEOUT_SECONDS", "10"))
+# A flush retries the sessions whose write failed, with exponential backoff, before dropping them
+SESSION_WRITE_MAX_ATTEMPTS = int(os.environ.get("SESSION_WRITE_MAX_ATTEMPTS", "3"))
+SESSION_WRITE_RETRY_BACKOFF_SECONDS = float(os.environ.get("SESSION_WRITE_RETRY_BACKOFF_SECONDS", "0.1"))
+
+# Logging (src/logging_config.py): LOG_FORMAT is "text" or "json";
+# LOG_SAMPLE_RATES keeps a fraction of INFO lines per logger, e.g. "src.service=0.1"
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+LOG_SAMPLE_RATES = os.environ.get("LOG_SAMPLE_RATES", "")
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+
+# Single-flight sign-in per authorization code (src/signin_dedup.py); successful responses are
+# replayed to duplicates for the TTL. A SQLite path (e.g. on /dev/shm) shares them between workers.
+SIGNIN_DEDUP = os.environ.get("SIGNIN_DEDUP", "true").lower() == "true"
+SIGNIN_DEDUP_TTL_SECONDS = float(os.environ.get("SIGNIN_DEDUP_TTL_SECONDS", "30"))
+SIGNIN_DEDUP_LEASE_SECONDS = float(os.environ.get("SIGNIN_DEDUP_LEASE_SECONDS", "15"))
+SIGNIN_DEDUP_MAX_ENTRIES = int(os.environ.get("SIGNIN_DEDUP_MAX_ENTRIES", "10000"))
+SIGNIN_DEDUP_SQLITE_PATH = os.environ.get("SIGNIN_DEDUP_SQLITE_PATH", "")
+
+# Sign-in admission control per worker (src/admission.py): requests over the concurrency limit
+# queue for up to the timeout, then get 503 + Retry-After. A per-client rate of 0 disables the
+# token bucket; ADMISSION_TRUST_FORWARDED_FOR takes the client IP from the proxy's X-Forwarded-For.
+ADMISSION_CONCURRENCY_LIMIT = int(os.environ.get("ADMISSION_CONCURRENCY_LIMIT", "64"))
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", "128"))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT_SECONDS", "1"))
+ADMISSION_ADAPTIVE = os.environ.get("ADMISSION_ADAPTIVE", "false").lower() == "true"
+ADMISSION_MIN_LIMIT = int(os.environ.get("ADMISSION_MIN_LIMIT", "4"))
+ADMISSION_MAX_LIMIT = int(os.environ.get("ADMISSION_MAX_LIMIT", "256"))
+ADMISSION_LATENCY_TARGET_SECONDS = float(os.environ.get("ADMISSION_LATENCY_TARGET_SECONDS", "1"))
+ADMISSION_RATE_PER_CLIENT = float(os.environ.get("ADMISSION_RATE_PER_CLIENT", "0"))
+ADMISSION_BURST_PER_CLIENT = float(os.environ.get("ADMISSION_BURST_PER_CLIENT", "10"))
+ADMISSION_TRUST_FORWARDED_FOR = os.environ.get("ADMISSION_TRUST_FORWARDED_FOR", "false").lower() == "true"
+
+# Session JWTs (cookie "session") are signed with the key ring in src/signing_keys.py; the
+# algorithm applies to keys that do not name one. Sessions issued before kid headers were signed
+# with encryption_secret_key and only verify while SESSION_VERIFY_UNKEYED_TOKENS is true.
+SESSION_JWT_ALGORITHM = os.environ.get("SESSION_JWT_ALGORITHM", "HS256")
+SESSION_VERIFY_UNKEYED_TOKENS = os.environ.get("SESSION_VERIFY_UNKEYED_TOKENS", "true").lower() == "true"
+
+# /api/v1/accessToken (src/access_tokens.py): decrypted Google access tokens are cached per worker
+# until the margin before they expire; refreshed tokens are written back on a background thread
+ACCESS_TOKEN_CACHE_SIZE = int(os.environ.get("ACCESS_TOKEN_CACHE_SIZE", "10000"))
+ACCESS_TOKEN_EXPIRY_MARGIN_SECONDS = float(os.environ.get("ACCESS_TOKEN_EXPIRY_MARGIN_SECONDS", "300"))
+ACCESS_TOKEN_PERSIST_WORKERS = int(os.environ.get("ACCESS_TOKEN_PERSIST_WORKERS", "2"))
+# Deadline of one lookup, including the wait for a refresh of the same user already running
+ACCESS_TOKEN_DEADLINE_SECONDS = float(os.environ.get("ACCESS_TOKEN_DEADLINE_SECONDS", "10"))
+
+# Session revocation (src/session_revocation.py): logouts are recorded in REVOCATION_DDB_TABLE
+# (key pk/sk, TTL attribute expires_at) and every worker syncs them into memory at the interval.
+# The filter capacity is the number of revoked sessions expected within COOKIE_DAYS_TO_EXPIRE.
+REVOCATION_DDB_TABLE = os.environ.get("REVOCATION_DDB_TABLE", "session_revocations")
+REVOCATION_SYNC_INTERVAL_SECONDS = float(os.environ.get("REVOCATION_SYNC_INTERVAL_SECONDS", "5"))
+REVOCATION_SYNC_OVERLAP_SECONDS = float(os.environ.get("REVOCATION_SYNC_OVERLAP_SECONDS", "30"))
+REVOCATION_FILTER_CAPACITY = int(os.environ.get("REVOCATION_FILTER_CAPACITY", "1000000"))
+REVOCATION_FILTER_ERROR_RATE = float(os.environ.get("REVOCATION_FILTER_ERROR_RATE", "0.001"))
+REVOCATION_LOAD_TIMEOUT_SECONDS = float(os.environ.get("REVOCATION_LOAD_TIMEOUT_SECONDS", "2"))
+REVOCATION_PURGE_INTERVAL_SECONDS = float(os.environ.get("REVOCATION_PURGE_INTERVAL_SECONDS", "3600"))
+
+# /api/v1/session/verify (src/session_verification.py): verified session claims cached per worker
+SESSION_VERIFY_CACHE_SIZE = int(os.environ.get("SESSION_VERIFY_CACHE_SIZE", "100000"))
+
+# Sliding sessions (src/session_renewal.py): /api/v1/session/renew issues a new session once
+# SESSION_RENEWAL_FRACTION of the current one's lifetime has passed, and writes it to the user
+# store at most once per SESSION_RENEWAL_WINDOW_SECONDS per user
+SESSION_RENEWAL_FRACTION = float(os.environ.get("SESSION_RENEWAL_FRACTION", "0.5"))
+SESSION_RENEWAL_WINDOW_SECONDS = float(os.environ.get("SESSION_RENEWAL_WINDOW_SECONDS", "3600"))
+SESSION_RENEWAL_CACHE_SIZE = int(os.environ.get("SESSION_RENEWAL_CACHE_SIZE", "100000"))
+
+# Per-worker cache of is_user_exists (src/existence_cache.py). Positive answers are kept long,
+# negative ones briefly; the key-only read fetches just the email attribute on a miss (less data
+# over the wire, DynamoDB still charges read units for the whole item)
+USER_EXISTS_CACHE = os.environ.get("USER_EXISTS_CACHE", "true").lower() == "true"
+USER_EXISTS_CACHE_SIZE = int(os.environ.get("USER_EXISTS_CACHE_SIZE", "100000"))
+USER_EXISTS_POSITIVE_TTL_SECONDS = float(os.environ.get("USER_EXISTS_POSITIVE_TTL_SECONDS", "3600"))
+USER_EXISTS_NEGATIVE_TTL_SECONDS = float(os.environ.get("USER_EXISTS_NEGATIVE_TTL_SECONDS", "5"))
+USER_EXISTS_KEY_ONLY_READ = os.environ.get("USER_EXISTS_KEY_ONLY_READ", "true").lower() == "true"
+
+# Cache shared by the workers of one host (src/shared_cache.py): a fixed-size hash table in a
+# memory-mapped file under SHARED_CACHE_DIR (/dev/shm when empty), so it also survives restarts.
+# Used by the user existence cache when SHARED_CACHE is on. SHARED_CACHE_SLOTS entries of
+# SHARED_CACHE_SLOT_BYTES each (32 of them header); entries that do not fit are not cached.
+SHARED_CACHE = os.environ.get("SHARED_CACHE", "false").lower() == "true"
+SHARED_CACHE_DIR = os.environ.get("SHARED_CACHE_DIR", "")
+SHARED_CACHE_SLOTS = int(os.environ.get("SHARED_CACHE_SLOTS", "65536"))
+SHARED_CACHE_SLOT_BYTES = int(os.environ.get("SHARED_CACHE_SLOT_BYTES", "256"))
+
+# Resilience (src/resilience.py): a sign-in runs under a deadline; token exchange, secrets fetch
+# and user store calls are retried with jittered backoff inside it and fail fast while their
+# circuit breaker is open. Hedged reads send a second idempotent read after the recent p95.
+# With RESILIENCE on, the user store's DynamoDB client leaves retries to this layer.
+RESILIENCE = os.environ.get("RESILIENCE", "true").lower() == "true"
+SIGNIN_DEADLINE_SECONDS = float(os.environ.get("SIGNIN_DEADLINE_SECONDS", "10"))
+DEPENDENCY_MAX_ATTEMPTS = int(os.environ.get("DEPENDENCY_MAX_ATTEMPTS", "3"))
+DEPENDENCY_RETRY_BASE_SECONDS = float(os.environ.get("DEPENDENCY_RETRY_BASE_SECONDS", "0.05"))
+DEPENDENCY_RETRY_MAX_SECONDS = float(os.environ.get("DEPENDENCY_RETRY_MAX_SECONDS", "1"))
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.environ.get("BREAKER_RESET_SECONDS", "30"))
+SECRETS_FETCH_TIMEOUT_SECONDS = float(os.environ.get("SECRETS_FETCH_TIMEOUT_SECONDS", "5"))
+HEDGED_READS = os.environ.get("HEDGED_READS", "false").lower() == "true"
+HEDGE_MIN_DELAY_SECONDS = float(os.environ.get("HEDGE_MIN_DELAY_SECONDS", "0.01"))
+RESILIENCE_EXECUTOR_WORKERS = int(os.environ.get("RESILIENCE_EXECUTOR_WORKERS", "32"))
+
+# On-demand profiling (src/profiling.py): with PROFILING on, 1 in PROFILING_SAMPLE_EVERY requests
+# (0 = none) and requests whose PROFILING_TRIGGER_HEADER carries PROFILING_ADMIN_TOKEN are sampled
+# every PROFILING_INTERVAL_SECONDS. Stacks are aggregated per route, at most
+# PROFILING_MAX_STACKS distinct ones each, and served to PROFILING_ADMIN_TOKEN holders. Without a
+# token the admin endpoint and the trigger header are off.
+PROFILING = os.environ.get("PROFILING", "false").lower() == "true"
+PROFILING_SAMPLE_EVERY = int(os.environ.get("PROFILING_SAMPLE_EVERY", "100"))
+PROFILING_TRIGGER_HEADER = os.environ.get("PROFILING_TRIGGER_HEADER", "X-Profile-Request")
+PROFILING_INTERVAL_SECONDS = float(os.environ.get("PROFILING_INTERVAL_SECONDS", "0.005"))
+PROFILING_MAX_STACKS = int(os.environ.get("PROFILING_MAX_STACKS", "10000"))
+PROFILING_ADMIN_TOKEN = os.environ.get("PROFILING_ADMIN_TOKEN", "")
@@ -0,0 +1,33 @@
+import logging
+import os
+from functools import lru_cache
+
+from src.constants import (
+    AWS_DEFAULT_REGION,
+    DYNAMODB_MAX_POOL_CONNECTIONS,
+    DYNAMODB_CONNECT_TIMEOUT_SECONDS,
+    DYNAMODB_READ_TIMEOUT_SECONDS,
+    DYNAMODB_MAX_ATTEMPTS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def get_dynamodb_client(max_attempts: int = DYNAMODB_MAX_ATTEMPTS):
+    # boto3 clients are thread-safe, so one per worker process (and retry setting) is enough
+    import boto3
+    from botocore.config import Config
+
+    config = Config(
+        max_pool_connections=DYNAMODB_MAX_POOL_CONNECTIONS,
+        connect_timeout=DYNAMODB_CONNECT_TIMEOUT_SECONDS,
+        read_timeout=DYNAMODB_READ_TIMEOUT_SECONDS,
+        retries={"max_attempts": max_attempts, "mode": "standard"},
+        tcp_keepalive=True,
+    )
+    return boto3.client("dynamodb", region_name=AWS_DEFAULT_REGION, config=config)
+
+
+# A client created before a fork (gunicorn --preload) would share its connection pool with the parent
+os.register_at_fork(after_in_child=get_dynamodb_client.cache_clear)
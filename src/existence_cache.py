@@ -0,0 +1,119 @@
+# Per-worker cache of whether a user exists, in front of is_user_exists.
+#
+# Users are never deleted by this service, so a positive answer stays valid for a long time
+# (USER_EXISTS_POSITIVE_TTL_SECONDS). A negative answer only bridges the gap between the lookup
+# and create_user in the same sign-in and is kept for a few seconds; create_user and the
+# conditional sign-in write replace it with a positive entry as soon as the user is written.
+#
+# With SHARED_CACHE the entries live in the host's shared cache (src/shared_cache.py) instead of a
+# per-worker dict, so a user looked up by one worker is a hit in all of them, also after a restart.
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from prometheus_client import REGISTRY, Counter
+
+from src.constants import (
+    SHARED_CACHE,
+    USER_EXISTS_CACHE,
+    USER_EXISTS_CACHE_SIZE,
+    USER_EXISTS_POSITIVE_TTL_SECONDS,
+    USER_EXISTS_NEGATIVE_TTL_SECONDS,
+)
+from src.shared_cache import SharedCache, open_shared_cache
+
+user_exists_cache_requests = Counter(
+    "user_exists_cache_requests_total",
+    "User existence lookups by cache result (hit_positive, hit_negative, miss)",
+    ["result"],
+    registry=REGISTRY,
+)
+_HIT_POSITIVE = user_exists_cache_requests.labels(result="hit_positive")
+_HIT_NEGATIVE = user_exists_cache_requests.labels(result="hit_negative")
+_MISS = user_exists_cache_requests.labels(result="miss")
+
+
+class UserExistenceCache:
+    def __init__(
+        self,
+        max_entries: int = USER_EXISTS_CACHE_SIZE,
+        positive_ttl: float = USER_EXISTS_POSITIVE_TTL_SECONDS,
+        negative_ttl: float = USER_EXISTS_NEGATIVE_TTL_SECONDS,
+        enabled: bool = USER_EXISTS_CACHE,
+        clock=time.monotonic,
+        shared: Optional[SharedCache] = None,
+    ):
+        self.max_entries = max_entries
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.enabled = enabled
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, bool]]" = OrderedDict()
+        # Sized by SHARED_CACHE_SLOTS rather than max_entries, expiry on its own wall clock
+        self.shared = shared
+
+    def __len__(self) -> int:
+        return len(self.shared) if self.shared is not None else len(self._entries)
+
+    def get(self, email: str) -> Optional[bool]:
+        # None when the store has to be asked
+        if not self.enabled:
+            return None
+        if self.shared is not None:
+            exists = self.shared.get(email)
+        else:
+            exists = self._get_local(email)
+        if exists is None:
+            _MISS.inc()
+            return None
+        (_HIT_POSITIVE if exists else _HIT_NEGATIVE).inc()
+        return exists
+
+    def _get_local(self, email: str) -> Optional[bool]:
+        with self._lock:
+            entry = self._entries.get(email)
+            if entry is not None and entry[0] <= self._clock():
+                del self._entries[email]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(email)
+        return None if entry is None else entry[1]
+
+    def put(self, email: str, exists: bool) -> None:
+        if not self.enabled:
+            return
+        ttl = self.positive_ttl if exists else self.negative_ttl
+        if self.shared is not None:
+            self.shared.set(email, exists, ttl)
+            return
+        with self._lock:
+            self._entries[email] = (self._clock() + ttl, exists)
+            self._entries.move_to_end(email)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, email: str) -> None:
+        if self.shared is not None:
+            self.shared.pop(email)
+        with self._lock:
+            self._entries.pop(email, None)
+
+    def clear(self) -> None:
+        if self.shared is not None:
+            self.shared.clear()
+        with self._lock:
+            self._entries.clear()
+
+    def reset_after_fork(self) -> None:
+        self._lock = threading.Lock()
+        if self.shared is not None:
+            self.shared.reset_after_fork()
+
+
+user_existence_cache = UserExistenceCache(
+    shared=open_shared_cache("user-exists") if SHARED_CACHE and USER_EXISTS_CACHE else None
+)
+os.register_at_fork(after_in_child=user_existence_cache.reset_after_fork)
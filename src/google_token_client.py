@@ -0,0 +1,114 @@
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from src.constants import (
+    GOOGLE_TOKEN_URI,
+    GOOGLE_TOKEN_POOL_SIZE,
+    GOOGLE_TOKEN_TIMEOUT_SECONDS,
+)
+from src.resilience import GOOGLE_TOKEN, Dependency, call_timeout, is_connect_failure
+
+logger = logging.getLogger(__name__)
+
+
+class TokenExchangeError(Exception):
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class GoogleTokenClient:
+    def __init__(
+        self,
+        client_id: str,
+        client_secret: str,
+        redirect_uri: str,
+        token_uri: str = GOOGLE_TOKEN_URI,
+        pool_size: int = GOOGLE_TOKEN_POOL_SIZE,
+        timeout: float = GOOGLE_TOKEN_TIMEOUT_SECONDS,
+        ca_bundle: Optional[str] = None,
+        dependency: Dependency = GOOGLE_TOKEN,
+    ):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.redirect_uri = redirect_uri
+        self.token_uri = token_uri
+        self.timeout = timeout
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        # Keep-alive pool so sign-in bursts reuse TLS connections to the token endpoint
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.verify = ca_bundle or True
+        # Retries, circuit breaker and deadline (src/resilience.py)
+        self.dependency = dependency
+
+    def exchange_code(self, authorization_code: str) -> Dict[str, Any]:
+        # Codes are single-use: a request that may have reached the endpoint is not sent again
+        return self._post(
+            {"grant_type": "authorization_code", "code": authorization_code, "redirect_uri": self.redirect_uri},
+            retry_if=is_connect_failure,
+        )
+
+    def refresh(self, refresh_token: str) -> Dict[str, Any]:
+        return self._post({"grant_type": "refresh_token", "refresh_token": refresh_token})
+
+    def close(self) -> None:
+        self.session.close()
+
+    def _client_secret(self) -> str:
+        return self.client_secret
+
+    def _post(self, data: Dict[str, str], retry_if: Optional[Callable[[BaseException], bool]] = None) -> Dict[str, Any]:
+        data = dict(data, client_id=self.client_id, client_secret=self._client_secret())
+        return self.dependency.call(lambda: self._send(data), retry_if=retry_if)
+
+    def _send(self, data: Dict[str, str]) -> Dict[str, Any]:
+        response = self.session.post(
+            self.token_uri,
+            data=data,
+            headers={"Accept": "application/json"},
+            timeout=call_timeout(self.timeout, self.dependency.name),
+            verify=self.verify,
+        )
+        if response.status_code != 200:
+            raise TokenExchangeError(
+                f"Token endpoint returned {response.status_code}: {response.text[:200]}",
+                response.status_code,
+            )
+        return response.json()
+
+
+_client_lock = threading.Lock()
+_client: Optional[GoogleTokenClient] = None
+_client_config: Optional[Tuple[str, str, str]] = None
+
+
+def get_google_token_client(client_id: str, client_secret: str, redirect_uri: str) -> GoogleTokenClient:
+    # Rebuilt only when the OAuth client settings in the secrets change
+    global _client, _client_config
+    config = (client_id, client_secret, redirect_uri)
+    with _client_lock:
+        if _client is None or _client_config != config:
+            if _client is not None:
+                logger.info("Google OAuth client settings changed, rebuilding token client")
+                _client.close()
+            _client = GoogleTokenClient(client_id, client_secret, redirect_uri)
+            _client_config = config
+        return _client
+
+
+def _reset_after_fork() -> None:
+    # Pooled connections inherited from the parent are left alone, the child opens its own
+    global _client_lock, _client, _client_config
+    _client_lock = threading.Lock()
+    _client = None
+    _client_config = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,149 @@
+import logging
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+from src.constants import (
+    JWKS_DEFAULT_MAX_AGE_SECONDS,
+    JWKS_MIN_REFETCH_SECONDS,
+    ID_TOKEN_LEEWAY_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+_MAX_AGE_PATTERN = re.compile(r"max-age=(\d+)")
+_PROFILE_CLAIMS = ("name", "given_name", "family_name", "picture", "locale")
+GOOGLE_OIDC_PROVIDER = "google-oauth2"
+
+
+class InvalidIdTokenError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class IdTokenClaims:
+    email: str
+    subject: str
+    name: Optional[str] = None
+    profile: Dict[str, Any] = field(default_factory=dict)
+    raw: Dict[str, Any] = field(default_factory=dict)
+    oidc_provider: str = GOOGLE_OIDC_PROVIDER
+
+    @classmethod
+    def from_payload(cls, payload: Dict[str, Any], oidc_provider: str = GOOGLE_OIDC_PROVIDER) -> "IdTokenClaims":
+        if not payload.get("email"):
+            raise InvalidIdTokenError("ID token has no email claim")
+        # Users are keyed by email across providers, so an unverified address must not sign in as
+        # its owner. Apple sends the claim as the string "true".
+        if payload.get("email_verified") not in (True, "true"):
+            raise InvalidIdTokenError("ID token email is not verified")
+        return cls(
+            email=payload["email"],
+            subject=payload.get("sub", ""),
+            name=payload.get("name"),
+            profile={claim: payload[claim] for claim in _PROFILE_CLAIMS if claim in payload},
+            raw=payload,
+            oidc_provider=oidc_provider,
+        )
+
+
+def _fetch_jwks(jwks_uri: str) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    import requests
+
+    response = requests.get(jwks_uri, timeout=5)
+    response.raise_for_status()
+    return response.json(), dict(response.headers)
+
+
+def parse_max_age(headers: Dict[str, str], default: float) -> float:
+    cache_control = next((v for k, v in headers.items() if k.lower() == "cache-control"), "")
+    match = _MAX_AGE_PATTERN.search(cache_control)
+    return float(match.group(1)) if match else default
+
+
+class JwksCache:
+    def __init__(
+        self,
+        jwks_uri: str,
+        fetcher: Callable[[str], Tuple[Dict[str, Any], Dict[str, str]]] = _fetch_jwks,
+        default_max_age: float = JWKS_DEFAULT_MAX_AGE_SECONDS,
+        min_refetch_interval: float = JWKS_MIN_REFETCH_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._jwks_uri = jwks_uri
+        self._fetcher = fetcher
+        self._default_max_age = default_max_age
+        self._min_refetch_interval = min_refetch_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._keys: Dict[str, Any] = {}
+        self._expires_at = 0.0
+        self._fetched_at: Optional[float] = None
+        self.fetches = 0
+
+    def get_key(self, kid: str) -> Any:
+        now = self._clock()
+        key = self._keys.get(kid)
+        if key is not None and now < self._expires_at:
+            return key
+        with self._lock:
+            key = self._keys.get(kid)
+            if key is not None and now < self._expires_at:
+                return key
+            # Unknown kids trigger a refetch (Google rotated), but not more often than min_refetch_interval
+            recently_fetched = self._fetched_at is not None and now - self._fetched_at < self._min_refetch_interval
+            if key is None and recently_fetched:
+                raise InvalidIdTokenError(f"Unknown signing key id: {kid}")
+            try:
+                self._refresh(now)
+            except Exception as e:
+                if key is None:
+                    raise
+                logger.warning("JWKS refresh failed, using cached keys: %s", e)
+                return key
+            key = self._keys.get(kid)
+            if key is None:
+                raise InvalidIdTokenError(f"Unknown signing key id: {kid}")
+            return key
+
+    def _refresh(self, now: float) -> None:
+        import jwt
+
+        self._fetched_at = now
+        jwks, headers = self._fetcher(self._jwks_uri)
+        self.fetches += 1
+        keys = {}
+        for jwk in jwks.get("keys", []):
+            if "kid" in jwk:
+                keys[jwk["kid"]] = jwt.PyJWK(jwk).key
+        self._keys = keys
+        self._expires_at = now + parse_max_age(headers, self._default_max_age)
+
+
+def verify_id_token(
+    id_token: str,
+    jwks_cache: JwksCache,
+    audience: str,
+    issuers: Sequence[str],
+    leeway: float = ID_TOKEN_LEEWAY_SECONDS,
+    oidc_provider: str = GOOGLE_OIDC_PROVIDER,
+) -> IdTokenClaims:
+    import jwt
+
+    try:
+        header = jwt.get_unverified_header(id_token)
+        key = jwks_cache.get_key(header.get("kid", ""))
+        payload = jwt.decode(
+            id_token,
+            key,
+            algorithms=["RS256"],
+            audience=audience,
+            leeway=leeway,
+        )
+    except jwt.PyJWTError as e:
+        raise InvalidIdTokenError(str(e)) from e
+    if payload.get("iss") not in issuers:
+        raise InvalidIdTokenError(f"Unexpected issuer: {payload.get('iss')}")
+    return IdTokenClaims.from_payload(payload, oidc_provider)
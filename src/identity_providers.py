@@ -0,0 +1,37 @@
+# Sign-in providers, by the name used in the sign-in route (signinWith<display_name>).
+# Each one exchanges an authorization code for (access_token, refresh_token, id_token, access
+# token expiry as epoch seconds) on its own pooled token client and verifies the ID token
+# against its own cached JWKS; the stage names give each provider its own series in
+# signin_stage_duration_seconds.
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from src.constants import APPLE_ISSUERS, GOOGLE_ISSUERS
+from src.id_token import GOOGLE_OIDC_PROVIDER
+from src.stage_metrics import (
+    APPLE_ID_TOKEN_VERIFICATION,
+    APPLE_TOKEN_EXCHANGE,
+    GOOGLE_TOKEN_EXCHANGE,
+    ID_TOKEN_VERIFICATION,
+)
+
+
+@dataclass(frozen=True)
+class IdentityProvider:
+    name: str
+    display_name: str
+    oidc_provider: str
+    issuers: Tuple[str, ...]
+    token_exchange_stage: str
+    id_token_stage: str
+
+
+GOOGLE = IdentityProvider("google", "Google", GOOGLE_OIDC_PROVIDER, GOOGLE_ISSUERS, GOOGLE_TOKEN_EXCHANGE, ID_TOKEN_VERIFICATION)
+APPLE = IdentityProvider("apple", "Apple", "apple", APPLE_ISSUERS, APPLE_TOKEN_EXCHANGE, APPLE_ID_TOKEN_VERIFICATION)
+
+IDENTITY_PROVIDERS: Dict[str, IdentityProvider] = {provider.name: provider for provider in (GOOGLE, APPLE)}
+
+
+def provider_for_user(oidc_provider: Optional[str]) -> IdentityProvider:
+    # Users stored before other providers existed have no oidc_provider or "google-oauth2"
+    return APPLE if oidc_provider == APPLE.oidc_provider else GOOGLE
@@ -1,54 +1,122 @@
-from src.constants import (
-    COOKIE_DAYS_TO_EXPIRE,
-    AUTHENTICATION_DDB_TABLE,
-)
-from flask import make_response
-from utils.jwt_utils import extract_email
+from src.constants import COOKIE_DAYS_TO_EXPIRE, SESSION_WRITE_BEHIND
 from http.cookies import SimpleCookie
+import uuid
 from datetime import datetime, timedelta
-from utils.jwt_utils import create_jwt
-from utils.aws_dynamodb_utils import update_to_dynamodb
+from src.user_store import get_user_store
+from src.stage_metrics import SESSION_TOKEN, SESSION_WRITE, observe_stage
+from src.session_writer import session_write_queue
+from src.signing_keys import SigningKeyError, as_key_ring
 
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def extract_email_from_token(id_token):
-    return extract_email(id_token)
+def create_jwt(payload, encryption_secret_key):
+    from utils.jwt_utils import create_jwt as sign_jwt
 
+    return sign_jwt(payload, encryption_secret_key)
 
-def create_cookie(user_email, encryption_secret_key):
+
+class InvalidSessionError(Exception):
+    pass
+
+
+def sign_session_token(payload, signing_key):
+    # signing_key is a SigningKeyRing (src/signing_keys.py) or a plain secret for unkeyed tokens
+    if isinstance(signing_key, str):
+        return create_jwt(payload, signing_key)
+    return signing_key.sign(payload)
+
+
+def verify_session_token(token, signing_key):
+    import jwt
+
+    try:
+        claims = as_key_ring(signing_key).key_for(token).verify(token)
+    except SigningKeyError as e:
+        raise InvalidSessionError(str(e))
+    except jwt.PyJWTError as e:
+        raise InvalidSessionError(f"Invalid session token: {e}")
+    if not claims.get("email"):
+        raise InvalidSessionError("Session token has no email")
+    return claims
+
+
+def session_token_from_headers(headers):
+    # The session cookie set at sign-in, or "Authorization: Bearer <session JWT>" for
+    # services calling on the user's behalf
+    authorization = headers.get("authorization") or ""
+    if authorization.lower().startswith("bearer "):
+        return authorization[7:].strip() or None
+    cookies: SimpleCookie = SimpleCookie()
+    try:
+        cookies.load(headers.get("cookie") or "")
+    except Exception:
+        return None
+    session = cookies.get("session")
+    return session.value if session is not None else None
+
+
+def issue_session_token(user_email, signing_key, sid=None):
+    session_start_time = datetime.now()
+    jwt_payload = {
+        "email": user_email,
+        "iat": session_start_time,
+        "exp": session_start_time + timedelta(days=COOKIE_DAYS_TO_EXPIRE),
+        # Session ID, so a single session can be revoked (src/session_revocation.py)
+        "jti": uuid.uuid4().hex,
+    }
+    if sid:
+        # Renewed sessions carry the jti of the session signed in, so logout revokes them all
+        jwt_payload["sid"] = sid
+    with observe_stage(SESSION_TOKEN):
+        token = sign_session_token(jwt_payload, signing_key)
+    return token, session_start_time
+
+
+def session_cookie_header(token):
+    cookie: SimpleCookie = SimpleCookie()
+    cookie["session"] = token
+    cookie["session"]["httponly"] = True
+    cookie["session"]["secure"] = True
+    return cookie["session"].OutputString()
+
+
+def expired_session_cookie_header():
+    cookie: SimpleCookie = SimpleCookie()
+    cookie["session"] = ""
+    cookie["session"]["httponly"] = True
+    cookie["session"]["secure"] = True
+    cookie["session"]["max-age"] = 0
+    cookie["session"]["expires"] = "Thu, 01 Jan 1970 00:00:00 GMT"
+    return cookie["session"].OutputString()
+
+
+def session_cookie_response(token):
+    from flask import make_response
+
+    cookie_output = make_response("Cookie is set using SimpleCookie!")
+    cookie_output.headers.add('Set-Cookie', session_cookie_header(token))
+    return cookie_output
+
+
+def build_session_cookie(user_email, signing_key):
+    token, session_start_time = issue_session_token(user_email, signing_key)
+    return session_cookie_response(token), token, session_start_time
+
+
+def save_session(user_email, token, session_start_time):
+    if SESSION_WRITE_BEHIND and session_write_queue.submit(user_email, str(session_start_time), token):
+        return
+    with observe_stage(SESSION_WRITE):
+        get_user_store().update_session(user_email, str(session_start_time), token)
+
+
+def create_cookie(user_email, signing_key):
     try:
-        session_start_time = datetime.now()
-        jwt_payload = {
-            "email": user_email,
-            "iat": session_start_time,
-            "exp": session_start_time + timedelta(days=COOKIE_DAYS_TO_EXPIRE),
-        }
-        cookie_output = make_response("Cookie is set using SimpleCookie!")
-        token = create_jwt(jwt_payload, encryption_secret_key)
-        cookie: SimpleCookie = SimpleCookie()
-        cookie["session"] = token
-        cookie["session"]["httponly"] = True
-        cookie["session"]["secure"] = True
-        cookie["session"]["secure"] = True
-        for key, morsel in cookie.items():
-            cookie_output.headers.add('Set-Cookie', morsel.OutputString())
-
-
-        response = update_to_dynamodb(
-            AUTHENTICATION_DDB_TABLE,
-            {"email": user_email},
-            {":sst": str(session_start_time), ":jwt": token},
-            "SET session_start_time = :sst, jwt = :jwt",
-        )
-
-        if response["status"] == 200:
-            return cookie_output
-        else:
-            raise ValueError("Unable to create session")
+        cookie_output, token, session_start_time = build_session_cookie(user_email, signing_key)
+        save_session(user_email, token, session_start_time)
+        return cookie_output
     except Exception as e:
-        logging.error(f"ValueError: {str(e)}")
+        logging.error("ValueError: %s", e)
@@ -0,0 +1,242 @@
+# Central logging setup for the Flask and ASGI apps.
+#
+# Request threads only build a LogRecord and put it on a bounded queue; redaction, %-style
+# formatting and the blocking write to stderr run on a listener thread. INFO and DEBUG lines
+# can be sampled per logger before they are queued. Call configure_logging() once from an
+# entry point; library modules only use logging.getLogger(__name__).
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import threading
+from typing import Any, Dict, List, Optional, TextIO
+
+from src.constants import LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATES, LOG_QUEUE_SIZE
+
+REDACTED = "[REDACTED]"
+SENSITIVE_FIELDS = frozenset({
+    "access_token",
+    "refresh_token",
+    "id_token",
+    "jwt",
+    "token",
+    "authorization_code",
+    "client_secret",
+    "encryption_secret_key",
+    "session_signing_keys",
+    "secret",
+    "private_key",
+    "apple_private_key",
+    "session",
+    "profile",
+})
+# JWTs, Google access/refresh tokens, Fernet and envelope ciphertexts
+TOKEN_PATTERN = re.compile(r"eyJ[\w-]+\.[\w-]+\.[\w-]*|ya29\.[\w.-]+|1//[\w.-]+|gAAAAA[\w=-]+|env1\.[\w.-]+")
+TEXT_FORMAT = "%(levelname)s:%(name)s:%(message)s"
+
+# Attributes every LogRecord has; anything else came in through extra= and is a structured field
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+def redact(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: REDACTED if str(k).lower() in SENSITIVE_FIELDS else redact(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(redact(item) for item in value)
+    if isinstance(value, str):
+        return TOKEN_PATTERN.sub(REDACTED, value)
+    return value
+
+
+def parse_sample_rates(value: str) -> Dict[str, float]:
+    # "src.service=0.1,src.local_utils=0.5"
+    rates = {}
+    for entry in filter(None, (part.strip() for part in value.split(","))):
+        name, _, rate = entry.partition("=")
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    # Keeps a fraction of INFO and DEBUG records per logger (the closest configured parent
+    # logger's rate applies); warnings and errors are always kept
+    def __init__(self, rates: Dict[str, float], rng=random.random):
+        super().__init__()
+        self._rates = rates
+        self._rng = rng
+        self._resolved: Dict[str, float] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO or not self._rates:
+            return True
+        rate = self._resolved.get(record.name)
+        if rate is None:
+            rate = self._resolve(record.name)
+        return rate >= 1.0 or self._rng() < rate
+
+    def _resolve(self, name: str) -> float:
+        candidate = name
+        while True:
+            if candidate in self._rates:
+                rate = self._rates[candidate]
+                break
+            if "." not in candidate:
+                rate = 1.0
+                break
+            candidate = candidate.rsplit(".", 1)[0]
+        self._resolved[name] = rate
+        return rate
+
+
+class RedactingFilter(logging.Filter):
+    # Runs on the listener thread: merges args into the message with sensitive values
+    # masked, so handlers downstream only ever see the redacted text
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.args:
+            args = record.args
+            record.args = redact(args) if isinstance(args, (dict, tuple)) else args
+        record.msg = TOKEN_PATTERN.sub(REDACTED, record.getMessage())
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        if record.exc_text:
+            record.exc_text = TOKEN_PATTERN.sub(REDACTED, record.exc_text)
+        for name in structured_fields(record):
+            value = getattr(record, name)
+            setattr(record, name, REDACTED if name.lower() in SENSITIVE_FIELDS else redact(value))
+        return True
+
+
+def structured_fields(record: logging.LogRecord) -> List[str]:
+    return [name for name in vars(record) if name not in _RECORD_ATTRIBUTES]
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name in structured_fields(record):
+            entry[name] = getattr(record, name)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = structured_fields(record)
+        if fields:
+            line += " " + " ".join(f"{name}={getattr(record, name)}" for name in fields)
+        return line
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    # The stock QueueHandler formats the message on the calling thread; here the record is
+    # queued as is and formatted by the listener. Arguments must not be mutated after logging.
+    # SimpleQueue is the C implementation; the size limit is checked, not enforced atomically.
+    def __init__(self, log_queue: "queue.SimpleQueue[logging.LogRecord]", max_size: int):
+        super().__init__(log_queue)
+        self.max_size = max_size
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.queue.qsize() >= self.max_size:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+
+_lock = threading.Lock()
+_queue_handler: Optional[DeferredQueueHandler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+_output_handlers: List[logging.Handler] = []
+
+
+def configure_logging(
+    level: str = LOG_LEVEL,
+    log_format: str = LOG_FORMAT,
+    sample_rates: Optional[Dict[str, float]] = None,
+    stream: Optional[TextIO] = None,
+    queue_size: int = LOG_QUEUE_SIZE,
+) -> DeferredQueueHandler:
+    global _queue_handler, _listener, _output_handlers
+    with _lock:
+        root = logging.getLogger()
+        _stop_listener()
+        if _queue_handler is not None:
+            root.removeHandler(_queue_handler)
+        for handler in _output_handlers:
+            root.removeHandler(handler)
+
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter(TEXT_FORMAT))
+        output.addFilter(RedactingFilter())
+        _output_handlers = [output]
+
+        # None of the formats print caller, thread or process details, so skip collecting them
+        # for every record (see "Optimization" in the logging HOWTO)
+        logging._srcfile = None
+        logging.logThreads = False
+        logging.logProcesses = False
+        logging.logMultiprocessing = False
+
+        _queue_handler = DeferredQueueHandler(queue.SimpleQueue(), queue_size)
+        _queue_handler.addFilter(SamplingFilter(parse_sample_rates(LOG_SAMPLE_RATES) if sample_rates is None else sample_rates))
+        root.addHandler(_queue_handler)
+        root.setLevel(level)
+        _start_listener()
+        return _queue_handler
+
+
+def shutdown_logging() -> None:
+    # Writes what is still queued, then logs synchronously so late messages (for example
+    # from other atexit handlers) are not lost
+    global _queue_handler
+    with _lock:
+        _stop_listener()
+        if _queue_handler is not None:
+            root = logging.getLogger()
+            root.removeHandler(_queue_handler)
+            _queue_handler = None
+            for handler in _output_handlers:
+                root.addHandler(handler)
+
+
+def _start_listener() -> None:
+    global _listener
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, *_output_handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def _stop_listener() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _restart_after_fork() -> None:
+    # The listener thread does not exist in a forked child (gunicorn --preload), and the
+    # queue's locks may have been held at fork time, so the child gets fresh ones
+    global _listener
+    if _queue_handler is not None:
+        _queue_handler.queue = queue.SimpleQueue()
+        _listener = None
+        _start_listener()
+
+
+os.register_at_fork(after_in_child=_restart_after_fork)
+atexit.register(shutdown_logging)
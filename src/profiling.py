@@ -0,0 +1,316 @@
+# On-demand profiling of production workers, off unless PROFILING is set.
+#
+# A profiled request (1 in PROFILING_SAMPLE_EVERY, or one carrying the admin token in
+# PROFILING_TRIGGER_HEADER) registers the thread it runs on, and a sampler thread reads that
+# thread's stack every PROFILING_INTERVAL_SECONDS from sys._current_frames(). Samples are
+# wall-clock: in the Flask app, time blocked on Google or DynamoDB shows up as the HTTP client's
+# socket reads. On the ASGI event loop a sample only counts while the request's own coroutine is
+# on the stack, so concurrent requests are not mixed up; its run_blocking calls register the
+# executor thread that runs them. Work in tasks the request spawns (resilience timeouts) is not
+# attributed. Stacks are kept per route as counts of collapsed stacks, along with the time each
+# sign-in stage took (observe_stage adds it up while the request is profiled). With PROFILING off
+# a request costs one attribute check.
+import contextvars
+import hmac
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from types import CodeType, FrameType
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+from src.constants import (
+    PROFILING,
+    PROFILING_ADMIN_TOKEN,
+    PROFILING_INTERVAL_SECONDS,
+    PROFILING_MAX_STACKS,
+    PROFILING_SAMPLE_EVERY,
+    PROFILING_TRIGGER_HEADER,
+)
+from src.stage_metrics import (
+    APPLE_ID_TOKEN_VERIFICATION,
+    APPLE_TOKEN_EXCHANGE,
+    GOOGLE_TOKEN_EXCHANGE,
+    ID_TOKEN_VERIFICATION,
+    SECRETS_FETCH,
+    SESSION_TOKEN,
+    SESSION_WRITE,
+    SIGNIN_WRITE,
+    TOKEN_ENCRYPTION,
+    USER_CREATE,
+    USER_LOOKUP,
+    profiled_stages,
+)
+
+# The wall-clock split of a route; ID token checks go with their provider because they may fetch JWKS
+STAGE_GROUPS = {
+    GOOGLE_TOKEN_EXCHANGE: "google",
+    ID_TOKEN_VERIFICATION: "google",
+    APPLE_TOKEN_EXCHANGE: "apple",
+    APPLE_ID_TOKEN_VERIFICATION: "apple",
+    SECRETS_FETCH: "secrets",
+    USER_LOOKUP: "dynamodb",
+    USER_CREATE: "dynamodb",
+    SESSION_WRITE: "dynamodb",
+    SIGNIN_WRITE: "dynamodb",
+    TOKEN_ENCRYPTION: "crypto",
+    SESSION_TOKEN: "crypto",
+}
+# Counts samples of new stacks once a route holds max_stacks of them
+OTHER_STACKS = "[other stacks]"
+FORMATS = ("summary", "collapsed", "speedscope")
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+
+
+class RouteProfile:
+    def __init__(self):
+        self.requests = 0
+        self.wall_seconds = 0.0
+        self.stage_seconds: Dict[str, float] = {}
+        self.stacks: Counter = Counter()
+
+
+class ProfiledRequest:
+    def __init__(self, profiler: "RequestProfiler", route: str):
+        self.profiler = profiler
+        self.route = route
+        self.stages: Dict[str, float] = {}
+        self.started = time.perf_counter()
+        self.registration: Optional[object] = None
+
+    def on_thread(self, fn: Callable[..., Any], *args) -> Any:
+        # Runs fn with the calling thread sampled for this request
+        registration = self.profiler._register(threading.get_ident(), self.route, None)
+        try:
+            return fn(*args)
+        finally:
+            self.profiler._unregister(registration)
+
+
+current_profile: contextvars.ContextVar[Optional[ProfiledRequest]] = contextvars.ContextVar(
+    "current_profile", default=None
+)
+
+
+class RequestProfiler:
+    def __init__(
+        self,
+        enabled: bool = PROFILING,
+        sample_every: int = PROFILING_SAMPLE_EVERY,
+        trigger_header: str = PROFILING_TRIGGER_HEADER,
+        admin_token: str = PROFILING_ADMIN_TOKEN,
+        interval: float = PROFILING_INTERVAL_SECONDS,
+        max_stacks: int = PROFILING_MAX_STACKS,
+    ):
+        self.enabled = enabled
+        self.sample_every = sample_every
+        self.trigger_header = trigger_header
+        self.admin_token = admin_token
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self._requests = itertools.count(1)
+        self._lock = threading.Lock()
+        self._routes: Dict[str, RouteProfile] = {}
+        # registration -> (thread ident, route, frame that must be on the stack or None)
+        self._active: Dict[object, Tuple[int, str, Optional[FrameType]]] = {}
+        self._names: Dict[CodeType, str] = {}
+        self._wake = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+
+    def should_profile(self, headers: Mapping[str, str]) -> bool:
+        if self.admin_token and self.trigger_header:
+            value = headers.get(self.trigger_header) or headers.get(self.trigger_header.lower())
+            if value and hmac.compare_digest(value.encode(), self.admin_token.encode()):
+                return True
+        return self.sample_every > 0 and next(self._requests) % self.sample_every == 0
+
+    def begin(self, route: str, headers: Mapping[str, str], root: Optional[FrameType] = None) -> Optional[ProfiledRequest]:
+        # A ProfiledRequest to pass to end() when this request is sampled, else None. root is the
+        # request's coroutine frame when the thread is an event loop shared with other requests.
+        if not self.enabled or not self.should_profile(headers):
+            return None
+        profiled = ProfiledRequest(self, route)
+        profiled.registration = self._register(threading.get_ident(), route, root)
+        current_profile.set(profiled)
+        profiled_stages.set(profiled.stages)
+        return profiled
+
+    def end(self, profiled: ProfiledRequest) -> None:
+        self._unregister(profiled.registration)
+        current_profile.set(None)
+        profiled_stages.set(None)
+        elapsed = time.perf_counter() - profiled.started
+        with self._lock:
+            route = self._route(profiled.route)
+            route.requests += 1
+            route.wall_seconds += elapsed
+            for stage, seconds in profiled.stages.items():
+                route.stage_seconds[stage] = route.stage_seconds.get(stage, 0.0) + seconds
+
+    def _route(self, name: str) -> RouteProfile:
+        route = self._routes.get(name)
+        if route is None:
+            route = self._routes[name] = RouteProfile()
+        return route
+
+    def _register(self, ident: int, route: str, root: Optional[FrameType]) -> object:
+        registration = object()
+        with self._lock:
+            self._active[registration] = (ident, route, root)
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._sampler.start()
+            self._wake.set()
+        return registration
+
+    def _unregister(self, registration: object) -> None:
+        with self._lock:
+            self._active.pop(registration, None)
+            if not self._active:
+                self._wake.clear()
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait()
+            time.sleep(self.interval)
+            self.sample()
+
+    def sample(self) -> None:
+        # One sample of every registered thread; the sampler thread calls this each interval
+        active = list(self._active.values())
+        if not active:
+            return
+        frames = sys._current_frames()
+        stacks = []
+        for ident, route, root in active:
+            frame = frames.get(ident)
+            if frame is not None:
+                stack = self._collapse(frame, root)
+                if stack is not None:
+                    stacks.append((route, stack))
+        del frames
+        with self._lock:
+            for route, stack in stacks:
+                counts = self._route(route).stacks
+                if stack not in counts and len(counts) >= self.max_stacks:
+                    stack = OTHER_STACKS
+                counts[stack] += 1
+
+    def _collapse(self, frame: Optional[FrameType], root: Optional[FrameType]) -> Optional[str]:
+        names = []
+        found = root is None
+        while frame is not None:
+            names.append(self._name(frame.f_code))
+            found = found or frame is root
+            frame = frame.f_back
+        if not found:
+            return None
+        names.reverse()
+        return ";".join(names)
+
+    def _name(self, code: CodeType) -> str:
+        name = self._names.get(code)
+        if name is None:
+            # co_qualname (Class.method) is Python 3.11+; ";" separates frames in collapsed stacks
+            qualname = getattr(code, "co_qualname", code.co_name)
+            name = f"{qualname} ({_short_path(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+            self._names[code] = name
+        return name
+
+    def admin_error(self, headers: Mapping[str, str]) -> Optional[int]:
+        # 404 while profiling or its admin token is off, 401 for a wrong token, None to serve
+        if not (self.enabled and self.admin_token):
+            return 404
+        authorization = headers.get("Authorization") or headers.get("authorization") or ""
+        scheme, _, token = authorization.partition(" ")
+        if scheme.lower() != "bearer" or not hmac.compare_digest(token.strip().encode(), self.admin_token.encode()):
+            return 401
+        return None
+
+    def report(self, format: str = "summary", route: Optional[str] = None) -> Any:
+        # A dict (summary, speedscope) or collapsed-stack text, for one route or all of them
+        if format not in FORMATS:
+            raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+        with self._lock:
+            routes = {
+                name: (profile.requests, profile.wall_seconds, dict(profile.stage_seconds), dict(profile.stacks))
+                for name, profile in self._routes.items()
+                if route is None or name == route
+            }
+        if format == "collapsed":
+            return "".join(
+                f"{name};{stack} {count}\n"
+                for name, (_, _, _, stacks) in sorted(routes.items())
+                for stack, count in sorted(stacks.items())
+            )
+        if format == "speedscope":
+            return self._speedscope(routes)
+        return {name: self._summary(*profile) for name, profile in sorted(routes.items())}
+
+    def _summary(self, requests: int, wall_seconds: float, stage_seconds: Dict[str, float], stacks: Dict[str, int]) -> Dict[str, Any]:
+        groups: Dict[str, float] = {}
+        for stage, seconds in stage_seconds.items():
+            group = STAGE_GROUPS.get(stage, stage)
+            groups[group] = groups.get(group, 0.0) + seconds
+        groups["other"] = max(0.0, wall_seconds - sum(groups.values()))
+        return {
+            "requests": requests,
+            "samples": sum(stacks.values()),
+            "wall_seconds": round(wall_seconds, 6),
+            "stage_seconds": {stage: round(seconds, 6) for stage, seconds in sorted(stage_seconds.items())},
+            "group_seconds": {group: round(seconds, 6) for group, seconds in sorted(groups.items())},
+        }
+
+    def _speedscope(self, routes: Dict[str, Tuple[int, float, Dict[str, float], Dict[str, int]]]) -> Dict[str, Any]:
+        frames: Dict[str, int] = {}
+        profiles = []
+        for name, (_, _, _, stacks) in sorted(routes.items()):
+            samples: List[List[int]] = []
+            weights: List[float] = []
+            for stack, count in sorted(stacks.items()):
+                samples.append([frames.setdefault(frame, len(frames)) for frame in stack.split(";")])
+                weights.append(count * self.interval)
+            profiles.append({
+                "type": "sampled",
+                "name": name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            })
+        return {
+            "$schema": SPEEDSCOPE_SCHEMA,
+            "name": "authorization-service",
+            "exporter": "authorization-service",
+            "shared": {"frames": [{"name": frame} for frame in frames]},
+            "profiles": profiles,
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._routes.clear()
+
+    def reset_after_fork(self) -> None:
+        # The sampler thread is not copied into the child; it starts again with the first profiled request
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._sampler = None
+        self._active.clear()
+        self._routes.clear()
+
+
+def _short_path(filename: str) -> str:
+    # Relative to the longest sys.path entry containing it, e.g. src/service.py or requests/sessions.py
+    best = ""
+    for entry in sys.path:
+        entry = os.path.abspath(entry) if entry else os.getcwd()
+        if filename.startswith(entry + os.sep) and len(entry) > len(best):
+            best = entry
+    return filename[len(best) + 1:] if best else filename
+
+
+request_profiler = RequestProfiler()
+os.register_at_fork(after_in_child=request_profiler.reset_after_fork)
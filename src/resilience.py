@@ -0,0 +1,466 @@
+# Timeouts, retries, circuit breakers and hedged reads for the calls a sign-in waits on: the
+# token exchange (per provider), the secrets fetch and the user store.
+#
+# A sign-in runs under a deadline (request_deadline). No attempt starts and no backoff sleep runs
+# past it, and HTTP timeouts are cut to what is left of it. Failed attempts are retried up to
+# DEPENDENCY_MAX_ATTEMPTS times with full-jitter exponential backoff. Only failures of the
+# dependency count (timeouts, connection errors, 5xx, throttling); answers such as invalid_grant
+# are raised straight away. Calls that must not run twice, like authorization code exchanges
+# (codes are single-use), pass retry_if=is_connect_failure: they are retried only when the
+# request never reached the server.
+#
+# Each dependency has a circuit breaker. After BREAKER_FAILURE_THRESHOLD consecutive failures it
+# rejects calls with CircuitOpenError for BREAKER_RESET_SECONDS, then lets a single probe through
+# (half-open) and closes again when the probe succeeds. Idempotent reads can be hedged: when the
+# first attempt has not answered within the dependency's recent p95 latency, a second one is sent
+# and the first successful answer wins.
+import asyncio
+import contextlib
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Awaitable, Callable, Deque, Iterator, List, Optional, TypeVar
+
+from prometheus_client import REGISTRY, Counter, Gauge
+
+from src.constants import (
+    BREAKER_FAILURE_THRESHOLD,
+    BREAKER_RESET_SECONDS,
+    DEPENDENCY_MAX_ATTEMPTS,
+    DEPENDENCY_RETRY_BASE_SECONDS,
+    DEPENDENCY_RETRY_MAX_SECONDS,
+    HEDGE_MIN_DELAY_SECONDS,
+    RESILIENCE,
+    RESILIENCE_EXECUTOR_WORKERS,
+    SECRETS_FETCH_TIMEOUT_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+_STATE_NAMES = {CLOSED: "closed", HALF_OPEN: "half-open", OPEN: "open"}
+
+dependency_circuit_state = Gauge(
+    "dependency_circuit_state",
+    "Circuit breaker state per dependency (0 closed, 1 half-open, 2 open)",
+    ["dependency"],
+    registry=REGISTRY,
+)
+dependency_calls = Counter(
+    "dependency_calls_total",
+    "Dependency calls by result (success, error, failure, circuit_open, deadline_exceeded)",
+    ["dependency", "result"],
+    registry=REGISTRY,
+)
+dependency_retries = Counter(
+    "dependency_retries_total",
+    "Dependency attempts that were retried after a failure",
+    ["dependency"],
+    registry=REGISTRY,
+)
+dependency_hedged_requests = Counter(
+    "dependency_hedged_requests_total",
+    "Hedged second requests (sent, won)",
+    ["dependency", "result"],
+    registry=REGISTRY,
+)
+RESILIENCE_METRICS = (dependency_circuit_state, dependency_calls, dependency_retries, dependency_hedged_requests)
+
+
+class DependencyUnavailable(Exception):
+    def __init__(self, dependency: str, message: str):
+        super().__init__(message)
+        self.dependency = dependency
+
+
+class CircuitOpenError(DependencyUnavailable):
+    pass
+
+
+class DeadlineExceeded(DependencyUnavailable):
+    pass
+
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+@contextlib.contextmanager
+def request_deadline(seconds: float) -> Iterator[None]:
+    # A nested deadline can only shorten the one already set
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def time_remaining() -> Optional[float]:
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def call_timeout(timeout: float, dependency: str = "") -> float:
+    # The per-call timeout, cut to what is left of the request deadline
+    remaining = time_remaining()
+    if remaining is None:
+        return timeout
+    if remaining <= 0:
+        raise DeadlineExceeded(dependency, f"Request deadline exceeded before calling {dependency}")
+    return min(timeout, remaining)
+
+
+def is_http_failure(exc: BaseException) -> bool:
+    # Token endpoints: 5xx and 429 answers, timeouts and connection errors (requests' exceptions
+    # are OSErrors), but not 4xx answers like invalid_grant
+    status_code = getattr(exc, "status_code", None)
+    if status_code is not None:
+        return status_code >= 500 or status_code == 429
+    if isinstance(exc, (OSError, asyncio.TimeoutError)):
+        return True
+    try:
+        import aiohttp
+    except ImportError:
+        return False
+    return isinstance(exc, aiohttp.ClientConnectionError)
+
+
+def is_connect_failure(exc: BaseException) -> bool:
+    # The connection could not be opened (refused, DNS, connect timeout), so nothing was sent. Read
+    # timeouts, dropped connections and error answers may follow a request the server acted on.
+    try:
+        import aiohttp
+    except ImportError:
+        pass
+    else:
+        if isinstance(exc, aiohttp.ClientConnectorError):
+            return True
+    try:
+        import requests
+        from urllib3.exceptions import NewConnectionError
+    except ImportError:
+        return False
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(exc, requests.exceptions.ConnectionError) and exc.args:
+        return isinstance(getattr(exc.args[0], "reason", None), NewConnectionError)
+    return False
+
+
+_AWS_FAILURE_CODES = frozenset({
+    "InternalServerError",
+    "InternalFailure",
+    "ServiceUnavailable",
+    "ThrottlingException",
+    "Throttling",
+    "ProvisionedThroughputExceededException",
+    "RequestLimitExceeded",
+})
+
+
+def is_aws_failure(exc: BaseException) -> bool:
+    from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, HTTPClientError
+
+    if isinstance(exc, ClientError):
+        error = exc.response.get("Error", {})
+        status = exc.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+        return error.get("Code") in _AWS_FAILURE_CODES or status >= 500
+    return isinstance(exc, (BotoConnectionError, HTTPClientError, TimeoutError))
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+        reset_timeout: float = BREAKER_RESET_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._probe_started = 0.0
+        self._gauge = dependency_circuit_state.labels(dependency=name)
+        self._gauge.set(CLOSED)
+
+    @property
+    def state(self) -> int:
+        return self._state
+
+    def allow(self) -> bool:
+        if self._state == CLOSED:
+            return True
+        with self._lock:
+            if self._state == OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+                self._set_state(HALF_OPEN)
+            # A probe that never reported back (lost with its task) stops blocking after reset_timeout
+            if self._state == HALF_OPEN and (
+                not self._probing or self._clock() - self._probe_started >= self.reset_timeout
+            ):
+                self._probing = True
+                self._probe_started = self._clock()
+                return True
+            return self._state == CLOSED
+
+    def record_success(self) -> None:
+        if self._state == CLOSED and self._failures == 0:
+            return
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            if self._state != CLOSED:
+                self._set_state(CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._state == HALF_OPEN or (self._state == CLOSED and self._failures >= self.failure_threshold):
+                self._opened_at = self._clock()
+                self._set_state(OPEN)
+
+    def release_probe(self) -> None:
+        # The probe ended without an answer (cancelled, deadline): the next call probes instead
+        if self._probing:
+            with self._lock:
+                self._probing = False
+
+    def _set_state(self, state: int) -> None:
+        log = logger.warning if state == OPEN else logger.info
+        log("Circuit for %s is %s", self.name, _STATE_NAMES[state])
+        self._state = state
+        self._gauge.set(state)
+
+    def reset_after_fork(self) -> None:
+        self._lock = threading.Lock()
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        max_attempts: int = DEPENDENCY_MAX_ATTEMPTS,
+        base_delay: float = DEPENDENCY_RETRY_BASE_SECONDS,
+        max_delay: float = DEPENDENCY_RETRY_MAX_SECONDS,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt: int) -> float:
+        # Full jitter, so workers that failed together do not retry together
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class LatencyTracker:
+    # Recent successful call durations; the p95 is recomputed every few samples, not per call
+    def __init__(self, window: int = 512, min_samples: int = 20, recompute_every: int = 32):
+        self.min_samples = min_samples
+        self.recompute_every = recompute_every
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._since_recompute = 0
+        self._p95: Optional[float] = None
+
+    def observe(self, seconds: float) -> None:
+        self._samples.append(seconds)
+        self._since_recompute += 1
+        if self._since_recompute >= self.recompute_every or (
+            self._p95 is None and len(self._samples) >= self.min_samples
+        ):
+            self._since_recompute = 0
+            ordered = sorted(self._samples)
+            self._p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def p95(self) -> Optional[float]:
+        return self._p95
+
+
+_executor_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _submit(fn: Callable[[], T]) -> "Future[T]":
+    # Timed and hedged attempts run here so the caller can stop waiting; each one carries a
+    # copy of the caller's context (request deadline, trace ID)
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=RESILIENCE_EXECUTOR_WORKERS, thread_name_prefix="dependency-calls")
+    return _executor.submit(contextvars.copy_context().run, fn)
+
+
+class Dependency:
+    def __init__(
+        self,
+        name: str,
+        is_failure: Callable[[BaseException], bool],
+        timeout: Optional[float] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        retry: Optional[RetryPolicy] = None,
+        hedge_min_delay: float = HEDGE_MIN_DELAY_SECONDS,
+        enabled: bool = RESILIENCE,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.name = name
+        self.is_failure = is_failure
+        # For calls without a timeout of their own; HTTP clients use call_timeout() instead
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker(name)
+        self.retry = retry or RetryPolicy()
+        self.latency = LatencyTracker()
+        self.hedge_min_delay = hedge_min_delay
+        self.enabled = enabled
+        self._sleep = sleep
+        self._results = {
+            result: dependency_calls.labels(dependency=name, result=result)
+            for result in ("success", "error", "failure", "circuit_open", "deadline_exceeded")
+        }
+        self._retries = dependency_retries.labels(dependency=name)
+        self._hedges_sent = dependency_hedged_requests.labels(dependency=name, result="sent")
+        self._hedges_won = dependency_hedged_requests.labels(dependency=name, result="won")
+
+    def call(
+        self, fn: Callable[[], T], hedge: bool = False, retry_if: Optional[Callable[[BaseException], bool]] = None
+    ) -> T:
+        # hedge only for idempotent reads; retry_if narrows which failures are retried
+        if not self.enabled:
+            return fn()
+        attempt = 0
+        while True:
+            attempt += 1
+            self._admit()
+            start = time.perf_counter()
+            try:
+                result = self._attempt(fn, hedge and self.breaker.state == CLOSED)
+            except Exception as e:
+                delay = self._failed(e, attempt, retry_if)
+                self._sleep(delay)
+                continue
+            except BaseException:
+                self.breaker.release_probe()
+                raise
+            self.latency.observe(time.perf_counter() - start)
+            self.breaker.record_success()
+            self._results["success"].inc()
+            return result
+
+    async def call_async(
+        self, fn: Callable[[], Awaitable[T]], retry_if: Optional[Callable[[BaseException], bool]] = None
+    ) -> T:
+        if not self.enabled:
+            return await fn()
+        attempt = 0
+        while True:
+            attempt += 1
+            self._admit()
+            start = time.perf_counter()
+            try:
+                result = await fn()
+            except Exception as e:
+                delay = self._failed(e, attempt, retry_if)
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # CancelledError when the client goes away
+                self.breaker.release_probe()
+                raise
+            self.latency.observe(time.perf_counter() - start)
+            self.breaker.record_success()
+            self._results["success"].inc()
+            return result
+
+    def _admit(self) -> None:
+        remaining = time_remaining()
+        if remaining is not None and remaining <= 0:
+            self._results["deadline_exceeded"].inc()
+            raise DeadlineExceeded(self.name, f"Request deadline exceeded before calling {self.name}")
+        if not self.breaker.allow():
+            self._results["circuit_open"].inc()
+            raise CircuitOpenError(self.name, f"Circuit for {self.name} is open")
+
+    def _failed(
+        self, exc: Exception, attempt: int, retry_if: Optional[Callable[[BaseException], bool]] = None
+    ) -> float:
+        # Re-raises unless the attempt should be retried; returns the backoff before the retry
+        if isinstance(exc, DeadlineExceeded):
+            self._results["deadline_exceeded"].inc()
+            self.breaker.release_probe()
+            raise exc
+        if not self.is_failure(exc):
+            # The dependency answered; a rejected request says nothing about its health
+            self.breaker.record_success()
+            self._results["error"].inc()
+            raise exc
+        self.breaker.record_failure()
+        delay = self.retry.backoff(attempt)
+        remaining = time_remaining()
+        if (
+            attempt >= self.retry.max_attempts
+            or (remaining is not None and delay >= remaining)
+            or (retry_if is not None and not retry_if(exc))
+        ):
+            self._results["failure"].inc()
+            raise exc
+        logger.warning("%s call failed (attempt %s), retrying in %.3fs: %s", self.name, attempt, delay, exc)
+        self._retries.inc()
+        return delay
+
+    def _attempt(self, fn: Callable[[], T], hedge: bool) -> T:
+        if not hedge and self.timeout is None:
+            return fn()
+        budget = time_remaining() if self.timeout is None else call_timeout(self.timeout, self.name)
+        deadline = None if budget is None else time.monotonic() + budget
+        pending: List[Future] = [_submit(fn)]
+        hedge_delay = self.latency.p95() if hedge else None
+        if hedge_delay is not None:
+            hedge_delay = max(hedge_delay, self.hedge_min_delay)
+            if budget is None or hedge_delay < budget:
+                done, _ = wait(pending, timeout=hedge_delay)
+                if not done:
+                    self._hedges_sent.inc()
+                    pending.append(_submit(fn))
+        hedged = pending[1] if len(pending) > 1 else None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError(f"{self.name} call timed out after {budget:.3f}s")
+            for future in done:
+                pending.remove(future)
+                # A failed first answer still leaves the other request to wait for
+                if future.exception() is None or not pending:
+                    if future is hedged and future.exception() is None:
+                        self._hedges_won.inc()
+                    return future.result()
+
+
+GOOGLE_TOKEN = Dependency("google_token", is_http_failure)
+APPLE_TOKEN = Dependency("apple_token", is_http_failure)
+SECRETS_MANAGER = Dependency("secrets_manager", is_aws_failure, timeout=SECRETS_FETCH_TIMEOUT_SECONDS)
+USER_STORE = Dependency("user_store", is_aws_failure)
+DEPENDENCIES = (GOOGLE_TOKEN, APPLE_TOKEN, SECRETS_MANAGER, USER_STORE)
+
+
+def _reset_after_fork() -> None:
+    global _executor_lock, _executor
+    _executor_lock = threading.Lock()
+    _executor = None
+    for dependency in DEPENDENCIES:
+        dependency.breaker.reset_after_fork()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,130 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from src.constants import (
+    AUTHENTICATION_SECRET_NAME,
+    HEDGED_READS,
+    SECRETS_CACHE_TTL_SECONDS,
+    SECRETS_CACHE_RETRY_SECONDS,
+)
+from src.resilience import SECRETS_MANAGER
+from src.stage_metrics import SECRETS_FETCH, observe_stage
+
+logger = logging.getLogger(__name__)
+
+
+class SecretsCache:
+    def __init__(
+        self,
+        loader: Callable[[], Dict[str, Any]],
+        ttl_seconds: float = SECRETS_CACHE_TTL_SECONDS,
+        retry_seconds: float = SECRETS_CACHE_RETRY_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._loader = loader
+        self._ttl_seconds = ttl_seconds
+        self._retry_seconds = retry_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._value: Optional[Dict[str, Any]] = None
+        self._refresh_at = 0.0
+        self._refresh_thread: Optional[threading.Thread] = None
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+    def get(self) -> Dict[str, Any]:
+        # The returned map is shared between requests and must be treated as read-only
+        refresh_thread = None
+        with self._lock:
+            value = self._value
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                if self._clock() >= self._refresh_at and self._refresh_thread is None:
+                    refresh_thread = threading.Thread(
+                        target=self._refresh, name="secrets-cache-refresh", daemon=True
+                    )
+                    self._refresh_thread = refresh_thread
+        if value is None:
+            return self._load()
+        if refresh_thread is not None:
+            refresh_thread.start()
+        return value
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._value = None
+            self._refresh_at = 0.0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "refresh_failures": self.refresh_failures,
+            }
+
+    def _load(self) -> Dict[str, Any]:
+        # Cold start: only one thread goes to the backend, the others wait for its result
+        with self._load_lock:
+            with self._lock:
+                if self._value is not None:
+                    return self._value
+            with observe_stage(SECRETS_FETCH):
+                value = self._loader()
+            with self._lock:
+                self._value = value
+                self._refresh_at = self._clock() + self._ttl_seconds
+            return value
+
+    def reset_after_fork(self) -> None:
+        # Keeps the cached value but not the parent's locks or refresh thread
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._refresh_thread = None
+
+    def _refresh(self) -> None:
+        try:
+            with observe_stage(SECRETS_FETCH):
+                value = self._loader()
+        except Exception as e:
+            logger.warning("Secrets refresh failed, serving last good value: %s", e)
+            with self._lock:
+                self.refresh_failures += 1
+                self._refresh_at = self._clock() + self._retry_seconds
+                self._refresh_thread = None
+            return
+        with self._lock:
+            self._value = value
+            self._refresh_at = self._clock() + self._ttl_seconds
+            self.refreshes += 1
+            self._refresh_thread = None
+
+
+def get_secret(secret_name: str) -> Dict[str, Any]:
+    from utils.aws_secrets_utils import get_secret as get_secret_from_aws
+
+    return get_secret_from_aws(secret_name)
+
+
+def _load_authentication_secrets() -> Dict[str, Any]:
+    authentication_secrets: dict = SECRETS_MANAGER.call(lambda: get_secret(AUTHENTICATION_SECRET_NAME), hedge=HEDGED_READS)
+    return json.loads(authentication_secrets["response"])
+
+
+authentication_secrets_cache = SecretsCache(_load_authentication_secrets)
+os.register_at_fork(after_in_child=authentication_secrets_cache.reset_after_fork)
+
+
+def get_authentication_secrets() -> Dict[str, Any]:
+    # Only fetches from Secrets Manager are observed as SECRETS_FETCH, not cache hits
+    return authentication_secrets_cache.get()
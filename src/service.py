@@ -1,103 +1,132 @@
 from datetime import datetime
 import json
-from typing import Any
+import time
+from typing import Any, Dict
 import logging
-from flask import jsonify
-
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import Flow
-from utils.jwt_utils import extract_name, extract_profile
-from utils.aws_dynamodb_utils import read_from_dynamodb
-from utils.aws_secrets_utils import get_secret
-from utils.hashing_utils import encrypt_message
-from utils.aws_dynamodb_utils import save_to_dynamodb   
 
+from src.apple_token_client import get_apple_token_client
 from src.constants import (
-    GOOGLE_AUTH_URI,
-    GOOGLE_TOKEN_URI,
-    GOOGLE_PROFILE_INFO_SCOPE,
-    GOOGLE_OPENID_SCOPE,
-    GOOGLE_EMAIL_SCOPE,
-    AUTHENTICATION_DDB_TABLE,
-    AWS_DEFAULT_REGION,
-    AUTHENTICATION_SECRET_NAME,
+    APPLE_JWKS_URI,
+    GOOGLE_JWKS_URI,
+    TOKEN_ENCRYPTION_FORMAT,
+    USER_EXISTS_KEY_ONLY_READ,
+)
+from src.existence_cache import user_existence_cache
+from src.id_token import IdTokenClaims, JwksCache, verify_id_token
+from src.google_token_client import get_google_token_client
+from src.identity_providers import APPLE, GOOGLE
+from src.local_utils import (
+    create_cookie,
+    issue_session_token,
+    save_session,
+    session_cookie_response,
+)
+from src.secrets_cache import get_authentication_secrets
+from src.signing_keys import SigningKeyRing, session_key_rings
+from src.stage_metrics import (
+    SIGNIN_WRITE,
+    TOKEN_ENCRYPTION,
+    USER_CREATE,
+    USER_LOOKUP,
+    observe_stage,
 )
-from src.local_utils import create_cookie
+from src.user_store import KEY_ATTRIBUTE, get_user_store
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Keys of the Sign in with Apple settings in the authentication secret, in the order
+# get_apple_token_client takes them
+APPLE_SECRET_NAMES = ("apple_client_id", "apple_team_id", "apple_key_id", "apple_private_key", "apple_redirect_uri")
+
+# Access token lifetime assumed when the provider's token response has no expires_in
+DEFAULT_EXPIRES_IN_SECONDS = 3600
+
+google_jwks_cache = JwksCache(GOOGLE_JWKS_URI)
+apple_jwks_cache = JwksCache(APPLE_JWKS_URI)
+
 def authorize_with_google(authorization_code) -> Any:
     client_id, client_secret, redirect_uri = _fetch_sign_with_google_secrets_from_aws()
-    logger.info(f"Fetched redirect_uri from AWS: {redirect_uri}")
+    logger.info("Fetched redirect_uri from AWS: %s", redirect_uri)
     try:
-        flow: Flow = Flow.from_client_config(
-            client_config={
-                "web": {
-                    "client_id": client_id,
-                    "client_secret": client_secret,
-                    "redirect_uris": [redirect_uri],
-                    "auth_uri": GOOGLE_AUTH_URI,
-                    "token_uri": GOOGLE_TOKEN_URI,
-                }
-            },
-            scopes=[GOOGLE_PROFILE_INFO_SCOPE, GOOGLE_OPENID_SCOPE, GOOGLE_EMAIL_SCOPE],
-            redirect_uri=redirect_uri,
-        )
-        logger.info(f"Flow created with redirect_uri: {flow.redirect_uri}")
-        logger.info(f"Attempting to fetch token with code: {authorization_code[:10]}...") 
-        flow.fetch_token(code=authorization_code)
-        logging.info("Token fetched successfully")
-        credentials: Credentials = flow.credentials
-        access_token = credentials.token
-        refresh_token = credentials.refresh_token
-        id_token = credentials.id_token
-        return access_token, refresh_token, id_token
+        token_client = get_google_token_client(client_id, client_secret, redirect_uri)
+        logger.info("Attempting to fetch token with code: %s...", authorization_code[:10]) 
+        with observe_stage(GOOGLE.token_exchange_stage):
+            tokens = token_client.exchange_code(authorization_code)
+        logger.info("Token fetched successfully")
+        access_token = tokens["access_token"]
+        refresh_token = tokens.get("refresh_token")
+        id_token = tokens["id_token"]
+        return access_token, refresh_token, id_token, access_token_expires_at(tokens)
+    except Exception as e:
+        logger.error("Error fetching tokens from Google: %s", e)
+        raise
+
+def access_token_expires_at(tokens: Dict[str, Any]) -> int:
+    # Stored with the access token, so /api/v1/accessToken serves it without refreshing until then
+    return int(time.time()) + int(tokens.get("expires_in", DEFAULT_EXPIRES_IN_SECONDS))
+
+def verify_google_id_token(id_token) -> IdTokenClaims:
+    client_id: str = get_authentication_secrets()["client_id"]
+    with observe_stage(GOOGLE.id_token_stage):
+        claims = verify_id_token(id_token, google_jwks_cache, client_id, GOOGLE.issuers)
+    logger.info("Verified ID token for: %s", claims.email)
+    return claims
+
+def authorize_with_apple(authorization_code) -> Any:
+    client_id, team_id, key_id, private_key, redirect_uri = _fetch_sign_with_apple_secrets_from_aws()
+    try:
+        token_client = get_apple_token_client(client_id, team_id, key_id, private_key, redirect_uri)
+        with observe_stage(APPLE.token_exchange_stage):
+            tokens = token_client.exchange_code(authorization_code)
+        logger.info("Token fetched successfully")
+        return tokens["access_token"], tokens.get("refresh_token"), tokens["id_token"], access_token_expires_at(tokens)
     except Exception as e:
-        logger.error(f"Error fetching tokens from Google: {str(e)}")
+        logger.error("Error fetching tokens from Apple: %s", e)
         raise
 
+def verify_apple_id_token(id_token) -> IdTokenClaims:
+    # The audience is the Services ID the code was issued to
+    client_id: str = get_authentication_secrets()["apple_client_id"]
+    with observe_stage(APPLE.id_token_stage):
+        claims = verify_id_token(id_token, apple_jwks_cache, client_id, APPLE.issuers, oidc_provider=APPLE.oidc_provider)
+    logger.info("Verified Apple ID token for: %s", claims.email)
+    return claims
+
 def is_user_exists(user_email) -> bool:
-    logger.info(f"Checking if user exists: {user_email}")
+    logger.info("Checking if user exists: %s", user_email)
+    cached = user_existence_cache.get(user_email)
+    if cached is not None:
+        logger.info("User %s %s (cached)", user_email, "exists" if cached else "not found")
+        return cached
     try:
-        response = read_from_dynamodb(
-            AUTHENTICATION_DDB_TABLE, {"email": user_email}, AWS_DEFAULT_REGION
-        )
-        logger.info(f"DynamoDB response for user check: {response}")
-        if response["status"] == 200:
-            logger.info(f"User {user_email} exists in DynamoDB")
+        with observe_stage(USER_LOOKUP):
+            item = get_user_store().get(user_email, [KEY_ATTRIBUTE] if USER_EXISTS_KEY_ONLY_READ else None)
+        user_existence_cache.put(user_email, item is not None)
+        if item is not None:
+            logger.info("User %s exists in the user store", user_email)
             return True
-        elif response["status"] == 404:
-            logger.info(f"User {user_email} not found in DynamoDB")
-            return False
-        else:
-            logger.warning(f"Unexpected status code from DynamoDB: {response['status']}")
-            return False
+        logger.info("User %s not found in the user store", user_email)
+        return False
     except json.JSONDecodeError as e:
-        logger.error(f"Invalid JSON in the event body: {e}")
+        logger.error("Invalid JSON in the event body: %s", e)
     except Exception as e:
-        logger.error(f"Unexpected error in is_user_exists: {str(e)}")
+        logger.error("Unexpected error in is_user_exists: %s", e)
     return False
 
-def create_user(user_email, id_token, access_token, refresh_token):
-    logger.info(f"Attempting to create user: {user_email}")
+def create_user(user_email, claims: IdTokenClaims, access_token, refresh_token, expires_at=None):
+    logger.info("Attempting to create user: %s", user_email)
     try:
-        user_full_name = _extract_name_from_token(id_token)
-        user_google_profile = _extract_profile_from_token(id_token)
-        logger.info(f"Extracted user details: name={user_full_name}, profile={user_google_profile}")
-
-        authentication_secrets: dict = get_secret(AUTHENTICATION_SECRET_NAME)
-        logger.info(f"Retrieved authentication secrets. Keys: {authentication_secrets.keys()}")
-        authentication_secrets_map = json.loads(authentication_secrets["response"])
-        logger.info(f"Parsed authentication secrets. Keys: {authentication_secrets_map.keys()}")
+        user_full_name = claims.name
+        user_google_profile = claims.profile
+        logger.info("Extracted user details for %s: profile fields=%s", user_email, sorted(user_google_profile))
+
+        authentication_secrets_map = get_authentication_secrets()
+        logger.info("Retrieved authentication secrets. Keys: %s", authentication_secrets_map.keys())
         encryption_secret_key: str = authentication_secrets_map["encryption_secret_key"]
         
-        access_token_encrypted = encrypt_message(
-            access_token, encryption_secret_key
-        ).decode("utf-8")
-        refresh_token_encrypted = encrypt_message(
-            refresh_token, encryption_secret_key
-        ).decode("utf-8")
+        access_token_encrypted, refresh_token_encrypted = _encrypt_tokens(
+            access_token, refresh_token, encryption_secret_key
+        )
 
         created_at = datetime.utcnow().isoformat()
         data = {
@@ -107,69 +136,152 @@ def create_user(user_email, id_token, access_token, refresh_token):
             "refresh_token": refresh_token_encrypted,
             "name": user_full_name,
             "created_at": created_at,
-            "oidc_provider": "google-oauth2",
+            "oidc_provider": claims.oidc_provider,
         }
+        if expires_at is not None:
+            data["access_token_expires_at"] = expires_at
 
-        logger.info(f"Saving user data to DynamoDB: {data}")
-        response = save_to_dynamodb(AUTHENTICATION_DDB_TABLE, data, AWS_DEFAULT_REGION)
-        logger.info(f"DynamoDB save response: {response}")
-
-        if response["status"] == 200:
-            logger.info(f"User {user_email} created successfully")
-            return True
+        logger.info("Saving user data to the user store: %s", data)
+        try:
+            with observe_stage(USER_CREATE):
+                created = get_user_store().create_if_not_exists(data)
+        except Exception:
+            # The write may still have landed, so forget the cached "not found"
+            user_existence_cache.invalidate(user_email)
+            raise
+        user_existence_cache.put(user_email, True)
+        if created:
+            logger.info("User %s created successfully", user_email)
         else:
-            logger.error(f"User Creation save to DDB failed: {response}")
-            return False
+            # A concurrent first sign-in created the user between our existence check and this write
+            logger.info("User %s already exists, keeping the stored profile", user_email)
+        return True
     except KeyError as e:
-        logger.error(f"KeyError in create_user: {str(e)}")
+        logger.error("KeyError in create_user: %s", e)
         return False
     except json.JSONDecodeError as e:
-        logger.error(f"JSONDecodeError in create_user: {str(e)}")
+        logger.error("JSONDecodeError in create_user: %s", e)
         return False
     except Exception as e:
-        logger.error(f"Unexpected error in create_user: {str(e)}")
+        logger.error("Unexpected error in create_user: %s", e)
         return False
 
+def write_signin(claims: IdTokenClaims, access_token, refresh_token, expires_at=None):
+    # Creates the user if needed and writes the session in a single conditional UpdateItem
+    user_email = claims.email
+    logger.info("Signing in user with conditional write: %s", user_email)
+    encryption_secret_key = _get_encryption_secret_key()
+
+    access_token_encrypted, refresh_token_encrypted = _encrypt_tokens(
+        access_token, refresh_token, encryption_secret_key
+    )
+    token, session_start_time = issue_session_token(user_email, _get_session_key_ring())
+    profile_fields = {
+        "profile": claims.profile,
+        "access_token": access_token_encrypted,
+        "refresh_token": refresh_token_encrypted,
+        "name": claims.name,
+        "created_at": datetime.utcnow().isoformat(),
+        "oidc_provider": claims.oidc_provider,
+    }
+    if expires_at is not None:
+        profile_fields["access_token_expires_at"] = expires_at
+
+    with observe_stage(SIGNIN_WRITE):
+        user_created = get_user_store().upsert_user_with_session(
+            user_email, profile_fields, {"session_start_time": str(session_start_time), "jwt": token}
+        )
+    user_existence_cache.put(user_email, True)
+    if user_created:
+        logger.info("User %s created successfully", user_email)
+    return token, user_created
+
+def signin_user(claims: IdTokenClaims, access_token, refresh_token, expires_at=None):
+    token, user_created = write_signin(claims, access_token, refresh_token, expires_at)
+    logger.info("Cookie created successfully")
+    return session_cookie_response(token), user_created
+
+def start_session(user_email):
+    token, session_start_time = issue_session_token(user_email, _get_session_key_ring())
+    save_session(user_email, token, session_start_time)
+    return token
+
 def authenticate_user(user_email):
-    logger.info(f"Authenticating user: {user_email}")
+    from flask import jsonify
+
+    logger.info("Authenticating user: %s", user_email)
     try:
-        authentication_secrets: dict = get_secret(AUTHENTICATION_SECRET_NAME)
-        logger.info(f"Retrieved authentication secrets. Keys: {authentication_secrets.keys()}")
-        authentication_secrets_map = json.loads(authentication_secrets["response"])
-        logger.info(f"Parsed authentication secrets. Keys: {authentication_secrets_map.keys()}")
+        authentication_secrets_map = get_authentication_secrets()
+        logger.info("Retrieved authentication secrets. Keys: %s", authentication_secrets_map.keys())
         if "encryption_secret_key" not in authentication_secrets_map:
             raise KeyError("encryption_secret_key not present in AWS Secrets")
-        encryption_secret_key: str = authentication_secrets_map["encryption_secret_key"]
-        response = create_cookie(user_email, encryption_secret_key)
+        response = create_cookie(user_email, session_key_rings.get(authentication_secrets_map))
         logger.info("Cookie created successfully")
         return response
     except KeyError as ke:
-        logger.error(f"KeyError in authenticate_user: {ke}")
+        logger.error("KeyError in authenticate_user: %s", ke)
         return jsonify({"error": str(ke)}), 400
     except json.JSONDecodeError as e:
-        logger.error(f"JSONDecodeError in authenticate_user: {str(e)}")
+        logger.error("JSONDecodeError in authenticate_user: %s", e)
         return jsonify({"error": "Invalid secret format"}), 500
     except Exception as e:
-        logger.error(f"Unexpected error in authenticate_user: {e}")
+        logger.error("Unexpected error in authenticate_user: %s", e)
         return jsonify({"error": "An unexpected error occurred"}), 500
 
-def _extract_name_from_token(id_token):
-    name = extract_name(id_token)
-    logger.info(f"Extracted name from token: {name}")
-    return name
+def encrypt_message(message, encryption_secret_key):
+    from utils.hashing_utils import encrypt_message as fernet_encrypt_message
+
+    return fernet_encrypt_message(message, encryption_secret_key)
+
+def decrypt_message(ciphertext, encryption_secret_key):
+    from utils.hashing_utils import decrypt_message as fernet_decrypt_message
+
+    return fernet_decrypt_message(ciphertext, encryption_secret_key)
+
+def encrypt_token(token, encryption_secret_key):
+    with observe_stage(TOKEN_ENCRYPTION):
+        if TOKEN_ENCRYPTION_FORMAT == "envelope":
+            return _token_cipher(encryption_secret_key).encrypt(token)
+        return encrypt_message(token, encryption_secret_key).decode("utf-8")
 
-def _extract_profile_from_token(id_token):
-    profile = extract_profile(id_token)
-    logger.info(f"Extracted profile from token: {profile}")
-    return profile
+def decrypt_token(ciphertext, encryption_secret_key) -> str:
+    # Stored tokens may be in either format, whatever TOKEN_ENCRYPTION_FORMAT was at the time
+    from src.token_crypto import FORMAT_PREFIX
+
+    if ciphertext.startswith(FORMAT_PREFIX + "."):
+        return _token_cipher(encryption_secret_key).decrypt(ciphertext)
+    token = decrypt_message(ciphertext.encode("utf-8"), encryption_secret_key)
+    return token.decode("utf-8") if isinstance(token, bytes) else token
+
+def _encrypt_tokens(access_token, refresh_token, encryption_secret_key):
+    with observe_stage(TOKEN_ENCRYPTION):
+        if TOKEN_ENCRYPTION_FORMAT == "envelope":
+            return _token_cipher(encryption_secret_key).encrypt_pair(access_token, refresh_token)
+        access_token_encrypted = encrypt_message(access_token, encryption_secret_key).decode("utf-8")
+        refresh_token_encrypted = encrypt_message(refresh_token, encryption_secret_key).decode("utf-8")
+    return access_token_encrypted, refresh_token_encrypted
+
+def _token_cipher(encryption_secret_key):
+    # Secrets of earlier rotations are listed in the secret, so a worker started since still decrypts their rows
+    from src.token_crypto import get_token_cipher
+
+    return get_token_cipher(encryption_secret_key, get_authentication_secrets().get("previous_encryption_secret_keys"))
+
+def _get_encryption_secret_key() -> str:
+    authentication_secrets_map = get_authentication_secrets()
+    if "encryption_secret_key" not in authentication_secrets_map:
+        raise KeyError("encryption_secret_key not present in AWS Secrets")
+    return authentication_secrets_map["encryption_secret_key"]
+
+def _get_session_key_ring() -> SigningKeyRing:
+    # Session JWTs are signed with their own keys, not with encryption_secret_key (src/signing_keys.py)
+    return session_key_rings.get(get_authentication_secrets())
 
 def _fetch_sign_with_google_secrets_from_aws() -> Any:
     logger.info("Fetching Google sign-in secrets from AWS")
     try:
-        authentication_secrets = get_secret(AUTHENTICATION_SECRET_NAME)
-        logger.info(f"Retrieved authentication secrets. Keys: {authentication_secrets.keys()}")
-        authentication_secrets_map = json.loads(authentication_secrets["response"])
-        logger.info(f"Parsed authentication secrets. Keys: {authentication_secrets_map.keys()}")
+        authentication_secrets_map = get_authentication_secrets()
+        logger.info("Retrieved authentication secrets. Keys: %s", authentication_secrets_map.keys())
 
         if not all(
                 [
@@ -183,11 +295,22 @@ def _fetch_sign_with_google_secrets_from_aws() -> Any:
         client_id: str = authentication_secrets_map["client_id"]
         client_secret: str = authentication_secrets_map["client_secret"]
         redirect_uri: str = authentication_secrets_map["redirect_uri"]
-        logger.info(f"Successfully fetched Google sign-in secrets. Redirect URI: {redirect_uri}")
+        logger.info("Successfully fetched Google sign-in secrets. Redirect URI: %s", redirect_uri)
         return client_id, client_secret, redirect_uri
     except KeyError as e:
-        logger.error(f"KeyError in _fetch_sign_with_google_secrets_from_aws: {e}")
+        logger.error("KeyError in _fetch_sign_with_google_secrets_from_aws: %s", e)
         raise
     except Exception as e:
-        logger.error(f"Unexpected error in _fetch_sign_with_google_secrets_from_aws: {e}")
-        raise
\ No newline at end of file
+        logger.error("Unexpected error in _fetch_sign_with_google_secrets_from_aws: %s", e)
+        raise
+
+def _fetch_sign_with_apple_secrets_from_aws() -> Any:
+    authentication_secrets_map = get_authentication_secrets()
+    try:
+        values = tuple(authentication_secrets_map[name] for name in APPLE_SECRET_NAMES)
+    except KeyError as e:
+        logger.error("KeyError in _fetch_sign_with_apple_secrets_from_aws: %s", e)
+        raise
+    if not all(values):
+        raise KeyError("Error extracting the Sign in with Apple settings from AWS secrets")
+    return values
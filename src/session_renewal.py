@@ -0,0 +1,162 @@
+# Sliding sessions: /api/v1/session/renew keeps active users signed in without the Google or
+# Apple sign-in path.
+#
+# The current session is checked locally, like /api/v1/session/verify. Until
+# SESSION_RENEWAL_FRACTION of its lifetime has passed nothing else happens, so renewing on every
+# page load costs no I/O. Past that point a new session (new jti, full COOKIE_DAYS_TO_EXPIRE) is
+# issued and written to the user store with a condition on session_start_time. The write only
+# lands if the stored session is older than SESSION_RENEWAL_WINDOW_SECONDS, so each user is
+# written at most once per window however many workers renew them. Each worker also remembers,
+# by the old session's jti, the sessions it issued within the window, so the same old cookie sent
+# again (other tabs, retries) gets the same new session without another write. Other sessions of
+# the user (other devices) get their own, and a remembered session that was revoked since is not
+# handed out again. The new session carries the sid of the session first signed in (its jti), and
+# logout revokes that sid too, so logging out of a renewed session also ends the sessions it was
+# renewed from. Until then the old session stays valid, so retries with it keep working.
+import logging
+import os
+import threading
+import time
+from calendar import timegm
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from prometheus_client import REGISTRY, Counter
+
+from src import service, session_revocation
+from src.constants import (
+    COOKIE_DAYS_TO_EXPIRE,
+    SESSION_RENEWAL_CACHE_SIZE,
+    SESSION_RENEWAL_FRACTION,
+    SESSION_RENEWAL_WINDOW_SECONDS,
+)
+from src.local_utils import issue_session_token
+from src.session_verification import verify_session
+from src.stage_metrics import SESSION_WRITE, observe_stage
+from src.user_store import get_user_store
+
+logger = logging.getLogger(__name__)
+
+session_renewals = Counter(
+    "session_renewals_total",
+    "Session renewal requests by result (not_due, renewed, reused, not_written, failed)",
+    ["result"],
+    registry=REGISTRY,
+)
+_NOT_DUE = session_renewals.labels(result="not_due")
+_RENEWED = session_renewals.labels(result="renewed")
+_REUSED = session_renewals.labels(result="reused")
+_NOT_WRITTEN = session_renewals.labels(result="not_written")
+_FAILED = session_renewals.labels(result="failed")
+
+SESSION_LIFETIME = timedelta(days=COOKIE_DAYS_TO_EXPIRE).total_seconds()
+
+
+class RecentRenewals:
+    # LRU of old session jti -> (renewed_at, token, exp, new jti) for sessions this worker issued within the window
+    def __init__(
+        self,
+        window: float = SESSION_RENEWAL_WINDOW_SECONDS,
+        max_entries: int = SESSION_RENEWAL_CACHE_SIZE,
+        clock=time.time,
+    ):
+        self.window = window
+        self.max_entries = max_entries
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, str, float, str]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, old_jti: str) -> Optional[Tuple[str, float, str]]:
+        # (token, exp, jti) of the session issued in place of old_jti
+        with self._lock:
+            entry = self._entries.get(old_jti)
+            if entry is None:
+                return None
+            if entry[0] + self.window <= self._clock():
+                del self._entries[old_jti]
+                return None
+            self._entries.move_to_end(old_jti)
+            return entry[1], entry[2], entry[3]
+
+    def put(self, old_jti: str, token: str, exp: float, jti: str) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[old_jti] = (self._clock(), token, exp, jti)
+            self._entries.move_to_end(old_jti)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, old_jti: str) -> None:
+        with self._lock:
+            self._entries.pop(old_jti, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def reset_after_fork(self) -> None:
+        self._lock = threading.Lock()
+
+
+def renewal_due(claims: Dict[str, Any], now: float, fraction: float = SESSION_RENEWAL_FRACTION) -> bool:
+    exp = float(claims["exp"])
+    iat = float(claims["iat"]) if "iat" in claims else exp - SESSION_LIFETIME
+    return now >= iat + (exp - iat) * fraction
+
+
+def renew_session(session_token: Optional[str], signing_key: Any = None) -> Tuple[Optional[str], float]:
+    # (new session token, or None to keep the current one, and the expiry of the session to use);
+    # raises InvalidSessionError like verify_session
+    claims = verify_session(session_token, signing_key)
+    if not renewal_due(claims, time.time()):
+        _NOT_DUE.inc()
+        return None, float(claims["exp"])
+    email = claims["email"]
+    # Sessions issued before jti was added are renewed without reuse
+    old_jti = claims.get("jti")
+    recent = recent_renewals.get(old_jti) if old_jti else None
+    if recent is not None:
+        token, exp, jti = recent
+        if not session_revocation.revocation_list.is_revoked(jti):
+            _REUSED.inc()
+            return token, exp
+        recent_renewals.discard(old_jti)
+    token, session_start_time = issue_session_token(
+        email, signing_key or service._get_session_key_ring(), sid=claims.get("sid") or old_jti
+    )
+    # The exp claim as PyJWT encodes it
+    exp = float(timegm((session_start_time + timedelta(days=COOKIE_DAYS_TO_EXPIRE)).utctimetuple()))
+    started_before = str(session_start_time - timedelta(seconds=recent_renewals.window))
+    try:
+        with observe_stage(SESSION_WRITE):
+            written = get_user_store().renew_session(email, str(session_start_time), token, started_before)
+    except Exception as e:
+        # The current session is still valid; the client renews on a later request
+        logger.error("Session renewal write failed for %s: %s", email, e)
+        _FAILED.inc()
+        return None, float(claims["exp"])
+    # Handed out either way: sessions are verified by signature, not against the stored jwt
+    (_RENEWED if written else _NOT_WRITTEN).inc()
+    if old_jti:
+        recent_renewals.put(old_jti, token, exp, _unverified_jti(token))
+    return token, exp
+
+
+def _unverified_jti(token: str) -> str:
+    # The token was just signed here; only its jti is read back
+    import jwt
+
+    return jwt.decode(token, options={"verify_signature": False})["jti"]
+
+
+def renewal_response(token: Optional[str], exp: float) -> Dict[str, Any]:
+    return {"renewed": token is not None, "expires_at": int(exp)}
+
+
+recent_renewals = RecentRenewals()
+os.register_at_fork(after_in_child=recent_renewals.reset_after_fork)
@@ -0,0 +1,422 @@
+# Revocation of individual sessions by their JWT ID (jti).
+#
+# Revocations are stored in the session_revocations table, partitioned by UTC day
+# (pk "day#2024-05-01", sk "<revoked_at>#<jti>") so each worker can pull only what was revoked
+# since its last sync with one Query per day. Every worker keeps all unexpired revocations in
+# memory: a Bloom filter answers almost every check ("not revoked") from a few bit tests, and a
+# sorted array of 64-bit fingerprints confirms the rare positives exactly. Each fingerprint keeps
+# the expiry of its session (12 bytes per entry in all), and revocations of sessions that have
+# expired are dropped every REVOCATION_PURGE_INTERVAL_SECONDS.
+# A background thread syncs every REVOCATION_SYNC_INTERVAL_SECONDS, so a revocation reaches the
+# other workers within that interval; the revoking worker sees it immediately.
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from prometheus_client import REGISTRY, Counter, Gauge
+
+from src import service
+from src.constants import (
+    COOKIE_DAYS_TO_EXPIRE,
+    REVOCATION_DDB_TABLE,
+    REVOCATION_SYNC_INTERVAL_SECONDS,
+    REVOCATION_SYNC_OVERLAP_SECONDS,
+    REVOCATION_FILTER_CAPACITY,
+    REVOCATION_FILTER_ERROR_RATE,
+    REVOCATION_LOAD_TIMEOUT_SECONDS,
+    REVOCATION_PURGE_INTERVAL_SECONDS,
+    USER_STORE_BACKEND,
+    USER_STORE_SQLITE_PATH,
+)
+from src.dynamodb_client import get_dynamodb_client
+from src.local_utils import InvalidSessionError, verify_session_token
+
+logger = logging.getLogger(__name__)
+
+MERGE_THRESHOLD = 4096
+
+
+class UnrevocableSessionError(Exception):
+    # A session issued before sessions had a jti: it stays valid until it expires
+    def __init__(self, email: str, expires_at: float):
+        super().__init__(f"Session of {email} has no jti and cannot be revoked")
+        self.email = email
+        self.expires_at = expires_at
+
+session_revocation_entries = Gauge(
+    "session_revocation_entries", "Revoked sessions held in memory by this worker", registry=REGISTRY
+)
+session_revocation_checks = Counter(
+    "session_revocation_checks_total",
+    "Session revocation checks by result (filtered, confirmed, false_positive, unsynced)",
+    ["result"],
+    registry=REGISTRY,
+)
+session_revocation_sync_errors = Counter(
+    "session_revocation_sync_errors_total", "Failed revocation syncs", registry=REGISTRY
+)
+# Bound once, the check path should not pay for the label lookup
+_FILTERED = session_revocation_checks.labels(result="filtered")
+_CONFIRMED = session_revocation_checks.labels(result="confirmed")
+_FALSE_POSITIVE = session_revocation_checks.labels(result="false_positive")
+SESSION_REVOCATION_METRICS = (session_revocation_entries, session_revocation_checks, session_revocation_sync_errors)
+
+
+def fingerprint(jti: str) -> int:
+    # The 64-bit str hash: salted per process (so not predictable from outside) and the same in
+    # forked workers, which is all a structure rebuilt from the jti strings in each worker needs
+    return hash(jti) & 0xFFFFFFFFFFFFFFFF
+
+
+def _day(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%d")
+
+
+def _sort_key(timestamp: float) -> str:
+    # Fixed width, so sort keys order like the timestamps
+    return f"{timestamp:017.6f}"
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def add(self, value: int) -> None:
+        # Double hashing on the two halves of the 64-bit fingerprint
+        bits, size = self.bits, self.size
+        first, second = value & 0xFFFFFFFF, (value >> 32) | 1
+        for index in range(self.hashes):
+            position = (first + index * second) % size
+            bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value: int) -> bool:
+        bits, size = self.bits, self.size
+        first, second = value & 0xFFFFFFFF, (value >> 32) | 1
+        for index in range(self.hashes):
+            position = (first + index * second) % size
+            if not bits[position >> 3] >> (position & 7) & 1:
+                return False
+        return True
+
+
+class RevocationSet:
+    # Readers take no lock: additions land in _recent before the filter bits are set, and a
+    # merge publishes the new filter and sorted array before it drops the merged _recent entries.
+    # Expired entries stay in the filter until it is rebuilt; their bits only add false positives.
+    def __init__(self, capacity: int = REVOCATION_FILTER_CAPACITY, error_rate: float = REVOCATION_FILTER_ERROR_RATE):
+        self.error_rate = error_rate
+        self._lock = threading.Lock()
+        self._filter = BloomFilter(capacity, error_rate)
+        # Entries dropped since the filter was built, still set in it
+        self._stale = 0
+        self._sorted = array("Q")
+        # Expiry (epoch seconds) of each entry of _sorted
+        self._expires = array("I")
+        self._recent: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._sorted) + len(self._recent)
+
+    def add(self, jti: str, expires_at: float) -> None:
+        self.add_many(((jti, expires_at),))
+
+    def add_many(self, revocations: Iterable[Tuple[str, float]]) -> None:
+        # (jti, expiry of the revoked session as epoch seconds)
+        with self._lock:
+            for jti, expires_at in revocations:
+                value = fingerprint(jti)
+                self._recent[value] = max(math.ceil(expires_at), self._recent.get(value, 0))
+                self._filter.add(value)
+            if len(self._recent) >= MERGE_THRESHOLD:
+                self._merge(time.time())
+        session_revocation_entries.set(len(self))
+
+    def drop_expired(self, now: float) -> int:
+        # Drops the revocations of sessions expired by now; returns how many
+        with self._lock:
+            dropped = self._merge(now)
+        session_revocation_entries.set(len(self))
+        return dropped
+
+    def __contains__(self, jti: str) -> bool:
+        value = fingerprint(jti)
+        if value not in self._filter:
+            _FILTERED.inc()
+            return False
+        found = value in self._recent or _sorted_contains(self._sorted, value)
+        (_CONFIRMED if found else _FALSE_POSITIVE).inc()
+        return found
+
+    def memory_bytes(self) -> int:
+        return len(self._filter.bits) + (self._sorted.itemsize + self._expires.itemsize) * len(self._sorted)
+
+    def _merge(self, now: float) -> int:
+        # Returns how many entries expired
+        merged = dict(zip(self._sorted, self._expires))
+        for value, expires_at in self._recent.items():
+            if expires_at > merged.get(value, 0):
+                merged[value] = expires_at
+        entries = {value: expires_at for value, expires_at in merged.items() if expires_at > now}
+        values = sorted(entries)
+        dropped = len(merged) - len(entries)
+        self._stale += dropped
+        if len(values) + self._stale > self._filter.capacity:
+            # Keep the false positive rate: rebuild the filter without the dropped entries,
+            # doubling its capacity until the live ones fit
+            capacity = self._filter.capacity
+            while capacity < len(values):
+                capacity *= 2
+            bloom = BloomFilter(capacity, self.error_rate)
+            for value in values:
+                bloom.add(value)
+            self._filter = bloom
+            self._stale = 0
+        self._sorted = array("Q", values)
+        self._expires = array("I", [entries[value] for value in values])
+        self._recent = {}
+        return dropped
+
+
+def _sorted_contains(ordered: array, value: int) -> bool:
+    position = bisect_left(ordered, value)
+    return position < len(ordered) and ordered[position] == value
+
+
+class RevocationStore:
+    def revoke(self, jti: str, email: str, revoked_at: float, expires_at: float) -> None:
+        raise NotImplementedError
+
+    def revoked_since(self, day: str, after: str) -> Iterator[Tuple[str, float]]:
+        # (jti, expires_at) revoked on `day` with a sort key after `after`
+        raise NotImplementedError
+
+
+class DynamoDBRevocationStore(RevocationStore):
+    # expires_at is the table's TTL attribute, so DynamoDB drops entries once the session has expired
+    def __init__(self, table_name: str = REVOCATION_DDB_TABLE, client=None):
+        self.table_name = table_name
+        self._client = client
+
+    @property
+    def client(self):
+        return self._client or get_dynamodb_client()
+
+    def revoke(self, jti, email, revoked_at, expires_at):
+        self.client.put_item(
+            TableName=self.table_name,
+            Item={
+                "pk": {"S": f"day#{_day(revoked_at)}"},
+                "sk": {"S": f"{_sort_key(revoked_at)}#{jti}"},
+                "jti": {"S": jti},
+                "email": {"S": email},
+                "expires_at": {"N": str(int(expires_at))},
+            },
+        )
+
+    def revoked_since(self, day, after):
+        request = {
+            "TableName": self.table_name,
+            "KeyConditionExpression": "pk = :pk AND sk > :after",
+            "ExpressionAttributeValues": {":pk": {"S": f"day#{day}"}, ":after": {"S": after}},
+            "ProjectionExpression": "jti, expires_at",
+        }
+        while True:
+            response = self.client.query(**request)
+            for item in response.get("Items", []):
+                yield item["jti"]["S"], float(item["expires_at"]["N"])
+            if "LastEvaluatedKey" not in response:
+                return
+            request["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+class SQLiteRevocationStore(RevocationStore):
+    def __init__(self, path: str = ":memory:"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        if path != ":memory:":
+            self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS session_revocations "
+            "(pk TEXT NOT NULL, sk TEXT NOT NULL, jti TEXT NOT NULL, email TEXT, expires_at REAL, PRIMARY KEY (pk, sk))"
+        )
+
+    def revoke(self, jti, email, revoked_at, expires_at):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO session_revocations VALUES (?, ?, ?, ?, ?)",
+                (f"day#{_day(revoked_at)}", f"{_sort_key(revoked_at)}#{jti}", jti, email, expires_at),
+            )
+
+    def revoked_since(self, day, after):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT jti, expires_at FROM session_revocations WHERE pk = ? AND sk > ? ORDER BY sk",
+                (f"day#{day}", after),
+            ).fetchall()
+        yield from rows
+
+
+def create_revocation_store(backend: str = USER_STORE_BACKEND) -> RevocationStore:
+    if backend == "dynamodb":
+        return DynamoDBRevocationStore()
+    if backend == "sqlite":
+        return SQLiteRevocationStore(USER_STORE_SQLITE_PATH)
+    raise ValueError(f"Unknown user store backend: {backend}")
+
+
+class RevocationList:
+    def __init__(
+        self,
+        store_factory: Callable[[], RevocationStore] = create_revocation_store,
+        interval: float = REVOCATION_SYNC_INTERVAL_SECONDS,
+        overlap: float = REVOCATION_SYNC_OVERLAP_SECONDS,
+        load_timeout: float = REVOCATION_LOAD_TIMEOUT_SECONDS,
+        revoked: Optional[RevocationSet] = None,
+        purge_interval: float = REVOCATION_PURGE_INTERVAL_SECONDS,
+    ):
+        self._store_factory = store_factory
+        self._store: Optional[RevocationStore] = None
+        self.interval = interval
+        self.overlap = overlap
+        self.load_timeout = load_timeout
+        self.purge_interval = purge_interval
+        self._purge_at = time.time() + purge_interval
+        self.revoked = revoked if revoked is not None else RevocationSet()
+        # Sessions revoked before this could not be valid anymore
+        self._synced_until = time.time() - timedelta(days=COOKIE_DAYS_TO_EXPIRE).total_seconds()
+        self._loaded = threading.Event()
+        # Set once the first sync has been tried, or a check has given up waiting for it
+        self._settled = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_pid: Optional[int] = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def store(self) -> RevocationStore:
+        if self._store is None:
+            self._store = self._store_factory()
+        return self._store
+
+    def revoke(self, jti: str, email: str, expires_at: float) -> None:
+        self.store.revoke(jti, email, time.time(), expires_at)
+        self.revoked.add(jti, expires_at)
+
+    def is_revoked(self, jti: str) -> bool:
+        self._ensure_worker()
+        if not self._loaded.is_set():
+            return self._unsynced(jti)
+        return jti in self.revoked
+
+    def _unsynced(self, jti: str) -> bool:
+        # Only the first checks of a worker wait for the first sync, and for no longer than
+        # load_timeout. Once it has failed or timed out, checks fail open at once: only signature
+        # and expiry are checked until a sync succeeds.
+        if not self._settled.is_set() and not self._settled.wait(self.load_timeout):
+            logger.error("Session revocations not loaded within %ss, accepting sessions unchecked", self.load_timeout)
+            self._settled.set()
+        if self._loaded.is_set():
+            return jti in self.revoked
+        session_revocation_checks.labels(result="unsynced").inc()
+        return False
+
+    def sync(self) -> int:
+        # Pulls revocations since the last sync; the overlap covers writers whose clocks run behind
+        started = time.time()
+        since = self._synced_until - self.overlap
+        first = day = datetime.fromtimestamp(since, timezone.utc).date()
+        today = datetime.fromtimestamp(started, timezone.utc).date()
+        revocations = []
+        while day <= today:
+            after = _sort_key(since) if day == first else ""
+            revocations.extend(
+                (jti, expires_at)
+                for jti, expires_at in self.store.revoked_since(day.isoformat(), after)
+                if expires_at > started
+            )
+            day += timedelta(days=1)
+        self.revoked.add_many(revocations)
+        self._synced_until = started
+        self._loaded.set()
+        if started >= self._purge_at:
+            self._purge_at = started + self.purge_interval
+            self.revoked.drop_expired(started)
+        return len(revocations)
+
+    def stop(self) -> None:
+        self._wake.set()
+
+    def _ensure_worker(self) -> None:
+        # Started on first use and again after a fork, since threads do not survive fork
+        if self._thread is not None and self._thread_pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or self._thread_pid != os.getpid() or not self._thread.is_alive():
+                self._wake.clear()
+                self._thread = threading.Thread(target=self._run, name="session-revocation-sync", daemon=True)
+                self._thread_pid = os.getpid()
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.sync()
+            except Exception as e:
+                session_revocation_sync_errors.inc()
+                logger.error("Session revocation sync failed: %s", e)
+            self._settled.set()
+            if self._wake.wait(self.interval):
+                return
+
+    def reset_after_fork(self) -> None:
+        # The parent's filter and cursor stay valid; its locks and thread do not
+        self._start_lock = threading.Lock()
+        self.revoked._lock = threading.Lock()
+        self._store = None
+
+
+def authenticate_session(session_token: Optional[str], signing_key) -> dict:
+    # Signature, expiry and revocation; raises InvalidSessionError
+    if not session_token:
+        raise InvalidSessionError("Session token is required")
+    claims = verify_session_token(session_token, signing_key)
+    if is_session_revoked(claims):
+        raise InvalidSessionError("Session was revoked")
+    return claims
+
+
+def is_session_revoked(claims: dict) -> bool:
+    # The session or, for renewed sessions, the session they were renewed from (sid). Sessions
+    # issued before jti was added cannot be revoked individually.
+    jti, sid = claims.get("jti"), claims.get("sid")
+    return bool(jti and revocation_list.is_revoked(jti)) or bool(sid and revocation_list.is_revoked(sid))
+
+
+def logout(session_token: Optional[str]) -> str:
+    # Revokes the session, and the sessions it was renewed from, until it would have expired;
+    # returns the user's email. Raises UnrevocableSessionError for sessions issued before jti was added.
+    claims = authenticate_session(session_token, service._get_session_key_ring())
+    if not claims.get("jti"):
+        raise UnrevocableSessionError(claims["email"], claims["exp"])
+    revocation_list.revoke(claims["jti"], claims["email"], claims["exp"])
+    if claims.get("sid"):
+        # Earlier sessions of the family expire before this one
+        revocation_list.revoke(claims["sid"], claims["email"], claims["exp"])
+    logger.info("Session revoked for %s", claims["email"])
+    return claims["email"]
+
+
+revocation_list = RevocationList()
+os.register_at_fork(after_in_child=revocation_list.reset_after_fork)
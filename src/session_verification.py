@@ -0,0 +1,104 @@
+# Session verification for downstream services: /api/v1/session/verify and verify_session().
+#
+# The session JWT's signature and expiry are checked locally with the signing key its kid names,
+# from the key ring in the secrets cache, never against the jwt column in DynamoDB. Verified claims are kept in an LRU
+# keyed by the SHA-256 of the token until the token expires, so a session that is checked on
+# every request costs one hash and a dict lookup after the first time. The revocation check
+# (src/session_revocation.py) is in memory and runs on every call, cached or not.
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from prometheus_client import REGISTRY, Counter
+
+from src import service, session_revocation
+from src.constants import SESSION_VERIFY_CACHE_SIZE
+from src.local_utils import InvalidSessionError, verify_session_token
+
+session_verifications = Counter(
+    "session_verifications_total", "Session verifications by result (cached, verified, invalid)", ["result"], registry=REGISTRY
+)
+_CACHED = session_verifications.labels(result="cached")
+_VERIFIED = session_verifications.labels(result="verified")
+_INVALID = session_verifications.labels(result="invalid")
+
+
+def token_digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode("utf-8")).digest()
+
+
+class VerifiedSessionCache:
+    # LRU of token digest -> (exp, claims) for tokens verified with one key ring; a new ring empties it
+    def __init__(self, max_entries: int = SESSION_VERIFY_CACHE_SIZE, clock=time.time):
+        self.max_entries = max_entries
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[bytes, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._key: Any = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, digest: bytes, key: Any) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if key != self._key:
+                return None
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            if entry[0] <= self._clock():
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+            return entry[1]
+
+    def put(self, digest: bytes, key: Any, claims: Dict[str, Any]) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            if key != self._key:
+                self._entries.clear()
+                self._key = key
+            self._entries[digest] = (float(claims["exp"]), claims)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def reset_after_fork(self) -> None:
+        self._lock = threading.Lock()
+
+
+def verify_session(session_token: Optional[str], signing_key: Any = None) -> Dict[str, Any]:
+    # The session's claims; raises InvalidSessionError when it is missing, forged, expired or revoked
+    if not session_token:
+        _INVALID.inc()
+        raise InvalidSessionError("Session token is required")
+    key = signing_key or service._get_session_key_ring()
+    digest = token_digest(session_token)
+    claims = verified_sessions.get(digest, key)
+    if claims is None:
+        try:
+            claims = verify_session_token(session_token, key)
+        except InvalidSessionError:
+            _INVALID.inc()
+            raise
+        verified_sessions.put(digest, key, claims)
+        _VERIFIED.inc()
+    else:
+        _CACHED.inc()
+    if session_revocation.is_session_revoked(claims):
+        _INVALID.inc()
+        raise InvalidSessionError("Session was revoked")
+    # Callers get their own copy, the cached claims are shared
+    return dict(claims)
+
+
+verified_sessions = VerifiedSessionCache()
+os.register_at_fork(after_in_child=verified_sessions.reset_after_fork)
@@ -0,0 +1,197 @@
+# Write-behind queue for session writes (session_start_time and jwt).
+#
+# The session cookie is valid as soon as the JWT is signed, so with SESSION_WRITE_BEHIND
+# the write is queued and the response goes out without waiting for DynamoDB. A background
+# thread flushes the queue in batches; a newer session for a queued user replaces the older
+# one. When the queue is full the caller writes synchronously. Failed writes are retried with
+# backoff, unless a newer session for the user is queued, and each one dropped after the last
+# attempt is logged. The queue is drained at exit.
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+
+from src.constants import (
+    SESSION_WRITE_QUEUE_SIZE,
+    SESSION_WRITE_BATCH_SIZE,
+    SESSION_WRITE_FLUSH_INTERVAL_SECONDS,
+    SESSION_WRITE_DRAIN_TIMEOUT_SECONDS,
+    SESSION_WRITE_MAX_ATTEMPTS,
+    SESSION_WRITE_RETRY_BACKOFF_SECONDS,
+    SIGNIN_STAGE_BUCKETS,
+)
+from src.user_store import UserStore, get_user_store
+
+logger = logging.getLogger(__name__)
+
+session_write_queue_depth = Gauge(
+    "session_write_queue_depth", "Session writes waiting to be flushed", registry=REGISTRY
+)
+session_write_flush_duration = Histogram(
+    "session_write_flush_duration_seconds",
+    "Duration of one write-behind batch flush",
+    buckets=SIGNIN_STAGE_BUCKETS,
+    registry=REGISTRY,
+)
+session_writes = Counter(
+    "session_writes_total",
+    "Write-behind session writes by result (queued, coalesced, rejected, written, retried, failed)",
+    ["result"],
+    registry=REGISTRY,
+)
+SESSION_WRITE_METRICS = (session_write_queue_depth, session_write_flush_duration, session_writes)
+
+
+class SessionWriteQueue:
+    def __init__(
+        self,
+        store_factory: Callable[[], UserStore] = get_user_store,
+        max_size: int = SESSION_WRITE_QUEUE_SIZE,
+        batch_size: int = SESSION_WRITE_BATCH_SIZE,
+        flush_interval: float = SESSION_WRITE_FLUSH_INTERVAL_SECONDS,
+        max_attempts: int = SESSION_WRITE_MAX_ATTEMPTS,
+        retry_backoff: float = SESSION_WRITE_RETRY_BACKOFF_SECONDS,
+    ):
+        self._store_factory = store_factory
+        self._max_size = max_size
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._max_attempts = max(1, max_attempts)
+        self._retry_backoff = retry_backoff
+        self._condition = threading.Condition()
+        self._pending: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+        self._closed = False
+        self._flushing = False
+        self._flush_waiters = 0
+        self._thread: Optional[threading.Thread] = None
+        self._thread_pid: Optional[int] = None
+
+    def submit(self, email: str, session_start_time: str, jwt: str) -> bool:
+        # False means the caller has to write the session itself
+        with self._condition:
+            if self._closed:
+                return False
+            if email in self._pending:
+                session_writes.labels(result="coalesced").inc()
+            elif len(self._pending) >= self._max_size:
+                session_writes.labels(result="rejected").inc()
+                return False
+            self._pending[email] = (session_start_time, jwt)
+            session_writes.labels(result="queued").inc()
+            session_write_queue_depth.set(len(self._pending))
+            self._ensure_worker()
+            if len(self._pending) >= self._batch_size:
+                self._condition.notify()
+        return True
+
+    def depth(self) -> int:
+        with self._condition:
+            return len(self._pending)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        # Blocks until everything queued so far has been written; True if it was
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            self._flush_waiters += 1
+            self._condition.notify_all()
+            try:
+                while self._pending or self._flushing:
+                    if self._thread is None or not self._thread.is_alive():
+                        break
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+            finally:
+                self._flush_waiters -= 1
+        self._drain()
+        return True
+
+    def close(self, timeout: float = SESSION_WRITE_DRAIN_TIMEOUT_SECONDS) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            thread = self._thread if self._thread_pid == os.getpid() else None
+        if thread is not None:
+            thread.join(timeout)
+            if thread.is_alive():
+                logger.error("Session write-behind did not drain within %ss, %s writes left", timeout, self.depth())
+                return
+        self._drain()
+
+    def _ensure_worker(self) -> None:
+        # Started on first use and again after a fork, since threads do not survive fork
+        if self._thread is None or self._thread_pid != os.getpid() or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="session-write-behind", daemon=True)
+            self._thread_pid = os.getpid()
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._closed and not self._flush_waiters and len(self._pending) < self._batch_size:
+                    # Give a burst of sign-ins a moment to fill the batch
+                    self._condition.wait(self._flush_interval)
+                if not self._pending and self._closed:
+                    return
+                batch = self._take_batch()
+                self._flushing = True
+            try:
+                self._write(batch)
+            finally:
+                with self._condition:
+                    self._flushing = False
+                    self._condition.notify_all()
+
+    def _drain(self) -> None:
+        while True:
+            with self._condition:
+                batch = self._take_batch()
+            if not batch:
+                return
+            self._write(batch)
+
+    def _take_batch(self) -> List[Tuple[str, str, str]]:
+        batch = []
+        while self._pending and len(batch) < self._batch_size:
+            email, (session_start_time, jwt) = self._pending.popitem(last=False)
+            batch.append((email, session_start_time, jwt))
+        session_write_queue_depth.set(len(self._pending))
+        return batch
+
+    def _write(self, batch: List[Tuple[str, str, str]]) -> None:
+        start = time.perf_counter()
+        sessions = batch
+        for attempt in range(1, self._max_attempts + 1):
+            try:
+                failed = set(self._store_factory().update_sessions(sessions))
+            except Exception as e:
+                logger.error("Session write-behind flush failed: %s", e)
+                failed = {email for email, _, _ in sessions}
+            session_writes.labels(result="written").inc(len(sessions) - len(failed))
+            if not failed or attempt == self._max_attempts:
+                break
+            time.sleep(self._retry_backoff * 2 ** (attempt - 1))
+            with self._condition:
+                # A newer session queued in the meantime replaces the one that failed
+                sessions = [session for session in sessions if session[0] in failed and session[0] not in self._pending]
+            failed = set()
+            if not sessions:
+                break
+            session_writes.labels(result="retried").inc(len(sessions))
+        session_write_flush_duration.observe(time.perf_counter() - start)
+        if failed:
+            session_writes.labels(result="failed").inc(len(failed))
+            for email in sorted(failed):
+                logger.error("Session write for %s dropped after %s attempts", email, self._max_attempts)
+
+
+session_write_queue = SessionWriteQueue()
+atexit.register(session_write_queue.close)
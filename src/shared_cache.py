@@ -0,0 +1,250 @@
+# Cache shared by the gunicorn workers of one host, in a memory-mapped file.
+#
+# The file is a fixed-size hash table of SHARED_CACHE_SLOTS slots of SHARED_CACHE_SLOT_BYTES,
+# grouped into buckets of WAYS slots. A key hashes to one bucket and is stored in one of its slots;
+# the bucket starts with the key hashes of its slots, so a lookup reads one array before any slot.
+# When the bucket is full, an expired entry or else the least recently used one is replaced, so
+# eviction is LRU per bucket rather than over the whole table. Expired entries are dropped when
+# read. Each operation touches one bucket under that bucket's lock: an fcntl byte-range lock on the
+# file between processes, plus a striped thread lock, because fcntl locks do not separate the
+# threads of one process. Keys are strings, values anything JSON can encode.
+#
+# The file name carries the table geometry, so a deploy with other sizes gets a new file instead of
+# reading the old layout while old workers may still use it. Files in /dev/shm outlive worker and
+# master restarts (not reboots), so restarted workers start warm.
+import fcntl
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from typing import Any, Callable, Optional, Tuple
+
+from src.constants import SHARED_CACHE_DIR, SHARED_CACHE_SLOT_BYTES, SHARED_CACHE_SLOTS
+
+MAGIC = b"SHMCACHE"
+WAYS = 8
+# magic, buckets, ways, slot size; the rest of the first 64 bytes is unused
+_FILE_HEADER = struct.Struct("<8sIII")
+_HEADER_BYTES = 64
+# Per bucket: the key hash of each slot (0 = empty), then the slots
+_TAGS = struct.Struct(f"<{WAYS}Q")
+_TAG = struct.Struct("<Q")
+# Per slot: expires_at, last_used, key length, value length, then key and value bytes
+_SLOT = struct.Struct("<ddHH4x")
+_LAST_USED = struct.Struct("<d")
+_EMPTY_TAGS = bytes(_TAGS.size)
+_THREAD_LOCK_STRIPES = 64
+_MISSING = object()
+
+
+class SharedCache:
+    def __init__(
+        self,
+        path: str,
+        slots: int = SHARED_CACHE_SLOTS,
+        slot_bytes: int = SHARED_CACHE_SLOT_BYTES,
+        default_ttl: float = 3600.0,
+        clock: Callable[[], float] = time.time,
+    ):
+        if not _SLOT.size < slot_bytes <= 0xFFFF:
+            raise ValueError(f"Shared cache slots must be {_SLOT.size + 1} to 65535 bytes")
+        self.path = path
+        self.buckets = max(1, slots // WAYS)
+        self.slot_bytes = slot_bytes
+        self.bucket_bytes = _TAGS.size + WAYS * slot_bytes
+        self.default_ttl = default_ttl
+        self.size = _HEADER_BYTES + self.buckets * self.bucket_bytes
+        self._clock = clock
+        self._thread_locks = [threading.Lock() for _ in range(_THREAD_LOCK_STRIPES)]
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            self._map = self._open()
+        except Exception:
+            os.close(self._fd)
+            raise
+
+    def _open(self) -> mmap.mmap:
+        # Byte 0 of the file is the initialisation lock, byte 1 + n the lock of bucket n
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, 0)
+        try:
+            if os.fstat(self._fd).st_size < self.size:
+                # A new file reads as zeros: every slot empty
+                os.ftruncate(self._fd, self.size)
+            mapping = mmap.mmap(self._fd, self.size)
+            magic, buckets, ways, slot_bytes = _FILE_HEADER.unpack_from(mapping, 0)
+            if magic != MAGIC:
+                _FILE_HEADER.pack_into(mapping, 0, MAGIC, self.buckets, WAYS, self.slot_bytes)
+            elif (buckets, ways, slot_bytes) != (self.buckets, WAYS, self.slot_bytes):
+                mapping.close()
+                raise ValueError(f"{self.path} holds a shared cache of another size")
+            return mapping
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, 0)
+
+    def _locate(self, key: str) -> Tuple[bytes, int, int]:
+        # crc32 is plenty to pick a bucket and skip slots, keys are compared in full
+        encoded = key.encode("utf-8")
+        checksum = zlib.crc32(encoded)
+        return encoded, checksum + 1, checksum % self.buckets
+
+    def _acquire(self, bucket: int) -> None:
+        self._thread_locks[bucket % _THREAD_LOCK_STRIPES].acquire()
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, bucket + 1)
+        except BaseException:
+            self._thread_locks[bucket % _THREAD_LOCK_STRIPES].release()
+            raise
+
+    def _release(self, bucket: int) -> None:
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, bucket + 1)
+        finally:
+            self._thread_locks[bucket % _THREAD_LOCK_STRIPES].release()
+
+    def _find(self, encoded: bytes, key_hash: int, base: int) -> int:
+        # The key's way in the bucket at base, -1 when it is not there; caller holds the lock
+        tags = _TAGS.unpack_from(self._map, base)
+        way = -1
+        while True:
+            try:
+                way = tags.index(key_hash, way + 1)
+            except ValueError:
+                return -1
+            offset = base + _TAGS.size + way * self.slot_bytes
+            key_length = _SLOT.unpack_from(self._map, offset)[2]
+            start = offset + _SLOT.size
+            if self._map[start:start + key_length] == encoded:
+                return way
+
+    def _victim(self, base: int, now: float) -> int:
+        # An empty or expired way, else the least recently used one
+        tags = _TAGS.unpack_from(self._map, base)
+        if 0 in tags:
+            return tags.index(0)
+        victim, oldest = 0, float("inf")
+        for way in range(WAYS):
+            expires_at, last_used, _, _ = _SLOT.unpack_from(self._map, base + _TAGS.size + way * self.slot_bytes)
+            if expires_at <= now:
+                return way
+            if last_used < oldest:
+                victim, oldest = way, last_used
+        return victim
+
+    def _read(self, key: str, default: Any, remove: bool) -> Any:
+        encoded, key_hash, bucket = self._locate(key)
+        base = _HEADER_BYTES + bucket * self.bucket_bytes
+        now = self._clock()
+        self._acquire(bucket)
+        try:
+            way = self._find(encoded, key_hash, base)
+            if way < 0:
+                return default
+            offset = base + _TAGS.size + way * self.slot_bytes
+            expires_at, _, key_length, value_length = _SLOT.unpack_from(self._map, offset)
+            if remove or expires_at <= now:
+                _TAG.pack_into(self._map, base + way * _TAG.size, 0)
+                if expires_at <= now:
+                    return default
+            else:
+                _LAST_USED.pack_into(self._map, offset + 8, now)
+            start = offset + _SLOT.size + key_length
+            raw = self._map[start:start + value_length]
+        finally:
+            self._release(bucket)
+        return json.loads(raw.decode("utf-8"))
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self._read(key, default, remove=False)
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        return self._read(key, default, remove=True)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        # False when the entry does not fit in a slot (it is then not cached)
+        encoded, key_hash, bucket = self._locate(key)
+        raw = json.dumps(value, separators=(",", ":")).encode("utf-8")
+        if _SLOT.size + len(encoded) + len(raw) > self.slot_bytes:
+            return False
+        base = _HEADER_BYTES + bucket * self.bucket_bytes
+        now = self._clock()
+        expires_at = now + (self.default_ttl if ttl is None else ttl)
+        self._acquire(bucket)
+        try:
+            way = self._find(encoded, key_hash, base)
+            if way < 0:
+                way = self._victim(base, now)
+            tag = base + way * _TAG.size
+            offset = base + _TAGS.size + way * self.slot_bytes
+            # Emptied first and tagged last, so a worker killed mid-write leaves an empty slot
+            _TAG.pack_into(self._map, tag, 0)
+            _SLOT.pack_into(self._map, offset, expires_at, now, len(encoded), len(raw))
+            start = offset + _SLOT.size
+            self._map[start:start + len(encoded) + len(raw)] = encoded + raw
+            _TAG.pack_into(self._map, tag, key_hash)
+        finally:
+            self._release(bucket)
+        return True
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.set(key, value)
+
+    def __delitem__(self, key: str) -> None:
+        if self.pop(key, _MISSING) is _MISSING:
+            raise KeyError(key)
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        # Live entries, counted without locks: a snapshot for metrics and tests, O(slots)
+        now = self._clock()
+        count = 0
+        for base in range(_HEADER_BYTES, self.size, self.bucket_bytes):
+            for way, tag in enumerate(_TAGS.unpack_from(self._map, base)):
+                if tag and _SLOT.unpack_from(self._map, base + _TAGS.size + way * self.slot_bytes)[0] > now:
+                    count += 1
+        return count
+
+    def clear(self) -> None:
+        for bucket in range(self.buckets):
+            base = _HEADER_BYTES + bucket * self.bucket_bytes
+            self._acquire(bucket)
+            try:
+                self._map[base:base + _TAGS.size] = _EMPTY_TAGS
+            finally:
+                self._release(bucket)
+
+    def close(self) -> None:
+        if not self._map.closed:
+            self._map.close()
+            os.close(self._fd)
+
+    def reset_after_fork(self) -> None:
+        # The mapping is shared with the parent as intended; only the thread locks are replaced
+        self._thread_locks = [threading.Lock() for _ in range(_THREAD_LOCK_STRIPES)]
+
+
+def shared_cache_path(
+    name: str,
+    slots: int = SHARED_CACHE_SLOTS,
+    slot_bytes: int = SHARED_CACHE_SLOT_BYTES,
+    directory: str = SHARED_CACHE_DIR,
+) -> str:
+    if not directory:
+        directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, f"authorization-service-{name}-{slots}x{slot_bytes}.cache")
+
+
+def open_shared_cache(name: str, default_ttl: float = 3600.0) -> SharedCache:
+    # The owner calls reset_after_fork() in forked children along with its own state
+    return SharedCache(shared_cache_path(name), default_ttl=default_ttl)
@@ -0,0 +1,312 @@
+# Single-flight de-duplication of sign-ins by authorization code.
+#
+# Google authorization codes are single-use, so a second POST of the same code (double click,
+# client retry, redirect firing twice) can only fail at the token exchange. Requests with a code
+# that is already being exchanged wait for that sign-in and get its response; a successful
+# response is kept for SIGNIN_DEDUP_TTL_SECONDS for late duplicates. With
+# SIGNIN_DEDUP_SQLITE_PATH the in-flight claim and the result are also shared between the
+# workers of one host. Codes are only ever stored as SHA-256 digests.
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from prometheus_client import REGISTRY, Counter
+
+from src.constants import (
+    SIGNIN_DEDUP,
+    SIGNIN_DEDUP_TTL_SECONDS,
+    SIGNIN_DEDUP_LEASE_SECONDS,
+    SIGNIN_DEDUP_MAX_ENTRIES,
+    SIGNIN_DEDUP_SQLITE_PATH,
+)
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL_SECONDS = 0.02
+
+signin_dedup_requests = Counter(
+    "signin_dedup_requests_total",
+    "Sign-in requests by de-duplication result (leader, joined, cached, shared)",
+    ["result"],
+    registry=REGISTRY,
+)
+
+
+class SigninResponse(NamedTuple):
+    status: int
+    headers: List[Tuple[str, str]]
+    body: bytes
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 300
+
+
+def code_digest(authorization_code: str) -> str:
+    return hashlib.sha256(str(authorization_code).encode("utf-8")).hexdigest()
+
+
+class SqliteSigninStore:
+    # Claims and results shared by the workers of one host. Rows with a NULL status are
+    # in-flight claims that expire after the lease; the others are results that expire after the TTL.
+    def __init__(self, path: str):
+        self.path = path
+        if path != ":memory:":
+            # The stored responses carry session cookies
+            os.close(os.open(path, os.O_CREAT | os.O_RDWR, 0o600))
+        self._lock = threading.Lock()
+        self._connect()
+
+    def _connect(self) -> None:
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=5)
+        if self.path != ":memory:":
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS signin_dedup "
+            "(key TEXT PRIMARY KEY, expires_at REAL NOT NULL, status INTEGER, headers TEXT, body BLOB)"
+        )
+
+    def claim(self, key: str, lease: float) -> bool:
+        now = time.time()
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.execute("DELETE FROM signin_dedup WHERE expires_at <= ?", (now,))
+                cursor = self._connection.execute(
+                    "INSERT OR IGNORE INTO signin_dedup (key, expires_at) VALUES (?, ?)", (key, now + lease)
+                )
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+        return cursor.rowcount == 1
+
+    def get(self, key: str) -> Tuple[bool, Optional[SigninResponse]]:
+        # (pending, response): (True, None) while another worker holds the claim,
+        # (False, None) when there is neither a live claim nor a result
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT status, headers, body FROM signin_dedup WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        if row is None:
+            return False, None
+        status, headers, body = row
+        if status is None:
+            return True, None
+        return False, SigninResponse(status, [tuple(header) for header in json.loads(headers)], body)
+
+    def complete(self, key: str, response: SigninResponse, ttl: float) -> None:
+        with self._lock:
+            self._connection.execute(
+                "UPDATE signin_dedup SET expires_at = ?, status = ?, headers = ?, body = ? WHERE key = ?",
+                (time.time() + ttl, response.status, json.dumps(response.headers), response.body, key),
+            )
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM signin_dedup WHERE key = ? AND status IS NULL", (key,))
+
+    def reset_after_fork(self) -> None:
+        # sqlite3 connections must not be used across fork
+        self._lock = threading.Lock()
+        self._connect()
+
+
+class SigninDeduplicator:
+    def __init__(
+        self,
+        ttl: float = SIGNIN_DEDUP_TTL_SECONDS,
+        lease: float = SIGNIN_DEDUP_LEASE_SECONDS,
+        max_entries: int = SIGNIN_DEDUP_MAX_ENTRIES,
+        shared: Optional[SqliteSigninStore] = None,
+        enabled: bool = SIGNIN_DEDUP,
+    ):
+        self.ttl = ttl
+        self.lease = lease
+        self.max_entries = max_entries
+        self.shared = shared
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._flights: Dict[str, Future] = {}
+        self._results: "OrderedDict[str, Tuple[float, SigninResponse]]" = OrderedDict()
+
+    def run(self, authorization_code: str, signin: Callable[[], SigninResponse]) -> SigninResponse:
+        if not self.enabled:
+            return signin()
+        key = code_digest(authorization_code)
+        flight, leader, response = self._join(key)
+        if response is not None:
+            return response
+        if not leader:
+            try:
+                return flight.result(self.lease)
+            except FutureTimeoutError:
+                return signin()
+        try:
+            response = self._lead_sync(key, signin)
+        except BaseException as e:
+            self._settle(key, flight, error=e)
+            raise
+        self._settle(key, flight, response=response)
+        return response
+
+    async def run_async(
+        self,
+        authorization_code: str,
+        signin: Callable[[], Awaitable[SigninResponse]],
+        run_blocking: Callable[..., Awaitable],
+    ) -> SigninResponse:
+        # run_blocking moves the SQLite calls off the event loop
+        if not self.enabled:
+            return await signin()
+        key = code_digest(authorization_code)
+        flight, leader, response = self._join(key)
+        if response is not None:
+            return response
+        if not leader:
+            try:
+                # shield: a timed-out waiter must not cancel the flight the others share
+                return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(flight)), self.lease)
+            except asyncio.TimeoutError:
+                return await signin()
+        try:
+            response = await self._lead_async(key, signin, run_blocking)
+        except BaseException as e:
+            self._settle(key, flight, error=e)
+            raise
+        self._settle(key, flight, response=response)
+        return response
+
+    def clear(self) -> None:
+        with self._lock:
+            self._results.clear()
+
+    def _join(self, key: str) -> Tuple[Optional[Future], bool, Optional[SigninResponse]]:
+        # A cached response, another request's flight to wait on, or a new flight this caller leads
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    signin_dedup_requests.labels(result="cached").inc()
+                    return None, False, entry[1]
+                del self._results[key]
+            flight = self._flights.get(key)
+            if flight is not None:
+                signin_dedup_requests.labels(result="joined").inc()
+                return flight, False, None
+            flight = self._flights[key] = Future()
+        return flight, True, None
+
+    def _settle(self, key: str, flight: Future, response: Optional[SigninResponse] = None, error=None) -> None:
+        with self._lock:
+            self._flights.pop(key, None)
+            if response is not None and response.ok:
+                self._results[key] = (time.monotonic() + self.ttl, response)
+                self._results.move_to_end(key)
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+        if error is not None:
+            flight.set_exception(error if isinstance(error, Exception) else RuntimeError("Sign-in was cancelled"))
+        else:
+            flight.set_result(response)
+
+    def _lead_sync(self, key: str, signin: Callable[[], SigninResponse]) -> SigninResponse:
+        if self.shared is None:
+            signin_dedup_requests.labels(result="leader").inc()
+            return signin()
+        deadline = time.monotonic() + self.lease
+        while True:
+            claimed, response = self._shared_step(key, deadline)
+            if response is not None:
+                return response
+            if claimed is not None:
+                break
+            time.sleep(POLL_INTERVAL_SECONDS)
+        signin_dedup_requests.labels(result="leader").inc()
+        try:
+            response = signin()
+        except BaseException:
+            if claimed:
+                self._shared_release(key)
+            raise
+        if claimed:
+            self._shared_publish(key, response)
+        return response
+
+    async def _lead_async(self, key, signin, run_blocking) -> SigninResponse:
+        if self.shared is None:
+            signin_dedup_requests.labels(result="leader").inc()
+            return await signin()
+        deadline = time.monotonic() + self.lease
+        while True:
+            claimed, response = await run_blocking(self._shared_step, key, deadline)
+            if response is not None:
+                return response
+            if claimed is not None:
+                break
+            await asyncio.sleep(POLL_INTERVAL_SECONDS)
+        signin_dedup_requests.labels(result="leader").inc()
+        try:
+            response = await signin()
+        except BaseException:
+            if claimed:
+                await run_blocking(self._shared_release, key)
+            raise
+        if claimed:
+            await run_blocking(self._shared_publish, key, response)
+        return response
+
+    def _shared_step(self, key: str, deadline: float) -> Tuple[Optional[bool], Optional[SigninResponse]]:
+        # (None, response) when another worker's result is available, (True, None) when this
+        # worker now holds the claim, (False, None) to sign in unclaimed (store error or the
+        # wait ran out) and (None, None) to poll again
+        try:
+            if self.shared.claim(key, self.lease):
+                return True, None
+            pending, response = self.shared.get(key)
+        except sqlite3.Error as e:
+            logger.error("Sign-in de-duplication store unavailable: %s", e)
+            return False, None
+        if response is not None:
+            signin_dedup_requests.labels(result="shared").inc()
+            return None, response
+        if pending and time.monotonic() >= deadline:
+            return False, None
+        return None, None
+
+    def _shared_publish(self, key: str, response: SigninResponse) -> None:
+        try:
+            if response.ok:
+                self.shared.complete(key, response, self.ttl)
+            else:
+                self.shared.release(key)
+        except sqlite3.Error as e:
+            logger.error("Could not share sign-in result: %s", e)
+
+    def _shared_release(self, key: str) -> None:
+        try:
+            self.shared.release(key)
+        except sqlite3.Error as e:
+            logger.error("Could not release sign-in claim: %s", e)
+
+    def reset_after_fork(self) -> None:
+        # Flights belong to the parent's request threads; cached results stay valid
+        self._lock = threading.Lock()
+        self._flights = {}
+        if self.shared is not None:
+            self.shared.reset_after_fork()
+
+
+signin_deduplicator = SigninDeduplicator(
+    shared=SqliteSigninStore(SIGNIN_DEDUP_SQLITE_PATH) if SIGNIN_DEDUP_SQLITE_PATH else None
+)
+os.register_at_fork(after_in_child=signin_deduplicator.reset_after_fork)
@@ -0,0 +1,185 @@
+# Key ring for session JWTs, separate from the key that encrypts the stored OAuth tokens.
+#
+# Keys come from "session_signing_keys" in the authentication secret, a list (or a JSON string
+# of one) like
+#   [{"kid": "2024-06", "secret": "...", "primary": true},
+#    {"kid": "2024-01", "secret": "...", "retired_at": 1717200000}]
+# Every key in the ring verifies; the primary one (else the first active one) signs, and its kid
+# goes into the JWT header so verification looks the key up directly. A retired key keeps
+# verifying for COOKIE_DAYS_TO_EXPIRE after retired_at, until the last token it signed has
+# expired, and is dropped after that. Keys may also be asymmetric ("algorithm": "ES256" with a
+# PEM "private_key"). Each key's signing and verifying objects are prepared once per ring.
+#
+# Rotation without a sign-in storm: add the new key, make it primary, and set retired_at on the
+# old one. Sessions signed with the old key stay valid until they expire.
+#
+# Without "session_signing_keys" a signing key is derived from encryption_secret_key with HKDF,
+# so the two are never the same key. Sessions issued before kid headers existed were signed with
+# encryption_secret_key itself; they verify against it while SESSION_VERIFY_UNKEYED_TOKENS is true.
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from src.constants import COOKIE_DAYS_TO_EXPIRE, SESSION_JWT_ALGORITHM, SESSION_VERIFY_UNKEYED_TOKENS
+
+logger = logging.getLogger(__name__)
+
+SESSION_LIFETIME_SECONDS = timedelta(days=COOKIE_DAYS_TO_EXPIRE).total_seconds()
+UNKEYED_KID = ""
+
+
+class SigningKeyError(Exception):
+    pass
+
+
+class SigningKey:
+    def __init__(
+        self,
+        kid: str,
+        material: str,
+        algorithm: str = SESSION_JWT_ALGORITHM,
+        retired_at: Optional[float] = None,
+    ):
+        from jwt.algorithms import get_default_algorithms
+
+        implementation = get_default_algorithms().get(algorithm)
+        if implementation is None:
+            raise SigningKeyError(f"Unsupported session signing algorithm: {algorithm}")
+        self.kid = kid
+        self.algorithm = algorithm
+        self.retired_at = retired_at
+        self.signer = implementation.prepare_key(material)
+        # Asymmetric keys verify with the public half, HMAC keys with the same secret
+        self.verifier = self.signer.public_key() if hasattr(self.signer, "public_key") else self.signer
+
+    def verifies_until(self) -> float:
+        return float("inf") if self.retired_at is None else self.retired_at + SESSION_LIFETIME_SECONDS
+
+    def sign(self, payload: Dict[str, Any]) -> str:
+        import jwt
+
+        headers = {"kid": self.kid} if self.kid != UNKEYED_KID else None
+        return jwt.encode(payload, self.signer, algorithm=self.algorithm, headers=headers)
+
+    def verify(self, token: str) -> Dict[str, Any]:
+        import jwt
+
+        return jwt.decode(token, self.verifier, algorithms=[self.algorithm], options={"require": ["exp"]})
+
+
+class SigningKeyRing:
+    def __init__(self, keys: Iterable[SigningKey], primary_kid: Optional[str] = None):
+        self.keys: Dict[str, SigningKey] = {key.kid: key for key in keys}
+        signers = [key for key in self.keys.values() if key.retired_at is None and key.kid != UNKEYED_KID]
+        if primary_kid is None and signers:
+            primary_kid = signers[0].kid
+        if primary_kid not in self.keys:
+            raise SigningKeyError("No active session signing key")
+        self.primary = self.keys[primary_kid]
+
+    def sign(self, payload: Dict[str, Any]) -> str:
+        return self.primary.sign(payload)
+
+    def key_for(self, token: str) -> SigningKey:
+        # Straight to the key named by the header; tokens without a kid predate the ring
+        import jwt
+
+        try:
+            kid = jwt.get_unverified_header(token).get("kid", UNKEYED_KID)
+        except jwt.PyJWTError as e:
+            raise SigningKeyError(f"Malformed session token: {e}")
+        key = self.keys.get(kid)
+        if key is None:
+            raise SigningKeyError(f"Unknown session signing key: {kid or '(none)'}")
+        if time.time() >= key.verifies_until():
+            raise SigningKeyError(f"Session signing key {kid} was retired")
+        return key
+
+
+def _derived_secret(encryption_secret_key: str) -> Tuple[str, str]:
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+    key = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"session-jwt-signing-v1").derive(
+        encryption_secret_key.encode("utf-8")
+    )
+    return "d" + hashlib.sha256(key).hexdigest()[:11], base64.urlsafe_b64encode(key).decode("ascii")
+
+
+def _configured_keys(value: Any) -> List[Dict[str, Any]]:
+    entries = json.loads(value) if isinstance(value, str) else value
+    if not isinstance(entries, list) or not entries:
+        raise SigningKeyError("session_signing_keys must be a non-empty list")
+    return entries
+
+
+def build_key_ring(secrets: Dict[str, Any], verify_unkeyed: bool = SESSION_VERIFY_UNKEYED_TOKENS) -> SigningKeyRing:
+    now = time.time()
+    keys: List[SigningKey] = []
+    primary_kid = None
+    configured = secrets.get("session_signing_keys")
+    if configured:
+        for entry in _configured_keys(configured):
+            retired_at = entry.get("retired_at")
+            key = SigningKey(
+                str(entry["kid"]),
+                entry.get("private_key") or entry["secret"],
+                entry.get("algorithm", SESSION_JWT_ALGORITHM),
+                float(retired_at) if retired_at is not None else None,
+            )
+            if now >= key.verifies_until():
+                logger.info("Dropping expired session signing key %s", key.kid)
+                continue
+            if entry.get("primary"):
+                primary_kid = key.kid
+            keys.append(key)
+    else:
+        kid, secret = _derived_secret(secrets["encryption_secret_key"])
+        keys.append(SigningKey(kid, secret, "HS256"))
+    if verify_unkeyed and secrets.get("encryption_secret_key"):
+        keys.append(SigningKey(UNKEYED_KID, secrets["encryption_secret_key"], SESSION_JWT_ALGORITHM))
+    return SigningKeyRing(keys, primary_kid)
+
+
+class KeyRingCache:
+    # Rebuilt only when the secrets it was built from change, so a secrets refresh that returns
+    # the same keys keeps the same ring (and the verified-session cache keyed on it)
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._current: Optional[Tuple[Tuple[Any, Any], SigningKeyRing]] = None
+
+    def get(self, secrets: Dict[str, Any]) -> SigningKeyRing:
+        source = (secrets.get("session_signing_keys"), secrets.get("encryption_secret_key"))
+        current = self._current
+        if current is not None and current[0] == source:
+            return current[1]
+        with self._lock:
+            if self._current is None or self._current[0] != source:
+                ring = build_key_ring(secrets)
+                self._current = (source, ring)
+                logger.info("Session signing keys loaded: %s, signing with %s", sorted(ring.keys), ring.primary.kid)
+            return self._current[1]
+
+    def reset_after_fork(self) -> None:
+        self._lock = threading.Lock()
+
+
+@lru_cache(maxsize=16)
+def _single_key_ring(secret: str) -> SigningKeyRing:
+    return SigningKeyRing([SigningKey(UNKEYED_KID, secret)], UNKEYED_KID)
+
+
+def as_key_ring(key: Any) -> SigningKeyRing:
+    # A plain secret stands for the one unkeyed key sessions were signed with before key rings
+    return key if isinstance(key, SigningKeyRing) else _single_key_ring(key)
+
+
+session_key_rings = KeyRingCache()
+os.register_at_fork(after_in_child=session_key_rings.reset_after_fork)
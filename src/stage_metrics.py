@@ -0,0 +1,75 @@
+# Latency of each sign-in stage, shared by the Flask and ASGI apps.
+# Flask exports it through the default registry; the ASGI app registers it in its own.
+import contextlib
+import contextvars
+import re
+import time
+from typing import Dict, Iterator, Mapping, Optional
+
+from prometheus_client import REGISTRY, Histogram
+
+from src.constants import SIGNIN_STAGE_BUCKETS, SIGNIN_STAGE_EXEMPLARS
+
+SECRETS_FETCH = "secrets_fetch"
+GOOGLE_TOKEN_EXCHANGE = "google_token_exchange"
+ID_TOKEN_VERIFICATION = "id_token_verification"
+APPLE_TOKEN_EXCHANGE = "apple_token_exchange"
+APPLE_ID_TOKEN_VERIFICATION = "apple_id_token_verification"
+USER_LOOKUP = "user_lookup"
+USER_CREATE = "user_create"
+TOKEN_ENCRYPTION = "token_encryption"
+SESSION_TOKEN = "session_token"
+SESSION_WRITE = "session_write"
+SIGNIN_WRITE = "signin_write"
+
+signin_stage_duration = Histogram(
+    "signin_stage_duration_seconds",
+    "Duration of each sign-in pipeline stage",
+    ["stage", "outcome"],
+    buckets=SIGNIN_STAGE_BUCKETS,
+    registry=REGISTRY,
+)
+
+trace_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("trace_id", default=None)
+# Stage totals of the current request while src/profiling.py samples it
+profiled_stages: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "profiled_stages", default=None
+)
+
+_TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-[0-9a-f]{16}-[0-9a-f]{2}$")
+_AMZN_TRACE_ROOT = re.compile(r"Root=([0-9A-Za-z-]+)")
+
+
+def trace_id_from_headers(headers: Mapping[str, str]) -> Optional[str]:
+    # W3C traceparent first, then the ALB/X-Ray header
+    traceparent = headers.get("traceparent")
+    if traceparent:
+        match = _TRACEPARENT.match(traceparent.strip().lower())
+        if match:
+            return match.group(1)
+    amzn_trace_id = headers.get("X-Amzn-Trace-Id") or headers.get("x-amzn-trace-id")
+    if amzn_trace_id:
+        match = _AMZN_TRACE_ROOT.search(amzn_trace_id)
+        if match:
+            return match.group(1)
+    return None
+
+
+@contextlib.contextmanager
+def observe_stage(stage: str, exemplars: Optional[bool] = None) -> Iterator[None]:
+    outcome = "error"
+    start = time.perf_counter()
+    try:
+        yield
+        outcome = "success"
+    finally:
+        elapsed = time.perf_counter() - start
+        exemplar = None
+        if SIGNIN_STAGE_EXEMPLARS if exemplars is None else exemplars:
+            current_trace_id = trace_id.get()
+            if current_trace_id:
+                exemplar = {"trace_id": current_trace_id}
+        signin_stage_duration.labels(stage=stage, outcome=outcome).observe(elapsed, exemplar)
+        stages = profiled_stages.get()
+        if stages is not None:
+            stages[stage] = stages.get(stage, 0.0) + elapsed
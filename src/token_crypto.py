@@ -0,0 +1,197 @@
+# Envelope encryption for the OAuth tokens stored with each user.
+#
+# Ciphertext: "env1.<kid>.<wrapped data key>.<nonce + AES-GCM ciphertext>" (base64url, unpadded).
+# The master key for <kid> is derived once from an encryption secret and only wraps data keys;
+# data keys encrypt the tokens and are reused for a bounded number of operations or seconds.
+# Old ciphertexts name the key that wrapped them, so rotating the secret only needs the old
+# secret to stay in the key ring, not a re-encryption of every stored row. Old secrets are listed
+# in the authentication secret under previous_encryption_secret_keys, so a worker started after a
+# rotation still has them.
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from src.constants import TOKEN_DATA_KEY_MAX_USES, TOKEN_DATA_KEY_MAX_AGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+FORMAT_PREFIX = "env1"
+NONCE_BYTES = 12
+DATA_KEY_CACHE_SIZE = 256
+
+
+class TokenDecryptionError(Exception):
+    pass
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def derive_master_key(encryption_secret_key: str) -> Tuple[str, bytes]:
+    key = HKDF(
+        algorithm=hashes.SHA256(), length=32, salt=None, info=b"oauth-token-envelope-v1"
+    ).derive(encryption_secret_key.encode("utf-8"))
+    kid = hashlib.sha256(key).hexdigest()[:12]
+    return kid, key
+
+
+class _DataKey:
+    def __init__(self, kid: str, master: AESGCM, created_at: float):
+        key = AESGCM.generate_key(bit_length=256)
+        nonce = os.urandom(NONCE_BYTES)
+        self.header = f"{FORMAT_PREFIX}.{kid}.{_b64encode(nonce + master.encrypt(nonce, key, kid.encode()))}"
+        self.cipher = AESGCM(key)
+        self.uses = 0
+        self.created_at = created_at
+
+
+class TokenCipher:
+    def __init__(
+        self,
+        encryption_secret_key: str,
+        max_uses: int = TOKEN_DATA_KEY_MAX_USES,
+        max_age: float = TOKEN_DATA_KEY_MAX_AGE_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._max_uses = max_uses
+        self._max_age = max_age
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._master_keys: Dict[str, AESGCM] = {}
+        self._data_key: Optional[_DataKey] = None
+        # Unwrapped data keys by "env1.<kid>.<wrapped>" header, so decrypting a row is one AES-GCM call
+        self._decrypt_keys: "OrderedDict[str, AESGCM]" = OrderedDict()
+        self.data_keys_created = 0
+        self.current_kid = ""
+        self.add_key(encryption_secret_key)
+
+    def add_key(self, encryption_secret_key: str, make_current: bool = True) -> str:
+        kid, key = derive_master_key(encryption_secret_key)
+        with self._lock:
+            self._master_keys.setdefault(kid, AESGCM(key))
+            if make_current and self.current_kid != kid:
+                self.current_kid = kid
+                self._data_key = None
+        return kid
+
+    def encrypt(self, plaintext: Optional[str]) -> Optional[str]:
+        if plaintext is None:
+            return None
+        header, cipher = self._checkout_data_key()
+        return self._seal(header, cipher, plaintext)
+
+    def encrypt_pair(self, access_token: Optional[str], refresh_token: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+        # One data key checkout for both tokens of a sign-in
+        header, cipher = self._checkout_data_key(uses=2)
+        return (
+            None if access_token is None else self._seal(header, cipher, access_token),
+            None if refresh_token is None else self._seal(header, cipher, refresh_token),
+        )
+
+    def decrypt(self, ciphertext: str) -> str:
+        try:
+            prefix, kid, wrapped, payload = ciphertext.split(".")
+        except ValueError:
+            raise TokenDecryptionError("Not an envelope-encrypted token")
+        if prefix != FORMAT_PREFIX:
+            raise TokenDecryptionError(f"Unsupported token format: {prefix}")
+        header = f"{prefix}.{kid}.{wrapped}"
+        try:
+            cipher = self._data_key_for(header, kid, wrapped)
+            raw = _b64decode(payload)
+            return cipher.decrypt(raw[:NONCE_BYTES], raw[NONCE_BYTES:], header.encode("ascii")).decode("utf-8")
+        except (InvalidTag, ValueError) as e:
+            raise TokenDecryptionError(f"Token could not be decrypted: {e!r}")
+
+    @staticmethod
+    def _seal(header: str, cipher: AESGCM, plaintext: str) -> str:
+        nonce = os.urandom(NONCE_BYTES)
+        payload = cipher.encrypt(nonce, plaintext.encode("utf-8"), header.encode("ascii"))
+        return f"{header}.{_b64encode(nonce + payload)}"
+
+    def _checkout_data_key(self, uses: int = 1) -> Tuple[str, AESGCM]:
+        with self._lock:
+            data_key = self._data_key
+            if (
+                data_key is None
+                or data_key.uses + uses > self._max_uses
+                or self._clock() - data_key.created_at >= self._max_age
+            ):
+                data_key = _DataKey(self.current_kid, self._master_keys[self.current_kid], self._clock())
+                self._data_key = data_key
+                self.data_keys_created += 1
+            data_key.uses += uses
+            return data_key.header, data_key.cipher
+
+    def _data_key_for(self, header: str, kid: str, wrapped: str) -> AESGCM:
+        with self._lock:
+            cipher = self._decrypt_keys.get(header)
+            if cipher is not None:
+                self._decrypt_keys.move_to_end(header)
+                return cipher
+            master = self._master_keys.get(kid)
+        if master is None:
+            raise TokenDecryptionError(f"Unknown key id: {kid}")
+        raw = _b64decode(wrapped)
+        cipher = AESGCM(master.decrypt(raw[:NONCE_BYTES], raw[NONCE_BYTES:], kid.encode()))
+        with self._lock:
+            self._decrypt_keys[header] = cipher
+            if len(self._decrypt_keys) > DATA_KEY_CACHE_SIZE:
+                self._decrypt_keys.popitem(last=False)
+        return cipher
+
+
+def previous_secret_keys(value: Any) -> List[str]:
+    # previous_encryption_secret_keys: a list (or JSON list) of secrets, or of {"kid", "key"} entries
+    entries = json.loads(value) if isinstance(value, str) else value
+    if not isinstance(entries, list):
+        raise ValueError("previous_encryption_secret_keys must be a list")
+    keys = []
+    for entry in entries:
+        key = entry if isinstance(entry, str) else entry["key"]
+        if isinstance(entry, dict) and entry.get("kid") and entry["kid"] != derive_master_key(key)[0]:
+            logger.warning("Previous encryption key listed as %s has key id %s", entry["kid"], derive_master_key(key)[0])
+        keys.append(key)
+    return keys
+
+
+_cipher_lock = threading.Lock()
+_cipher: Optional[TokenCipher] = None
+_cipher_secret: Optional[str] = None
+_cipher_previous: Any = None
+
+
+def get_token_cipher(encryption_secret_key: str, previous_keys: Any = None) -> TokenCipher:
+    # Built once per worker; a rotated secret becomes the current key and the previous
+    # ones stay in the ring so rows written before the rotation still decrypt. previous_keys
+    # (previous_encryption_secret_keys) adds the keys of rotations before this worker started.
+    global _cipher, _cipher_secret, _cipher_previous
+    if _cipher is not None and _cipher_secret == encryption_secret_key and _cipher_previous == previous_keys:
+        return _cipher
+    with _cipher_lock:
+        if _cipher is None:
+            _cipher = TokenCipher(encryption_secret_key)
+        elif _cipher_secret != encryption_secret_key:
+            _cipher.add_key(encryption_secret_key)
+        if previous_keys and _cipher_previous != previous_keys:
+            for key in previous_secret_keys(previous_keys):
+                _cipher.add_key(key, make_current=False)
+        _cipher_secret = encryption_secret_key
+        _cipher_previous = previous_keys
+        return _cipher
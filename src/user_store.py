@@ -0,0 +1,494 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from src.constants import (
+    AUTHENTICATION_DDB_TABLE,
+    DYNAMODB_MAX_ATTEMPTS,
+    HEDGED_READS,
+    RESILIENCE,
+    USER_STORE_BACKEND,
+    USER_STORE_SQLITE_PATH,
+    SESSION_WRITE_CONCURRENCY,
+)
+from src.dynamodb_client import get_dynamodb_client
+from src.resilience import USER_STORE, Dependency
+
+logger = logging.getLogger(__name__)
+
+KEY_ATTRIBUTE = "email"
+BATCH_GET_LIMIT = 100
+BATCH_WRITE_LIMIT = 25
+BATCH_WRITE_MAX_ATTEMPTS = 8
+SCAN_PAGE_SIZE = 1000
+
+
+class UserStore:
+    def get(self, email: str, attributes: Optional[Sequence[str]] = None) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def create_if_not_exists(self, item: Dict[str, Any]) -> bool:
+        raise NotImplementedError
+
+    def update_session(self, email: str, session_start_time: str, jwt: str) -> None:
+        raise NotImplementedError
+
+    def renew_session(self, email: str, session_start_time: str, jwt: str, started_before: str) -> bool:
+        # Writes the session only if the stored one started before started_before; False when it
+        # did not (renewed by another worker in the meantime) or there is no such user
+        raise NotImplementedError
+
+    def update_sessions(self, sessions: Sequence[Tuple[str, str, str]]) -> List[str]:
+        # (email, session_start_time, jwt) per user; returns the emails whose write failed
+        failed = []
+        for email, session_start_time, jwt in sessions:
+            try:
+                self.update_session(email, session_start_time, jwt)
+            except Exception as e:
+                logger.error("Session write failed for %s: %s", email, e)
+                failed.append(email)
+        return failed
+
+    def batch_get(self, emails: Iterable[str], attributes: Optional[Sequence[str]] = None) -> Dict[str, Dict[str, Any]]:
+        raise NotImplementedError
+
+    def update_attributes(self, email: str, attributes: Dict[str, Any]) -> bool:
+        # Sets the given attributes on an existing user; False when there is no such user
+        raise NotImplementedError
+
+    def scan(
+        self,
+        segment: int = 0,
+        total_segments: int = 1,
+        attributes: Optional[Sequence[str]] = None,
+        page_size: int = SCAN_PAGE_SIZE,
+    ) -> Iterator[Dict[str, Any]]:
+        # Every user in one segment of the table, fetched a page at a time
+        raise NotImplementedError
+
+    def batch_put(self, items: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # Writes whole items (replacing existing ones); returns the items that could not be written
+        raise NotImplementedError
+
+    def upsert_user_with_session(
+        self, email: str, profile_fields: Dict[str, Any], session_fields: Dict[str, Any]
+    ) -> bool:
+        # Profile fields are only written when missing (first sign-in), session fields always.
+        # Returns True when the user did not exist before this write.
+        raise NotImplementedError
+
+
+class DynamoDBUserStore(UserStore):
+    def __init__(self, table_name: str = AUTHENTICATION_DDB_TABLE, client=None, max_attempts: int = DYNAMODB_MAX_ATTEMPTS):
+        from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+        self.table_name = table_name
+        self._client = client
+        self.max_attempts = max_attempts
+        self._serializer = TypeSerializer()
+        self._deserializer = TypeDeserializer()
+        self._session_executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def client(self):
+        return self._client or get_dynamodb_client(self.max_attempts)
+
+    def get(self, email, attributes=None):
+        request: Dict[str, Any] = {"TableName": self.table_name, "Key": self._key(email)}
+        request.update(self._projection(attributes))
+        response = self.client.get_item(**request)
+        return self._deserialize(response["Item"]) if "Item" in response else None
+
+    def create_if_not_exists(self, item):
+        try:
+            self.client.put_item(
+                TableName=self.table_name,
+                Item={name: self._serializer.serialize(value) for name, value in item.items()},
+                ConditionExpression="attribute_not_exists(#k)",
+                ExpressionAttributeNames={"#k": KEY_ATTRIBUTE},
+            )
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return False
+        return True
+
+    def update_session(self, email, session_start_time, jwt):
+        self.client.update_item(
+            TableName=self.table_name,
+            Key=self._key(email),
+            UpdateExpression="SET session_start_time = :sst, jwt = :jwt",
+            ExpressionAttributeValues={":sst": {"S": session_start_time}, ":jwt": {"S": jwt}},
+        )
+
+    def renew_session(self, email, session_start_time, jwt, started_before):
+        # A missing item or session_start_time fails the comparison, so no user is created here
+        try:
+            self.client.update_item(
+                TableName=self.table_name,
+                Key=self._key(email),
+                UpdateExpression="SET session_start_time = :sst, jwt = :jwt",
+                ConditionExpression="session_start_time < :before",
+                ExpressionAttributeValues={
+                    ":sst": {"S": session_start_time},
+                    ":jwt": {"S": jwt},
+                    ":before": {"S": started_before},
+                },
+            )
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return False
+        return True
+
+    def update_sessions(self, sessions):
+        # BatchWriteItem only puts whole items, which would drop the profile, so the
+        # session updates of a batch go out as concurrent UpdateItem calls instead
+        if len(sessions) <= 1:
+            return super().update_sessions(sessions)
+        if self._session_executor is None:
+            self._session_executor = ThreadPoolExecutor(
+                max_workers=SESSION_WRITE_CONCURRENCY, thread_name_prefix="session-writes"
+            )
+        chunks = [sessions[i::SESSION_WRITE_CONCURRENCY] for i in range(SESSION_WRITE_CONCURRENCY)]
+        failed = self._session_executor.map(super().update_sessions, [chunk for chunk in chunks if chunk])
+        return [email for chunk in failed for email in chunk]
+
+    def batch_get(self, emails, attributes=None):
+        emails = list(dict.fromkeys(emails))
+        items: Dict[str, Dict[str, Any]] = {}
+        for start in range(0, len(emails), BATCH_GET_LIMIT):
+            keys_and_attributes: Dict[str, Any] = {"Keys": [self._key(email) for email in emails[start:start + BATCH_GET_LIMIT]]}
+            keys_and_attributes.update(self._projection(attributes, always_include_key=True))
+            request_items = {self.table_name: keys_and_attributes}
+            attempt = 0
+            while request_items:
+                response = self.client.batch_get_item(RequestItems=request_items)
+                for raw_item in response.get("Responses", {}).get(self.table_name, []):
+                    item = self._deserialize(raw_item)
+                    items[item[KEY_ATTRIBUTE]] = item
+                request_items = response.get("UnprocessedKeys") or {}
+                if request_items:
+                    attempt += 1
+                    time.sleep(min(0.05 * 2 ** attempt, 1.0))
+        return items
+
+    def scan(self, segment=0, total_segments=1, attributes=None, page_size=SCAN_PAGE_SIZE):
+        request: Dict[str, Any] = {"TableName": self.table_name, "Limit": page_size}
+        if total_segments > 1:
+            request.update(Segment=segment, TotalSegments=total_segments)
+        request.update(self._projection(attributes))
+        while True:
+            response = self.client.scan(**request)
+            for raw_item in response.get("Items", []):
+                yield self._deserialize(raw_item)
+            if "LastEvaluatedKey" not in response:
+                return
+            request["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def batch_put(self, items):
+        failed: List[Dict[str, Any]] = []
+        for start in range(0, len(items), BATCH_WRITE_LIMIT):
+            requests = [
+                {"PutRequest": {"Item": {name: self._serializer.serialize(value) for name, value in item.items()}}}
+                for item in items[start:start + BATCH_WRITE_LIMIT]
+            ]
+            attempt = 0
+            while requests:
+                response = self.client.batch_write_item(RequestItems={self.table_name: requests})
+                requests = response.get("UnprocessedItems", {}).get(self.table_name, [])
+                if requests:
+                    attempt += 1
+                    if attempt >= BATCH_WRITE_MAX_ATTEMPTS:
+                        failed.extend(self._deserialize(request["PutRequest"]["Item"]) for request in requests)
+                        break
+                    time.sleep(min(0.05 * 2 ** attempt, 1.0))
+        return failed
+
+    def update_attributes(self, email, attributes):
+        names = {f"#u{index}": name for index, name in enumerate(attributes)}
+        values = {f":u{index}": self._serializer.serialize(value) for index, value in enumerate(attributes.values())}
+        names["#k"] = KEY_ATTRIBUTE
+        try:
+            self.client.update_item(
+                TableName=self.table_name,
+                Key=self._key(email),
+                UpdateExpression="SET " + ", ".join(f"#u{index} = :u{index}" for index in range(len(attributes))),
+                ConditionExpression="attribute_exists(#k)",
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values,
+            )
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return False
+        return True
+
+    def upsert_user_with_session(self, email, profile_fields, session_fields):
+        names: Dict[str, str] = {}
+        values: Dict[str, Any] = {}
+        assignments = []
+        for index, (field_name, value) in enumerate(profile_fields.items()):
+            names[f"#p{index}"] = field_name
+            values[f":p{index}"] = self._serializer.serialize(value)
+            assignments.append(f"#p{index} = if_not_exists(#p{index}, :p{index})")
+        for index, (field_name, value) in enumerate(session_fields.items()):
+            names[f"#s{index}"] = field_name
+            values[f":s{index}"] = self._serializer.serialize(value)
+            assignments.append(f"#s{index} = :s{index}")
+
+        response = self.client.update_item(
+            TableName=self.table_name,
+            Key=self._key(email),
+            UpdateExpression="SET " + ", ".join(assignments),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values,
+            ReturnValues="UPDATED_OLD",
+        )
+        # UPDATED_OLD only carries attributes that existed before the write
+        return "created_at" not in response.get("Attributes", {})
+
+    def _key(self, email: str) -> Dict[str, Any]:
+        return {KEY_ATTRIBUTE: {"S": email}}
+
+    def _projection(self, attributes: Optional[Sequence[str]], always_include_key: bool = False) -> Dict[str, Any]:
+        if not attributes:
+            return {}
+        attributes = list(attributes)
+        if always_include_key and KEY_ATTRIBUTE not in attributes:
+            attributes.append(KEY_ATTRIBUTE)
+        names = {f"#a{index}": name for index, name in enumerate(attributes)}
+        return {"ProjectionExpression": ", ".join(names), "ExpressionAttributeNames": names}
+
+    def _deserialize(self, raw_item: Dict[str, Any]) -> Dict[str, Any]:
+        return {name: self._deserializer.deserialize(value) for name, value in raw_item.items()}
+
+
+def _json_default(value: Any) -> Any:
+    # Items read from DynamoDB or an NDJSON import (bulk_users.loads) carry numbers as Decimal
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def _dumps(item: Dict[str, Any]) -> str:
+    return json.dumps(item, default=_json_default)
+
+
+class SQLiteUserStore(UserStore):
+    # Same semantics as the DynamoDB table, for offline load tests and benchmarks.
+    # A file path can be shared between gunicorn workers; ":memory:" is per process.
+    def __init__(self, path: str = ":memory:"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        if path != ":memory:":
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS users (email TEXT PRIMARY KEY, item TEXT NOT NULL)")
+
+    def get(self, email, attributes=None):
+        with self._lock:
+            row = self._connection.execute("SELECT item FROM users WHERE email = ?", (email,)).fetchone()
+        return self._project(json.loads(row[0]), attributes) if row else None
+
+    def create_if_not_exists(self, item):
+        with self._lock:
+            cursor = self._connection.execute(
+                "INSERT OR IGNORE INTO users (email, item) VALUES (?, ?)",
+                (item[KEY_ATTRIBUTE], _dumps(item)),
+            )
+        return cursor.rowcount == 1
+
+    def update_session(self, email, session_start_time, jwt):
+        self._update(email, {}, {"session_start_time": session_start_time, "jwt": jwt})
+
+    def renew_session(self, email, session_start_time, jwt, started_before):
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._connection.execute("SELECT item FROM users WHERE email = ?", (email,)).fetchone()
+                item = json.loads(row[0]) if row else {}
+                renewed = "session_start_time" in item and item["session_start_time"] < started_before
+                if renewed:
+                    item.update(session_start_time=session_start_time, jwt=jwt)
+                    self._connection.execute("UPDATE users SET item = ? WHERE email = ?", (_dumps(item), email))
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+        return renewed
+
+    def update_sessions(self, sessions):
+        # One transaction for the whole batch
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                for email, session_start_time, jwt in sessions:
+                    row = self._connection.execute("SELECT item FROM users WHERE email = ?", (email,)).fetchone()
+                    item = json.loads(row[0]) if row else {KEY_ATTRIBUTE: email}
+                    item.update(session_start_time=session_start_time, jwt=jwt)
+                    self._connection.execute(
+                        "INSERT OR REPLACE INTO users (email, item) VALUES (?, ?)", (email, _dumps(item))
+                    )
+                self._connection.execute("COMMIT")
+            except Exception as e:
+                self._connection.execute("ROLLBACK")
+                logger.error("Session batch write failed: %s", e)
+                return [email for email, _, _ in sessions]
+        return []
+
+    def batch_get(self, emails, attributes=None):
+        emails = list(dict.fromkeys(emails))
+        items: Dict[str, Dict[str, Any]] = {}
+        for start in range(0, len(emails), BATCH_GET_LIMIT):
+            chunk = emails[start:start + BATCH_GET_LIMIT]
+            placeholders = ", ".join("?" for _ in chunk)
+            with self._lock:
+                rows = self._connection.execute(
+                    f"SELECT email, item FROM users WHERE email IN ({placeholders})", chunk
+                ).fetchall()
+            for email, item in rows:
+                items[email] = self._project(json.loads(item), attributes, always_include_key=True)
+        return items
+
+    def scan(self, segment=0, total_segments=1, attributes=None, page_size=SCAN_PAGE_SIZE):
+        last_rowid = 0
+        while True:
+            with self._lock:
+                rows = self._connection.execute(
+                    "SELECT rowid, item FROM users WHERE rowid > ? AND rowid % ? = ? ORDER BY rowid LIMIT ?",
+                    (last_rowid, total_segments, segment, page_size),
+                ).fetchall()
+            for _, item in rows:
+                yield self._project(json.loads(item), attributes)
+            if len(rows) < page_size:
+                return
+            last_rowid = rows[-1][0]
+
+    def batch_put(self, items):
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO users (email, item) VALUES (?, ?)",
+                    [(item[KEY_ATTRIBUTE], _dumps(item)) for item in items],
+                )
+                self._connection.execute("COMMIT")
+            except Exception as e:
+                self._connection.execute("ROLLBACK")
+                logger.error("Batch write failed: %s", e)
+                return list(items)
+        return []
+
+    def update_attributes(self, email, attributes):
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._connection.execute("SELECT item FROM users WHERE email = ?", (email,)).fetchone()
+                if row is not None:
+                    item = json.loads(row[0])
+                    item.update(attributes)
+                    self._connection.execute("UPDATE users SET item = ? WHERE email = ?", (_dumps(item), email))
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+        return row is not None
+
+    def upsert_user_with_session(self, email, profile_fields, session_fields):
+        return self._update(email, profile_fields, session_fields)
+
+    def _update(self, email: str, profile_fields: Dict[str, Any], session_fields: Dict[str, Any]) -> bool:
+        # BEGIN IMMEDIATE takes the write lock up front, so concurrent workers sharing
+        # a database file see the same read-modify-write atomicity as UpdateItem
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._connection.execute("SELECT item FROM users WHERE email = ?", (email,)).fetchone()
+                item = json.loads(row[0]) if row else {KEY_ATTRIBUTE: email}
+                for name, value in profile_fields.items():
+                    item.setdefault(name, value)
+                item.update(session_fields)
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO users (email, item) VALUES (?, ?)", (email, _dumps(item))
+                )
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+        return row is None or "created_at" not in json.loads(row[0])
+
+    def _project(
+        self, item: Dict[str, Any], attributes: Optional[Sequence[str]], always_include_key: bool = False
+    ) -> Dict[str, Any]:
+        if not attributes:
+            return item
+        wanted = set(attributes)
+        if always_include_key:
+            wanted.add(KEY_ATTRIBUTE)
+        return {name: value for name, value in item.items() if name in wanted}
+
+
+class ResilientUserStore(UserStore):
+    # Sends the calls a request waits on through the user_store dependency (src/resilience.py):
+    # deadline, retries and circuit breaker, and hedging for reads when HEDGED_READS is on.
+    # Bulk calls (scan, batch_put, update_sessions) have their own retries and pass straight through.
+    def __init__(self, store: UserStore, dependency: Dependency = USER_STORE, hedge_reads: bool = HEDGED_READS):
+        self.store = store
+        self.dependency = dependency
+        self.hedge_reads = hedge_reads
+
+    def get(self, email, attributes=None):
+        return self.dependency.call(lambda: self.store.get(email, attributes), hedge=self.hedge_reads)
+
+    def batch_get(self, emails, attributes=None):
+        emails = list(emails)
+        return self.dependency.call(lambda: self.store.batch_get(emails, attributes), hedge=self.hedge_reads)
+
+    def create_if_not_exists(self, item):
+        return self.dependency.call(lambda: self.store.create_if_not_exists(item))
+
+    def update_session(self, email, session_start_time, jwt):
+        return self.dependency.call(lambda: self.store.update_session(email, session_start_time, jwt))
+
+    def renew_session(self, email, session_start_time, jwt, started_before):
+        # A retry after a write that landed returns False, and the caller still hands out the session
+        return self.dependency.call(lambda: self.store.renew_session(email, session_start_time, jwt, started_before))
+
+    def update_attributes(self, email, attributes):
+        return self.dependency.call(lambda: self.store.update_attributes(email, attributes))
+
+    def upsert_user_with_session(self, email, profile_fields, session_fields):
+        # A retry after a write that landed reports the user as existing, which only affects logging
+        return self.dependency.call(lambda: self.store.upsert_user_with_session(email, profile_fields, session_fields))
+
+    def update_sessions(self, sessions):
+        return self.store.update_sessions(sessions)
+
+    def scan(self, segment=0, total_segments=1, attributes=None, page_size=SCAN_PAGE_SIZE):
+        return self.store.scan(segment, total_segments, attributes, page_size)
+
+    def batch_put(self, items):
+        return self.store.batch_put(items)
+
+
+def create_user_store(backend: str = USER_STORE_BACKEND, resilient: bool = RESILIENCE) -> UserStore:
+    if backend == "dynamodb":
+        # botocore's own retries would run inside every attempt of the resilience layer
+        store: UserStore = DynamoDBUserStore(max_attempts=1 if resilient else DYNAMODB_MAX_ATTEMPTS)
+    elif backend == "sqlite":
+        store = SQLiteUserStore(USER_STORE_SQLITE_PATH)
+    else:
+        raise ValueError(f"Unknown user store backend: {backend}")
+    return ResilientUserStore(store) if resilient else store
+
+
+@lru_cache(maxsize=None)
+def get_user_store() -> UserStore:
+    return create_user_store()
+
+
+# SQLite connections and the session write executor must not be carried across fork
+os.register_at_fork(after_in_child=get_user_store.cache_clear)
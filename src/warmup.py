@@ -0,0 +1,47 @@
+# Work done once in the gunicorn master when the app is preloaded (see gunicorn.conf.py),
+# so forked workers start with it: the imports the request path defers until first use,
+# and botocore's service models. Nothing here may open a connection or start a thread.
+import importlib
+import logging
+import time
+
+from src.constants import AWS_DEFAULT_REGION
+
+logger = logging.getLogger(__name__)
+
+WARM_UP_MODULES = (
+    "boto3",
+    "boto3.dynamodb.types",
+    "botocore.config",
+    "requests",
+    "jwt",
+    "cryptography.hazmat.primitives.ciphers.aead",
+    "utils.aws_secrets_utils",
+    "utils.hashing_utils",
+    "utils.jwt_utils",
+    "flask",
+    "aiohttp",
+)
+WARM_UP_AWS_SERVICES = ("dynamodb", "secretsmanager")
+
+
+def warm_up() -> float:
+    start = time.perf_counter()
+    for module in WARM_UP_MODULES:
+        importlib.import_module(module)
+
+    import boto3
+
+    # Creating a client loads the service model, endpoint rules and partitions into the default
+    # session's loader cache. Explicit dummy credentials skip the credential chain (which could
+    # call the instance metadata service); the clients are discarded without sending anything.
+    for service_name in WARM_UP_AWS_SERVICES:
+        boto3.client(
+            service_name,
+            region_name=AWS_DEFAULT_REGION,
+            aws_access_key_id="warm-up",
+            aws_secret_access_key="warm-up",
+        )
+    elapsed = time.perf_counter() - start
+    logger.info("Warm-up finished in %.3fs", elapsed)
+    return elapsed
@@ -0,0 +1,67 @@
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+
+class AsgiResponse:
+    def __init__(self, status_code: int, headers: List[Tuple[bytes, bytes]], data: bytes):
+        self.status_code = status_code
+        self.headers: Dict[str, str] = {}
+        for name, value in headers:
+            self.headers.setdefault(name.decode("latin-1").title(), value.decode("latin-1"))
+        self.raw_headers = headers
+        self.data = data
+
+
+class AsgiTestClient:
+    # Minimal stand-in for Flask's test_client() so the same tests drive both apps
+    def __init__(self, app):
+        self.app = app
+
+    def get(self, path: str, headers: Optional[Dict[str, str]] = None) -> AsgiResponse:
+        return self.open("GET", path, headers=headers)
+
+    def post(self, path: str, data=b"", content_type: str = "", headers: Optional[Dict[str, str]] = None) -> AsgiResponse:
+        headers = dict(headers or {})
+        if content_type:
+            headers["Content-Type"] = content_type
+        return self.open("POST", path, data=data, headers=headers)
+
+    def delete(self, path: str, headers: Optional[Dict[str, str]] = None) -> AsgiResponse:
+        return self.open("DELETE", path, headers=headers)
+
+    def open(self, method: str, path: str, data=b"", headers: Optional[Dict[str, str]] = None) -> AsgiResponse:
+        return asyncio.run(self.request(method, path, data, headers or {}))
+
+    async def request(self, method: str, path: str, data=b"", headers: Optional[Dict[str, str]] = None) -> AsgiResponse:
+        headers = headers or {}
+        body = data.encode() if isinstance(data, str) else data
+        path, _, query = path.partition("?")
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query.encode(),
+            "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers.items()],
+            "client": ("127.0.0.1", 50000),
+            "server": ("testserver", 80),
+        }
+        received = False
+        messages = []
+
+        async def receive():
+            nonlocal received
+            if received:
+                return {"type": "http.disconnect"}
+            received = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        await self.app(scope, receive, send)
+        start = next(m for m in messages if m["type"] == "http.response.start")
+        payload = b"".join(m.get("body", b"") for m in messages if m["type"] == "http.response.body")
+        return AsgiResponse(start["status"], start.get("headers", []), payload)
@@ -0,0 +1,200 @@
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from benchmarks.stand_ins import LocalAppleServer, LocalGoogleServer
+from src.apple_token_client import AppleClientSecret, AppleTokenClient
+from src import service
+from src.access_tokens import AccessTokenBroker, AccessTokenCache, AccessTokenError, access_token_for_session
+from src.google_token_client import GoogleTokenClient
+from src.id_token import IdTokenClaims
+from src.local_utils import create_jwt
+from src.resilience import request_deadline
+from src.token_crypto import get_token_cipher
+from src.user_store import SQLiteUserStore
+
+SECRET = "encryption-secret-for-access-token-tests"
+EMAIL = "user@example.com"
+
+
+class TestAccessTokenCache(unittest.TestCase):
+    def test_entries_expire_before_the_token(self):
+        cache = AccessTokenCache(margin=300)
+        cache.put(EMAIL, "ya29.a", time.time() + 299)
+        cache.put("other@example.com", "ya29.b", time.time() + 301)
+
+        self.assertIsNone(cache.get(EMAIL))
+        self.assertEqual(cache.get("other@example.com")[0], "ya29.b")
+
+    def test_least_recently_used_is_evicted(self):
+        cache = AccessTokenCache(max_entries=2, margin=0)
+        for email in ("a", "b"):
+            cache.put(email, "token-" + email, time.time() + 60)
+        cache.get("a")
+        cache.put("c", "token-c", time.time() + 60)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+
+
+class TestAccessTokenBroker(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = LocalGoogleServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.store = SQLiteUserStore()
+        self.cipher = get_token_cipher(SECRET)
+        self.store.create_if_not_exists({"email": EMAIL, "refresh_token": self.cipher.encrypt("1//refresh")})
+        self.broker = AccessTokenBroker(cache=AccessTokenCache(margin=300), store_factory=lambda: self.store)
+        self.addCleanup(self.broker.flush)
+        self.client = GoogleTokenClient(
+            self.server.issuer.audience, "client_secret", "https://example.com/callback", token_uri=self.server.token_uri
+        )
+        self.addCleanup(self.client.close)
+        secrets = {
+            "client_id": self.server.issuer.audience,
+            "client_secret": "client_secret",
+            "redirect_uri": "https://example.com/callback",
+            "encryption_secret_key": SECRET,
+        }
+        for target, value in (
+            ("src.service.get_authentication_secrets", lambda: secrets),
+            ("src.access_tokens.get_google_token_client", lambda *args: self.client),
+            ("src.service.TOKEN_ENCRYPTION_FORMAT", "envelope"),
+        ):
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_refreshes_once_then_serves_from_cache(self):
+        requests_before = self.server.token_requests
+
+        token, expires_at = self.broker.get(EMAIL)
+        self.assertEqual(self.broker.get(EMAIL), (token, expires_at))
+
+        self.assertTrue(token.startswith("ya29."))
+        self.assertAlmostEqual(expires_at, time.time() + 3599, delta=5)
+        self.assertEqual(self.server.token_requests - requests_before, 1)
+
+    def test_refreshed_token_is_persisted_encrypted(self):
+        token, expires_at = self.broker.get(EMAIL)
+        self.broker.flush()
+
+        item = self.store.get(EMAIL)
+        self.assertEqual(self.cipher.decrypt(item["access_token"]), token)
+        self.assertEqual(item["access_token_expires_at"], int(expires_at))
+
+    def test_fresh_stored_token_is_used_without_refresh(self):
+        self.store.update_attributes(EMAIL, {
+            "access_token": self.cipher.encrypt("ya29.stored"),
+            "access_token_expires_at": int(time.time() + 1800),
+        })
+        requests_before = self.server.token_requests
+
+        self.assertEqual(self.broker.get(EMAIL)[0], "ya29.stored")
+        self.assertEqual(self.server.token_requests, requests_before)
+
+    def test_concurrent_misses_share_one_refresh(self):
+        requests_before = self.server.token_requests
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.broker.get(EMAIL))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(set(results)), 1)
+        self.assertEqual(self.server.token_requests - requests_before, 1)
+
+    def test_waiters_give_up_at_their_deadline(self):
+        entered, release = threading.Event(), threading.Event()
+        store_get = self.store.get
+
+        def slow_get(*args, **kwargs):
+            entered.set()
+            release.wait(5)
+            return store_get(*args, **kwargs)
+
+        with patch.object(self.store, "get", slow_get):
+            leader = threading.Thread(target=self.broker.get, args=(EMAIL,))
+            leader.start()
+            self.addCleanup(leader.join, 5)
+            self.addCleanup(release.set)
+            entered.wait(5)
+            started = time.monotonic()
+            with request_deadline(0.1), self.assertRaises(AccessTokenError) as raised:
+                self.broker.get(EMAIL)
+
+        self.assertEqual(raised.exception.status, 504)
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_token_from_sign_in_is_used_without_refresh(self):
+        claims = IdTokenClaims(email="new@example.com", subject="002")
+        expires_at = int(time.time()) + 3599
+        with patch("src.service.get_user_store", lambda: self.store):
+            self.assertTrue(service.create_user(claims.email, claims, "ya29.signin", "1//refresh", expires_at))
+        requests_before = self.server.token_requests
+
+        self.assertEqual(self.broker.get(claims.email), ("ya29.signin", expires_at))
+        self.assertEqual(self.server.token_requests, requests_before)
+
+    def test_rejected_refresh_token_requires_sign_in(self):
+        self.store.update_attributes(EMAIL, {"refresh_token": self.cipher.encrypt("")})
+
+        with self.assertRaises(AccessTokenError) as raised:
+            self.broker.get(EMAIL)
+
+        self.assertEqual(raised.exception.status, 401)
+
+    def test_apple_users_refresh_with_apple(self):
+        apple = LocalAppleServer().start()
+        self.addCleanup(apple.stop)
+        client_id, team_id, key_id, private_key, redirect_uri = apple.settings()
+        client = AppleTokenClient(AppleClientSecret(client_id, team_id, key_id, private_key), redirect_uri, token_uri=apple.token_uri)
+        self.addCleanup(client.close)
+        self.store.update_attributes(EMAIL, {"oidc_provider": "apple"})
+        google_requests_before = self.server.token_requests
+
+        with patch("src.access_tokens.get_apple_token_client", lambda *args: client), patch(
+            "src.service._fetch_sign_with_apple_secrets_from_aws", return_value=apple.settings()
+        ):
+            self.broker.get(EMAIL)
+
+        self.assertEqual(apple.token_requests, 1)
+        self.assertEqual(self.server.token_requests, google_requests_before)
+
+    def test_unknown_user(self):
+        with self.assertRaises(AccessTokenError) as raised:
+            self.broker.get("nobody@example.com")
+
+        self.assertEqual(raised.exception.status, 404)
+
+    def test_access_token_for_session(self):
+        now = datetime.now()
+        session = create_jwt({"email": EMAIL, "iat": now, "exp": now + timedelta(days=1)}, SECRET)
+
+        with patch("src.access_tokens.access_token_broker", self.broker):
+            token, expires_in = access_token_for_session(session)
+
+        self.assertTrue(token.startswith("ya29."))
+        self.assertGreater(expires_in, 3000)
+
+    def test_access_token_for_invalid_session(self):
+        now = datetime.now()
+        forged = create_jwt({"email": EMAIL, "iat": now, "exp": now + timedelta(days=1)}, "other-secret-of-at-least-32-bytes-long")
+
+        for session in (None, "not-a-jwt", forged):
+            with self.assertRaises(AccessTokenError) as raised:
+                access_token_for_session(session)
+            self.assertEqual(raised.exception.status, 401)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+import asyncio
+import threading
+import unittest
+from unittest.mock import patch
+
+from src.admission import AdmissionController, AdmissionRejected, TokenBucketLimiter, client_address
+
+
+class TestAdmissionController(unittest.TestCase):
+    def test_admits_up_to_the_limit(self):
+        controller = AdmissionController(limit=2, max_queue=0)
+        first, second = controller.admit(), controller.admit()
+
+        with self.assertRaises(AdmissionRejected) as raised:
+            controller.admit()
+
+        self.assertEqual(raised.exception.reason, "queue_full")
+        self.assertEqual(raised.exception.status, 503)
+        first.release()
+        controller.admit()
+        self.assertEqual(controller.in_flight, 2)
+
+    def test_queued_request_gets_released_slot(self):
+        controller = AdmissionController(limit=1, max_queue=1, queue_timeout=5)
+        ticket = controller.admit()
+        admitted = threading.Event()
+
+        def wait():
+            with controller.admit():
+                admitted.set()
+
+        thread = threading.Thread(target=wait)
+        thread.start()
+        self.assertFalse(admitted.wait(0.05))
+        ticket.release()
+        thread.join(5)
+
+        self.assertTrue(admitted.is_set())
+        self.assertEqual(controller.in_flight, 0)
+
+    def test_queue_wait_budget_sheds(self):
+        controller = AdmissionController(limit=1, max_queue=1, queue_timeout=0.01)
+        controller.admit()
+
+        with self.assertRaises(AdmissionRejected) as raised:
+            controller.admit()
+
+        self.assertEqual(raised.exception.reason, "queue_timeout")
+        self.assertGreaterEqual(raised.exception.retry_after, 1)
+        self.assertEqual(controller.in_flight, 1)
+
+    def test_release_is_idempotent(self):
+        controller = AdmissionController(limit=1)
+        ticket = controller.admit()
+
+        ticket.release()
+        ticket.release()
+
+        self.assertEqual(controller.in_flight, 0)
+
+    def test_async_waiters_are_admitted_in_order(self):
+        controller = AdmissionController(limit=1, max_queue=10, queue_timeout=5)
+        order = []
+
+        async def signin(name):
+            with await controller.admit_async():
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        async def main():
+            await asyncio.gather(*(signin(name) for name in "abc"))
+
+        asyncio.run(main())
+
+        self.assertEqual(order, ["a", "b", "c"])
+        self.assertEqual(controller.in_flight, 0)
+
+    def test_async_queue_timeout(self):
+        controller = AdmissionController(limit=1, max_queue=1, queue_timeout=0.01)
+
+        async def main():
+            ticket = await controller.admit_async()
+            with self.assertRaises(AdmissionRejected):
+                await controller.admit_async()
+            ticket.release()
+
+        asyncio.run(main())
+        self.assertEqual(controller.in_flight, 0)
+
+    def test_adaptive_limit_backs_off_on_slow_requests(self):
+        controller = AdmissionController(limit=20, adaptive=True, min_limit=4, latency_target=0.5)
+        clock = [100.0]
+        with patch("src.admission.time.monotonic", lambda: clock[0]):
+            ticket = controller.admit()
+            clock[0] += 2
+            ticket.release()
+
+        self.assertEqual(controller.limit, 18)
+
+    def test_adaptive_limit_grows_while_saturated(self):
+        controller = AdmissionController(limit=4, adaptive=True, latency_target=0.5)
+        tickets = [controller.admit() for _ in range(4)]
+        for _ in range(3):
+            for ticket in tickets:
+                ticket.release()
+            tickets = [controller.admit() for _ in range(controller.limit)]
+
+        self.assertGreater(controller.limit, 4)
+
+
+class TestTokenBucketLimiter(unittest.TestCase):
+    def test_burst_then_rate(self):
+        clock = [0.0]
+        limiter = TokenBucketLimiter(rate=2, burst=3, clock=lambda: clock[0])
+
+        self.assertEqual([limiter.acquire("10.0.0.1") for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(limiter.acquire("10.0.0.1"), 0.5)
+        self.assertEqual(limiter.acquire("10.0.0.2"), 0)
+        clock[0] = 0.5
+        self.assertEqual(limiter.acquire("10.0.0.1"), 0)
+
+    def test_forgets_least_recent_clients(self):
+        limiter = TokenBucketLimiter(rate=1, burst=1, max_clients=2)
+        for client in ("a", "b", "c"):
+            limiter.acquire(client)
+
+        self.assertEqual(limiter.acquire("a"), 0)
+
+    def test_controller_rejects_with_429(self):
+        controller = AdmissionController(rate_limiter=TokenBucketLimiter(rate=1, burst=1))
+        controller.admit("10.0.0.1").release()
+
+        with self.assertRaises(AdmissionRejected) as raised:
+            controller.admit("10.0.0.1")
+
+        self.assertEqual(raised.exception.status, 429)
+
+
+class TestClientAddress(unittest.TestCase):
+    def test_uses_peer_address_by_default(self):
+        self.assertEqual(client_address({"X-Forwarded-For": "1.2.3.4"}, "10.0.0.1"), "10.0.0.1")
+
+    def test_uses_proxy_entry_when_trusted(self):
+        with patch("src.admission.ADMISSION_TRUST_FORWARDED_FOR", True):
+            self.assertEqual(client_address({"x-forwarded-for": "6.6.6.6, 1.2.3.4"}, "10.0.0.1"), "1.2.3.4")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,131 +1,489 @@
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 from flask import json
 
-from src.app import app
+from src import app as flask_app_module
+from src import asgi_app as asgi_app_module
+from src.access_tokens import AccessTokenError
+from src.admission import AdmissionController, TokenBucketLimiter
+from src.id_token import IdTokenClaims, InvalidIdTokenError
+from src.local_utils import InvalidSessionError
+from src.profiling import RequestProfiler
+from src.resilience import CircuitOpenError
+from src.session_revocation import UnrevocableSessionError
+from src.signin_dedup import signin_deduplicator
+from test.asgi_client import AsgiTestClient
 
-class FlaskAppTestCase(unittest.TestCase):
-    def setUp(self):
-        self.app = app.test_client()
-        self.app.testing = True
 
-    @patch('src.app.authorize_with_google')
-    @patch('src.app.extract_email_from_token')
-    @patch('src.app.is_user_exists')
-    @patch('src.app.create_user')
-    @patch('src.app.authenticate_user')
-    def test_signin_with_google_success_new_user(self, mock_authenticate, mock_create, mock_exists, 
-                                                 mock_extract_email, mock_authorize):
-        mock_authorize.return_value = ('access_token', 'refresh_token', 'id_token')
-        mock_extract_email.return_value = 'new_user@example.com'
+class SigninWithGoogleTests:
+    # Shared by the Flask app (src/app.py) and the ASGI app (src/asgi_app.py)
+    module = None
+    mock_class = MagicMock
+
+    def patch_pipeline(self, name):
+        patcher = patch.object(self.module, name, new_callable=self.mock_class)
+        mock = patcher.start()
+        self.addCleanup(patcher.stop)
+        return mock
+
+    def patch_blocking(self, name):
+        patcher = patch.object(self.module, name, new_callable=MagicMock)
+        mock = patcher.start()
+        self.addCleanup(patcher.stop)
+        return mock
+
+    def patch_setting(self, name, value):
+        patcher = patch.object(self.module, name, value)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post_signin(self, payload):
+        return self.app.post('/api/v1/signinWithGoogle', 
+                             data=json.dumps(payload),
+                             content_type='application/json')
+
+    def test_signin_with_google_success_new_user(self):
+        mock_authorize = self.patch_pipeline('authorize_with_google')
+        mock_verify = self.patch_pipeline('verify_google_id_token')
+        mock_exists = self.patch_pipeline('is_user_exists')
+        mock_create = self.patch_pipeline('create_user')
+        mock_authenticate = self.patch_pipeline('authenticate_user')
+        mock_authorize.return_value = ('access_token', 'refresh_token', 'id_token', 1700003600)
+        mock_verify.return_value = IdTokenClaims(email='new_user@example.com', subject='123')
         mock_exists.return_value = False
         mock_create.return_value = True
         mock_authenticate.return_value = ({'status': 'success', 'token': 'auth_token'}, 200)
 
-        response = self.app.post('/api/v1/signinWithGoogle', 
-                                 data=json.dumps({'authorization_code': 'test_code'}),
-                                 content_type='application/json')
+        response = self.post_signin({'authorization_code': 'test_code'})
 
         self.assertEqual(response.status_code, 200)
         data = json.loads(response.data)
         self.assertEqual(data, {'status': 'success', 'token': 'auth_token'})
         mock_create.assert_called_once()
 
-    @patch('src.app.authorize_with_google')
-    @patch('src.app.extract_email_from_token')
-    @patch('src.app.is_user_exists')
-    @patch('src.app.create_user')
-    @patch('src.app.authenticate_user')
-    def test_signin_with_google_success_existing_user(self, mock_authenticate, mock_create, mock_exists, 
-                                                      mock_extract_email, mock_authorize):
-        mock_authorize.return_value = ('access_token', 'refresh_token', 'id_token')
-        mock_extract_email.return_value = 'existing_user@example.com'
+    def test_signin_with_google_success_existing_user(self):
+        mock_authorize = self.patch_pipeline('authorize_with_google')
+        mock_verify = self.patch_pipeline('verify_google_id_token')
+        mock_exists = self.patch_pipeline('is_user_exists')
+        mock_create = self.patch_pipeline('create_user')
+        mock_authenticate = self.patch_pipeline('authenticate_user')
+        mock_authorize.return_value = ('access_token', 'refresh_token', 'id_token', 1700003600)
+        mock_verify.return_value = IdTokenClaims(email='existing_user@example.com', subject='123')
         mock_exists.return_value = True
         mock_authenticate.return_value = ({'status': 'success', 'token': 'auth_token'}, 200)
 
-        response = self.app.post('/api/v1/signinWithGoogle', 
-                                 data=json.dumps({'authorization_code': 'test_code'}),
-                                 content_type='application/json')
+        response = self.post_signin({'authorization_code': 'test_code'})
 
         self.assertEqual(response.status_code, 200)
         data = json.loads(response.data)
         self.assertEqual(data, {'status': 'success', 'token': 'auth_token'})
         mock_create.assert_not_called()
 
-    def test_signin_with_google_missing_code(self):
-        response = self.app.post('/api/v1/signinWithGoogle', 
-                                 data=json.dumps({}),
+    def test_signin_with_google_duplicate_code_reuses_response(self):
+        mock_authorize = self.patch_pipeline('authorize_with_google')
+        mock_verify = self.patch_pipeline('verify_google_id_token')
+        mock_exists = self.patch_pipeline('is_user_exists')
+        mock_authenticate = self.patch_pipeline('authenticate_user')
+        mock_authorize.return_value = ('access_token', 'refresh_token', 'id_token', 1700003600)
+        mock_verify.return_value = IdTokenClaims(email='existing_user@example.com', subject='123')
+        mock_exists.return_value = True
+        mock_authenticate.return_value = ({'status': 'success', 'token': 'auth_token'}, 200)
+
+        first = self.post_signin({'authorization_code': 'test_code'})
+        second = self.post_signin({'authorization_code': 'test_code'})
+
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second.headers['Content-Type'], 'application/json')
+        self.assertEqual(second.headers['Access-Control-Allow-Origin'], '*')
+        mock_authorize.assert_called_once_with('test_code')
+
+    def test_signin_with_google_failed_code_is_not_reused(self):
+        mock_authorize = self.patch_pipeline('authorize_with_google')
+        mock_authorize.side_effect = Exception("invalid_grant")
+
+        self.post_signin({'authorization_code': 'test_code'})
+        response = self.post_signin({'authorization_code': 'test_code'})
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(mock_authorize.call_count, 2)
+
+    def test_signin_with_google_fails_fast_when_circuit_is_open(self):
+        self.patch_pipeline('authorize_with_google').side_effect = CircuitOpenError("google_token", "Circuit for google_token is open")
+        mock_verify = self.patch_pipeline('verify_google_id_token')
+
+        response = self.post_signin({'authorization_code': 'test_code'})
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(json.loads(response.data), {'error': 'Google sign-in is temporarily unavailable, retry later'})
+        mock_verify.assert_not_called()
+
+    def test_signin_with_apple_uses_the_apple_steps(self):
+        mock_google = self.patch_pipeline('authorize_with_google')
+        mock_authorize = self.patch_pipeline('authorize_with_apple')
+        mock_verify = self.patch_pipeline('verify_apple_id_token')
+        mock_exists = self.patch_pipeline('is_user_exists')
+        mock_authenticate = self.patch_pipeline('authenticate_user')
+        mock_authorize.return_value = ('access_token', 'refresh_token', 'id_token', 1700003600)
+        mock_verify.return_value = IdTokenClaims(email='user@privaterelay.appleid.com', subject='001', oidc_provider='apple')
+        mock_exists.return_value = True
+        mock_authenticate.return_value = ({'status': 'success', 'token': 'auth_token'}, 200)
+
+        response = self.app.post('/api/v1/signinWithApple', data=json.dumps({'authorization_code': 'apple_code'}),
                                  content_type='application/json')
 
+        self.assertEqual(response.status_code, 200)
+        mock_authorize.assert_called_once_with('apple_code')
+        mock_verify.assert_called_once_with('id_token')
+        mock_authenticate.assert_called_once_with('user@privaterelay.appleid.com')
+        mock_google.assert_not_called()
+
+    def test_signin_with_apple_authorization_failure(self):
+        self.patch_pipeline('authorize_with_apple').side_effect = Exception("invalid_client")
+
+        response = self.app.post('/api/v1/signinWithApple', data=json.dumps({'authorization_code': 'apple_code'}),
+                                 content_type='application/json')
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(json.loads(response.data), {'error': 'Exception occurred during authorization with Apple'})
+
+    def test_signin_with_google_sheds_when_saturated(self):
+        mock_authorize = self.patch_pipeline('authorize_with_google')
+        admission = AdmissionController(limit=1, max_queue=0)
+        self.patch_setting('signin_admission', admission)
+        admission.admit()
+
+        response = self.post_signin({'authorization_code': 'test_code'})
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.assertEqual(json.loads(response.data), {'error': 'Too many sign-in requests, retry later'})
+        mock_authorize.assert_not_called()
+
+    def test_signin_with_google_rate_limits_client(self):
+        self.patch_pipeline('authorize_with_google').side_effect = Exception("invalid_grant")
+        self.patch_setting('signin_admission', AdmissionController(rate_limiter=TokenBucketLimiter(rate=0.5, burst=1)))
+
+        first = self.post_signin({'authorization_code': 'code-1'})
+        second = self.post_signin({'authorization_code': 'code-2'})
+
+        self.assertEqual(first.status_code, 500)
+        self.assertEqual(second.status_code, 429)
+        self.assertEqual(second.headers['Retry-After'], '2')
+
+    def test_access_token(self):
+        # Called synchronously by both apps (on the blocking pool in the ASGI app)
+        mock_lookup = self.patch_blocking('access_token_for_session')
+        mock_lookup.return_value = ('ya29.token', 3000)
+
+        response = self.app.get('/api/v1/accessToken', headers={'Authorization': 'Bearer jwt-value'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data), {'access_token': 'ya29.token', 'expires_in': 3000})
+        self.assertEqual(response.headers['Cache-Control'], 'no-store')
+        mock_lookup.assert_called_once_with('jwt-value')
+
+    def test_access_token_error(self):
+        self.patch_blocking('access_token_for_session').side_effect = AccessTokenError("Invalid session", 401)
+
+        response = self.app.get('/api/v1/accessToken', headers={'Authorization': 'Bearer forged'})
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(json.loads(response.data), {'error': 'Invalid session'})
+
+    def test_session_verify(self):
+        mock_verify = self.patch_blocking('verify_session')
+        mock_verify.return_value = {'email': 'user@example.com', 'exp': 1700000000}
+
+        response = self.app.get('/api/v1/session/verify', headers={'Authorization': 'Bearer jwt-value'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data), {'claims': {'email': 'user@example.com', 'exp': 1700000000}})
+        self.assertEqual(response.headers['Cache-Control'], 'no-store')
+        mock_verify.assert_called_once_with('jwt-value')
+
+    def test_session_verify_invalid(self):
+        self.patch_blocking('verify_session').side_effect = InvalidSessionError("Invalid session token: expired")
+
+        response = self.app.get('/api/v1/session/verify', headers={'Authorization': 'Bearer expired'})
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(json.loads(response.data), {'error': 'Invalid session'})
+
+    def test_session_renew_issues_a_new_cookie(self):
+        mock_renew = self.patch_blocking('renew_session')
+        mock_renew.return_value = ('new-jwt', 1700000000.0)
+
+        response = self.app.post('/api/v1/session/renew', headers={'Authorization': 'Bearer jwt-value'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data), {'renewed': True, 'expires_at': 1700000000})
+        self.assertIn('session=new-jwt', response.headers['Set-Cookie'])
+        self.assertEqual(response.headers['Cache-Control'], 'no-store')
+        mock_renew.assert_called_once_with('jwt-value')
+
+    def test_session_renew_not_due(self):
+        self.patch_blocking('renew_session').return_value = (None, 1700000000.0)
+
+        response = self.app.post('/api/v1/session/renew', headers={'Authorization': 'Bearer jwt-value'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data), {'renewed': False, 'expires_at': 1700000000})
+        self.assertNotIn('Set-Cookie', response.headers)
+
+    def test_session_renew_invalid(self):
+        self.patch_blocking('renew_session').side_effect = InvalidSessionError("Invalid session token: expired")
+
+        response = self.app.post('/api/v1/session/renew', headers={'Authorization': 'Bearer expired'})
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(json.loads(response.data), {'error': 'Invalid session'})
+
+    def test_logout(self):
+        mock_logout = self.patch_blocking('logout')
+
+        response = self.app.post('/api/v1/logout', headers={'Authorization': 'Bearer jwt-value'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('session=""', response.headers['Set-Cookie'])
+        self.assertIn('Max-Age=0', response.headers['Set-Cookie'])
+        mock_logout.assert_called_once_with('jwt-value')
+
+    def test_logout_invalid_session(self):
+        self.patch_blocking('logout').side_effect = InvalidSessionError("Session was revoked")
+
+        response = self.app.post('/api/v1/logout', headers={'Authorization': 'Bearer revoked'})
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(json.loads(response.data), {'error': 'Invalid session'})
+
+    def test_logout_of_a_session_without_jti(self):
+        self.patch_blocking('logout').side_effect = UnrevocableSessionError('user@example.com', 1700000000)
+
+        response = self.app.post('/api/v1/logout', headers={'Authorization': 'Bearer legacy'})
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(json.loads(response.data)['expires_at'], 1700000000)
+        self.assertNotIn('Set-Cookie', response.headers)
+
+    def test_signin_with_google_missing_code(self):
+        response = self.post_signin({})
+
         self.assertEqual(response.status_code, 400)
         data = json.loads(response.data)
         self.assertEqual(data, {'error': "'Authorization code is required in parameters'"})
 
-    @patch('src.app.authorize_with_google')
-    def test_signin_with_google_authorization_failure(self, mock_authorize):
+    def test_signin_with_google_empty_body(self):
+        response = self.post_signin(None)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.data), {'error': 'POST parameters empty'})
+
+    def test_signin_with_google_authorization_failure(self):
+        mock_authorize = self.patch_pipeline('authorize_with_google')
         mock_authorize.side_effect = Exception("Authorization failed")
 
-        response = self.app.post('/api/v1/signinWithGoogle', 
-                                 data=json.dumps({'authorization_code': 'test_code'}),
-                                 content_type='application/json')
+        response = self.post_signin({'authorization_code': 'test_code'})
 
         self.assertEqual(response.status_code, 500)
         data = json.loads(response.data)
         self.assertEqual(data, {'error': 'Exception occurred during authorization with Google'})
 
-    @patch('src.app.authorize_with_google')
-    @patch('src.app.extract_email_from_token')
-    @patch('src.app.is_user_exists')
-    def test_signin_with_google_user_verification_failure(self, mock_exists, mock_extract_email, mock_authorize):
-        mock_authorize.return_value = ('access_token', 'refresh_token', 'id_token')
-        mock_extract_email.return_value = 'test@example.com'
+    def test_signin_with_google_user_verification_failure(self):
+        mock_authorize = self.patch_pipeline('authorize_with_google')
+        mock_verify = self.patch_pipeline('verify_google_id_token')
+        mock_exists = self.patch_pipeline('is_user_exists')
+        mock_authorize.return_value = ('access_token', 'refresh_token', 'id_token', 1700003600)
+        mock_verify.return_value = IdTokenClaims(email='test@example.com', subject='123')
         mock_exists.side_effect = Exception("Database error")
 
-        response = self.app.post('/api/v1/signinWithGoogle', 
-                                 data=json.dumps({'authorization_code': 'test_code'}),
-                                 content_type='application/json')
+        response = self.post_signin({'authorization_code': 'test_code'})
 
         self.assertEqual(response.status_code, 500)
         data = json.loads(response.data)
         self.assertEqual(data, {'error': 'Exception occurred during customer verification'})
 
-    @patch('src.app.authorize_with_google')
-    @patch('src.app.extract_email_from_token')
-    @patch('src.app.is_user_exists')
-    @patch('src.app.create_user')
-    def test_signin_with_google_user_creation_failure(self, mock_create, mock_exists, mock_extract_email, mock_authorize):
-        mock_authorize.return_value = ('access_token', 'refresh_token', 'id_token')
-        mock_extract_email.return_value = 'test@example.com'
+    def test_signin_with_google_user_creation_failure(self):
+        mock_authorize = self.patch_pipeline('authorize_with_google')
+        mock_verify = self.patch_pipeline('verify_google_id_token')
+        mock_exists = self.patch_pipeline('is_user_exists')
+        mock_create = self.patch_pipeline('create_user')
+        mock_authorize.return_value = ('access_token', 'refresh_token', 'id_token', 1700003600)
+        mock_verify.return_value = IdTokenClaims(email='test@example.com', subject='123')
         mock_exists.return_value = False
         mock_create.return_value = False
 
-        response = self.app.post('/api/v1/signinWithGoogle', 
-                                 data=json.dumps({'authorization_code': 'test_code'}),
-                                 content_type='application/json')
+        response = self.post_signin({'authorization_code': 'test_code'})
 
         self.assertEqual(response.status_code, 500)
         data = json.loads(response.data)
         self.assertEqual(data, {'error': 'Exception occurred during customer signup'})
 
-    @patch('src.app.authorize_with_google')
-    @patch('src.app.extract_email_from_token')
-    @patch('src.app.is_user_exists')
-    @patch('src.app.create_user')
-    @patch('src.app.authenticate_user')
-    def test_signin_with_google_authentication_failure(self, mock_authenticate, mock_create, mock_exists, 
-                                                       mock_extract_email, mock_authorize):
-        mock_authorize.return_value = ('access_token', 'refresh_token', 'id_token')
-        mock_extract_email.return_value = 'test@example.com'
+    def test_signin_with_google_authentication_failure(self):
+        mock_authorize = self.patch_pipeline('authorize_with_google')
+        mock_verify = self.patch_pipeline('verify_google_id_token')
+        mock_exists = self.patch_pipeline('is_user_exists')
+        mock_authenticate = self.patch_pipeline('authenticate_user')
+        mock_authorize.return_value = ('access_token', 'refresh_token', 'id_token', 1700003600)
+        mock_verify.return_value = IdTokenClaims(email='test@example.com', subject='123')
         mock_exists.return_value = True
         mock_authenticate.side_effect = Exception("Authentication failed")
 
-        response = self.app.post('/api/v1/signinWithGoogle', 
-                                 data=json.dumps({'authorization_code': 'test_code'}),
-                                 content_type='application/json')
+        response = self.post_signin({'authorization_code': 'test_code'})
 
         self.assertEqual(response.status_code, 500)
         data = json.loads(response.data)
         self.assertEqual(data, {'error': 'Exception occurred during customer authentication'})
 
+    def test_signin_with_google_conditional_write(self):
+        mock_authorize = self.patch_pipeline('authorize_with_google')
+        mock_verify = self.patch_pipeline('verify_google_id_token')
+        mock_exists = self.patch_pipeline('is_user_exists')
+        mock_signin = self.patch_pipeline('signin_user')
+        self.patch_setting('CONDITIONAL_SIGNIN_WRITE', True)
+        mock_authorize.return_value = ('access_token', 'refresh_token', 'id_token', 1700003600)
+        mock_verify.return_value = IdTokenClaims(email='new_user@example.com', subject='123')
+        mock_signin.return_value = (({'status': 'success', 'token': 'auth_token'}, 200), True)
+
+        response = self.post_signin({'authorization_code': 'test_code'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data), {'status': 'success', 'token': 'auth_token'})
+        mock_signin.assert_called_once_with(mock_verify.return_value, 'access_token', 'refresh_token', 1700003600)
+        mock_exists.assert_not_called()
+
+    def test_signin_with_google_conditional_write_failure(self):
+        mock_authorize = self.patch_pipeline('authorize_with_google')
+        mock_verify = self.patch_pipeline('verify_google_id_token')
+        mock_signin = self.patch_pipeline('signin_user')
+        self.patch_setting('CONDITIONAL_SIGNIN_WRITE', True)
+        mock_authorize.return_value = ('access_token', 'refresh_token', 'id_token', 1700003600)
+        mock_verify.return_value = IdTokenClaims(email='new_user@example.com', subject='123')
+        mock_signin.side_effect = Exception("ProvisionedThroughputExceededException")
+
+        response = self.post_signin({'authorization_code': 'test_code'})
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(json.loads(response.data), {'error': 'Exception occurred during customer authentication'})
+
+    def test_signin_with_google_invalid_id_token(self):
+        mock_authorize = self.patch_pipeline('authorize_with_google')
+        mock_verify = self.patch_pipeline('verify_google_id_token')
+        mock_exists = self.patch_pipeline('is_user_exists')
+        mock_authorize.return_value = ('access_token', 'refresh_token', 'id_token', 1700003600)
+        mock_verify.side_effect = InvalidIdTokenError("Signature verification failed")
+
+        response = self.post_signin({'authorization_code': 'test_code'})
+
+        self.assertEqual(response.status_code, 401)
+        data = json.loads(response.data)
+        self.assertEqual(data, {'error': 'Invalid ID token'})
+        mock_exists.assert_not_called()
+
+    def profile_signins(self):
+        profiler = RequestProfiler(enabled=True, sample_every=1, admin_token='admin-token', interval=60)
+        self.patch_setting('request_profiler', profiler)
+        mock_authorize = self.patch_pipeline('authorize_with_google')
+        mock_verify = self.patch_pipeline('verify_google_id_token')
+        mock_signin = self.patch_pipeline('signin_user')
+        self.patch_setting('CONDITIONAL_SIGNIN_WRITE', True)
+        mock_authorize.return_value = ('access_token', 'refresh_token', 'id_token', 1700003600)
+        mock_verify.return_value = IdTokenClaims(email='new_user@example.com', subject='123')
+        mock_signin.return_value = (({'status': 'success'}, 200), True)
+        for code in ('code-1', 'code-2'):
+            self.assertEqual(self.post_signin({'authorization_code': code}).status_code, 200)
+        return profiler
+
+    def test_admin_profile_is_off_by_default(self):
+        response = self.app.get('/api/v1/admin/profile', headers={'Authorization': 'Bearer '})
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(json.loads(response.data), {'error': 'Not Found'})
+
+    def test_admin_profile_reports_profiled_routes(self):
+        self.profile_signins()
+
+        response = self.app.get('/api/v1/admin/profile', headers={'Authorization': 'Bearer admin-token'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Cache-Control'], 'no-store')
+        summary = json.loads(response.data)
+        self.assertEqual(list(summary), ['POST /api/v1/signinWithGoogle'])
+        self.assertEqual(summary['POST /api/v1/signinWithGoogle']['requests'], 2)
+
+    def test_admin_profile_formats(self):
+        profiler = self.profile_signins()
+        profiler._routes['POST /api/v1/signinWithGoogle'].stacks['app;signin'] = 3
+        headers = {'Authorization': 'Bearer admin-token'}
+
+        collapsed = self.app.get('/api/v1/admin/profile?format=collapsed', headers=headers)
+        speedscope = self.app.get('/api/v1/admin/profile?format=speedscope&route=POST+/api/v1/signinWithGoogle', headers=headers)
+        unknown = self.app.get('/api/v1/admin/profile?format=pstats', headers=headers)
+
+        self.assertEqual(collapsed.status_code, 200)
+        self.assertTrue(collapsed.headers['Content-Type'].startswith('text/plain'))
+        self.assertEqual(collapsed.data, b'POST /api/v1/signinWithGoogle;app;signin 3\n')
+        self.assertEqual(json.loads(speedscope.data)['profiles'][0]['name'], 'POST /api/v1/signinWithGoogle')
+        self.assertEqual(unknown.status_code, 400)
+
+    def test_admin_profile_needs_the_token(self):
+        profiler = self.profile_signins()
+
+        response = self.app.get('/api/v1/admin/profile', headers={'Authorization': 'Bearer guess'})
+        reset = self.app.delete('/api/v1/admin/profile', headers={'Authorization': 'Bearer guess'})
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(json.loads(response.data), {'error': 'Invalid admin token'})
+        self.assertEqual(reset.status_code, 401)
+        self.assertEqual(len(profiler.report()), 1)
+
+    def test_admin_profile_reset(self):
+        profiler = self.profile_signins()
+
+        response = self.app.delete('/api/v1/admin/profile', headers={'Authorization': 'Bearer admin-token'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(profiler.report(), {})
+
+    def test_health_check(self):
+        response = self.app.get('/health')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data), {'status': 'healthy'})
+
+    def test_login_redirect(self):
+        response = self.app.get('/login')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b'Login successful. You can close this window.')
+
+
+class FlaskAppTestCase(SigninWithGoogleTests, unittest.TestCase):
+    module = flask_app_module
+
+    def setUp(self):
+        self.app = flask_app_module.app.test_client()
+        self.app.testing = True
+        signin_deduplicator.clear()
+
+
+class AsgiAppTestCase(SigninWithGoogleTests, unittest.TestCase):
+    module = asgi_app_module
+    mock_class = AsyncMock
+
+    def setUp(self):
+        self.app = AsgiTestClient(asgi_app_module.app)
+        signin_deduplicator.clear()
+
+    def test_unknown_route(self):
+        response = self.app.get('/does-not-exist')
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_cors_header(self):
+        response = self.app.get('/health')
+
+        self.assertEqual(response.headers['Access-Control-Allow-Origin'], '*')
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -0,0 +1,121 @@
+import unittest
+
+import jwt
+
+from benchmarks.stand_ins import LocalAppleServer
+from src import apple_token_client
+from src.apple_token_client import AppleClientSecret, AppleTokenClient, get_apple_token_client
+from src.google_token_client import TokenExchangeError
+
+
+class TestAppleClientSecret(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = LocalAppleServer()
+
+    def setUp(self):
+        self.now = 1_700_000_000.0
+        client_id, team_id, key_id, private_key, _ = self.server.settings()
+        self.client_secret = AppleClientSecret(
+            client_id, team_id, key_id, private_key, lifetime=86400, refresh_before=3600, clock=lambda: self.now
+        )
+
+    def test_assertion_is_signed_once_and_reused(self):
+        first = self.client_secret.get()
+        self.now += 86400 - 3601
+
+        self.assertEqual(self.client_secret.get(), first)
+        self.assertEqual(self.client_secret.signed, 1)
+
+    def test_assertion_is_re_signed_before_it_expires(self):
+        first = self.client_secret.get()
+        self.now += 86400 - 3600
+        second = self.client_secret.get()
+
+        self.assertNotEqual(second, first)
+        self.assertEqual(self.client_secret.signed, 2)
+        claims = jwt.decode(second, options={"verify_signature": False})
+        self.assertEqual(claims["exp"], int(self.now) + 86400)
+
+    def test_assertion_claims(self):
+        assertion = self.client_secret.get()
+        claims = jwt.decode(
+            assertion,
+            self.server.signing_key.public_key(),
+            algorithms=["ES256"],
+            audience="https://appleid.apple.com",
+            options={"verify_exp": False, "verify_iat": False},
+        )
+
+        self.assertEqual(jwt.get_unverified_header(assertion)["kid"], self.server.key_id)
+        self.assertEqual(claims["iss"], self.server.team_id)
+        self.assertEqual(claims["sub"], self.server.issuer.audience)
+
+    def test_refresh_margin_must_be_shorter_than_lifetime(self):
+        with self.assertRaises(ValueError):
+            AppleClientSecret(*self.server.settings()[:4], lifetime=3600, refresh_before=3600)
+
+
+class TestAppleTokenClient(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = LocalAppleServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        client_id, team_id, key_id, private_key, redirect_uri = self.server.settings()
+        self.client_secret = AppleClientSecret(client_id, team_id, key_id, private_key)
+        self.client = AppleTokenClient(self.client_secret, redirect_uri, token_uri=self.server.token_uri, pool_size=2)
+        self.addCleanup(self.client.close)
+
+    def test_exchange_code_reuses_one_assertion_and_connection(self):
+        connections_before = self.server.connections
+        results = [self.client.exchange_code("c0de:user@example.com") for _ in range(3)]
+
+        self.assertTrue(all("id_token" in tokens for tokens in results))
+        self.assertEqual(jwt.decode(results[0]["id_token"], options={"verify_signature": False})["iss"], "https://appleid.apple.com")
+        self.assertEqual(self.client_secret.signed, 1)
+        self.assertEqual(self.server.client_secrets[self.client_secret.get()], 3)
+        self.assertEqual(self.server.connections - connections_before, 1)
+
+    def test_assertion_from_another_key_is_rejected(self):
+        other = LocalAppleServer()
+        client_secret = AppleClientSecret(*self.server.settings()[:3], other.private_key)
+        client = AppleTokenClient(client_secret, "https://example.com/callback", token_uri=self.server.token_uri)
+        self.addCleanup(client.close)
+
+        with self.assertRaises(TokenExchangeError) as context:
+            client.exchange_code("c0de:user@example.com")
+        self.assertEqual(context.exception.status_code, 400)
+
+
+class TestGetAppleTokenClient(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = LocalAppleServer()
+
+    def tearDown(self):
+        apple_token_client._reset_after_fork()
+
+    def test_client_and_assertion_are_reused_for_same_settings(self):
+        first = get_apple_token_client(*self.server.settings())
+
+        self.assertIs(get_apple_token_client(*self.server.settings()), first)
+
+    def test_client_is_rebuilt_when_settings_change(self):
+        first = get_apple_token_client(*self.server.settings())
+        redirected = get_apple_token_client(*self.server.settings("https://example.com/other"))
+        rotated = LocalAppleServer(key_id="ROTATED001")
+        second = get_apple_token_client(*self.server.settings()[:2], "ROTATED001", rotated.private_key, "https://example.com/callback")
+
+        self.assertIsNot(redirected, first)
+        self.assertIs(redirected.assertion, first.assertion)
+        self.assertIsNot(second, redirected)
+        self.assertEqual(second.assertion.key_id, "ROTATED001")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import asyncio
+import json
+import time
+import unittest
+from unittest.mock import patch
+
+from benchmarks.stand_ins import LocalAppleServer, LocalGoogleServer
+from src import apple_token_client, async_service
+from src.async_service import AsyncGoogleTokenClient, authenticate_user, authorize_with_apple, authorize_with_google
+from src.google_token_client import TokenExchangeError
+from src.resilience import Dependency, RetryPolicy, is_http_failure
+
+
+class TestAsyncService(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = LocalGoogleServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def test_token_client_exchange_and_reuse(self):
+        async def scenario():
+            client = AsyncGoogleTokenClient(
+                self.server.issuer.audience, "secret", "uri", token_uri=self.server.token_uri, pool_size=2
+            )
+            try:
+                connections_before = self.server.connections
+                results = [await client.exchange_code("4/0Ab:user@example.com") for _ in range(3)]
+                return results, self.server.connections - connections_before
+            finally:
+                await client.close()
+
+        results, connections = asyncio.run(scenario())
+        self.assertTrue(all("id_token" in tokens for tokens in results))
+        self.assertEqual(connections, 1)
+
+    def test_token_client_error(self):
+        async def scenario():
+            client = AsyncGoogleTokenClient("wrong-client", "secret", "uri", token_uri=self.server.token_uri)
+            try:
+                await client.exchange_code("4/0Ab")
+            finally:
+                await client.close()
+
+        with self.assertRaises(TokenExchangeError):
+            asyncio.run(scenario())
+
+    def test_token_client_retries_refresh_but_not_code_exchange(self):
+        dependency = Dependency(
+            "google_token_async_retries", is_http_failure, retry=RetryPolicy(base_delay=0.001, max_delay=0.001), enabled=True
+        )
+
+        async def scenario():
+            client = AsyncGoogleTokenClient(
+                self.server.issuer.audience, "secret", "uri", token_uri=self.server.token_uri, dependency=dependency
+            )
+            try:
+                self.server.faults.inject(503)
+                requests_before = self.server.token_requests
+                with self.assertRaises(TokenExchangeError):
+                    await client.exchange_code("4/0Ab:user@example.com")
+                exchanges = self.server.token_requests - requests_before
+                self.server.faults.inject(503)
+                requests_before = self.server.token_requests
+                await client.refresh("1//refresh")
+                return exchanges, self.server.token_requests - requests_before
+            finally:
+                self.server.faults.clear()
+                await client.close()
+
+        self.assertEqual(asyncio.run(scenario()), (1, 2))
+
+    @patch('src.async_service.service._fetch_sign_with_google_secrets_from_aws')
+    def test_authorize_with_google(self, mock_fetch_secrets):
+        mock_fetch_secrets.return_value = (self.server.issuer.audience, "secret", "uri")
+
+        async def scenario():
+            with patch('src.async_service.GOOGLE_TOKEN_URI', self.server.token_uri):
+                try:
+                    return await authorize_with_google("4/0Ab:user@example.com")
+                finally:
+                    await async_service.close()
+
+        access_token, refresh_token, id_token, expires_at = asyncio.run(scenario())
+        self.assertTrue(access_token.startswith("ya29."))
+        self.assertGreater(expires_at, time.time())
+        self.assertIsNotNone(refresh_token)
+        self.assertIsNotNone(id_token)
+
+    def test_authorize_with_apple(self):
+        apple = LocalAppleServer().start()
+        self.addCleanup(apple.stop)
+        self.addCleanup(apple_token_client._reset_after_fork)
+
+        async def scenario():
+            with patch('src.async_service.APPLE_TOKEN_URI', apple.token_uri), patch(
+                'src.async_service.service._fetch_sign_with_apple_secrets_from_aws', return_value=apple.settings()
+            ):
+                try:
+                    return [await authorize_with_apple("c0de:user@example.com") for _ in range(2)]
+                finally:
+                    await async_service.close()
+
+        results = asyncio.run(scenario())
+        self.assertTrue(all(id_token for _, _, id_token, _ in results))
+        # One assertion signed for the worker and sent with both exchanges
+        self.assertEqual(list(apple.client_secrets.values()), [2])
+
+    @patch('src.async_service.service.start_session')
+    def test_authenticate_user_sets_cookie(self, mock_start_session):
+        mock_start_session.return_value = "jwt_token"
+        body, status, headers = asyncio.run(authenticate_user("user@example.com"))
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[0][0], "Set-Cookie")
+        self.assertIn("session=jwt_token", headers[0][1])
+        self.assertIn("HttpOnly", headers[0][1])
+
+    @patch('src.async_service.service.start_session')
+    def test_authenticate_user_errors(self, mock_start_session):
+        mock_start_session.side_effect = KeyError("encryption_secret_key not present in AWS Secrets")
+        self.assertEqual(asyncio.run(authenticate_user("user@example.com"))[1], 400)
+
+        mock_start_session.side_effect = json.JSONDecodeError("Expecting value", "invalid json", 0)
+        self.assertEqual(
+            asyncio.run(authenticate_user("user@example.com")),
+            ({"error": "Invalid secret format"}, 500),
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+from decimal import Decimal
+from unittest.mock import patch
+
+import boto3
+
+from benchmarks.stand_ins import LocalAwsServer
+from src import bulk_users
+from src.bulk_users import Throttle, dumps, export_users, import_users, loads
+from src.user_store import DynamoDBUserStore, SQLiteUserStore
+
+
+def users(count):
+    return [
+        {"email": f"user{index:03d}@example.com", "name": f"User {index}", "profile": {"picture": "p.png"}, "logins": index}
+        for index in range(count)
+    ]
+
+
+class TestSerialization(unittest.TestCase):
+    def test_round_trip_keeps_numbers_exact(self):
+        item = {"email": "a@example.com", "count": Decimal("3"), "ratio": Decimal("0.25"), "tags": {"b", "a"}}
+
+        line = dumps(item)
+
+        self.assertEqual(line, '{"count":3,"email":"a@example.com","ratio":0.25,"tags":["a","b"]}')
+        self.assertEqual(loads(line)["ratio"], Decimal("0.25"))
+
+
+class TestThrottle(unittest.TestCase):
+    def test_paces_to_rate(self):
+        throttle = Throttle(rate=1000)
+        started = time.monotonic()
+        for _ in range(4):
+            throttle.wait(25)
+
+        self.assertGreaterEqual(time.monotonic() - started, 0.07)
+
+    def test_zero_rate_is_unthrottled(self):
+        throttle = Throttle(rate=0)
+        started = time.monotonic()
+        throttle.wait(1000000)
+
+        self.assertLess(time.monotonic() - started, 0.05)
+
+
+class TestSQLiteTransfer(unittest.TestCase):
+    def test_export_then_import(self):
+        source = SQLiteUserStore()
+        self.assertEqual(source.batch_put(users(250)), [])
+        output = io.StringIO()
+
+        self.assertEqual(export_users(source, output, segments=3, workers=3, page_size=40), 250)
+
+        target = SQLiteUserStore()
+        totals = import_users(target, io.StringIO(output.getvalue()), workers=2, batch_size=25)
+        self.assertEqual(totals, {"written": 250, "failed": 0})
+        self.assertEqual(target.get("user042@example.com"), users(250)[42])
+
+    def test_export_projection(self):
+        store = SQLiteUserStore()
+        store.batch_put(users(3))
+        output = io.StringIO()
+
+        export_users(store, output, segments=1, workers=1, attributes=["email", "name"])
+
+        self.assertEqual(
+            sorted(loads(line)["email"] for line in output.getvalue().splitlines()),
+            [item["email"] for item in users(3)],
+        )
+        self.assertEqual(set(loads(output.getvalue().splitlines()[0])), {"email", "name"})
+
+    def test_import_then_export_float_fields(self):
+        lines = '{"email":"a@example.com","logins":3,"score":0.25}\n{"email":"b@example.com","score":1.5}\n'
+        store = SQLiteUserStore()
+
+        self.assertEqual(import_users(store, io.StringIO(lines), workers=1), {"written": 2, "failed": 0})
+
+        self.assertEqual(store.get("a@example.com"), {"email": "a@example.com", "logins": 3, "score": 0.25})
+        output = io.StringIO()
+        export_users(store, output, segments=1, workers=1)
+        self.assertEqual(sorted(output.getvalue().splitlines()), lines.splitlines())
+
+    def test_failed_write_stops_the_scans(self):
+        store = SQLiteUserStore()
+        store.batch_put(users(200))
+
+        class BrokenPipe(io.StringIO):
+            def write(self, line):
+                if self.tell() > 500:
+                    raise BrokenPipeError("reader went away")
+                return super().write(line)
+
+        errors = []
+
+        def export():
+            try:
+                export_users(store, BrokenPipe(), segments=4, workers=4, page_size=10)
+            except BrokenPipeError as e:
+                errors.append(e)
+
+        # In a thread, so a hang fails the test instead of blocking the run
+        with patch.object(bulk_users, "QUEUE_SIZE", 2):
+            thread = threading.Thread(target=export, daemon=True)
+            thread.start()
+            thread.join(10)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(errors), 1)
+
+
+class TestDynamoDBTransfer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = LocalAwsServer().start()
+        cls.client = boto3.client(
+            "dynamodb",
+            endpoint_url=cls.server.endpoint_url,
+            region_name="us-east-1",
+            aws_access_key_id="local",
+            aws_secret_access_key="local",
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.server.tables.clear()
+        self.server.scan_page_size = 100
+        self.server.unprocessed_writes = 0
+        self.store = DynamoDBUserStore("user_authentication", client=self.client)
+
+    def test_import_retries_unprocessed_items(self):
+        self.server.unprocessed_writes = 30
+        lines = io.StringIO("\n".join(dumps(item) for item in users(60)) + "\n")
+
+        totals = import_users(self.store, lines, workers=2)
+
+        self.assertEqual(totals, {"written": 60, "failed": 0})
+        self.assertEqual(len(self.server.tables["user_authentication"]), 60)
+        self.assertEqual(self.store.get("user007@example.com")["logins"], 7)
+
+    def test_items_still_unprocessed_after_retries_are_reported(self):
+        self.server.unprocessed_writes = 1000
+        failed = io.StringIO()
+
+        with patch("src.user_store.time.sleep"):
+            totals = import_users(self.store, [dumps(item) for item in users(3)], failed_output=failed)
+
+        self.assertEqual(totals, {"written": 0, "failed": 3})
+        self.assertEqual(len(failed.getvalue().splitlines()), 3)
+
+    def test_parallel_scan_returns_every_item_once(self):
+        self.store.batch_put(users(230))
+        self.server.scan_page_size = 20
+        output = io.StringIO()
+
+        count = export_users(self.store, output, segments=4, workers=4)
+
+        emails = [loads(line)["email"] for line in output.getvalue().splitlines()]
+        self.assertEqual(count, 230)
+        self.assertEqual(sorted(emails), [item["email"] for item in users(230)])
+        self.assertGreater(self.server.requests["Scan"], 4)
+
+    def test_cli_round_trip(self):
+        self.store.batch_put(users(10))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "users.ndjson")
+            with patch.object(bulk_users, "_store", lambda table: self.store):
+                self.assertEqual(bulk_users.main(["export", "--segments", "2", "--output", path]), 0)
+                self.server.tables.clear()
+                self.assertEqual(bulk_users.main(["import", "--input", path]), 0)
+
+        self.assertEqual(len(self.server.tables["user_authentication"]), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
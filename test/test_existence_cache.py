@@ -0,0 +1,82 @@
+import os
+import tempfile
+import unittest
+
+from src.existence_cache import UserExistenceCache
+from src.shared_cache import SharedCache
+
+
+class TestUserExistenceCache(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.cache = UserExistenceCache(max_entries=3, positive_ttl=3600, negative_ttl=5, clock=lambda: self.now)
+
+    def test_negative_entries_expire_sooner(self):
+        self.cache.put("new@example.com", False)
+        self.cache.put("known@example.com", True)
+
+        self.assertIs(self.cache.get("new@example.com"), False)
+        self.now = 5
+        self.assertIsNone(self.cache.get("new@example.com"))
+        self.assertIs(self.cache.get("known@example.com"), True)
+        self.now = 3600
+        self.assertIsNone(self.cache.get("known@example.com"))
+
+    def test_size_bound_evicts_least_recently_used(self):
+        for email in ("a", "b", "c"):
+            self.cache.put(email, True)
+        self.cache.get("a")
+        self.cache.put("d", True)
+
+        self.assertEqual(len(self.cache), 3)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertIs(self.cache.get("a"), True)
+
+    def test_invalidate(self):
+        self.cache.put("new@example.com", False)
+        self.cache.invalidate("new@example.com")
+
+        self.assertIsNone(self.cache.get("new@example.com"))
+
+    def test_disabled(self):
+        cache = UserExistenceCache(enabled=False)
+        cache.put("known@example.com", True)
+
+        self.assertIsNone(cache.get("known@example.com"))
+        self.assertEqual(len(cache), 0)
+
+
+
+class TestSharedUserExistenceCache(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.now = 1000.0
+        path = os.path.join(directory.name, "user-exists.cache")
+        self.workers = [
+            UserExistenceCache(positive_ttl=3600, negative_ttl=5, shared=SharedCache(path, slots=64, clock=lambda: self.now))
+            for _ in range(2)
+        ]
+        for worker in self.workers:
+            self.addCleanup(worker.shared.close)
+
+    def test_entries_are_seen_by_every_worker(self):
+        first, second = self.workers
+        first.put("known@example.com", True)
+        first.put("new@example.com", False)
+
+        self.assertIs(second.get("known@example.com"), True)
+        self.assertIs(second.get("new@example.com"), False)
+        self.now += 5
+        self.assertIsNone(second.get("new@example.com"))
+
+    def test_invalidate_reaches_every_worker(self):
+        first, second = self.workers
+        first.put("new@example.com", False)
+        second.invalidate("new@example.com")
+
+        self.assertIsNone(first.get("new@example.com"))
+
+
+if __name__ == "__main__":
+    unittest.main()
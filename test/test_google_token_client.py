@@ -0,0 +1,64 @@
+import unittest
+
+from benchmarks.stand_ins import LocalGoogleServer
+from src import google_token_client
+from src.google_token_client import GoogleTokenClient, TokenExchangeError, get_google_token_client
+
+
+class TestGoogleTokenClient(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = LocalGoogleServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.client = GoogleTokenClient(
+            self.server.issuer.audience, "client_secret", "https://example.com/callback",
+            token_uri=self.server.token_uri, pool_size=2,
+        )
+        self.addCleanup(self.client.close)
+
+    def test_exchange_code(self):
+        tokens = self.client.exchange_code("4/0Ab:user@example.com")
+        self.assertTrue(tokens["access_token"].startswith("ya29."))
+        self.assertIn("refresh_token", tokens)
+        self.assertIn("id_token", tokens)
+
+    def test_refresh(self):
+        tokens = self.client.refresh("1//refresh")
+        self.assertIn("access_token", tokens)
+        self.assertEqual(tokens["expires_in"], 3599)
+
+    def test_connections_are_reused(self):
+        connections_before = self.server.connections
+        for _ in range(5):
+            self.client.exchange_code("4/0Ab:user@example.com")
+        self.assertEqual(self.server.connections - connections_before, 1)
+
+    def test_error_response_raises(self):
+        with self.assertRaises(TokenExchangeError) as context:
+            self.client.exchange_code("")
+        self.assertEqual(context.exception.status_code, 400)
+
+
+class TestGetGoogleTokenClient(unittest.TestCase):
+    def tearDown(self):
+        google_token_client._client = None
+        google_token_client._client_config = None
+
+    def test_client_is_reused_for_same_settings(self):
+        first = get_google_token_client("id", "secret", "uri")
+        self.assertIs(get_google_token_client("id", "secret", "uri"), first)
+
+    def test_client_is_rebuilt_when_settings_change(self):
+        first = get_google_token_client("id", "secret", "uri")
+        second = get_google_token_client("id", "rotated-secret", "uri")
+        self.assertIsNot(second, first)
+        self.assertEqual(second.client_secret, "rotated-secret")
+
+
+if __name__ == '__main__':
+    unittest.main()
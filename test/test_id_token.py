@@ -0,0 +1,115 @@
+import time
+import unittest
+
+from benchmarks.stand_ins import LocalJwksIssuer
+from src.constants import GOOGLE_ISSUERS
+from src.id_token import (
+    IdTokenClaims,
+    InvalidIdTokenError,
+    JwksCache,
+    parse_max_age,
+    verify_id_token,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestIdToken(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.issuer = LocalJwksIssuer(max_age=600)
+
+    def setUp(self):
+        self.issuer.fetches = 0
+        self.clock = FakeClock()
+        self.jwks_cache = JwksCache("local", fetcher=self.issuer.fetch, min_refetch_interval=30, clock=self.clock)
+
+    def _verify(self, id_token, audience=None):
+        return verify_id_token(id_token, self.jwks_cache, audience or self.issuer.audience, GOOGLE_ISSUERS)
+
+    def test_verify_returns_claims(self):
+        claims = self._verify(self.issuer.mint_id_token("user@example.com", name="Test User"))
+        self.assertIsInstance(claims, IdTokenClaims)
+        self.assertEqual(claims.email, "user@example.com")
+        self.assertEqual(claims.name, "Test User")
+        self.assertEqual(claims.profile["picture"], "https://example.com/photo.png")
+
+    def test_keys_are_cached_for_max_age(self):
+        id_token = self.issuer.mint_id_token("user@example.com")
+        self._verify(id_token)
+        self._verify(id_token)
+        self.assertEqual(self.issuer.fetches, 1)
+
+        self.clock.now += 601
+        self._verify(id_token)
+        self.assertEqual(self.issuer.fetches, 2)
+
+    def test_unknown_kid_triggers_refetch(self):
+        self._verify(self.issuer.mint_id_token("user@example.com"))
+        self.issuer.add_key("rotated-key")
+        self.clock.now += 31
+
+        claims = self._verify(self.issuer.mint_id_token("user@example.com", kid="rotated-key"))
+        self.assertEqual(claims.email, "user@example.com")
+        self.assertEqual(self.issuer.fetches, 2)
+
+    def test_unknown_kid_refetch_is_rate_limited(self):
+        self._verify(self.issuer.mint_id_token("user@example.com"))
+        self.issuer.add_key("too-soon-key")
+
+        with self.assertRaises(InvalidIdTokenError):
+            self._verify(self.issuer.mint_id_token("user@example.com", kid="too-soon-key"))
+        self.assertEqual(self.issuer.fetches, 1)
+
+    def test_refresh_failure_keeps_cached_keys(self):
+        id_token = self.issuer.mint_id_token("user@example.com")
+        self._verify(id_token)
+
+        def failing_fetch(uri):
+            raise ConnectionError("JWKS endpoint down")
+
+        self.jwks_cache._fetcher = failing_fetch
+        self.clock.now += 601
+        self.assertEqual(self._verify(id_token).email, "user@example.com")
+
+    def test_wrong_audience_is_rejected(self):
+        with self.assertRaises(InvalidIdTokenError):
+            self._verify(self.issuer.mint_id_token("user@example.com"), audience="another-client")
+
+    def test_wrong_issuer_is_rejected(self):
+        with self.assertRaises(InvalidIdTokenError):
+            self._verify(self.issuer.mint_id_token("user@example.com", iss="https://evil.example.com"))
+
+    def test_expired_token_is_rejected(self):
+        past = int(time.time()) - 7200
+        with self.assertRaises(InvalidIdTokenError):
+            self._verify(self.issuer.mint_id_token("user@example.com", iat=past, exp=past + 3600))
+
+    def test_tampered_signature_is_rejected(self):
+        header, payload, signature = self.issuer.mint_id_token("user@example.com").split(".")
+        other_payload = self.issuer.mint_id_token("attacker@example.com").split(".")[1]
+        with self.assertRaises(InvalidIdTokenError):
+            self._verify(".".join([header, other_payload, signature]))
+
+    def test_unverified_email_is_rejected(self):
+        for email_verified in (False, "false", None):
+            with self.assertRaises(InvalidIdTokenError):
+                self._verify(self.issuer.mint_id_token("user@example.com", email_verified=email_verified))
+
+    def test_apple_string_email_verified_is_accepted(self):
+        claims = self._verify(self.issuer.mint_id_token("user@example.com", email_verified="true"))
+        self.assertEqual(claims.email, "user@example.com")
+
+    def test_parse_max_age(self):
+        self.assertEqual(parse_max_age({"cache-control": "public, max-age=19836, must-revalidate"}, 10), 19836)
+        self.assertEqual(parse_max_age({}, 10), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,31 +1,23 @@
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import ANY, patch, MagicMock
 from datetime import datetime, timedelta
 from flask import Flask
 from http.cookies import SimpleCookie
 
-from src.local_utils import extract_email_from_token, create_cookie
-from src.constants import COOKIE_DAYS_TO_EXPIRE, AUTHENTICATION_DDB_TABLE
+from src.local_utils import InvalidSessionError, create_cookie, session_token_from_headers, verify_session_token
+from src.constants import COOKIE_DAYS_TO_EXPIRE
 
 class TestLocalUtils(unittest.TestCase):
     def setUp(self):
         self.app = Flask(__name__)
 
-    @patch('src.local_utils.extract_email')
-    def test_extract_email_from_token(self, mock_extract_email):
-        mock_extract_email.return_value = 'test@example.com'
-        result = extract_email_from_token('dummy_token')
-        self.assertEqual(result, 'test@example.com')
-        mock_extract_email.assert_called_once_with('dummy_token')
-
     @patch('src.local_utils.datetime')
     @patch('src.local_utils.create_jwt')
-    @patch('src.local_utils.update_to_dynamodb')
-    def test_create_cookie_success(self, mock_update, mock_create_jwt, mock_datetime):
+    @patch('src.local_utils.get_user_store')
+    def test_create_cookie_success(self, mock_get_store, mock_create_jwt, mock_datetime):
         mock_now = datetime(2023, 1, 1, 12, 0, 0)
         mock_datetime.now.return_value = mock_now
         mock_create_jwt.return_value = 'dummy_jwt_token'
-        mock_update.return_value = {'status': 200}
 
         with self.app.test_request_context():
             result = create_cookie('test@example.com', 'secret_key')
@@ -46,24 +38,22 @@ class TestLocalUtils(unittest.TestCase):
             "email": 'test@example.com',
             "iat": mock_now,
             "exp": mock_now + timedelta(days=COOKIE_DAYS_TO_EXPIRE),
+            "jti": ANY,
         }
         mock_create_jwt.assert_called_once_with(expected_payload, 'secret_key')
 
-        mock_update.assert_called_once_with(
-            AUTHENTICATION_DDB_TABLE,
-            {"email": 'test@example.com'},
-            {":sst": str(mock_now), ":jwt": 'dummy_jwt_token'},
-            "SET session_start_time = :sst, jwt = :jwt",
+        mock_get_store.return_value.update_session.assert_called_once_with(
+            'test@example.com', str(mock_now), 'dummy_jwt_token'
         )
 
     @patch('src.local_utils.datetime')
     @patch('src.local_utils.create_jwt')
-    @patch('src.local_utils.update_to_dynamodb')
-    def test_create_cookie_update_failure(self, mock_update, mock_create_jwt, mock_datetime):
+    @patch('src.local_utils.get_user_store')
+    def test_create_cookie_update_failure(self, mock_get_store, mock_create_jwt, mock_datetime):
         mock_now = datetime(2023, 1, 1, 12, 0, 0)
         mock_datetime.now.return_value = mock_now
         mock_create_jwt.return_value = 'dummy_jwt_token'
-        mock_update.return_value = {'status': 500}
+        mock_get_store.return_value.update_session.side_effect = Exception("Unable to create session")
 
         with self.app.test_request_context():
             result = create_cookie('test@example.com', 'secret_key')
@@ -82,5 +72,24 @@ class TestLocalUtils(unittest.TestCase):
         self.assertIsNone(result)
         self.assertIn('ERROR:root:ValueError: JWT creation failed', log.output[0])
 
+    def test_session_token_from_headers(self):
+        self.assertEqual(session_token_from_headers({"cookie": "theme=dark; session=abc.def.ghi"}), "abc.def.ghi")
+        self.assertEqual(session_token_from_headers({"authorization": "Bearer abc.def.ghi"}), "abc.def.ghi")
+        self.assertIsNone(session_token_from_headers({"cookie": "theme=dark"}))
+        self.assertIsNone(session_token_from_headers({}))
+
+    def test_verify_session_token(self):
+        import jwt
+
+        now = datetime.now()
+        secret = "session-secret-of-at-least-32-bytes"
+        token = jwt.encode({"email": "user@example.com", "iat": now, "exp": now + timedelta(days=1)}, secret, algorithm="HS256")
+        expired = jwt.encode({"email": "user@example.com", "exp": now - timedelta(days=1)}, secret, algorithm="HS256")
+
+        self.assertEqual(verify_session_token(token, secret)["email"], "user@example.com")
+        for invalid, key in ((token, "other-secret-of-at-least-32-bytes"), (expired, secret), ("garbage", secret)):
+            with self.assertRaises(InvalidSessionError):
+                verify_session_token(invalid, key)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,241 @@
+import asyncio
+import json
+import sys
+import threading
+import time
+import unittest
+
+from src import async_service
+from src.profiling import OTHER_STACKS, RequestProfiler, current_profile
+from src.stage_metrics import GOOGLE_TOKEN_EXCHANGE, SECRETS_FETCH, TOKEN_ENCRYPTION, USER_LOOKUP, observe_stage
+
+ADMIN_TOKEN = "admin-token-for-profiling-tests"
+ROUTE = "POST /api/v1/signinWithGoogle"
+
+
+def profiler(**kwargs):
+    kwargs.setdefault("enabled", True)
+    kwargs.setdefault("sample_every", 1)
+    kwargs.setdefault("admin_token", ADMIN_TOKEN)
+    # Long enough that the sampler thread stays out of the way; tests call sample() themselves
+    kwargs.setdefault("interval", 60)
+    return RequestProfiler(**kwargs)
+
+
+def blocked_in_google_exchange(started, release):
+    started.set()
+    release.wait(5)
+
+
+def blocked_in_secrets_fetch(started, release):
+    started.set()
+    release.wait(5)
+
+
+class ProfiledThread:
+    # A request thread that stays in blocked_in_google_exchange until the test has sampled it
+    def __init__(self, request_profiler, route=ROUTE, target=blocked_in_google_exchange):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+        def run():
+            profiled = request_profiler.begin(route, {})
+            try:
+                target(self.started, self.release)
+            finally:
+                request_profiler.end(profiled)
+
+        self.thread = threading.Thread(target=run)
+
+    def __enter__(self):
+        self.thread.start()
+        self.started.wait(5)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release.set()
+        self.thread.join(5)
+
+
+class TestSampling(unittest.TestCase):
+    def test_off_profiles_nothing(self):
+        request_profiler = profiler(enabled=False)
+
+        self.assertIsNone(request_profiler.begin(ROUTE, {"X-Profile-Request": ADMIN_TOKEN}))
+        self.assertIsNone(current_profile.get())
+
+    def test_one_in_n_requests(self):
+        request_profiler = profiler(sample_every=4)
+
+        self.assertEqual([request_profiler.should_profile({}) for _ in range(8)], [False, False, False, True] * 2)
+        self.assertFalse(profiler(sample_every=0).should_profile({}))
+
+    def test_trigger_header_needs_the_admin_token(self):
+        request_profiler = profiler(sample_every=0)
+
+        self.assertTrue(request_profiler.should_profile({"X-Profile-Request": ADMIN_TOKEN}))
+        self.assertTrue(request_profiler.should_profile({"x-profile-request": ADMIN_TOKEN}))
+        self.assertFalse(request_profiler.should_profile({"X-Profile-Request": "guess"}))
+        self.assertFalse(profiler(sample_every=0, admin_token="").should_profile({"X-Profile-Request": ""}))
+
+    def test_samples_are_aggregated_per_route(self):
+        request_profiler = profiler()
+        with ProfiledThread(request_profiler), ProfiledThread(request_profiler, "GET /api/v1/accessToken"):
+            request_profiler.sample()
+            request_profiler.sample()
+
+        collapsed = request_profiler.report("collapsed")
+        lines = collapsed.splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith("GET /api/v1/accessToken;"))
+        self.assertTrue(lines[1].startswith(f"{ROUTE};"))
+        for line in lines:
+            stack, count = line.rsplit(" ", 1)
+            self.assertEqual(count, "2")
+            self.assertIn(";blocked_in_google_exchange (test/test_profiling.py:", stack)
+        summary = request_profiler.report()
+        self.assertEqual(summary[ROUTE]["requests"], 1)
+        self.assertEqual(summary[ROUTE]["samples"], 2)
+        self.assertEqual(list(request_profiler.report(route=ROUTE)), [ROUTE])
+
+    def test_threads_are_not_sampled_after_the_request(self):
+        request_profiler = profiler()
+        with ProfiledThread(request_profiler):
+            pass
+        request_profiler.sample()
+
+        self.assertEqual(request_profiler.report()[ROUTE]["samples"], 0)
+
+    def test_distinct_stacks_are_capped(self):
+        request_profiler = profiler(max_stacks=1)
+        with ProfiledThread(request_profiler):
+            request_profiler.sample()
+        with ProfiledThread(request_profiler, target=blocked_in_secrets_fetch):
+            request_profiler.sample()
+
+        stacks = [line.rsplit(" ", 1)[0] for line in request_profiler.report("collapsed").splitlines()]
+        self.assertEqual(len(stacks), 2)
+        self.assertIn(f"{ROUTE};{OTHER_STACKS}", stacks)
+
+    def test_sampler_thread(self):
+        request_profiler = profiler(interval=0.001)
+        with ProfiledThread(request_profiler):
+            deadline = time.monotonic() + 5
+            while not request_profiler.report("collapsed") and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+        self.assertIn("blocked_in_google_exchange", request_profiler.report("collapsed"))
+
+
+class TestEventLoop(unittest.TestCase):
+    def test_only_the_requests_own_coroutine_is_sampled_on_the_loop(self):
+        request_profiler = profiler()
+
+        async def profiled_request():
+            profiled = request_profiler.begin(ROUTE, {}, sys._getframe())
+            try:
+                # other_request runs and samples the loop while this one waits
+                await asyncio.sleep(0)
+                request_profiler.sample()
+            finally:
+                request_profiler.end(profiled)
+
+        async def other_request():
+            request_profiler.sample()
+
+        async def main():
+            await asyncio.gather(profiled_request(), other_request())
+
+        asyncio.run(main())
+
+        collapsed = request_profiler.report("collapsed")
+        self.assertIn("profiled_request", collapsed)
+        self.assertNotIn("other_request", collapsed)
+        self.assertEqual(request_profiler.report()[ROUTE]["samples"], 1)
+
+    def test_blocking_calls_of_the_request_are_sampled(self):
+        request_profiler = profiler()
+
+        def blocking_work():
+            request_profiler.sample()
+
+        async def profiled_request():
+            profiled = request_profiler.begin(ROUTE, {}, sys._getframe())
+            try:
+                await async_service.run_blocking(blocking_work)
+            finally:
+                request_profiler.end(profiled)
+
+        asyncio.run(profiled_request())
+        asyncio.run(async_service.run_blocking(blocking_work))
+
+        stacks = [line for line in request_profiler.report("collapsed").splitlines() if "blocking_work" in line]
+        self.assertEqual(len(stacks), 1)
+        self.assertTrue(stacks[0].endswith(" 1"))
+
+
+class TestStages(unittest.TestCase):
+    def test_stage_time_is_split_by_dependency(self):
+        request_profiler = profiler()
+        profiled = request_profiler.begin(ROUTE, {})
+        try:
+            for stage in (SECRETS_FETCH, GOOGLE_TOKEN_EXCHANGE, USER_LOOKUP, TOKEN_ENCRYPTION):
+                with observe_stage(stage):
+                    time.sleep(0.002)
+        finally:
+            request_profiler.end(profiled)
+        with observe_stage(USER_LOOKUP):
+            pass
+
+        summary = request_profiler.report()[ROUTE]
+        self.assertEqual(
+            sorted(summary["stage_seconds"]), [GOOGLE_TOKEN_EXCHANGE, SECRETS_FETCH, TOKEN_ENCRYPTION, USER_LOOKUP]
+        )
+        self.assertEqual(sorted(summary["group_seconds"]), ["crypto", "dynamodb", "google", "other", "secrets"])
+        for group in ("crypto", "dynamodb", "google", "secrets"):
+            self.assertGreaterEqual(summary["group_seconds"][group], 0.002)
+        self.assertAlmostEqual(sum(summary["group_seconds"].values()), summary["wall_seconds"], places=4)
+
+
+class TestReports(unittest.TestCase):
+    def test_speedscope(self):
+        request_profiler = profiler()
+        with ProfiledThread(request_profiler):
+            request_profiler.sample()
+
+        document = json.loads(json.dumps(request_profiler.report("speedscope")))
+        self.assertEqual(document["$schema"], "https://www.speedscope.app/file-format-schema.json")
+        frames = [frame["name"] for frame in document["shared"]["frames"]]
+        (profile,) = document["profiles"]
+        self.assertEqual((profile["type"], profile["name"], profile["unit"]), ("sampled", ROUTE, "seconds"))
+        self.assertEqual(profile["weights"], [60])
+        self.assertEqual(profile["endValue"], 60)
+        (sample,) = profile["samples"]
+        self.assertIn("blocked_in_google_exchange", frames[sample[-3]])
+        self.assertTrue(frames[sample[-1]].startswith("Condition.wait (threading.py:"))
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            profiler().report("pstats")
+
+    def test_reset(self):
+        request_profiler = profiler()
+        with ProfiledThread(request_profiler):
+            request_profiler.sample()
+        request_profiler.reset()
+
+        self.assertEqual(request_profiler.report(), {})
+
+    def test_admin_token(self):
+        request_profiler = profiler()
+
+        self.assertIsNone(request_profiler.admin_error({"Authorization": f"Bearer {ADMIN_TOKEN}"}))
+        self.assertIsNone(request_profiler.admin_error({"authorization": f"bearer {ADMIN_TOKEN}"}))
+        self.assertEqual(request_profiler.admin_error({"Authorization": "Bearer guess"}), 401)
+        self.assertEqual(request_profiler.admin_error({}), 401)
+        self.assertEqual(profiler(admin_token="").admin_error({"Authorization": "Bearer "}), 404)
+        self.assertEqual(profiler(enabled=False).admin_error({"Authorization": f"Bearer {ADMIN_TOKEN}"}), 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,446 @@
+import asyncio
+import threading
+import time
+import unittest
+
+import boto3
+from botocore.config import Config
+from prometheus_client import REGISTRY
+
+from benchmarks.stand_ins import DROP, THROTTLE, LocalAwsServer, LocalGoogleServer
+from src.google_token_client import GoogleTokenClient, TokenExchangeError
+from src.resilience import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+    DeadlineExceeded,
+    Dependency,
+    RetryPolicy,
+    call_timeout,
+    is_aws_failure,
+    is_connect_failure,
+    is_http_failure,
+    request_deadline,
+)
+from src.user_store import DynamoDBUserStore, ResilientUserStore
+
+
+def sample(name, dependency, **labels):
+    return REGISTRY.get_sample_value(name, dict(labels, dependency=dependency)) or 0.0
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.breaker = CircuitBreaker("test_breaker", failure_threshold=3, reset_timeout=30, clock=lambda: self.now)
+
+    def test_opens_after_consecutive_failures(self):
+        for _ in range(2):
+            self.breaker.record_failure()
+        self.breaker.record_success()
+        for _ in range(2):
+            self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CLOSED)
+
+        self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(sample("dependency_circuit_state", "test_breaker"), OPEN)
+
+    def test_half_open_lets_one_probe_through(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.now += 30
+
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_probe_opens_again(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+
+        self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.state, OPEN)
+        self.now += 29
+        self.assertFalse(self.breaker.allow())
+
+    def test_lost_probe_is_replaced_after_the_reset_timeout(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+
+        self.now += 29
+        self.assertFalse(self.breaker.allow())
+        self.now += 1
+        self.assertTrue(self.breaker.allow())
+
+
+class TestFailureClassification(unittest.TestCase):
+    def test_http(self):
+        self.assertTrue(is_http_failure(TokenExchangeError("unavailable", 503)))
+        self.assertTrue(is_http_failure(TokenExchangeError("slow down", 429)))
+        self.assertTrue(is_http_failure(ConnectionResetError()))
+        self.assertFalse(is_http_failure(TokenExchangeError("invalid_grant", 400)))
+        self.assertFalse(is_http_failure(ValueError()))
+
+    def test_connect(self):
+        import requests
+        from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+        refused = NewConnectionError(None, "Connection refused")
+        self.assertTrue(is_connect_failure(requests.ConnectionError(MaxRetryError(None, "/token", refused))))
+        self.assertTrue(is_connect_failure(requests.ConnectTimeout()))
+        self.assertFalse(is_connect_failure(requests.ConnectionError(ProtocolError("Connection aborted"))))
+        self.assertFalse(is_connect_failure(requests.ReadTimeout()))
+        self.assertFalse(is_connect_failure(TokenExchangeError("unavailable", 503)))
+
+    def test_aws(self):
+        from botocore.exceptions import ClientError
+
+        def error(code, status):
+            return ClientError({"Error": {"Code": code}, "ResponseMetadata": {"HTTPStatusCode": status}}, "GetItem")
+
+        self.assertTrue(is_aws_failure(error("ProvisionedThroughputExceededException", 400)))
+        self.assertTrue(is_aws_failure(error("InternalServerError", 500)))
+        self.assertFalse(is_aws_failure(error("ConditionalCheckFailedException", 400)))
+
+
+class TestDependency(unittest.TestCase):
+    def setUp(self):
+        self.sleeps = []
+        self.dependency = self.make_dependency(self._testMethodName)
+
+    def make_dependency(self, name, **kwargs):
+        kwargs.setdefault("retry", RetryPolicy(max_attempts=3, base_delay=0.01, max_delay=0.01))
+        return Dependency(name, is_http_failure, enabled=True, sleep=self.sleeps.append, **kwargs)
+
+    def failing(self, *errors, result="ok"):
+        errors = list(errors)
+        calls = []
+
+        def fn():
+            calls.append(1)
+            if errors:
+                raise errors.pop(0)
+            return result
+
+        return fn, calls
+
+    def test_retries_failures_with_backoff(self):
+        fn, calls = self.failing(TokenExchangeError("unavailable", 503), ConnectionResetError())
+
+        self.assertEqual(self.dependency.call(fn), "ok")
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(len(self.sleeps), 2)
+        self.assertTrue(all(0 <= delay <= 0.01 for delay in self.sleeps))
+        self.assertEqual(sample("dependency_retries_total", self.dependency.name), 2)
+
+    def test_attempts_are_bounded(self):
+        fn, calls = self.failing(*[TokenExchangeError("unavailable", 503)] * 5)
+
+        with self.assertRaises(TokenExchangeError):
+            self.dependency.call(fn)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(sample("dependency_calls_total", self.dependency.name, result="failure"), 1)
+
+    def test_rejected_requests_are_not_retried(self):
+        fn, calls = self.failing(TokenExchangeError("invalid_grant", 400))
+
+        with self.assertRaises(TokenExchangeError):
+            self.dependency.call(fn)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.dependency.breaker.state, CLOSED)
+
+    def test_retries_stop_at_the_deadline(self):
+        def slow_failure():
+            time.sleep(0.03)
+            raise TokenExchangeError("unavailable", 503)
+
+        with request_deadline(0.02), self.assertRaises(TokenExchangeError):
+            self.dependency.call(slow_failure)
+        self.assertEqual(self.sleeps, [])
+
+    def test_no_call_after_the_deadline(self):
+        fn, calls = self.failing()
+
+        with request_deadline(0), self.assertRaises(DeadlineExceeded):
+            self.dependency.call(fn)
+        self.assertEqual(calls, [])
+
+    def test_nested_deadline_only_shortens(self):
+        with request_deadline(0.5):
+            with request_deadline(60):
+                self.assertLessEqual(call_timeout(10), 0.5)
+            with request_deadline(0.1):
+                self.assertLessEqual(call_timeout(10), 0.1)
+        self.assertEqual(call_timeout(10), 10)
+
+    def test_open_circuit_fails_fast(self):
+        dependency = self.make_dependency("test_open_circuit", breaker=CircuitBreaker("test_open_circuit", failure_threshold=2))
+        fn, calls = self.failing(*[TokenExchangeError("unavailable", 503)] * 5)
+
+        with self.assertRaises(CircuitOpenError):
+            dependency.call(fn)
+        with self.assertRaises(CircuitOpenError):
+            dependency.call(fn)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(sample("dependency_calls_total", "test_open_circuit", result="circuit_open"), 2)
+
+    def test_timeout(self):
+        dependency = self.make_dependency("test_timeout", timeout=0.05, retry=RetryPolicy(max_attempts=1))
+        released = threading.Event()
+        self.addCleanup(released.set)
+
+        start = time.perf_counter()
+        with self.assertRaises(TimeoutError):
+            dependency.call(lambda: released.wait(5))
+        self.assertLess(time.perf_counter() - start, 1)
+
+    def test_hedged_read_after_p95(self):
+        for _ in range(20):
+            self.dependency.latency.observe(0.02)
+        released = threading.Event()
+        self.addCleanup(released.set)
+        calls = []
+
+        def read():
+            calls.append(1)
+            if len(calls) == 1:
+                released.wait(5)
+                return "slow"
+            return "fast"
+
+        start = time.perf_counter()
+        self.assertEqual(self.dependency.call(read, hedge=True), "fast")
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(sample("dependency_hedged_requests_total", self.dependency.name, result="sent"), 1)
+        self.assertEqual(sample("dependency_hedged_requests_total", self.dependency.name, result="won"), 1)
+
+    def test_no_hedge_without_latency_history(self):
+        fn, calls = self.failing()
+
+        self.assertEqual(self.dependency.call(fn, hedge=True), "ok")
+        self.assertEqual(len(calls), 1)
+
+    def test_async_retries(self):
+        errors = [asyncio.TimeoutError()]
+
+        async def fn():
+            if errors:
+                raise errors.pop()
+            return "ok"
+
+        async def run():
+            return await self.dependency.call_async(fn)
+
+        self.assertEqual(asyncio.run(run()), "ok")
+        self.assertEqual(sample("dependency_retries_total", self.dependency.name), 1)
+
+    def test_retry_if_limits_retried_failures(self):
+        fn, calls = self.failing(TokenExchangeError("unavailable", 503))
+
+        with self.assertRaises(TokenExchangeError):
+            self.dependency.call(fn, retry_if=lambda exc: isinstance(exc, ConnectionRefusedError))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.dependency.breaker._failures, 1)
+        self.assertEqual(sample("dependency_calls_total", self.dependency.name, result="failure"), 1)
+
+        errors = [ConnectionRefusedError(), asyncio.TimeoutError()]
+
+        async def async_fn():
+            raise errors.pop(0)
+
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(self.dependency.call_async(async_fn, retry_if=lambda exc: isinstance(exc, ConnectionRefusedError)))
+        self.assertEqual(errors, [])
+        self.assertEqual(sample("dependency_retries_total", self.dependency.name), 1)
+
+    def open_circuit(self, name):
+        self.now = 0.0
+        breaker = CircuitBreaker(name, failure_threshold=1, reset_timeout=30, clock=lambda: self.now)
+        dependency = self.make_dependency(name, breaker=breaker, retry=RetryPolicy(max_attempts=1))
+        breaker.record_failure()
+        self.now += 30
+        return dependency
+
+    def test_cancelled_probe_lets_the_next_call_probe(self):
+        dependency = self.open_circuit("test_cancelled_probe")
+
+        async def hang():
+            await asyncio.Event().wait()
+
+        async def ok():
+            return "ok"
+
+        async def run():
+            probe = asyncio.ensure_future(dependency.call_async(hang))
+            await asyncio.sleep(0)
+            probe.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await probe
+            return await dependency.call_async(ok)
+
+        self.assertEqual(asyncio.run(run()), "ok")
+        self.assertEqual(dependency.breaker.state, CLOSED)
+
+    def test_probe_past_the_deadline_lets_the_next_call_probe(self):
+        dependency = self.open_circuit("test_deadline_probe")
+
+        def past_deadline():
+            raise DeadlineExceeded("test_deadline_probe", "Request deadline exceeded")
+
+        with self.assertRaises(DeadlineExceeded):
+            dependency.call(past_deadline)
+
+        self.assertEqual(dependency.call(lambda: "ok"), "ok")
+        self.assertEqual(dependency.breaker.state, CLOSED)
+
+    def test_disabled_calls_straight_through(self):
+        dependency = Dependency("test_disabled", is_http_failure, enabled=False)
+        fn, calls = self.failing(TokenExchangeError("unavailable", 503))
+
+        with self.assertRaises(TokenExchangeError):
+            dependency.call(fn)
+        self.assertEqual(len(calls), 1)
+
+
+class TestTokenExchangeAgainstFaultyStandIn(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = LocalGoogleServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.server.faults.clear()
+        dependency = Dependency(
+            f"google_token_{self._testMethodName}",
+            is_http_failure,
+            retry=RetryPolicy(max_attempts=3, base_delay=0.001, max_delay=0.001),
+            enabled=True,
+        )
+        self.client = GoogleTokenClient(
+            self.server.issuer.audience, "secret", "https://example.com/callback",
+            token_uri=self.server.token_uri, timeout=0.5, dependency=dependency,
+        )
+        self.addCleanup(self.client.close)
+
+    def test_unavailable_and_dropped_attempts_are_retried(self):
+        self.server.faults.inject(503, DROP)
+        requests_before = self.server.token_requests
+
+        tokens = self.client.refresh("1//refresh")
+
+        self.assertIn("access_token", tokens)
+        self.assertEqual(self.server.token_requests - requests_before, 3)
+
+    def test_code_exchange_that_reached_the_endpoint_is_not_retried(self):
+        for fault in (503, DROP, 1.0):
+            self.server.faults.clear()
+            self.server.faults.inject(fault)
+            requests_before = self.server.token_requests
+
+            with self.assertRaises(Exception):
+                self.client.exchange_code("c0de:user@example.com")
+            self.assertEqual(self.server.token_requests - requests_before, 1)
+
+    def test_code_exchange_is_retried_when_the_connection_fails(self):
+        import socket
+
+        with socket.socket() as unused:
+            unused.bind(("127.0.0.1", 0))
+            port = unused.getsockname()[1]
+        self.client.token_uri = f"http://127.0.0.1:{port}/token"
+        name = self.client.dependency.name
+
+        with self.assertRaises(Exception) as context:
+            self.client.exchange_code("c0de:user@example.com")
+        self.assertTrue(is_connect_failure(context.exception))
+        self.assertEqual(sample("dependency_retries_total", name), 2)
+
+    def test_slow_answer_times_out_and_is_retried(self):
+        self.server.faults.inject(1.0)
+
+        start = time.perf_counter()
+        self.assertIn("access_token", self.client.refresh("1//refresh"))
+        self.assertLess(time.perf_counter() - start, 1.0)
+
+    def test_invalid_grant_is_not_retried(self):
+        requests_before = self.server.token_requests
+
+        with self.assertRaises(TokenExchangeError) as context:
+            self.client.exchange_code("")
+        self.assertEqual(context.exception.status_code, 400)
+        self.assertEqual(self.server.token_requests - requests_before, 1)
+
+    def test_throttling_beyond_the_attempts_fails(self):
+        self.server.faults.inject(THROTTLE, THROTTLE, THROTTLE)
+
+        with self.assertRaises(TokenExchangeError) as context:
+            self.client.exchange_code("c0de:user@example.com")
+        self.assertEqual(context.exception.status_code, 429)
+
+
+class TestUserStoreAgainstFaultyStandIn(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = LocalAwsServer().start()
+        cls.client = boto3.client(
+            "dynamodb",
+            endpoint_url=cls.server.endpoint_url,
+            region_name="us-east-1",
+            aws_access_key_id="local",
+            aws_secret_access_key="local",
+            config=Config(retries={"total_max_attempts": 1}),
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.server.tables.clear()
+        self.server.requests.clear()
+        self.server.faults.clear()
+        dependency = Dependency(
+            f"user_store_{self._testMethodName}",
+            is_aws_failure,
+            retry=RetryPolicy(max_attempts=3, base_delay=0.001, max_delay=0.001),
+            enabled=True,
+        )
+        self.store = ResilientUserStore(DynamoDBUserStore("user_authentication", client=self.client), dependency)
+
+    def test_throttled_and_failed_calls_are_retried(self):
+        self.server.faults.inject(THROTTLE, 500)
+        self.assertTrue(self.store.create_if_not_exists({"email": "user@example.com", "name": "First"}))
+
+        self.server.faults.inject(THROTTLE)
+        self.assertEqual(self.store.get("user@example.com")["name"], "First")
+
+        self.assertEqual(self.server.requests, {"PutItem": 1, "GetItem": 1})
+
+    def test_conditional_check_failure_is_an_answer(self):
+        self.store.create_if_not_exists({"email": "user@example.com", "name": "First"})
+
+        self.assertFalse(self.store.create_if_not_exists({"email": "user@example.com", "name": "Second"}))
+        self.assertEqual(self.server.requests["PutItem"], 2)
+        self.assertEqual(self.store.dependency.breaker.state, CLOSED)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import json
+import unittest
+from unittest.mock import patch
+
+from prometheus_client import REGISTRY
+
+from src.secrets_cache import SecretsCache, _load_authentication_secrets
+from src.stage_metrics import SECRETS_FETCH
+
+
+class FakeSecretsBackend:
+    def __init__(self, secrets):
+        self.secrets = secrets
+        self.calls = 0
+        self.fail = False
+
+    def get_secret(self, secret_name):
+        self.calls += 1
+        if self.fail:
+            raise ConnectionError("Secrets Manager unavailable")
+        return {"response": json.dumps(self.secrets)}
+
+
+def secrets_fetches():
+    labels = {"stage": SECRETS_FETCH, "outcome": "success"}
+    return REGISTRY.get_sample_value("signin_stage_duration_seconds_count", labels) or 0.0
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestSecretsCache(unittest.TestCase):
+    def setUp(self):
+        self.backend = FakeSecretsBackend({"encryption_secret_key": "v1"})
+        self.clock = FakeClock()
+        patcher = patch('src.secrets_cache.get_secret', side_effect=self.backend.get_secret)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = SecretsCache(_load_authentication_secrets, ttl_seconds=60, retry_seconds=5, clock=self.clock)
+
+    def _wait_for_refresh(self):
+        thread = self.cache._refresh_thread
+        if thread is not None:
+            thread.join(timeout=5)
+
+    def test_first_get_is_a_miss_then_hits(self):
+        self.assertEqual(self.cache.get(), {"encryption_secret_key": "v1"})
+        self.assertEqual(self.cache.get(), {"encryption_secret_key": "v1"})
+        self.assertEqual(self.backend.calls, 1)
+        self.assertEqual(self.cache.stats(), {"hits": 1, "misses": 1, "refreshes": 0, "refresh_failures": 0})
+
+    def test_stale_value_served_while_refreshing(self):
+        self.cache.get()
+        self.backend.secrets = {"encryption_secret_key": "v2"}
+        self.clock.now += 61
+
+        self.assertEqual(self.cache.get(), {"encryption_secret_key": "v1"})
+        self._wait_for_refresh()
+
+        self.assertEqual(self.cache.get(), {"encryption_secret_key": "v2"})
+        self.assertEqual(self.backend.calls, 2)
+        self.assertEqual(self.cache.stats()["refreshes"], 1)
+
+    def test_backend_down_falls_back_to_last_good_value(self):
+        self.cache.get()
+        self.backend.fail = True
+        self.clock.now += 61
+
+        self.assertEqual(self.cache.get(), {"encryption_secret_key": "v1"})
+        self._wait_for_refresh()
+        self.assertEqual(self.cache.get(), {"encryption_secret_key": "v1"})
+        self.assertEqual(self.cache.stats()["refresh_failures"], 1)
+        # No new refresh until the retry interval has passed
+        self.assertEqual(self.backend.calls, 2)
+
+        self.backend.fail = False
+        self.clock.now += 6
+        self.cache.get()
+        self._wait_for_refresh()
+        self.assertEqual(self.backend.calls, 3)
+        self.assertEqual(self.cache.stats()["refreshes"], 1)
+
+    def test_cold_miss_propagates_backend_error(self):
+        self.backend.fail = True
+        with self.assertRaises(ConnectionError):
+            self.cache.get()
+
+    def test_cold_miss_propagates_invalid_json(self):
+        with patch('src.secrets_cache.get_secret', return_value={"response": "invalid json"}):
+            with self.assertRaises(json.JSONDecodeError):
+                self.cache.get()
+
+    def test_only_backend_fetches_are_observed(self):
+        fetches_before = secrets_fetches()
+        for _ in range(3):
+            self.cache.get()
+        self.assertEqual(secrets_fetches(), fetches_before + 1)
+
+        self.clock.now += 61
+        self.cache.get()
+        self._wait_for_refresh()
+        self.assertEqual(secrets_fetches(), fetches_before + 2)
+
+    def test_invalidate_forces_reload(self):
+        self.cache.get()
+        self.backend.secrets = {"encryption_secret_key": "v2"}
+        self.cache.invalidate()
+        self.assertEqual(self.cache.get(), {"encryption_secret_key": "v2"})
+        self.assertEqual(self.cache.stats()["misses"], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,146 +3,277 @@ from unittest.mock import patch, MagicMock
 import json
 from flask import Flask, jsonify
 
+from src.existence_cache import user_existence_cache
+from src.id_token import IdTokenClaims, InvalidIdTokenError
+from src.token_crypto import get_token_cipher
+
+from benchmarks.stand_ins import LocalAppleServer
 from src.service import (
+    authorize_with_apple,
     authorize_with_google,
     is_user_exists,
     create_user,
+    signin_user,
     authenticate_user,
-    _extract_name_from_token,
-    _extract_profile_from_token,
+    verify_apple_id_token,
+    verify_google_id_token,
+    _fetch_sign_with_apple_secrets_from_aws,
     _fetch_sign_with_google_secrets_from_aws
 )
 
 class TestService(unittest.TestCase):
     def setUp(self):
         self.app = Flask(__name__)
+        user_existence_cache.clear()
+        self.claims = IdTokenClaims(
+            email="user@example.com", subject="123", name="Test User", profile={"picture": "https://example.com/p.png"}
+        )
 
     @patch('src.service._fetch_sign_with_google_secrets_from_aws')
-    @patch('src.service.Flow')
-    def test_authorize_with_google_success(self, mock_flow, mock_fetch_secrets):
+    @patch('src.service.get_google_token_client')
+    def test_authorize_with_google_success(self, mock_get_client, mock_fetch_secrets):
         mock_fetch_secrets.return_value = ('client_id', 'client_secret', 'redirect_uri')
-        mock_credentials = MagicMock()
-        mock_credentials.token = 'access_token'
-        mock_credentials.refresh_token = 'refresh_token'
-        mock_credentials.id_token = 'id_token'
-        mock_flow.from_client_config.return_value.credentials = mock_credentials
+        mock_get_client.return_value.exchange_code.return_value = {
+            'access_token': 'access_token',
+            'refresh_token': 'refresh_token',
+            'id_token': 'id_token',
+            'expires_in': 3599,
+        }
 
-        result = authorize_with_google('auth_code')
-        self.assertEqual(result, ('access_token', 'refresh_token', 'id_token'))
+        with patch('src.service.time.time', return_value=1700000000.5):
+            result = authorize_with_google('auth_code')
+        self.assertEqual(result, ('access_token', 'refresh_token', 'id_token', 1700003599))
+        mock_get_client.assert_called_once_with('client_id', 'client_secret', 'redirect_uri')
+        mock_get_client.return_value.exchange_code.assert_called_once_with('auth_code')
 
     @patch('src.service._fetch_sign_with_google_secrets_from_aws')
-    @patch('src.service.Flow')
-    def test_authorize_with_google_failure(self, mock_flow, mock_fetch_secrets):
+    @patch('src.service.get_google_token_client')
+    def test_authorize_with_google_failure(self, mock_get_client, mock_fetch_secrets):
         mock_fetch_secrets.return_value = ('client_id', 'client_secret', 'redirect_uri')
-        mock_flow.from_client_config.side_effect = Exception("Auth failed")
+        mock_get_client.return_value.exchange_code.side_effect = Exception("Auth failed")
 
         result = authorize_with_google('auth_code')
         self.assertIsNone(result)
 
-    @patch('src.service.read_from_dynamodb')
-    def test_is_user_exists_true(self, mock_read):
-        mock_read.return_value = {"status": 200}
+    @patch('src.service.get_apple_token_client')
+    @patch('src.service.get_authentication_secrets')
+    def test_authorize_with_apple(self, mock_get_secrets, mock_get_client):
+        mock_get_secrets.return_value = {
+            "apple_client_id": "com.example.web",
+            "apple_team_id": "TEAM",
+            "apple_key_id": "KEY",
+            "apple_private_key": "pem",
+            "apple_redirect_uri": "uri",
+        }
+        mock_get_client.return_value.exchange_code.return_value = {"access_token": "a", "id_token": "id_token"}
+
+        with patch('src.service.time.time', return_value=1700000000):
+            self.assertEqual(authorize_with_apple('auth_code'), ('a', None, 'id_token', 1700003600))
+        mock_get_client.assert_called_once_with("com.example.web", "TEAM", "KEY", "pem", "uri")
+
+    @patch('src.service.get_authentication_secrets')
+    def test_fetch_sign_with_apple_secrets_missing_key(self, mock_get_secrets):
+        mock_get_secrets.return_value = {"apple_client_id": "com.example.web", "apple_team_id": "TEAM"}
+        with self.assertRaises(KeyError):
+            _fetch_sign_with_apple_secrets_from_aws()
+
+    @patch('src.service.get_authentication_secrets')
+    def test_verify_apple_id_token(self, mock_get_secrets):
+        server = LocalAppleServer()
+        mock_get_secrets.return_value = {"apple_client_id": server.issuer.audience}
+
+        with patch('src.service.apple_jwks_cache._fetcher', server.issuer.fetch):
+            claims = verify_apple_id_token(server.issuer.mint_id_token("user@privaterelay.appleid.com"))
+            with self.assertRaises(InvalidIdTokenError):
+                verify_apple_id_token(server.issuer.mint_id_token("user@example.com", iss="https://accounts.google.com"))
+        self.assertEqual(claims.email, "user@privaterelay.appleid.com")
+        self.assertEqual(claims.oidc_provider, "apple")
+
+    @patch('src.service.get_authentication_secrets')
+    @patch('src.service.encrypt_message')
+    @patch('src.service.get_user_store')
+    def test_create_user_records_the_provider(self, mock_get_store, mock_encrypt, mock_get_secrets):
+        mock_get_secrets.return_value = {"encryption_secret_key": "secret"}
+        mock_encrypt.return_value = b"encrypted"
+        claims = IdTokenClaims(email="user@example.com", subject="001", oidc_provider="apple")
+
+        self.assertTrue(create_user("user@example.com", claims, "access_token", "refresh_token"))
+        item = mock_get_store.return_value.create_if_not_exists.call_args[0][0]
+        self.assertEqual(item["oidc_provider"], "apple")
+        create_user("user@example.com", self.claims, "access_token", "refresh_token")
+        item = mock_get_store.return_value.create_if_not_exists.call_args[0][0]
+        self.assertEqual(item["oidc_provider"], "google-oauth2")
+
+    @patch('src.service.get_user_store')
+    def test_is_user_exists_true(self, mock_get_store):
+        mock_get_store.return_value.get.return_value = {"email": "user@example.com"}
+        self.assertTrue(is_user_exists('user@example.com'))
+
+    @patch('src.service.get_user_store')
+    def test_is_user_exists_false(self, mock_get_store):
+        mock_get_store.return_value.get.return_value = None
+        self.assertFalse(is_user_exists('user@example.com'))
+
+    @patch('src.service.get_user_store')
+    def test_is_user_exists_reads_only_the_key_and_caches(self, mock_get_store):
+        mock_get_store.return_value.get.return_value = {"email": "user@example.com"}
+
         self.assertTrue(is_user_exists('user@example.com'))
+        self.assertTrue(is_user_exists('user@example.com'))
+
+        mock_get_store.return_value.get.assert_called_once_with('user@example.com', ['email'])
 
-    @patch('src.service.read_from_dynamodb')
-    def test_is_user_exists_false(self, mock_read):
-        mock_read.return_value = {"status": 404}
+    @patch('src.service.get_authentication_secrets')
+    @patch('src.service.get_user_store')
+    def test_create_user_replaces_cached_negative(self, mock_get_store, mock_get_secrets):
+        mock_get_secrets.return_value = {"encryption_secret_key": "secret"}
+        mock_get_store.return_value.get.return_value = None
         self.assertFalse(is_user_exists('user@example.com'))
 
-    @patch('src.service.read_from_dynamodb')
-    def test_is_user_exists_error(self, mock_read):
-        mock_read.side_effect = Exception("DB error")
+        with patch('src.service.encrypt_message', return_value=b"encrypted"):
+            self.assertTrue(create_user('user@example.com', self.claims, 'access_token', 'refresh_token'))
+
+        self.assertTrue(is_user_exists('user@example.com'))
+        self.assertEqual(mock_get_store.return_value.get.call_count, 1)
+
+    @patch('src.service.get_user_store')
+    def test_is_user_exists_error(self, mock_get_store):
+        mock_get_store.return_value.get.side_effect = Exception("DB error")
         self.assertIsNone(is_user_exists('user@example.com'))
 
-    @patch('src.service._extract_name_from_token')
-    @patch('src.service._extract_profile_from_token')
-    @patch('src.service.get_secret')
+    @patch('src.service.get_authentication_secrets')
+    @patch('src.service.encrypt_message')
+    @patch('src.service.get_user_store')
+    def test_create_user_success(self, mock_get_store, mock_encrypt, mock_get_secrets):
+        mock_get_secrets.return_value = {"encryption_secret_key": "secret"}
+        mock_encrypt.return_value = b"encrypted"
+        mock_get_store.return_value.create_if_not_exists.return_value = True
+
+        result = create_user("user@example.com", self.claims, "access_token", "refresh_token")
+        self.assertTrue(result)
+
+    @patch('src.service.get_authentication_secrets')
     @patch('src.service.encrypt_message')
-    @patch('src.service.save_to_dynamodb')
-    def test_create_user_success(self, mock_save, mock_encrypt, mock_get_secret, mock_profile, mock_name):
-        mock_name.return_value = "Test User"
-        mock_profile.return_value = {"profile": "data"}
-        mock_get_secret.return_value = {"encryption_secret_key": "secret"}
+    @patch('src.service.get_user_store')
+    def test_create_user_already_exists(self, mock_get_store, mock_encrypt, mock_get_secrets):
+        mock_get_secrets.return_value = {"encryption_secret_key": "secret"}
         mock_encrypt.return_value = b"encrypted"
-        mock_save.return_value = {"status": 200}
+        mock_get_store.return_value.create_if_not_exists.return_value = False
 
-        result = create_user("user@example.com", "id_token", "access_token", "refresh_token")
+        result = create_user("user@example.com", self.claims, "access_token", "refresh_token")
         self.assertTrue(result)
 
-    @patch('src.service._extract_name_from_token')
-    @patch('src.service._extract_profile_from_token')
-    @patch('src.service.get_secret')
+    @patch('src.service.get_authentication_secrets')
     @patch('src.service.encrypt_message')
-    @patch('src.service.save_to_dynamodb')
-    def test_create_user_failure(self, mock_save, mock_encrypt, mock_get_secret, mock_profile, mock_name):
-        mock_name.return_value = "Test User"
-        mock_profile.return_value = {"profile": "data"}
-        mock_get_secret.return_value = {"encryption_secret_key": "secret"}
+    @patch('src.service.get_user_store')
+    def test_create_user_failure(self, mock_get_store, mock_encrypt, mock_get_secrets):
+        mock_get_secrets.return_value = {"encryption_secret_key": "secret"}
         mock_encrypt.return_value = b"encrypted"
-        mock_save.return_value = {"status": 500}
+        mock_get_store.return_value.create_if_not_exists.side_effect = Exception("DB error")
 
-        result = create_user("user@example.com", "id_token", "access_token", "refresh_token")
+        result = create_user("user@example.com", self.claims, "access_token", "refresh_token")
         self.assertFalse(result)
 
-    @patch('src.service.get_secret')
+    @patch('src.service.TOKEN_ENCRYPTION_FORMAT', 'envelope')
+    @patch('src.service.get_authentication_secrets')
+    @patch('src.service.encrypt_message')
+    @patch('src.service.get_user_store')
+    def test_create_user_envelope_encryption(self, mock_get_store, mock_encrypt, mock_get_secrets):
+        mock_get_secrets.return_value = {"encryption_secret_key": "secret"}
+        mock_get_store.return_value.create_if_not_exists.return_value = True
+
+        self.assertTrue(create_user("user@example.com", self.claims, "access_token", "refresh_token"))
+        mock_encrypt.assert_not_called()
+        item = mock_get_store.return_value.create_if_not_exists.call_args[0][0]
+        cipher = get_token_cipher("secret")
+        self.assertEqual(cipher.decrypt(item["access_token"]), "access_token")
+        self.assertEqual(cipher.decrypt(item["refresh_token"]), "refresh_token")
+
+    @patch('src.service.get_authentication_secrets')
+    @patch('src.service.encrypt_message')
+    @patch('src.service.issue_session_token')
+    @patch('src.service.get_user_store')
+    def test_signin_user_new_user(self, mock_get_store, mock_issue_token, mock_encrypt, mock_get_secrets):
+        mock_upsert = mock_get_store.return_value.upsert_user_with_session
+        mock_get_secrets.return_value = {"encryption_secret_key": "secret"}
+        mock_encrypt.return_value = b"encrypted"
+        mock_issue_token.return_value = ("jwt_token", "2023-01-01 12:00:00")
+        mock_upsert.return_value = True
+
+        with self.app.app_context():
+            response, user_created = signin_user(self.claims, "access_token", "refresh_token")
+        self.assertTrue(user_created)
+        self.assertIn("session=jwt_token", response.headers["Set-Cookie"])
+        mock_upsert.assert_called_once()
+        email, profile_fields, session_fields = mock_upsert.call_args[0]
+        self.assertEqual(email, "user@example.com")
+        self.assertEqual(profile_fields["access_token"], "encrypted")
+        self.assertEqual(profile_fields["name"], "Test User")
+        self.assertEqual(session_fields, {"session_start_time": "2023-01-01 12:00:00", "jwt": "jwt_token"})
+
+    @patch('src.service.get_authentication_secrets')
+    @patch('src.service.get_user_store')
+    def test_signin_user_missing_key(self, mock_get_store, mock_get_secrets):
+        mock_upsert = mock_get_store.return_value.upsert_user_with_session
+        mock_get_secrets.return_value = {}
+        with self.assertRaises(KeyError):
+            signin_user(self.claims, "access_token", "refresh_token")
+        mock_upsert.assert_not_called()
+
+    @patch('src.service.get_authentication_secrets')
     @patch('src.service.create_cookie')
-    def test_authenticate_user_success(self, mock_create_cookie, mock_get_secret):
-        mock_get_secret.return_value = {"response": json.dumps({"encryption_secret_key": "secret"})}
+    def test_authenticate_user_success(self, mock_create_cookie, mock_get_secrets):
+        mock_get_secrets.return_value = {"encryption_secret_key": "secret"}
         mock_create_cookie.return_value = ({"status": "success"}, 200)
 
         with self.app.app_context():
             result = authenticate_user("user@example.com")
         self.assertEqual(result, ({"status": "success"}, 200))
 
-    @patch('src.service.get_secret')
-    def test_authenticate_user_missing_key(self, mock_get_secret):
-        mock_get_secret.return_value = {"response": json.dumps({})}
+    @patch('src.service.get_authentication_secrets')
+    def test_authenticate_user_missing_key(self, mock_get_secrets):
+        mock_get_secrets.return_value = {}
 
         with self.app.app_context():
             result = authenticate_user("user@example.com")
         self.assertEqual(result[1], 400)  
         self.assertIn("error", json.loads(result[0].get_data(as_text=True)))
 
-    @patch('src.service.get_secret')
-    def test_authenticate_user_invalid_json(self, mock_get_secret):
-        mock_get_secret.return_value = {"response": "invalid json"}
+    @patch('src.service.get_authentication_secrets')
+    def test_authenticate_user_invalid_json(self, mock_get_secrets):
+        mock_get_secrets.side_effect = json.JSONDecodeError("Expecting value", "invalid json", 0)
 
         with self.app.app_context():
             result = authenticate_user("user@example.com")
         self.assertEqual(result[1], 500)  
         self.assertIn("error", json.loads(result[0].get_data(as_text=True)))
 
-    @patch('src.service.extract_name')
-    def test_extract_name_from_token(self, mock_extract):
-        mock_extract.return_value = "Test User"
-        result = _extract_name_from_token("id_token")
-        self.assertEqual(result, "Test User")
-
-    @patch('src.service.extract_profile')
-    def test_extract_profile_from_token(self, mock_extract):
-        mock_extract.return_value = {"profile": "data"}
-        result = _extract_profile_from_token("id_token")
-        self.assertEqual(result, {"profile": "data"})
-
-    @patch('src.service.get_secret')
-    def test_fetch_sign_with_google_secrets_success(self, mock_get_secret):
-        mock_get_secret.return_value = {
-            "response": json.dumps({
-                "client_id": "id",
-                "client_secret": "secret",
-                "redirect_uri": "uri"
-            })
+    @patch('src.service.verify_id_token')
+    @patch('src.service.get_authentication_secrets')
+    def test_verify_google_id_token_uses_client_id_as_audience(self, mock_get_secrets, mock_verify):
+        mock_get_secrets.return_value = {"client_id": "client-123"}
+        mock_verify.return_value = self.claims
+
+        result = verify_google_id_token("id_token")
+        self.assertEqual(result, self.claims)
+        self.assertEqual(mock_verify.call_args[0][0], "id_token")
+        self.assertEqual(mock_verify.call_args[0][2], "client-123")
+
+    @patch('src.service.get_authentication_secrets')
+    def test_fetch_sign_with_google_secrets_success(self, mock_get_secrets):
+        mock_get_secrets.return_value = {
+            "client_id": "id",
+            "client_secret": "secret",
+            "redirect_uri": "uri"
         }
         result = _fetch_sign_with_google_secrets_from_aws()
         self.assertEqual(result, ("id", "secret", "uri"))
 
-    @patch('src.service.get_secret')
-    def test_fetch_sign_with_google_secrets_missing_key(self, mock_get_secret):
-        mock_get_secret.return_value = {
-            "response": json.dumps({
-                "client_id": "id",
-                "client_secret": "secret"
-            })
+    @patch('src.service.get_authentication_secrets')
+    def test_fetch_sign_with_google_secrets_missing_key(self, mock_get_secrets):
+        mock_get_secrets.return_value = {
+            "client_id": "id",
+            "client_secret": "secret"
         }
         result = _fetch_sign_with_google_secrets_from_aws()
         self.assertIsNone(result)
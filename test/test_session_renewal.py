@@ -0,0 +1,164 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+from src.local_utils import InvalidSessionError, create_jwt, verify_session_token
+from src.session_renewal import RecentRenewals, recent_renewals, renew_session, renewal_due
+from src.session_revocation import RevocationList, SQLiteRevocationStore, logout
+from src.session_verification import verified_sessions
+from src.user_store import SQLiteUserStore
+
+SECRET = "encryption-secret-for-renewal-tests"
+EMAIL = "user@example.com"
+
+
+def session_token(age_days, jti="jti-1", lifetime_days=30):
+    iat = datetime.now() - timedelta(days=age_days)
+    return create_jwt({"email": EMAIL, "iat": iat, "exp": iat + timedelta(days=lifetime_days), "jti": jti}, SECRET)
+
+
+class TestRenewalDue(unittest.TestCase):
+    def test_due_past_the_fraction_of_the_lifetime(self):
+        claims = {"iat": 1000, "exp": 2000}
+
+        self.assertFalse(renewal_due(claims, 1499, fraction=0.5))
+        self.assertTrue(renewal_due(claims, 1500, fraction=0.5))
+        self.assertTrue(renewal_due(claims, 1250, fraction=0.25))
+
+
+class TestRecentRenewals(unittest.TestCase):
+    def test_entries_expire_with_the_window(self):
+        now = [0.0]
+        recent = RecentRenewals(window=60, clock=lambda: now[0])
+        recent.put("old-jti", "token", 2000.0, "new-jti")
+
+        self.assertEqual(recent.get("old-jti"), ("token", 2000.0, "new-jti"))
+        now[0] = 60
+        self.assertIsNone(recent.get("old-jti"))
+        self.assertEqual(len(recent), 0)
+
+
+class TestRenewSession(unittest.TestCase):
+    def setUp(self):
+        for cache in (verified_sessions, recent_renewals):
+            cache.clear()
+            self.addCleanup(cache.clear)
+        store = SQLiteRevocationStore()
+        self.revocations = RevocationList(store_factory=lambda: store, interval=60)
+        self.addCleanup(self.revocations.stop)
+        self.store = SQLiteUserStore()
+        self.store.create_if_not_exists(
+            {"email": EMAIL, "session_start_time": str(datetime.now() - timedelta(days=20)), "jwt": "old"}
+        )
+        for target, value in (
+            ("src.session_verification.session_revocation.revocation_list", self.revocations),
+            ("src.session_renewal.service._get_session_key_ring", MagicMock(return_value=SECRET)),
+            ("src.session_renewal.get_user_store", MagicMock(return_value=self.store)),
+        ):
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_young_session_is_left_alone(self):
+        token = session_token(age_days=1)
+        with patch.object(self.store, "renew_session") as write:
+            new_token, exp = renew_session(token)
+
+        self.assertIsNone(new_token)
+        self.assertEqual(exp, verify_session_token(token, SECRET)["exp"])
+        write.assert_not_called()
+
+    def test_session_past_its_half_life_is_renewed_and_written(self):
+        new_token, exp = renew_session(session_token(age_days=20))
+
+        claims = verify_session_token(new_token, SECRET)
+        self.assertEqual(claims["email"], EMAIL)
+        self.assertNotEqual(claims["jti"], "jti-1")
+        self.assertEqual(claims["exp"], exp)
+        self.assertGreater(exp, datetime.now().timestamp() + timedelta(days=29).total_seconds())
+        self.assertEqual(self.store.get(EMAIL)["jwt"], new_token)
+        # The renewed session is not due again
+        self.assertEqual(renew_session(new_token), (None, exp))
+
+    def test_old_cookie_sent_again_reuses_the_renewal(self):
+        token = session_token(age_days=20, jti="tab-1")
+        first = renew_session(token)
+        with patch.object(self.store, "renew_session") as write:
+            second = renew_session(token)
+
+        self.assertEqual(second, first)
+        write.assert_not_called()
+
+    def test_other_sessions_of_the_user_get_their_own_renewal(self):
+        laptop, _ = renew_session(session_token(age_days=20, jti="laptop"))
+        phone, _ = renew_session(session_token(age_days=20, jti="phone"))
+
+        self.assertNotEqual(phone, laptop)
+        self.assertNotEqual(verify_session_token(phone, SECRET)["jti"], verify_session_token(laptop, SECRET)["jti"])
+
+    def test_revoked_renewal_is_not_handed_out_again(self):
+        token = session_token(age_days=20, jti="tab-1")
+        first, _ = renew_session(token)
+        claims = verify_session_token(first, SECRET)
+        self.revocations.revoke(claims["jti"], EMAIL, claims["exp"])
+
+        second, _ = renew_session(token)
+
+        self.assertIsNotNone(second)
+        self.assertNotEqual(verify_session_token(second, SECRET)["jti"], claims["jti"])
+
+    def test_logout_of_the_renewed_session_ends_the_old_one(self):
+        token = session_token(age_days=20, jti="signed-in")
+        renewed, _ = renew_session(token)
+        self.assertEqual(verify_session_token(renewed, SECRET)["sid"], "signed-in")
+
+        logout(renewed)
+
+        for session in (token, renewed):
+            with self.assertRaises(InvalidSessionError):
+                renew_session(session)
+
+    def test_renewals_of_renewals_keep_the_first_sid(self):
+        iat = datetime.now() - timedelta(days=20)
+        renewed = create_jwt(
+            {"email": EMAIL, "iat": iat, "exp": iat + timedelta(days=30), "jti": "renewed", "sid": "signed-in"}, SECRET
+        )
+
+        again, _ = renew_session(renewed)
+
+        self.assertEqual(verify_session_token(again, SECRET)["sid"], "signed-in")
+        logout(again)
+        with self.assertRaises(InvalidSessionError):
+            renew_session(session_token(age_days=20, jti="signed-in"))
+
+    def test_one_write_per_window_across_workers(self):
+        first, _ = renew_session(session_token(age_days=20, jti="worker-1"))
+        # Another worker: same store, nothing renewed locally
+        recent_renewals.clear()
+        second, _ = renew_session(session_token(age_days=20, jti="worker-2"))
+
+        self.assertIsNotNone(second)
+        self.assertNotEqual(second, first)
+        self.assertEqual(self.store.get(EMAIL)["jwt"], first)
+
+    def test_failed_write_keeps_the_current_session(self):
+        token = session_token(age_days=20)
+        with patch.object(self.store, "renew_session", side_effect=RuntimeError("DynamoDB unavailable")):
+            new_token, exp = renew_session(token)
+
+        self.assertIsNone(new_token)
+        self.assertEqual(exp, verify_session_token(token, SECRET)["exp"])
+        self.assertEqual(len(recent_renewals), 0)
+
+    def test_invalid_and_revoked_sessions_are_rejected(self):
+        token = session_token(age_days=20, jti="jti-revoked")
+        self.revocations.revoke("jti-revoked", EMAIL, datetime.now().timestamp() + 3600)
+
+        for token in (None, session_token(age_days=31), token):
+            with self.assertRaises(InvalidSessionError):
+                renew_session(token)
+        self.assertEqual(self.store.get(EMAIL)["jwt"], "old")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,260 @@
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import boto3
+from prometheus_client import REGISTRY
+
+from benchmarks.stand_ins import LocalAwsServer
+from src.local_utils import InvalidSessionError, create_jwt
+from src.session_revocation import (
+    MERGE_THRESHOLD,
+    BloomFilter,
+    DynamoDBRevocationStore,
+    RevocationList,
+    RevocationSet,
+    SQLiteRevocationStore,
+    authenticate_session,
+    fingerprint,
+    UnrevocableSessionError,
+    logout,
+)
+
+SECRET = "encryption-secret-for-revocation-tests"
+EMAIL = "user@example.com"
+
+
+def session_token(jti=None, days=1):
+    now = datetime.now()
+    payload = {"email": EMAIL, "iat": now, "exp": now + timedelta(days=days)}
+    if jti is not None:
+        payload["jti"] = jti
+    return create_jwt(payload, SECRET)
+
+
+def checks(result):
+    return REGISTRY.get_sample_value("session_revocation_checks_total", {"result": result}) or 0.0
+
+
+class TestBloomFilter(unittest.TestCase):
+    def test_no_false_negatives_and_bounded_false_positives(self):
+        bloom = BloomFilter(10000, 0.01)
+        for index in range(10000):
+            bloom.add(fingerprint(f"revoked-{index}"))
+
+        self.assertTrue(all(fingerprint(f"revoked-{index}") in bloom for index in range(10000)))
+        false_positives = sum(fingerprint(f"valid-{index}") in bloom for index in range(10000))
+        self.assertLess(false_positives, 200)
+
+
+class TestRevocationSet(unittest.TestCase):
+    def test_membership_across_merges(self):
+        revoked = RevocationSet(capacity=100, error_rate=0.01)
+        revoked.add_many((f"jti-{index}", time.time() + 3600) for index in range(MERGE_THRESHOLD + 10))
+        revoked.add("jti-late", time.time() + 3600)
+
+        self.assertEqual(len(revoked), MERGE_THRESHOLD + 11)
+        self.assertIn("jti-0", revoked)
+        self.assertIn("jti-late", revoked)
+        self.assertNotIn("jti-other", revoked)
+
+    def test_filter_grows_past_its_capacity(self):
+        revoked = RevocationSet(capacity=1000, error_rate=0.01)
+        revoked.add_many((f"jti-{index}", time.time() + 3600) for index in range(MERGE_THRESHOLD))
+
+        self.assertGreaterEqual(revoked._filter.capacity, MERGE_THRESHOLD)
+        self.assertTrue(all(f"jti-{index}" in revoked for index in range(MERGE_THRESHOLD)))
+        false_positives = sum(fingerprint(f"other-{index}") in revoked._filter for index in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_expired_entries_are_dropped(self):
+        now = time.time()
+        revoked = RevocationSet(capacity=100, error_rate=0.01)
+        revoked.add_many([("expiring", now + 60), ("live", now + 3600)])
+        revoked.add_many((f"jti-{index}", now + 3600) for index in range(MERGE_THRESHOLD))
+        revoked.add("recent-expiring", now + 60)
+
+        self.assertEqual(revoked.drop_expired(now + 120), 2)
+        self.assertEqual(len(revoked), MERGE_THRESHOLD + 1)
+        self.assertNotIn("expiring", revoked)
+        self.assertNotIn("recent-expiring", revoked)
+        self.assertIn("live", revoked)
+        self.assertEqual(revoked.drop_expired(now + 7200), MERGE_THRESHOLD + 1)
+        self.assertEqual(len(revoked), 0)
+
+    def test_readded_entry_keeps_the_later_expiry(self):
+        now = time.time()
+        revoked = RevocationSet(capacity=100, error_rate=0.01)
+        revoked.add("jti-1", now + 3600)
+        revoked.drop_expired(now)
+        revoked.add("jti-1", now + 60)
+
+        self.assertEqual(revoked.drop_expired(now + 120), 0)
+        self.assertIn("jti-1", revoked)
+
+
+class TestRevocationList(unittest.TestCase):
+    def setUp(self):
+        self.store = SQLiteRevocationStore()
+
+    def revocation_list(self, **kwargs):
+        revocations = RevocationList(store_factory=lambda: self.store, **kwargs)
+        self.addCleanup(revocations.stop)
+        return revocations
+
+    def test_other_workers_see_revocations_after_sync(self):
+        revoking, other = self.revocation_list(), self.revocation_list()
+        other.sync()
+
+        revoking.revoke("jti-1", EMAIL, time.time() + 3600)
+
+        self.assertTrue(revoking.is_revoked("jti-1"))
+        self.assertNotIn("jti-1", other.revoked)
+        self.assertEqual(other.sync(), 1)
+        self.assertIn("jti-1", other.revoked)
+
+    def test_sync_skips_expired_and_old_revocations(self):
+        now = time.time()
+        self.store.revoke("expired", EMAIL, now - 60, now - 1)
+        self.store.revoke("live", EMAIL, now - 60, now + 3600)
+        revocations = self.revocation_list(overlap=0)
+
+        revocations.sync()
+        self.assertIn("live", revocations.revoked)
+        self.assertNotIn("expired", revocations.revoked)
+
+        # Only what was written since the last sync (less the overlap) is read again
+        self.store.revoke("old", EMAIL, now - 3600, now + 3600)
+        self.assertEqual(revocations.sync(), 0)
+
+    def test_sync_purges_expired_revocations(self):
+        now = time.time()
+        self.store.revoke("short", EMAIL, now - 60, now + 1)
+        self.store.revoke("long", EMAIL, now - 60, now + 3600)
+        revocations = self.revocation_list(purge_interval=0)
+        revocations.sync()
+        self.assertIn("short", revocations.revoked)
+
+        with patch("src.session_revocation.time.time", return_value=now + 2):
+            revocations.sync()
+
+        self.assertNotIn("short", revocations.revoked)
+        self.assertIn("long", revocations.revoked)
+        self.assertEqual(len(revocations.revoked), 1)
+
+    def test_sync_reads_every_day_since_the_cursor(self):
+        now = time.time()
+        self.store.revoke("two-days-ago", EMAIL, now - 2 * 86400, now + 3600)
+        revocations = self.revocation_list()
+
+        revocations.sync()
+
+        self.assertIn("two-days-ago", revocations.revoked)
+
+    def test_background_sync_loads_on_first_check(self):
+        self.store.revoke("jti-1", EMAIL, time.time(), time.time() + 3600)
+        revocations = self.revocation_list(interval=0.05)
+
+        self.assertTrue(revocations.is_revoked("jti-1"))
+        self.assertFalse(revocations.is_revoked("jti-2"))
+
+    def test_fails_open_until_loaded(self):
+        def unavailable():
+            raise RuntimeError("store unavailable")
+
+        revocations = RevocationList(store_factory=unavailable, interval=60, load_timeout=0.05)
+        self.addCleanup(revocations.stop)
+        revocations.revoked.add("jti-1", time.time() + 3600)
+
+        with self.assertLogs("src.session_revocation", "ERROR"):
+            self.assertFalse(revocations.is_revoked("jti-1"))
+
+    def test_waits_for_the_first_sync_only_once(self):
+        def unavailable():
+            raise RuntimeError("store unavailable")
+
+        revocations = RevocationList(store_factory=unavailable, interval=60, load_timeout=2)
+        self.addCleanup(revocations.stop)
+        unsynced_before = checks("unsynced")
+
+        started = time.monotonic()
+        for _ in range(3):
+            self.assertFalse(revocations.is_revoked("jti-1"))
+
+        # The failed first sync ends the wait, and later checks do not wait again
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(checks("unsynced"), unsynced_before + 3)
+
+
+class TestDynamoDBRevocationStore(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = LocalAwsServer().start()
+        cls.client = boto3.client(
+            "dynamodb",
+            endpoint_url=cls.server.endpoint_url,
+            region_name="us-east-1",
+            aws_access_key_id="local",
+            aws_secret_access_key="local",
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def test_revoked_since_pages_through_one_day(self):
+        self.server.scan_page_size = 2
+        self.addCleanup(setattr, self.server, "scan_page_size", 100)
+        store = DynamoDBRevocationStore(client=self.client)
+        start = datetime(2024, 5, 1, 12).timestamp()
+        for index in range(5):
+            store.revoke(f"jti-{index}", EMAIL, start + index, start + 3600)
+
+        day = datetime.fromtimestamp(start, timezone.utc).strftime("%Y-%m-%d")
+        after = f"{start + 1:017.6f}~"
+        self.assertEqual([jti for jti, _ in store.revoked_since(day, after)], ["jti-2", "jti-3", "jti-4"])
+        self.assertEqual(len(list(store.revoked_since(day, ""))), 5)
+        self.assertEqual(list(store.revoked_since("2024-05-02", "")), [])
+
+
+class TestAuthenticateSession(unittest.TestCase):
+    def setUp(self):
+        store = SQLiteRevocationStore()
+        self.revocations = RevocationList(store_factory=lambda: store, interval=60)
+        self.addCleanup(self.revocations.stop)
+        patcher = patch("src.session_revocation.revocation_list", self.revocations)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch("src.session_revocation.service._get_session_key_ring", return_value=SECRET)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_logout_revokes_the_session(self):
+        token, other = session_token("jti-1"), session_token("jti-2")
+
+        self.assertEqual(authenticate_session(token, SECRET)["email"], EMAIL)
+        self.assertEqual(logout(token), EMAIL)
+
+        with self.assertRaises(InvalidSessionError):
+            authenticate_session(token, SECRET)
+        with self.assertRaises(InvalidSessionError):
+            logout(token)
+        self.assertEqual(authenticate_session(other, SECRET)["jti"], "jti-2")
+
+    def test_sessions_without_jti_are_not_checked(self):
+        self.assertEqual(authenticate_session(session_token(), SECRET)["email"], EMAIL)
+
+    def test_sessions_without_jti_cannot_be_logged_out(self):
+        with self.assertRaises(UnrevocableSessionError):
+            logout(session_token())
+
+    def test_missing_or_forged_tokens_are_rejected(self):
+        with self.assertRaises(InvalidSessionError):
+            authenticate_session(None, SECRET)
+        with self.assertRaises(InvalidSessionError):
+            authenticate_session(session_token("jti-1"), "another-secret-of-at-least-32-bytes")
+
+
+if __name__ == "__main__":
+    unittest.main()
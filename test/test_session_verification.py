@@ -0,0 +1,99 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from src.local_utils import InvalidSessionError, create_jwt, verify_session_token
+from src.session_revocation import RevocationList, SQLiteRevocationStore
+from src.session_verification import VerifiedSessionCache, token_digest, verify_session, verified_sessions
+
+SECRET = "encryption-secret-for-verification-tests"
+EMAIL = "user@example.com"
+
+
+def session_token(jti="jti-1", days=1, email=EMAIL):
+    now = datetime.now()
+    return create_jwt({"email": email, "iat": now, "exp": now + timedelta(days=days), "jti": jti}, SECRET)
+
+
+class TestVerifiedSessionCache(unittest.TestCase):
+    def test_entries_expire_with_the_token(self):
+        now = [1000.0]
+        cache = VerifiedSessionCache(clock=lambda: now[0])
+        cache.put(b"digest", SECRET, {"email": EMAIL, "exp": 1060})
+
+        self.assertEqual(cache.get(b"digest", SECRET)["email"], EMAIL)
+        now[0] = 1060
+        self.assertIsNone(cache.get(b"digest", SECRET))
+        self.assertEqual(len(cache), 0)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = VerifiedSessionCache(max_entries=2, clock=lambda: 0)
+        for digest in (b"a", b"b"):
+            cache.put(digest, SECRET, {"exp": 60})
+        cache.get(b"a", SECRET)
+        cache.put(b"c", SECRET, {"exp": 60})
+
+        self.assertIsNone(cache.get(b"b", SECRET))
+        self.assertIsNotNone(cache.get(b"a", SECRET))
+
+    def test_another_key_does_not_see_the_entries(self):
+        cache = VerifiedSessionCache(clock=lambda: 0)
+        cache.put(b"a", SECRET, {"exp": 60})
+
+        self.assertIsNone(cache.get(b"a", "rotated-secret"))
+        cache.put(b"b", "rotated-secret", {"exp": 60})
+        self.assertIsNone(cache.get(b"a", "rotated-secret"))
+
+
+class TestVerifySession(unittest.TestCase):
+    def setUp(self):
+        verified_sessions.clear()
+        self.addCleanup(verified_sessions.clear)
+        store = SQLiteRevocationStore()
+        self.revocations = RevocationList(store_factory=lambda: store, interval=60)
+        self.addCleanup(self.revocations.stop)
+        patcher = patch("src.session_verification.session_revocation.revocation_list", self.revocations)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch("src.session_verification.service._get_session_key_ring", return_value=SECRET)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_claims_are_verified_once_then_cached(self):
+        token = session_token()
+        with patch("src.session_verification.verify_session_token", wraps=verify_session_token) as spy:
+            first = verify_session(token)
+            second = verify_session(token)
+
+        self.assertEqual(first["email"], EMAIL)
+        self.assertEqual(first, second)
+        self.assertEqual(spy.call_count, 1)
+        self.assertIsNotNone(verified_sessions.get(token_digest(token), SECRET))
+
+    def test_returned_claims_are_copies(self):
+        token = session_token()
+        verify_session(token)["email"] = "attacker@example.com"
+
+        self.assertEqual(verify_session(token)["email"], EMAIL)
+
+    def test_revoked_session_is_rejected_even_when_cached(self):
+        token = session_token("jti-revoked")
+        verify_session(token)
+        self.revocations.revoke("jti-revoked", EMAIL, datetime.now().timestamp() + 3600)
+
+        with self.assertRaises(InvalidSessionError):
+            verify_session(token)
+
+    def test_invalid_sessions_are_not_cached(self):
+        forged = create_jwt(
+            {"email": EMAIL, "exp": datetime.now() + timedelta(days=1)}, "another-secret-of-at-least-32-bytes"
+        )
+        expired = session_token(days=-1)
+        for token in (None, "", forged, expired):
+            with self.assertRaises(InvalidSessionError):
+                verify_session(token)
+        self.assertEqual(len(verified_sessions), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+import threading
+import unittest
+from unittest.mock import patch
+
+from prometheus_client import REGISTRY
+
+from src.local_utils import save_session
+from src.session_writer import SessionWriteQueue
+from src.user_store import SQLiteUserStore, UserStore
+
+
+class RecordingStore(UserStore):
+    def __init__(self):
+        self.batches = []
+        self.sessions = {}
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+        self.fail = False
+        self.failures_left = 0
+
+    def update_session(self, email, session_start_time, jwt):
+        if self.fail or self.failures_left:
+            self.failures_left = max(0, self.failures_left - 1)
+            raise ConnectionError("DynamoDB unavailable")
+        self.sessions[email] = (session_start_time, jwt)
+
+    def update_sessions(self, sessions):
+        self.entered.set()
+        self.release.wait(5)
+        self.batches.append(list(sessions))
+        return super().update_sessions(sessions)
+
+
+def writes(result):
+    return REGISTRY.get_sample_value("session_writes_total", {"result": result}) or 0.0
+
+
+class TestSessionWriteQueue(unittest.TestCase):
+    def setUp(self):
+        self.store = RecordingStore()
+        self.queue = SessionWriteQueue(
+            lambda: self.store, max_size=3, batch_size=2, flush_interval=0.01, retry_backoff=0.001
+        )
+        self.addCleanup(self.queue.close)
+
+    def test_writes_are_flushed_in_batches(self):
+        for i in range(3):
+            self.assertTrue(self.queue.submit(f"user{i}@example.com", f"t{i}", f"jwt{i}"))
+        self.assertTrue(self.queue.flush(timeout=5))
+
+        self.assertEqual(self.store.sessions["user2@example.com"], ("t2", "jwt2"))
+        self.assertTrue(all(len(batch) <= 2 for batch in self.store.batches))
+        self.assertEqual(sum(len(batch) for batch in self.store.batches), 3)
+        self.assertEqual(self.queue.depth(), 0)
+
+    def test_newer_session_replaces_queued_one(self):
+        self.store.release.clear()
+        self.queue.submit("blocker@example.com", "t0", "jwt0")
+        self.store.entered.wait(5)
+        self.queue.submit("user@example.com", "t1", "jwt1")
+        self.queue.submit("user@example.com", "t2", "jwt2")
+        self.assertEqual(self.queue.depth(), 1)
+        self.store.release.set()
+        self.queue.flush(timeout=5)
+
+        self.assertEqual(self.store.sessions["user@example.com"], ("t2", "jwt2"))
+        self.assertEqual(sum(email == "user@example.com" for batch in self.store.batches for email, _, _ in batch), 1)
+
+    def test_full_queue_rejects(self):
+        self.store.release.clear()
+        rejected_before = writes("rejected")
+        self.queue.submit("blocker@example.com", "t", "jwt")
+        self.store.entered.wait(5)
+        for i in range(3):
+            self.assertTrue(self.queue.submit(f"user{i}@example.com", "t", "jwt"))
+        self.assertFalse(self.queue.submit("overflow@example.com", "t", "jwt"))
+        self.assertTrue(self.queue.submit("user0@example.com", "t-newer", "jwt"))
+        self.assertEqual(writes("rejected"), rejected_before + 1)
+        self.store.release.set()
+
+    def test_close_drains_pending_writes(self):
+        self.queue.submit("user@example.com", "t", "jwt")
+        self.queue.close()
+        self.assertEqual(self.store.sessions["user@example.com"], ("t", "jwt"))
+        self.assertFalse(self.queue.submit("late@example.com", "t", "jwt"))
+
+    def test_failed_writes_are_counted(self):
+        self.store.fail = True
+        failed_before = writes("failed")
+        self.queue.submit("user@example.com", "t", "jwt")
+        with self.assertLogs("src.session_writer", "ERROR") as logs:
+            self.queue.flush(timeout=5)
+        self.assertEqual(writes("failed"), failed_before + 1)
+        self.assertEqual(len(self.store.batches), 3)
+        self.assertIn("Session write for user@example.com dropped after 3 attempts", "\n".join(logs.output))
+
+    def test_failed_writes_are_retried(self):
+        self.store.failures_left = 1
+        retried_before = writes("retried")
+        self.queue.submit("user@example.com", "t", "jwt")
+        self.queue.flush(timeout=5)
+
+        self.assertEqual(self.store.sessions["user@example.com"], ("t", "jwt"))
+        self.assertEqual(writes("retried"), retried_before + 1)
+
+    def test_newer_session_is_not_overwritten_by_a_retry(self):
+        self.store.failures_left = 1
+        self.store.release.clear()
+        self.queue.submit("user@example.com", "t1", "jwt1")
+        self.store.entered.wait(5)
+        self.queue.submit("user@example.com", "t2", "jwt2")
+        self.store.release.set()
+        self.queue.flush(timeout=5)
+
+        self.assertEqual(self.store.sessions["user@example.com"], ("t2", "jwt2"))
+        self.assertEqual([session[1] for batch in self.store.batches for session in batch], ["t1", "t2"])
+
+
+class TestSaveSession(unittest.TestCase):
+    def setUp(self):
+        self.store = SQLiteUserStore()
+        self.store.create_if_not_exists({"email": "user@example.com", "name": "Test User"})
+        self.queue = SessionWriteQueue(lambda: self.store, max_size=1, batch_size=10, flush_interval=5)
+        self.addCleanup(self.queue.close)
+        for target, value in (
+            ("src.local_utils.get_user_store", lambda: self.store),
+            ("src.local_utils.session_write_queue", self.queue),
+            ("src.local_utils.SESSION_WRITE_BEHIND", True),
+        ):
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_write_behind_keeps_profile(self):
+        save_session("user@example.com", "jwt", "2024-01-01 00:00:00")
+        self.assertNotIn("jwt", self.store.get("user@example.com"))
+
+        self.queue.flush(timeout=5)
+        item = self.store.get("user@example.com")
+        self.assertEqual(item["jwt"], "jwt")
+        self.assertEqual(item["name"], "Test User")
+
+    def test_falls_back_to_synchronous_write_when_full(self):
+        save_session("other@example.com", "queued-jwt", "2024-01-01 00:00:00")
+        save_session("user@example.com", "direct-jwt", "2024-01-01 00:00:00")
+        self.assertEqual(self.store.get("user@example.com")["jwt"], "direct-jwt")
+        self.assertIsNone(self.store.get("other@example.com"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from src.shared_cache import WAYS, SharedCache, shared_cache_path
+
+
+class SharedCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "test.cache")
+        self.now = 1000.0
+
+    def open(self, **kwargs):
+        kwargs.setdefault("clock", lambda: self.now)
+        cache = SharedCache(self.path, **kwargs)
+        self.addCleanup(cache.close)
+        return cache
+
+
+class TestSharedCache(SharedCacheTestCase):
+    def test_dict_like_access(self):
+        cache = self.open(slots=64, slot_bytes=128)
+        cache["user@example.com"] = True
+        cache.set("claims", {"email": "user@example.com", "exp": 1700000000})
+
+        self.assertIs(cache["user@example.com"], True)
+        self.assertEqual(cache.get("claims"), {"email": "user@example.com", "exp": 1700000000})
+        self.assertIn("claims", cache)
+        self.assertEqual(len(cache), 2)
+        del cache["claims"]
+        self.assertNotIn("claims", cache)
+        self.assertIsNone(cache.get("claims"))
+        with self.assertRaises(KeyError):
+            cache["claims"]
+        with self.assertRaises(KeyError):
+            del cache["claims"]
+
+    def test_entries_expire(self):
+        cache = self.open(slots=64, slot_bytes=128)
+        cache.set("negative", False, ttl=5)
+        cache.set("positive", True, ttl=3600)
+
+        self.now += 5
+        self.assertIsNone(cache.get("negative"))
+        self.assertIs(cache.get("positive"), True)
+        self.assertEqual(len(cache), 1)
+
+    def test_overwrite_keeps_one_entry(self):
+        cache = self.open(slots=64, slot_bytes=128)
+        cache["key"] = "first"
+        cache["key"] = "second"
+
+        self.assertEqual(cache["key"], "second")
+        self.assertEqual(len(cache), 1)
+
+    def test_full_bucket_evicts_least_recently_used(self):
+        cache = self.open(slots=WAYS, slot_bytes=64)
+        for index in range(WAYS):
+            self.now += 1
+            cache[f"key-{index}"] = index
+        self.now += 1
+        cache.get("key-0")
+        self.now += 1
+        cache["key-new"] = "new"
+
+        self.assertEqual(cache.get("key-0"), 0)
+        self.assertIsNone(cache.get("key-1"))
+        self.assertEqual(cache.get("key-new"), "new")
+        self.assertEqual(len(cache), WAYS)
+
+    def test_expired_entries_are_replaced_first(self):
+        cache = self.open(slots=WAYS, slot_bytes=64)
+        cache.set("short-lived", 1, ttl=1)
+        for index in range(WAYS - 1):
+            cache[f"key-{index}"] = index
+        self.now += 1
+        cache["key-new"] = "new"
+
+        self.assertTrue(all(cache.get(f"key-{index}") == index for index in range(WAYS - 1)))
+
+    def test_entries_that_do_not_fit_are_not_cached(self):
+        cache = self.open(slots=64, slot_bytes=64)
+
+        self.assertFalse(cache.set("key", "x" * 64))
+        self.assertIsNone(cache.get("key"))
+
+    def test_clear(self):
+        cache = self.open(slots=64, slot_bytes=64)
+        for index in range(10):
+            cache[f"key-{index}"] = index
+        cache.clear()
+
+        self.assertEqual(len(cache), 0)
+
+    def test_shared_between_handles_and_kept_on_reopen(self):
+        writer = self.open(slots=64, slot_bytes=128)
+        reader = self.open(slots=64, slot_bytes=128)
+        writer["user@example.com"] = True
+        writer.close()
+
+        self.assertIs(reader["user@example.com"], True)
+        self.assertIs(self.open(slots=64, slot_bytes=128)["user@example.com"], True)
+
+    def test_other_geometry_is_refused(self):
+        self.open(slots=64, slot_bytes=128)
+
+        with self.assertRaises(ValueError):
+            self.open(slots=64, slot_bytes=256)
+        self.assertNotEqual(shared_cache_path("x", 64, 128, "/tmp"), shared_cache_path("x", 64, 256, "/tmp"))
+
+    def test_concurrent_threads(self):
+        cache = self.open(slots=4096, slot_bytes=64, clock=lambda: 1000.0)
+
+        def write(prefix):
+            for index in range(200):
+                cache[f"{prefix}-{index}"] = index
+
+        threads = [threading.Thread(target=write, args=(f"t{number}",)) for number in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        found = sum(cache.get(f"t{number}-{index}") == index for number in range(8) for index in range(200))
+        self.assertGreater(found, 1500)
+
+
+@unittest.skipUnless(hasattr(os, "fork"), "needs fork")
+class TestSharedCacheAcrossProcesses(SharedCacheTestCase):
+    def fork(self, cache, target):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                cache.reset_after_fork()
+                target()
+                code = 0
+            except BaseException:
+                code = 1
+            os._exit(code)
+        return pid
+
+    def test_forked_workers_see_each_others_entries(self):
+        cache = self.open(slots=4096, slot_bytes=64, clock=lambda: 1000.0)
+
+        def write(worker):
+            def run():
+                for index in range(300):
+                    cache[f"w{worker}-{index}"] = [worker, index]
+                    # Reads of the other workers' keys, under the same bucket locks
+                    cache.get(f"w{(worker + 1) % 4}-{index}")
+            return run
+
+        pids = [self.fork(cache, write(worker)) for worker in range(4)]
+        codes = [os.waitpid(pid, 0)[1] for pid in pids]
+
+        self.assertEqual(codes, [0, 0, 0, 0])
+        values = [cache.get(f"w{worker}-{index}") for worker in range(4) for index in range(300)]
+        # Bucket evictions may drop a few keys, but nothing read back is torn or mixed up
+        self.assertGreater(sum(value is not None for value in values), 1100)
+        for worker in range(4):
+            for index in range(300):
+                value = cache.get(f"w{worker}-{index}")
+                self.assertIn(value, (None, [worker, index]))
+
+
+if __name__ == "__main__":
+    unittest.main()
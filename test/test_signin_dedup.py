@@ -0,0 +1,213 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from prometheus_client import REGISTRY
+
+from src.signin_dedup import SigninDeduplicator, SigninResponse, SqliteSigninStore, code_digest
+
+OK = SigninResponse(200, [("Set-Cookie", "session=abc")], b"Cookie is set using SimpleCookie!")
+FAILED = SigninResponse(500, [("Content-Type", "application/json")], b'{"error": "x"}')
+
+
+def dedup_count(result):
+    return REGISTRY.get_sample_value("signin_dedup_requests_total", {"result": result}) or 0.0
+
+
+class SlowSignin:
+    def __init__(self, response=OK):
+        self.response = response
+        self.calls = 0
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.entered.set()
+        self.release.wait(5)
+        return self.response
+
+
+class TestSigninDeduplicator(unittest.TestCase):
+    def test_concurrent_duplicates_share_one_signin(self):
+        dedup = SigninDeduplicator(ttl=30, lease=5)
+        signin = SlowSignin()
+        results = []
+        joined_before = dedup_count("joined")
+
+        leader = threading.Thread(target=lambda: results.append(dedup.run("code", signin)))
+        leader.start()
+        signin.entered.wait(5)
+        followers = [threading.Thread(target=lambda: results.append(dedup.run("code", signin))) for _ in range(3)]
+        for thread in followers:
+            thread.start()
+        for _ in range(500):
+            if dedup_count("joined") >= joined_before + 3:
+                break
+            time.sleep(0.01)
+        signin.release.set()
+        for thread in [leader] + followers:
+            thread.join(5)
+
+        self.assertEqual(signin.calls, 1)
+        self.assertEqual(results, [OK] * 4)
+
+    def test_successful_response_is_replayed_until_the_ttl(self):
+        clock = [0.0]
+        dedup = SigninDeduplicator(ttl=30, lease=5)
+        calls = []
+        signin = lambda: calls.append(1) or OK
+
+        with patch("src.signin_dedup.time.monotonic", lambda: clock[0]):
+            self.assertEqual(dedup.run("code", signin), OK)
+            clock[0] = 29
+            self.assertEqual(dedup.run("code", signin), OK)
+            clock[0] = 31
+            dedup.run("code", signin)
+
+        self.assertEqual(len(calls), 2)
+
+    def test_failed_response_is_not_cached(self):
+        dedup = SigninDeduplicator(ttl=30, lease=5)
+        responses = iter([FAILED, OK])
+
+        self.assertEqual(dedup.run("code", lambda: next(responses)), FAILED)
+        self.assertEqual(dedup.run("code", lambda: next(responses)), OK)
+
+    def test_exception_reaches_waiters_and_is_not_cached(self):
+        dedup = SigninDeduplicator(ttl=30, lease=5)
+        entered, release = threading.Event(), threading.Event()
+        errors = []
+
+        def failing():
+            entered.set()
+            release.wait(5)
+            raise ConnectionError("token endpoint down")
+
+        def call():
+            try:
+                dedup.run("code", failing)
+            except ConnectionError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(2)]
+        threads[0].start()
+        entered.wait(5)
+        threads[1].start()
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(dedup.run("code", lambda: OK), OK)
+
+    def test_distinct_codes_do_not_share(self):
+        dedup = SigninDeduplicator(ttl=30, lease=5)
+        other = SigninResponse(200, [], b"other")
+
+        dedup.run("code-1", lambda: OK)
+
+        self.assertEqual(dedup.run("code-2", lambda: other), other)
+
+    def test_max_entries_evicts_oldest(self):
+        dedup = SigninDeduplicator(ttl=30, lease=5, max_entries=2)
+        for code in ("a", "b", "c"):
+            dedup.run(code, lambda: OK)
+        calls = []
+
+        dedup.run("a", lambda: calls.append(1) or OK)
+        dedup.run("c", lambda: calls.append(1) or OK)
+
+        self.assertEqual(len(calls), 1)
+
+    def test_disabled_always_signs_in(self):
+        dedup = SigninDeduplicator(enabled=False)
+        calls = []
+
+        dedup.run("code", lambda: calls.append(1) or OK)
+        dedup.run("code", lambda: calls.append(1) or OK)
+
+        self.assertEqual(len(calls), 2)
+
+    def test_async_duplicates_share_one_signin(self):
+        dedup = SigninDeduplicator(ttl=30, lease=5)
+        calls = []
+
+        async def signin():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return OK
+
+        async def run_blocking(fn, *args):
+            return fn(*args)
+
+        async def main():
+            return await asyncio.gather(*(dedup.run_async("code", signin, run_blocking) for _ in range(5)))
+
+        self.assertEqual(asyncio.run(main()), [OK] * 5)
+        self.assertEqual(len(calls), 1)
+
+
+class TestSqliteSigninStore(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "signin.db")
+
+    def test_result_is_shared_between_workers(self):
+        worker_1 = SigninDeduplicator(ttl=30, lease=5, shared=SqliteSigninStore(self.path))
+        worker_2 = SigninDeduplicator(ttl=30, lease=5, shared=SqliteSigninStore(self.path))
+        calls = []
+
+        worker_1.run("code", lambda: calls.append(1) or OK)
+
+        self.assertEqual(worker_2.run("code", lambda: calls.append(1) or FAILED), OK)
+        self.assertEqual(len(calls), 1)
+
+    def test_worker_waits_for_claim_held_by_another_worker(self):
+        store_1, store_2 = SqliteSigninStore(self.path), SqliteSigninStore(self.path)
+        worker_2 = SigninDeduplicator(ttl=30, lease=5, shared=store_2)
+        key = code_digest("code")
+        self.assertTrue(store_1.claim(key, 5))
+        results = []
+
+        thread = threading.Thread(target=lambda: results.append(worker_2.run("code", lambda: FAILED)))
+        thread.start()
+        store_1.complete(key, OK, 30)
+        thread.join(5)
+
+        self.assertEqual(results, [OK])
+
+    def test_expired_claim_is_taken_over(self):
+        store_1, store_2 = SqliteSigninStore(self.path), SqliteSigninStore(self.path)
+        self.assertTrue(store_1.claim(code_digest("code"), 0))
+        worker_2 = SigninDeduplicator(ttl=30, lease=5, shared=store_2)
+
+        self.assertEqual(worker_2.run("code", lambda: OK), OK)
+        self.assertEqual(store_1.get(code_digest("code")), (False, OK))
+
+    def test_failed_signin_releases_the_claim(self):
+        store = SqliteSigninStore(self.path)
+        dedup = SigninDeduplicator(ttl=30, lease=5, shared=store)
+
+        dedup.run("code", lambda: FAILED)
+
+        self.assertEqual(store.get(code_digest("code")), (False, None))
+
+    def test_database_is_private_and_stores_only_digests(self):
+        store = SqliteSigninStore(self.path)
+        SigninDeduplicator(shared=store).run("secret-code", lambda: OK)
+
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+        for path in (self.path, self.path + "-wal"):
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    self.assertNotIn(b"secret-code", f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import time
+import unittest
+from datetime import datetime, timedelta
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from src.local_utils import InvalidSessionError, create_jwt, issue_session_token, verify_session_token
+from src.signing_keys import SESSION_LIFETIME_SECONDS, KeyRingCache, SigningKeyError, build_key_ring
+
+ENCRYPTION_KEY = "encryption-secret-key-of-at-least-32-bytes"
+OLD_SECRET = "old-session-signing-secret-of-32-bytes"
+NEW_SECRET = "new-session-signing-secret-of-32-bytes"
+
+
+def payload(days=1):
+    now = datetime.now()
+    return {"email": "user@example.com", "iat": now, "exp": now + timedelta(days=days)}
+
+
+class TestSigningKeyRing(unittest.TestCase):
+    def test_derived_key_is_not_the_encryption_key(self):
+        ring = build_key_ring({"encryption_secret_key": ENCRYPTION_KEY})
+        token, _ = issue_session_token("user@example.com", ring)
+
+        self.assertEqual(jwt.get_unverified_header(token)["kid"], ring.primary.kid)
+        self.assertEqual(verify_session_token(token, ring)["email"], "user@example.com")
+        with self.assertRaises(jwt.InvalidSignatureError):
+            jwt.decode(token, ENCRYPTION_KEY, algorithms=["HS256"])
+
+    def test_unkeyed_tokens_verify_with_the_encryption_key_while_enabled(self):
+        legacy = create_jwt(payload(), ENCRYPTION_KEY)
+
+        ring = build_key_ring({"encryption_secret_key": ENCRYPTION_KEY})
+        self.assertEqual(verify_session_token(legacy, ring)["email"], "user@example.com")
+        ring = build_key_ring({"encryption_secret_key": ENCRYPTION_KEY}, verify_unkeyed=False)
+        with self.assertRaises(InvalidSessionError):
+            verify_session_token(legacy, ring)
+
+    def test_rotation_keeps_sessions_of_the_retired_key(self):
+        before = build_key_ring({"session_signing_keys": [{"kid": "old", "secret": OLD_SECRET}]}, verify_unkeyed=False)
+        old_token = before.sign(payload())
+        after = build_key_ring(
+            {
+                "session_signing_keys": [
+                    {"kid": "old", "secret": OLD_SECRET, "retired_at": time.time()},
+                    {"kid": "new", "secret": NEW_SECRET, "primary": True},
+                ]
+            },
+            verify_unkeyed=False,
+        )
+
+        self.assertEqual(jwt.get_unverified_header(after.sign(payload()))["kid"], "new")
+        self.assertEqual(verify_session_token(old_token, after)["email"], "user@example.com")
+
+    def test_keys_retired_longer_than_a_session_are_dropped(self):
+        ring = build_key_ring(
+            {
+                "session_signing_keys": [
+                    {"kid": "old", "secret": OLD_SECRET, "retired_at": time.time() - SESSION_LIFETIME_SECONDS - 1},
+                    {"kid": "new", "secret": NEW_SECRET},
+                ]
+            },
+            verify_unkeyed=False,
+        )
+
+        self.assertEqual(sorted(ring.keys), ["new"])
+        self.assertEqual(ring.primary.kid, "new")
+
+    def test_verification_uses_only_the_key_named_by_kid(self):
+        secrets = {"session_signing_keys": [{"kid": "a", "secret": OLD_SECRET}, {"kid": "b", "secret": NEW_SECRET}]}
+        ring = build_key_ring(secrets, verify_unkeyed=False)
+        # Signed with b's secret but naming a
+        mislabeled = jwt.encode(payload(), NEW_SECRET, algorithm="HS256", headers={"kid": "a"})
+        unknown = jwt.encode(payload(), NEW_SECRET, algorithm="HS256", headers={"kid": "c"})
+
+        for token in (mislabeled, unknown, "not-a-jwt"):
+            with self.assertRaises(InvalidSessionError):
+                verify_session_token(token, ring)
+
+    def test_asymmetric_keys(self):
+        private_key = ec.generate_private_key(ec.SECP256R1()).private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        ).decode("ascii")
+        ring = build_key_ring(
+            {"session_signing_keys": [{"kid": "ec", "algorithm": "ES256", "private_key": private_key}]},
+            verify_unkeyed=False,
+        )
+        token = ring.sign(payload())
+
+        self.assertEqual(jwt.get_unverified_header(token)["alg"], "ES256")
+        self.assertEqual(verify_session_token(token, ring)["email"], "user@example.com")
+
+    def test_configuration_errors(self):
+        with self.assertRaises(SigningKeyError):
+            build_key_ring({"session_signing_keys": "[]"})
+        with self.assertRaises(SigningKeyError):
+            build_key_ring(
+                {"session_signing_keys": [{"kid": "old", "secret": OLD_SECRET, "retired_at": time.time()}]},
+                verify_unkeyed=False,
+            )
+
+
+class TestKeyRingCache(unittest.TestCase):
+    def test_rebuilt_only_when_the_keys_change(self):
+        cache = KeyRingCache()
+        ring = cache.get({"encryption_secret_key": ENCRYPTION_KEY, "client_id": "a"})
+
+        self.assertIs(cache.get({"encryption_secret_key": ENCRYPTION_KEY, "client_id": "b"}), ring)
+        rotated = cache.get({"encryption_secret_key": ENCRYPTION_KEY, "session_signing_keys": '[{"kid": "k", "secret": "%s"}]' % NEW_SECRET})
+        self.assertIsNot(rotated, ring)
+        self.assertEqual(rotated.primary.kid, "k")
+
+
+if __name__ == "__main__":
+    unittest.main()
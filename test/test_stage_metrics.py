@@ -0,0 +1,103 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from prometheus_client import REGISTRY, generate_latest
+from prometheus_client.openmetrics.exposition import generate_latest as generate_openmetrics
+
+from src import async_service
+from src.asgi_app import registry as asgi_registry
+from src.service import authorize_with_google, is_user_exists
+from src.stage_metrics import observe_stage, trace_id, trace_id_from_headers
+
+
+def stage_count(stage, outcome):
+    value = REGISTRY.get_sample_value(
+        "signin_stage_duration_seconds_count", {"stage": stage, "outcome": outcome}
+    )
+    return value or 0.0
+
+
+class TestObserveStage(unittest.TestCase):
+    def test_records_success_and_error_outcomes(self):
+        before_success = stage_count("test_stage", "success")
+        before_error = stage_count("test_stage", "error")
+
+        with observe_stage("test_stage"):
+            pass
+        with self.assertRaises(RuntimeError):
+            with observe_stage("test_stage"):
+                raise RuntimeError("boom")
+
+        self.assertEqual(stage_count("test_stage", "success"), before_success + 1)
+        self.assertEqual(stage_count("test_stage", "error"), before_error + 1)
+
+    def test_exemplar_carries_trace_id_when_enabled(self):
+        token = trace_id.set("4bf92f3577b34da6a3ce929d0e0e4736")
+        try:
+            with observe_stage("exemplar_stage", exemplars=True):
+                pass
+        finally:
+            trace_id.reset(token)
+        self.assertIn('trace_id="4bf92f3577b34da6a3ce929d0e0e4736"', generate_openmetrics(REGISTRY).decode())
+
+    def test_no_exemplar_by_default(self):
+        token = trace_id.set("0af7651916cd43dd8448eb211c80319c")
+        try:
+            with observe_stage("plain_stage"):
+                pass
+        finally:
+            trace_id.reset(token)
+        self.assertNotIn("0af7651916cd43dd8448eb211c80319c", generate_openmetrics(REGISTRY).decode())
+
+    def test_exported_by_both_apps(self):
+        with observe_stage("exported_stage"):
+            pass
+        self.assertIn(b'stage="exported_stage"', generate_latest(REGISTRY))
+        self.assertIn(b'stage="exported_stage"', generate_latest(asgi_registry))
+
+
+class TestTraceIdFromHeaders(unittest.TestCase):
+    def test_traceparent(self):
+        headers = {"traceparent": "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"}
+        self.assertEqual(trace_id_from_headers(headers), "4bf92f3577b34da6a3ce929d0e0e4736")
+
+    def test_amzn_trace_id(self):
+        headers = {"x-amzn-trace-id": "Self=1-67891234-abcdef;Root=1-67891233-abcdef012345678912345678"}
+        self.assertEqual(trace_id_from_headers(headers), "1-67891233-abcdef012345678912345678")
+
+    def test_missing_or_malformed(self):
+        self.assertIsNone(trace_id_from_headers({}))
+        self.assertIsNone(trace_id_from_headers({"traceparent": "not-a-traceparent"}))
+
+
+class TestPipelineStages(unittest.TestCase):
+    @patch('src.service._fetch_sign_with_google_secrets_from_aws')
+    @patch('src.service.get_google_token_client')
+    def test_token_exchange_stage(self, mock_get_client, mock_fetch_secrets):
+        mock_fetch_secrets.return_value = ('client_id', 'client_secret', 'redirect_uri')
+        mock_get_client.return_value.exchange_code.side_effect = Exception("Auth failed")
+        before = stage_count("google_token_exchange", "error")
+
+        with self.assertRaises(Exception):
+            authorize_with_google('auth_code')
+        self.assertEqual(stage_count("google_token_exchange", "error"), before + 1)
+
+    @patch('src.service.get_user_store')
+    def test_user_lookup_error_is_recorded_even_when_swallowed(self, mock_get_store):
+        mock_get_store.return_value.get.side_effect = Exception("DynamoDB error")
+        before = stage_count("user_lookup", "error")
+
+        self.assertFalse(is_user_exists('user@example.com'))
+        self.assertEqual(stage_count("user_lookup", "error"), before + 1)
+
+    def test_run_blocking_propagates_trace_id(self):
+        async def scenario():
+            trace_id.set("trace-from-request")
+            return await async_service.run_blocking(trace_id.get)
+
+        self.assertEqual(asyncio.run(scenario()), "trace-from-request")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+from unittest.mock import patch
+
+from src import token_crypto
+from src.token_crypto import TokenCipher, TokenDecryptionError, derive_master_key, get_token_cipher
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenCipher(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cipher = TokenCipher("secret-one", max_uses=4, max_age=60, clock=self.clock)
+
+    def test_round_trip(self):
+        ciphertext = self.cipher.encrypt("ya29.access-token")
+        self.assertTrue(ciphertext.startswith(f"env1.{self.cipher.current_kid}."))
+        self.assertNotIn("access-token", ciphertext)
+        self.assertEqual(self.cipher.decrypt(ciphertext), "ya29.access-token")
+
+    def test_encrypt_pair_shares_one_data_key(self):
+        access, refresh = self.cipher.encrypt_pair("access", "refresh")
+        self.assertEqual(access.rsplit(".", 1)[0], refresh.rsplit(".", 1)[0])
+        self.assertNotEqual(access, refresh)
+        self.assertEqual(self.cipher.decrypt(access), "access")
+        self.assertEqual(self.cipher.decrypt(refresh), "refresh")
+        self.assertEqual(self.cipher.data_keys_created, 1)
+
+    def test_encrypt_pair_passes_missing_refresh_token_through(self):
+        access, refresh = self.cipher.encrypt_pair("access", None)
+        self.assertIsNone(refresh)
+        self.assertEqual(self.cipher.decrypt(access), "access")
+
+    def test_data_key_rotates_after_max_uses(self):
+        for _ in range(2):
+            self.cipher.encrypt_pair("access", "refresh")
+        self.assertEqual(self.cipher.data_keys_created, 1)
+        self.cipher.encrypt("access")
+        self.assertEqual(self.cipher.data_keys_created, 2)
+
+    def test_data_key_rotates_after_max_age(self):
+        first = self.cipher.encrypt("access")
+        self.clock.now += 61
+        second = self.cipher.encrypt("access")
+        self.assertEqual(self.cipher.data_keys_created, 2)
+        self.assertNotEqual(first.rsplit(".", 1)[0], second.rsplit(".", 1)[0])
+        self.assertEqual(self.cipher.decrypt(first), "access")
+
+    def test_rotated_secret_still_decrypts_old_ciphertexts(self):
+        old = self.cipher.encrypt("old-token")
+        old_kid = self.cipher.current_kid
+        new_kid = self.cipher.add_key("secret-two")
+        new = self.cipher.encrypt("new-token")
+
+        self.assertNotEqual(old_kid, new_kid)
+        self.assertIn(f".{new_kid}.", new)
+        self.assertEqual(self.cipher.decrypt(old), "old-token")
+        self.assertEqual(self.cipher.decrypt(new), "new-token")
+
+    def test_unknown_key_id(self):
+        other = TokenCipher("another-secret")
+        with self.assertRaises(TokenDecryptionError):
+            self.cipher.decrypt(other.encrypt("token"))
+
+    def test_tampered_ciphertext(self):
+        ciphertext = self.cipher.encrypt("token")
+        tampered = ciphertext[:-2] + ("A" if ciphertext[-2] != "A" else "B") + ciphertext[-1]
+        with self.assertRaises(TokenDecryptionError):
+            self.cipher.decrypt(tampered)
+
+    def test_rejects_other_formats(self):
+        with self.assertRaises(TokenDecryptionError):
+            self.cipher.decrypt("gAAAAABlegacyfernettoken")
+
+
+class TestGetTokenCipher(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.multiple(token_crypto, _cipher=None, _cipher_secret=None, _cipher_previous=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reused_until_secret_changes(self):
+        cipher = get_token_cipher("secret-one")
+        old = cipher.encrypt("token")
+        self.assertIs(get_token_cipher("secret-one"), cipher)
+
+        rotated = get_token_cipher("secret-two")
+        self.assertIs(rotated, cipher)
+        self.assertNotIn(rotated.current_kid, old)
+        self.assertEqual(rotated.decrypt(old), "token")
+
+    def test_previous_keys_from_the_secret(self):
+        old = TokenCipher("secret-one").encrypt("token")
+        kid = derive_master_key("secret-one")[0]
+
+        cipher = get_token_cipher("secret-two", json.dumps([{"kid": kid, "key": "secret-one"}]))
+        self.assertEqual(cipher.current_kid, derive_master_key("secret-two")[0])
+        self.assertEqual(cipher.decrypt(old), "token")
+
+    def test_previous_keys_must_be_a_list(self):
+        with self.assertRaises(ValueError):
+            get_token_cipher("secret-two", "secret-one")
+
+    def decrypt_in_fresh_process(self, ciphertext, *args):
+        script = (
+            "import sys\n"
+            "from src.token_crypto import get_token_cipher\n"
+            f"print(get_token_cipher(*{args!r}).decrypt(sys.argv[1]))\n"
+        )
+        return subprocess.run(
+            [sys.executable, "-c", script, ciphertext], cwd=REPO_ROOT, capture_output=True, text=True, timeout=30
+        )
+
+    def test_worker_started_after_a_rotation(self):
+        old = TokenCipher("secret-one").encrypt("token")
+
+        restarted = self.decrypt_in_fresh_process(old, "secret-two", ["secret-one"])
+        self.assertEqual(restarted.returncode, 0, restarted.stderr)
+        self.assertEqual(restarted.stdout.strip(), "token")
+
+        without_previous_keys = self.decrypt_in_fresh_process(old, "secret-two")
+        self.assertNotEqual(without_previous_keys.returncode, 0)
+        self.assertIn("TokenDecryptionError", without_previous_keys.stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,249 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+import boto3
+
+from benchmarks.stand_ins import LocalAwsServer
+from src.user_store import DynamoDBUserStore, ResilientUserStore, SQLiteUserStore, create_user_store
+
+PROFILE = {"name": "Test User", "created_at": "2023-01-01T12:00:00"}
+SESSION = {"session_start_time": "2023-01-01 12:00:00", "jwt": "token"}
+
+
+class TestSQLiteUserStore(unittest.TestCase):
+    def setUp(self):
+        self.store = SQLiteUserStore()
+
+    def test_get_missing_user(self):
+        self.assertIsNone(self.store.get("user@example.com"))
+
+    def test_create_if_not_exists(self):
+        self.assertTrue(self.store.create_if_not_exists({"email": "user@example.com", "name": "First"}))
+        self.assertFalse(self.store.create_if_not_exists({"email": "user@example.com", "name": "Second"}))
+        self.assertEqual(self.store.get("user@example.com")["name"], "First")
+
+    def test_get_with_projection(self):
+        self.store.create_if_not_exists({"email": "user@example.com", "name": "First", "jwt": "t"})
+        self.assertEqual(self.store.get("user@example.com", ["email"]), {"email": "user@example.com"})
+
+    def test_renew_session_only_replaces_older_sessions(self):
+        self.store.create_if_not_exists({"email": "user@example.com", "name": "First", "session_start_time": "2023-01-01 12:00:00"})
+
+        self.assertFalse(self.store.renew_session("user@example.com", "2023-01-20 12:00:00", "t2", "2023-01-01 11:00:00"))
+        self.assertTrue(self.store.renew_session("user@example.com", "2023-01-20 12:00:00", "t2", "2023-01-20 11:00:00"))
+        self.assertFalse(self.store.renew_session("user@example.com", "2023-01-20 12:00:01", "t3", "2023-01-20 11:00:01"))
+        self.assertFalse(self.store.renew_session("missing@example.com", "2023-01-20 12:00:00", "t2", "2023-01-20 11:00:00"))
+        item = self.store.get("user@example.com")
+        self.assertEqual((item["jwt"], item["name"]), ("t2", "First"))
+        self.assertIsNone(self.store.get("missing@example.com"))
+
+    def test_update_session(self):
+        self.store.create_if_not_exists({"email": "user@example.com", "name": "First"})
+        self.store.update_session("user@example.com", "2023-01-02 00:00:00", "new-token")
+        item = self.store.get("user@example.com")
+        self.assertEqual(item["jwt"], "new-token")
+        self.assertEqual(item["name"], "First")
+
+    def test_update_sessions_in_one_transaction(self):
+        self.store.create_if_not_exists({"email": "user@example.com", "name": "First"})
+        failed = self.store.update_sessions([
+            ("user@example.com", "2023-01-02 00:00:00", "token-1"),
+            ("new@example.com", "2023-01-02 00:00:00", "token-2"),
+        ])
+        self.assertEqual(failed, [])
+        self.assertEqual(self.store.get("user@example.com")["name"], "First")
+        self.assertEqual(self.store.get("new@example.com")["jwt"], "token-2")
+
+    def test_batch_get(self):
+        for index in range(150):
+            self.store.create_if_not_exists({"email": f"user{index}@example.com", "name": f"User {index}"})
+        emails = [f"user{index}@example.com" for index in range(0, 150, 2)] + ["missing@example.com"]
+
+        items = self.store.batch_get(emails, ["name"])
+        self.assertEqual(len(items), 75)
+        self.assertEqual(items["user4@example.com"], {"email": "user4@example.com", "name": "User 4"})
+
+    def test_upsert_new_then_existing_user(self):
+        self.assertTrue(self.store.upsert_user_with_session("user@example.com", PROFILE, SESSION))
+        self.assertFalse(self.store.upsert_user_with_session(
+            "user@example.com", dict(PROFILE, name="Changed"), dict(SESSION, jwt="token-2")
+        ))
+        item = self.store.get("user@example.com")
+        self.assertEqual(item["name"], "Test User")
+        self.assertEqual(item["jwt"], "token-2")
+
+    def test_update_attributes_only_for_existing_user(self):
+        self.store.upsert_user_with_session("user@example.com", PROFILE, SESSION)
+
+        self.assertTrue(self.store.update_attributes("user@example.com", {"access_token": "enc", "access_token_expires_at": 10}))
+        self.assertFalse(self.store.update_attributes("nobody@example.com", {"access_token": "enc"}))
+        item = self.store.get("user@example.com")
+        self.assertEqual((item["access_token"], item["name"]), ("enc", "Test User"))
+        self.assertIsNone(self.store.get("nobody@example.com"))
+
+    def test_scan_segments_cover_every_user_once(self):
+        self.store.batch_put([{"email": f"user{index}@example.com", "name": str(index)} for index in range(25)])
+
+        emails = [item["email"] for segment in range(3) for item in self.store.scan(segment, 3, ["email"], page_size=4)]
+
+        self.assertEqual(sorted(emails), sorted(f"user{index}@example.com" for index in range(25)))
+
+    def test_file_database_is_shared_between_connections(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "users.db")
+            SQLiteUserStore(path).upsert_user_with_session("user@example.com", PROFILE, SESSION)
+            self.assertEqual(SQLiteUserStore(path).get("user@example.com")["jwt"], "token")
+
+
+class TestDynamoDBUserStore(unittest.TestCase):
+    def setUp(self):
+        self.client = MagicMock()
+        self.client.exceptions.ConditionalCheckFailedException = type("ConditionalCheckFailedException", (Exception,), {})
+        self.store = DynamoDBUserStore("user_authentication", client=self.client)
+
+    def test_get(self):
+        self.client.get_item.return_value = {"Item": {"email": {"S": "user@example.com"}, "name": {"S": "Test"}}}
+        self.assertEqual(self.store.get("user@example.com"), {"email": "user@example.com", "name": "Test"})
+        self.client.get_item.assert_called_once_with(
+            TableName="user_authentication", Key={"email": {"S": "user@example.com"}}
+        )
+
+    def test_get_with_projection(self):
+        self.client.get_item.return_value = {}
+        self.assertIsNone(self.store.get("user@example.com", ["email"]))
+        self.client.get_item.assert_called_once_with(
+            TableName="user_authentication",
+            Key={"email": {"S": "user@example.com"}},
+            ProjectionExpression="#a0",
+            ExpressionAttributeNames={"#a0": "email"},
+        )
+
+    def test_create_if_not_exists(self):
+        self.assertTrue(self.store.create_if_not_exists({"email": "user@example.com"}))
+        self.assertEqual(self.client.put_item.call_args[1]["ConditionExpression"], "attribute_not_exists(#k)")
+
+        self.client.put_item.side_effect = self.client.exceptions.ConditionalCheckFailedException()
+        self.assertFalse(self.store.create_if_not_exists({"email": "user@example.com"}))
+
+    def test_batch_get_retries_unprocessed_keys(self):
+        self.client.batch_get_item.side_effect = [
+            {
+                "Responses": {"user_authentication": [{"email": {"S": "a@example.com"}}]},
+                "UnprocessedKeys": {"user_authentication": {"Keys": [{"email": {"S": "b@example.com"}}]}},
+            },
+            {"Responses": {"user_authentication": [{"email": {"S": "b@example.com"}}]}},
+        ]
+        items = self.store.batch_get(["a@example.com", "b@example.com"])
+        self.assertEqual(set(items), {"a@example.com", "b@example.com"})
+        self.assertEqual(self.client.batch_get_item.call_count, 2)
+
+    def test_upsert_builds_single_conditional_update(self):
+        self.client.update_item.return_value = {}
+        self.assertTrue(self.store.upsert_user_with_session("user@example.com", PROFILE, SESSION))
+
+        self.client.update_item.assert_called_once_with(
+            TableName="user_authentication",
+            Key={"email": {"S": "user@example.com"}},
+            UpdateExpression=(
+                "SET #p0 = if_not_exists(#p0, :p0), #p1 = if_not_exists(#p1, :p1), #s0 = :s0, #s1 = :s1"
+            ),
+            ExpressionAttributeNames={
+                "#p0": "name", "#p1": "created_at", "#s0": "session_start_time", "#s1": "jwt"
+            },
+            ExpressionAttributeValues={
+                ":p0": {"S": "Test User"},
+                ":p1": {"S": "2023-01-01T12:00:00"},
+                ":s0": {"S": "2023-01-01 12:00:00"},
+                ":s1": {"S": "token"},
+            },
+            ReturnValues="UPDATED_OLD",
+        )
+
+    def test_upsert_existing_user(self):
+        self.client.update_item.return_value = {
+            "Attributes": {"created_at": {"S": "2022-01-01T00:00:00"}, "jwt": {"S": "old"}}
+        }
+        self.assertFalse(self.store.upsert_user_with_session("user@example.com", PROFILE, SESSION))
+
+
+class TestDynamoDBUserStoreAgainstLocalStandIn(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = LocalAwsServer().start()
+        cls.client = boto3.client(
+            "dynamodb",
+            endpoint_url=cls.server.endpoint_url,
+            region_name="us-east-1",
+            aws_access_key_id="local",
+            aws_secret_access_key="local",
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.server.tables.clear()
+        self.store = DynamoDBUserStore("user_authentication", client=self.client)
+
+    def test_upsert_then_get(self):
+        self.assertTrue(self.store.upsert_user_with_session("user@example.com", PROFILE, SESSION))
+        self.assertFalse(self.store.upsert_user_with_session("user@example.com", PROFILE, dict(SESSION, jwt="t2")))
+        self.assertEqual(self.store.get("user@example.com")["jwt"], "t2")
+        self.assertEqual(self.store.get("user@example.com", ["email"]), {"email": "user@example.com"})
+
+    def test_renew_session_only_replaces_older_sessions(self):
+        self.store.create_if_not_exists({"email": "user@example.com", "name": "First", "session_start_time": "2023-01-01 12:00:00"})
+
+        self.assertFalse(self.store.renew_session("user@example.com", "2023-01-20 12:00:00", "t2", "2023-01-01 11:00:00"))
+        self.assertTrue(self.store.renew_session("user@example.com", "2023-01-20 12:00:00", "t2", "2023-01-20 11:00:00"))
+        self.assertFalse(self.store.renew_session("user@example.com", "2023-01-20 12:00:01", "t3", "2023-01-20 11:00:01"))
+        self.assertFalse(self.store.renew_session("missing@example.com", "2023-01-20 12:00:00", "t2", "2023-01-20 11:00:00"))
+        item = self.store.get("user@example.com")
+        self.assertEqual((item["jwt"], item["name"]), ("t2", "First"))
+        self.assertIsNone(self.store.get("missing@example.com"))
+
+    def test_create_if_not_exists(self):
+        self.assertTrue(self.store.create_if_not_exists({"email": "user@example.com", "name": "First"}))
+        self.assertFalse(self.store.create_if_not_exists({"email": "user@example.com", "name": "Second"}))
+        self.assertEqual(self.store.batch_get(["user@example.com"])["user@example.com"]["name"], "First")
+
+    def test_update_sessions_keeps_profile(self):
+        for index in range(20):
+            self.store.create_if_not_exists({"email": f"user{index}@example.com", "name": f"User {index}"})
+        sessions = [(f"user{index}@example.com", "2023-01-02 00:00:00", f"token-{index}") for index in range(20)]
+
+        self.assertEqual(self.store.update_sessions(sessions), [])
+        items = self.store.batch_get([email for email, _, _ in sessions])
+        self.assertEqual(items["user7@example.com"]["jwt"], "token-7")
+        self.assertEqual(items["user7@example.com"]["name"], "User 7")
+
+    def test_update_attributes_only_for_existing_user(self):
+        self.store.upsert_user_with_session("user@example.com", PROFILE, SESSION)
+
+        self.assertTrue(self.store.update_attributes("user@example.com", {"access_token": "enc", "access_token_expires_at": 10}))
+        self.assertFalse(self.store.update_attributes("nobody@example.com", {"access_token": "enc"}))
+        item = self.store.get("user@example.com")
+        self.assertEqual((item["access_token"], item["access_token_expires_at"], item["name"]), ("enc", 10, "Test User"))
+        self.assertIsNone(self.store.get("nobody@example.com"))
+
+
+class TestCreateUserStore(unittest.TestCase):
+    def test_backends(self):
+        self.assertIsInstance(create_user_store("sqlite", resilient=False), SQLiteUserStore)
+        self.assertIsInstance(create_user_store("dynamodb", resilient=False), DynamoDBUserStore)
+        with self.assertRaises(ValueError):
+            create_user_store("redis")
+
+    def test_resilient_store_wraps_the_backend_without_botocore_retries(self):
+        store = create_user_store("dynamodb", resilient=True)
+
+        self.assertIsInstance(store, ResilientUserStore)
+        self.assertIsInstance(store.store, DynamoDBUserStore)
+        self.assertEqual(store.store.max_attempts, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import subprocess
+import sys
+import unittest
+
+from src import google_token_client
+from src.dynamodb_client import get_dynamodb_client
+from src.secrets_cache import authentication_secrets_cache
+from src.user_store import get_user_store
+from src.warmup import warm_up
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_in_child(check) -> int:
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os._exit(0 if check() else 1)
+        except BaseException:
+            os._exit(2)
+    _, status = os.waitpid(pid, 0)
+    return os.waitstatus_to_exitcode(status)
+
+
+class TestLazyImports(unittest.TestCase):
+    def imported_after(self, entry_point, modules):
+        code = f"import sys, {entry_point}; print(sorted(m for m in {modules!r} if m in sys.modules))"
+        output = subprocess.run(
+            [sys.executable, "-c", code], cwd=REPOSITORY_ROOT, env=dict(os.environ),
+            capture_output=True, text=True, check=True,
+        ).stdout
+        return output.strip()
+
+    def test_app_import_defers_aws_and_http_clients(self):
+        self.assertEqual(self.imported_after("src.app", ("boto3", "botocore", "requests", "jwt", "aiohttp")), "[]")
+
+    def test_asgi_import_defers_flask(self):
+        self.assertEqual(self.imported_after("src.asgi_app", ("boto3", "flask", "aiohttp")), "[]")
+
+
+class TestWarmUp(unittest.TestCase):
+    def test_imports_deferred_modules(self):
+        warm_up()
+        for module in ("boto3", "requests", "jwt"):
+            self.assertIn(module, sys.modules)
+
+
+class TestAfterFork(unittest.TestCase):
+    def test_clients_are_recreated_in_the_child(self):
+        parent_client = get_dynamodb_client()
+        parent_store = get_user_store()
+        google_token_client._client = object()
+        self.addCleanup(setattr, google_token_client, "_client", None)
+
+        def check():
+            return (
+                get_dynamodb_client() is not parent_client
+                and get_user_store() is not parent_store
+                and google_token_client._client is None
+            )
+
+        self.assertEqual(run_in_child(check), 0)
+        self.assertIs(get_dynamodb_client(), parent_client)
+
+    def test_secrets_cache_keeps_value_but_not_refresh_thread(self):
+        authentication_secrets_cache._refresh_thread = object()
+        parent_lock = authentication_secrets_cache._lock
+        self.addCleanup(setattr, authentication_secrets_cache, "_refresh_thread", None)
+
+        def check():
+            return authentication_secrets_cache._refresh_thread is None and authentication_secrets_cache._lock is not parent_lock
+
+        self.assertEqual(run_in_child(check), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()